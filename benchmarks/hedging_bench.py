@@ -0,0 +1,90 @@
+"""
+Hedging Bench - Sofia Lin V9.1
+Simula a OpenAI con un brownout (una fracción de las llamadas se cuelga) y a Gemini como
+respaldo más lento pero estable, y compara latencias p50/p95/p99 del esquema anterior
+(esperar a que falle el primario y recién ahí probar el secundario) contra HedgedProviders
+(deadline + hedge al p95 observado del primario + circuit breaker).
+
+    python -m benchmarks.hedging_bench --requests 200 --hang-rate 0.1
+"""
+import argparse
+import logging
+import random
+import time
+
+from core import metrics, resilience
+
+
+def simulated(name: str, median_ms: float, hang_rate: float, hang_ms: float, rng: random.Random):
+    def call(prompt: str, timeout_s: float = None) -> str:
+        hang = rng.random() < hang_rate
+        ms = hang_ms if hang else rng.lognormvariate(0, 0.35) * median_ms
+        if timeout_s is not None and ms / 1000 > timeout_s:
+            time.sleep(timeout_s)
+            raise TimeoutError(f"{name} timeout")
+        time.sleep(ms / 1000)
+        if hang:
+            raise ConnectionError(f"{name} 503 tras colgarse")
+        return name
+    return call
+
+
+def legacy(primary, secondary, prompt: str) -> str:
+    """get_response anterior: sin timeout, Gemini solo después de que OpenAI falle."""
+    try:
+        return primary(prompt)
+    except Exception:
+        return secondary(prompt)
+
+
+def run(label: str, n: int, func) -> dict:
+    hist = metrics.LatencyHistogram(window=n)
+    winners = {}
+    for _ in range(n):
+        start = time.perf_counter()
+        try:
+            winner = func()
+        except Exception as e:
+            winner = type(e).__name__
+        hist.observe((time.perf_counter() - start) * 1000)
+        winners[winner] = winners.get(winner, 0) + 1
+    snap = hist.snapshot()
+    print(f"{label:<28} p50 {snap['p50_ms']:>7.0f} ms  p95 {snap['p95_ms']:>7.0f} ms  p99 {snap['p99_ms']:>7.0f} ms  "
+          f"max {snap['max_ms']:>7.0f} ms  {winners}")
+    return snap
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--primary-ms", type=float, default=60, help="mediana de OpenAI")
+    parser.add_argument("--secondary-ms", type=float, default=120, help="mediana de Gemini")
+    parser.add_argument("--hang-rate", type=float, default=0.1, help="fracción de llamadas de OpenAI que se cuelgan")
+    parser.add_argument("--hang-ms", type=float, default=1500, help="cuánto tarda en fallar una llamada colgada")
+    parser.add_argument("--deadline", type=float, default=1.0, help="deadline del HedgedProviders en segundos")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    logging.getLogger("RESILIENCE").setLevel(logging.CRITICAL)
+
+    rng = random.Random(args.seed)
+    primary = simulated("openai", args.primary_ms, args.hang_rate, args.hang_ms, rng)
+    secondary = simulated("gemini", args.secondary_ms, 0.0, args.hang_ms, rng)
+    print(f"{args.requests} mensajes; OpenAI ~{args.primary_ms:.0f} ms con {args.hang_rate:.0%} colgadas "
+          f"de {args.hang_ms:.0f} ms; Gemini ~{args.secondary_ms:.0f} ms\n")
+
+    run("anterior (secuencial)", args.requests, lambda: legacy(primary, secondary, "hola"))
+
+    openai = resilience.Provider("openai", primary)
+    gemini = resilience.Provider("gemini", secondary)
+    hedged = resilience.HedgedProviders("bench", [openai, gemini], deadline_s=args.deadline)
+    run("hedged + breaker", args.requests, lambda: hedged.call("hola"))
+    for provider in (openai, gemini):
+        stats = provider.stats()
+        print(f"  {provider.name:<8} llamadas {stats['calls']:>4}  éxito {stats['success_rate']:.0%}  "
+              f"hedges {stats['hedges']:>3}  ganó {stats['wins']:>4}  descartadas {stats['discarded']:>3}  "
+              f"hedge a {stats['hedge_delay_ms']:.0f} ms  circuito {stats['breaker']['state']} "
+              f"(abierto {stats['breaker']['trips']} veces)")
+
+
+if __name__ == "__main__":
+    main()
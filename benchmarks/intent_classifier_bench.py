@@ -0,0 +1,131 @@
+"""
+Intent Classifier Bench - Sofia Lin V9.1
+Throughput del autómata de intenciones (policy_engine.intent_classifier) sobre lotes grandes
+de transcripts sintéticos en los 9 idiomas, comparado con buscar cada frase por separado
+(`frase in texto`, lo que haría una lista de keywords sin compilar). También mide recall sobre
+los transcripts con emergencia insertada y falsos positivos sobre los neutros, y cuánto
+detectaba el chequeo anterior ("gas" y "smell").
+
+    python -m benchmarks.intent_classifier_bench --count 200000 --words 40
+"""
+import argparse
+import random
+import statistics
+import time
+from typing import List, Optional, Tuple
+
+from policy_engine.intent_classifier import IntentClassifier, PHRASES, normalize
+
+# Relleno neutro por idioma (pedidos normales de plomería, sin frases de intención)
+FILLER = {
+    "en": "hi my name is john i need a plumber for my kitchen sink the water heater is old and makes noise "
+          "can someone come tomorrow morning my address is on main street thank you",
+    "es": "hola buenas tardes necesito un plomero para el lavabo del baño el calentador de agua hace ruido "
+          "pueden venir mañana en la mañana vivo en san jose gracias",
+    "fr": "bonjour je voudrais un plombier pour l'évier de la cuisine le chauffe-eau est vieux "
+          "pouvez-vous passer demain matin merci beaucoup",
+    "de": "guten tag ich brauche einen klempner für das waschbecken in der küche der boiler ist alt "
+          "können sie morgen früh kommen vielen dank",
+    "it": "buongiorno ho bisogno di un idraulico per il lavandino della cucina lo scaldabagno è vecchio "
+          "potete venire domani mattina grazie mille",
+    "zh": "你好 我需要一个水管工 厨房的水槽堵了 热水器很旧了 明天早上可以来吗 谢谢",
+    "ja": "こんにちは 台所の流しの修理をお願いしたいです 給湯器が古くなっています 明日の朝来ていただけますか",
+    "hi": "नमस्ते मुझे रसोई के सिंक के लिए प्लंबर चाहिए वॉटर हीटर पुराना है क्या आप कल सुबह आ सकते हैं धन्यवाद",
+    "ar": "مرحبا أحتاج سباكا لحوض المطبخ سخان الماء قديم هل يمكنكم الحضور غدا صباحا شكرا",
+}
+
+
+def build_batch(count: int, words: int, emergency_ratio: float, seed: int) -> List[Tuple[str, Optional[str]]]:
+    """(transcript, intent esperada o None)."""
+    rng = random.Random(seed)
+    vocab = {lang: text.split() for lang, text in FILLER.items()}
+    langs = list(FILLER)
+    batch = []
+    for _ in range(count):
+        lang = rng.choice(langs)
+        tokens = [rng.choice(vocab[lang]) for _ in range(words)]
+        expected = None
+        if rng.random() < emergency_ratio:
+            expected = rng.choice(list(PHRASES))
+            phrase = rng.choice(PHRASES[expected][lang]).rstrip("*")
+            tokens.insert(rng.randrange(len(tokens) + 1), phrase)
+        joiner = "" if lang in ("zh", "ja") and rng.random() < 0.5 else " "
+        batch.append((joiner.join(tokens), expected))
+    return batch
+
+
+def naive_classify(needles, transcript: str) -> List[str]:
+    text = normalize(transcript)
+    return [intent for needle, intent in needles if needle in text]
+
+
+def legacy_classify(transcript: str) -> bool:
+    lowered = transcript.lower()
+    return "gas" in lowered and "smell" in lowered
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=100000, help="transcripts en el lote")
+    parser.add_argument("--words", type=int, default=30, help="palabras de relleno por transcript")
+    parser.add_argument("--emergency-ratio", type=float, default=0.2, help="fracción con una intención insertada")
+    parser.add_argument("--naive-sample", type=int, default=5000, help="transcripts para la línea base sin compilar")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    classifier = IntentClassifier()
+    build_ms = (time.perf_counter() - start) * 1000
+    batch = build_batch(args.count, args.words, args.emergency_ratio, args.seed)
+    total_chars = sum(len(t) for t, _ in batch)
+    print(f"autómata: {classifier.stats()['patterns']} frases, {classifier.stats()['states']} estados, "
+          f"compilado en {build_ms:.1f} ms")
+    print(f"lote: {len(batch)} transcripts, {total_chars / len(batch):.0f} caracteres promedio\n")
+
+    # Autómata: lote completo + latencia por transcript
+    latencies = []
+    hits = misses = false_pos = 0
+    start = time.perf_counter()
+    for transcript, expected in batch:
+        t0 = time.perf_counter_ns()
+        result = classifier.classify(transcript)
+        latencies.append((time.perf_counter_ns() - t0) / 1e3)
+        if expected is None:
+            false_pos += bool(result.intents)
+        elif expected in result.intents:
+            hits += 1
+        else:
+            misses += 1
+    elapsed = time.perf_counter() - start
+    labelled = hits + misses
+    neutral = len(batch) - labelled
+    print(f"aho-corasick   {len(batch) / elapsed:>10,.0f} transcripts/s  {total_chars / elapsed / 1e6:6.2f} M chars/s  "
+          f"p50 {statistics.median(latencies):.1f} us  p95 {percentile(latencies, 0.95):.1f} us  "
+          f"p99 {percentile(latencies, 0.99):.1f} us")
+
+    # Línea base: cada frase buscada por separado (sin límites de palabra)
+    needles = [(normalize(p.rstrip("*")), intent) for intent, by_lang in PHRASES.items()
+               for phrases in by_lang.values() for p in phrases]
+    sample = batch[:args.naive_sample]
+    start = time.perf_counter()
+    for transcript, _ in sample:
+        naive_classify(needles, transcript)
+    naive_elapsed = time.perf_counter() - start
+    print(f"frase por frase {len(sample) / naive_elapsed:>9,.0f} transcripts/s  "
+          f"({naive_elapsed / len(sample) * 1e6:.1f} us promedio, muestra de {len(sample)})\n")
+
+    legacy = sum(1 for transcript, expected in batch if expected == "gas_leak" and legacy_classify(transcript))
+    gas_total = sum(1 for _, expected in batch if expected == "gas_leak")
+    print(f"recall autómata:     {hits / labelled:.1%} ({hits}/{labelled})" if labelled else "recall: sin casos")
+    print(f"falsos positivos:    {false_pos / neutral:.2%} ({false_pos}/{neutral})" if neutral else "")
+    if gas_total:
+        print(f"chequeo anterior:    {legacy / gas_total:.1%} de las fugas de gas ({legacy}/{gas_total})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Policy Engine Bench - Sofia Lin V9.1
+Micro-benchmark del PolicyEngine compilado: costo por decisión con y sin memo, lote de
+acciones de un turno, costo de registrar en el ring de auditoría y la versión anterior
+(dict + print por cada bloqueo L4) como referencia. Al final varios hilos deciden en
+paralelo mientras el hilo de flush vacía el ring, y se reporta cuánto llegó al archivo.
+
+    python -m benchmarks.policy_engine_bench --iterations 200000 --threads 4
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from policy_engine.audit import POLICY_AUDIT_CAPACITY, AuditLog
+from policy_engine.human_override import POLICY_RULES_PATH, ActionLevel, PolicyEngine
+
+TURN_ACTIONS = ["lookup_appointment", "create_appointment", ("refund_payment", {"human_confirmed": True}),
+                "spam_rejection", "get_weather"]
+
+
+class LegacyPolicyEngine:
+    """La implementación anterior: dict fijo y print síncrono en cada bloqueo."""
+
+    def __init__(self):
+        self.rules = {
+            "get_weather": ActionLevel.L0_INFORMATIONAL,
+            "lookup_appointment": ActionLevel.L1_LOW_RISK,
+            "create_appointment": ActionLevel.L2_BUSINESS_IMPACT,
+            "refund_payment": ActionLevel.L3_HIGH_IMPACT,
+            "gas_leak_emergency": ActionLevel.L4_SAFETY_CRITICAL
+        }
+
+    def evaluate_action(self, action_name: str, context: dict) -> bool:
+        level = self.rules.get(action_name, ActionLevel.L4_SAFETY_CRITICAL)
+        if level == ActionLevel.L4_SAFETY_CRITICAL:
+            print(f"[KILL SWITCH / TRANSFER] Triggered. Reason: Policy Block: {action_name} is L4")
+            return False
+        if level == ActionLevel.L3_HIGH_IMPACT and not context.get("human_confirmed"):
+            return False
+        return True
+
+
+def dense_rules(rows: int) -> dict:
+    """rules.json con una acción de `rows` filas condicionadas (zona, canal, monto), como una tabla real de despacho."""
+    with open(POLICY_RULES_PATH, "r", encoding="utf-8") as f:
+        spec = json.load(f)
+    cities = ["san_jose", "campbell", "cupertino", "milpitas", "gilroy", "palo_alto", "saratoga", "sunnyvale"]
+    table = [{"id": f"zone_{i}", "when": {"city": [cities[i % len(cities)]], "channel": ["phone", "whatsapp"],
+                                          "amount": {"gt": 100 * (i + 1)}}, "outcome": "confirm"}
+             for i in range(rows)]
+    spec["actions"]["dispatch_quote"] = {"level": "L2_BUSINESS_IMPACT", "rules": table}
+    return spec
+
+
+def measure(iterations: int, func) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) * 1e9 / iterations
+
+
+def report(label: str, ns: float) -> float:
+    print(f"{label:<46} {ns:>9.0f} ns/op  {1e9 / ns:>12,.0f} ops/s")
+    return ns
+
+
+def bench(label: str, iterations: int, func) -> float:
+    return report(label, measure(iterations, func))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100000)
+    parser.add_argument("--threads", type=int, default=4, help="hilos en la prueba concurrente")
+    parser.add_argument("--capacity", type=int, default=POLICY_AUDIT_CAPACITY, help="tamaño del ring de auditoría")
+    parser.add_argument("--rows", type=int, default=24, help="filas condicionadas de la acción densa (dispatch_quote)")
+    parser.add_argument("--flush", type=float, default=0.5, help="intervalo de flush en segundos")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="policy_bench_")
+    audit_path = os.path.join(workdir, "audit.jsonl")
+    audit = AuditLog(path=audit_path, capacity=args.capacity, flush_interval_s=args.flush)
+    # El logger del motor escribe los L4 a stderr; se silencia para medir solo la decisión
+    logging.getLogger("POLICY_ENGINE").setLevel(logging.ERROR)
+    rules_path = os.path.join(workdir, "rules.json")
+    with open(rules_path, "w", encoding="utf-8") as f:
+        json.dump(dense_rules(args.rows), f)
+    engine = PolicyEngine(rules_path=rules_path, audit=audit)
+    n = args.iterations
+    compiled = engine._compiled("refund_payment")
+    confirmed = {"human_confirmed": True, "channel": "phone"}
+
+    print(f"tabla: {len(engine.rules)} acciones; ring de {args.capacity} entradas; {n} iteraciones\n")
+    bench("decide L3, tabla chica (sin memo)", n, lambda: engine.decide("refund_payment", confirmed))
+    bench("  solo la tabla compilada", n, lambda: compiled.decide(confirmed))
+    quote = {"city": "gilroy", "channel": "phone", "amount": 950}
+    dense = engine._compiled("dispatch_quote")
+    bench(f"decide tabla densa, {args.rows} filas (memo)", n, lambda: engine.decide("dispatch_quote", quote))
+    bench("  solo la tabla densa, sin memo", n, lambda: dense.decide(quote))
+    bench("decide L4 (constante + aviso de transferencia)", n, lambda: engine.decide("gas_leak_emergency", {}))
+    per_batch = bench(f"evaluate_batch ({len(TURN_ACTIONS)} acciones)", n // len(TURN_ACTIONS),
+                      lambda: engine.evaluate_batch(TURN_ACTIONS, {"channel": "phone"}))
+    print(f"{'  -> por acción':<46} {per_batch / len(TURN_ACTIONS):>9.0f} ns")
+    bench("audit.record", n, lambda: audit.record("bench", "allow", 0, "bench", ""))
+
+    legacy = LegacyPolicyEngine()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        legacy_l4 = measure(n, lambda: legacy.evaluate_action("gas_leak_emergency", {}))
+    report("anterior: L4 con print (a /dev/null)", legacy_l4)
+    audit.flush()
+
+    # Concurrencia: hilos decidiendo mientras el flush corre en segundo plano
+    audit.start()
+    flushed_before = audit.flushed
+    recorded_before = audit.recorded
+    dropped_before = audit.stats()["dropped"]
+
+    def worker():
+        for i in range(n):
+            engine.decide("lookup_appointment" if i % 2 else "refund_payment", confirmed)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    audit.close()
+    stats = audit.stats()
+    total = args.threads * n
+    print(f"\n{args.threads} hilos x {n} decisiones: {total / elapsed:,.0f} decisiones/s "
+          f"({elapsed * 1e9 / total:.0f} ns c/u con contención del GIL)")
+    dropped = stats['dropped'] - dropped_before
+    print(f"auditoría: {stats['recorded'] - recorded_before} registradas, {stats['flushed'] - flushed_before} escritas, "
+          f"{dropped} descartadas por ring lleno ({dropped / total:.1%}), último flush {stats['last_flush_ms']} ms")
+    with open(audit_path, "rb") as f:
+        lines = sum(1 for _ in f)
+    print(f"archivo: {lines} líneas en {audit_path}")
+    print(f"memo: {engine.stats()['cache_hit_rate']:.2%} aciertos")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+"""
+Realtime Load - Sofia Lin V9.1
+Generador de carga offline para /ws/twilio: N llamadas simuladas (Media Stream de Twilio a
+ritmo real, frames μ-law de 20 ms) contra main.py, que a su vez habla con un OpenAI Realtime
+falso en loopback (deltas de audio, speech_started/stopped y tool calls con latencia
+configurable). Por cada nivel de N reporta latencia y jitter del audio, frames perdidos,
+latencia del clear (barge-in), duración de las tools y lag del event loop del servidor.
+No usa red: el servidor se lanza en un subproceso apuntando al Realtime falso.
+
+    python -m benchmarks.realtime_load --calls 1,10,25,50 --duration 20
+    python -m benchmarks.realtime_load --audio llamada.ulaw --coalesce 5
+
+Cada frame lleva en sus primeros bytes (llamada, respuesta, secuencia, reloj monotónico), así
+la latencia y los huecos se miden de punta a punta sin depender de los logs del servidor.
+"""
+import argparse
+import array
+import asyncio
+import base64
+import json
+import math
+import os
+import re
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+import websockets
+
+from core.phrase_bank import pcm16_to_ulaw
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FRAME_BYTES = 160  # 20 ms de μ-law 8 kHz
+FRAME_S = 0.02
+# llamada, respuesta (0 = audio del cliente), secuencia, time.monotonic() al enviar
+_TAG = struct.Struct(">HIId")
+
+
+def tag_frame(base: bytes, call: int, response: int, seq: int) -> bytes:
+    return _TAG.pack(call, response, seq, time.monotonic()) + base[_TAG.size:FRAME_BYTES]
+
+
+def read_tags(audio: bytes):
+    for offset in range(0, len(audio) - FRAME_BYTES + 1, FRAME_BYTES):
+        yield _TAG.unpack_from(audio, offset)
+
+
+def load_frames(path: Optional[str]) -> List[bytes]:
+    """Frames de 160 bytes de un archivo μ-law 8 kHz crudo; sin archivo, un tono de 440 Hz."""
+    if path:
+        with open(path, "rb") as f:
+            audio = f.read()
+    else:
+        samples = array.array("h", (int(6000 * math.sin(2 * math.pi * 440 * i / 8000)) for i in range(8000)))
+        if sys.byteorder == "big":
+            samples.byteswap()
+        audio = pcm16_to_ulaw(samples.tobytes(), 8000, 8000)
+    frames = [audio[i:i + FRAME_BYTES] for i in range(0, len(audio) - FRAME_BYTES + 1, FRAME_BYTES)]
+    if not frames:
+        raise SystemExit(f"{path}: se necesitan al menos {FRAME_BYTES} bytes de audio")
+    return frames
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered))) - 1))]
+
+
+async def monitor_loop_lag(samples: List[float], interval_s: float = 0.05):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval_s)
+        samples.append(max(0.0, (loop.time() - start - interval_s) * 1000))
+
+
+# ============ OPENAI REALTIME FALSO ============
+class FakeRealtime:
+    """
+    Imita lo que el bridge usa de la API Realtime: confirma el session.update, responde a
+    cada response.create con `reply_s` de audio (a ritmo real) y cada `turn_s` simula que el
+    cliente habla (speech_started -> speech_stopped -> respuesta o tool call).
+    """
+
+    def __init__(self, frames: List[bytes], reply_s: float, turn_s: float, response_ms: float,
+                 tool_every: int, delta_frames: int):
+        self.frames = frames
+        self.reply_frames = max(1, int(reply_s / FRAME_S))
+        self.turn_s = turn_s
+        self.response_ms = response_ms
+        self.tool_every = tool_every
+        self.delta_frames = max(1, delta_frames)
+        self.reset()
+
+    def reset(self):
+        self.inbound_latency_ms: List[float] = []
+        self.inbound_frames: Dict[int, int] = defaultdict(int)
+        self.inbound_drops: Dict[int, int] = defaultdict(int)
+        self.speech_started_at: Dict[int, float] = {}
+        self.tool_ms: List[float] = []
+        self.sessions = 0
+
+    async def _reply(self, ws, call: int, response: int):
+        """Audio de la respuesta en deltas de `delta_frames` frames, espaciados a tiempo real."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for first in range(0, self.reply_frames, self.delta_frames):
+            delay = start + first * FRAME_S - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            audio = b"".join(tag_frame(self.frames[(first + i) % len(self.frames)], call, response, first + i)
+                             for i in range(min(self.delta_frames, self.reply_frames - first)))
+            await ws.send('{"type":"response.output_audio.delta","response_id":"resp_%d","delta":"%s"}'
+                          % (response, base64.b64encode(audio).decode("ascii")))
+        await ws.send(json.dumps({"type": "response.done"}))
+
+    async def handler(self, ws):
+        self.sessions += 1
+        call: Optional[int] = None
+        responses = 0
+        reply_task: Optional[asyncio.Task] = None
+        turns_task: Optional[asyncio.Task] = None
+        tool_sent: Dict[str, float] = {}
+        last_seq = -1
+
+        def start_reply():
+            nonlocal reply_task, responses
+            if reply_task and not reply_task.done():
+                reply_task.cancel()
+            responses += 1
+            reply_task = asyncio.create_task(self._reply(ws, call or 0, responses))
+
+        async def turns():
+            turn = 0
+            while True:
+                await asyncio.sleep(self.turn_s)
+                turn += 1
+                # El cliente empieza a hablar: el bridge debe mandar "clear" a Twilio (barge-in)
+                self.speech_started_at[call] = time.monotonic()
+                await ws.send(json.dumps({"type": "input_audio_buffer.speech_started"}))
+                if reply_task and not reply_task.done():
+                    reply_task.cancel()
+                await asyncio.sleep(0.4)
+                await ws.send(json.dumps({"type": "input_audio_buffer.speech_stopped"}))
+                await asyncio.sleep(self.response_ms / 1000)
+                if self.tool_every and turn % self.tool_every == 0:
+                    call_id = f"call_{call}_{turn}"
+                    tool_sent[call_id] = time.monotonic()
+                    await ws.send(json.dumps({
+                        "type": "response.function_call_arguments.done", "name": "agendar_cita", "call_id": call_id,
+                        "arguments": json.dumps({"nombre": f"Carga {call}", "telefono": f"555{call:04d}",
+                                                 "direccion": "1 Loopback Way", "problema": "benchmark"}),
+                    }))
+                else:
+                    start_reply()
+
+        try:
+            async for raw in ws:
+                if raw.startswith('{"type":"input_audio_buffer.append"'):
+                    audio = base64.b64decode(json.loads(raw)["audio"])
+                    now = time.monotonic()
+                    for tag_call, _, seq, sent_at in read_tags(audio):
+                        self.inbound_latency_ms.append((now - sent_at) * 1000)
+                        self.inbound_frames[tag_call] += 1
+                        if seq > last_seq + 1:
+                            self.inbound_drops[tag_call] += seq - last_seq - 1
+                        last_seq = max(last_seq, seq)
+                        if call is None:
+                            call = tag_call
+                            turns_task = asyncio.create_task(turns())
+                    continue
+                event = json.loads(raw)
+                event_type = event.get("type")
+                if event_type == "session.update":
+                    await ws.send(json.dumps({"type": "session.updated", "session": event.get("session", {})}))
+                elif event_type == "response.create":
+                    start_reply()
+                elif event_type == "conversation.item.create" and event.get("item", {}).get("type") == "function_call_output":
+                    sent_at = tool_sent.pop(event["item"].get("call_id"), None)
+                    if sent_at is not None:
+                        self.tool_ms.append((time.monotonic() - sent_at) * 1000)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for task in (reply_task, turns_task):
+                if task:
+                    task.cancel()
+
+
+# ============ CLIENTE TWILIO SIMULADO ============
+class CallResult:
+    def __init__(self, call: int):
+        self.call = call
+        self.completed = False
+        self.error: Optional[str] = None
+        self.frames_sent = 0
+        self.frames_received = 0
+        self.latency_ms: List[float] = []
+        self.drops = 0
+        self.clear_ms: List[float] = []
+        self.send_lag_ms = 0.0
+
+    def jitter_ms(self) -> float:
+        """p95 de la latencia por frame menos la mínima de la llamada (variación, no retraso fijo)."""
+        if not self.latency_ms:
+            return 0.0
+        floor = min(self.latency_ms)
+        return percentile([ms - floor for ms in self.latency_ms], 95)
+
+
+async def twilio_call(http: str, ws_url: str, call: int, duration_s: float, frames: List[bytes],
+                      fake: FakeRealtime, result: CallResult):
+    stream_sid = f"MZbench{call:05d}"
+    try:
+        # Como Twilio: primero el webhook (calienta la sesión Realtime), luego el Media Stream
+        async with httpx.AsyncClient(timeout=10) as client:
+            await client.post(f"{http}/incoming-call")
+        async with websockets.connect(f"{ws_url}/ws/twilio", max_size=None) as ws:
+            await ws.send(json.dumps({"event": "connected", "protocol": "Call", "version": "1.0.0"}))
+            await ws.send(json.dumps({"event": "start", "sequenceNumber": "1", "streamSid": stream_sid,
+                                      "start": {"streamSid": stream_sid, "callSid": f"CA{call:05d}",
+                                                "mediaFormat": {"encoding": "audio/x-mulaw", "sampleRate": 8000, "channels": 1}}}))
+
+            async def receive():
+                last_seq: Dict[int, int] = {}
+                try:
+                    await receive_loop(last_seq)
+                except websockets.ConnectionClosed:
+                    pass  # el bridge corta el Media Stream al recibir "stop"
+
+            async def receive_loop(last_seq: Dict[int, int]):
+                async for raw in ws:
+                    data = json.loads(raw)
+                    if data.get("event") == "media":
+                        now = time.monotonic()
+                        for _, response, seq, sent_at in read_tags(base64.b64decode(data["media"]["payload"])):
+                            if response == 0:
+                                continue  # saludo pre-renderizado u otro audio sin marca
+                            result.frames_received += 1
+                            result.latency_ms.append((now - sent_at) * 1000)
+                            previous = last_seq.get(response, -1)
+                            if seq > previous + 1:
+                                result.drops += seq - previous - 1
+                            last_seq[response] = max(previous, seq)
+                    elif data.get("event") == "clear":
+                        started = fake.speech_started_at.get(call)
+                        if started is not None:
+                            result.clear_ms.append((time.monotonic() - started) * 1000)
+
+            receiver = asyncio.create_task(receive())
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            for seq in range(int(duration_s / FRAME_S)):
+                delay = start + seq * FRAME_S - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    result.send_lag_ms = max(result.send_lag_ms, -delay * 1000)
+                payload = base64.b64encode(tag_frame(frames[seq % len(frames)], call, 0, seq)).decode("ascii")
+                await ws.send('{"event":"media","sequenceNumber":"%d","media":{"track":"inbound","chunk":"%d",'
+                              '"timestamp":"%d","payload":"%s"},"streamSid":"%s"}'
+                              % (seq + 2, seq + 1, seq * 20, payload, stream_sid))
+                result.frames_sent += 1
+            await ws.send(json.dumps({"event": "stop", "streamSid": stream_sid, "stop": {"callSid": f"CA{call:05d}"}}))
+            try:
+                await asyncio.wait_for(receiver, timeout=5)
+            except asyncio.TimeoutError:
+                receiver.cancel()
+            result.completed = True
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+
+
+# ============ SERVIDOR ============
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, fake_port: int, workdir: str, coalesce: int, pool_size: int) -> subprocess.Popen:
+    """main.py en uvicorn con todas las salidas externas apuntando a loopback o apagadas."""
+    dead_port = free_port()
+    env = {k: v for k, v in os.environ.items()
+           if not k.startswith(("SUPABASE_", "TELEGRAM_", "EMAIL_", "SMTP_", "REDIS_"))}
+    env.update({
+        "OPENAI_API_KEY": "sk-benchmark",
+        "OPENAI_REALTIME_URL": f"ws://127.0.0.1:{fake_port}",
+        # LLM/TTS de las etapas de despacho fallan al instante en vez de salir a internet
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{dead_port}/v1",
+        "REALTIME_COALESCE_FRAMES": str(coalesce),
+        "REALTIME_POOL_SIZE": str(pool_size),
+        "APPOINTMENTS_DB_PATH": os.path.join(workdir, "appointments.db"),
+        "PHRASE_BANK_DIR": os.path.join(workdir, "phrases"),
+        "TTS_CACHE_DIR": os.path.join(workdir, "tts"),
+        "SESSION_BACKEND": "memory",
+    })
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=REPO_DIR, env=env,
+    )
+
+
+async def wait_ready(http: str, timeout_s: float = 60):
+    deadline = time.monotonic() + timeout_s
+    async with httpx.AsyncClient(timeout=2) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(f"{http}/voice")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.25)
+    raise SystemExit(f"El servidor no respondió en {http} tras {timeout_s}s")
+
+
+_BUCKET_RE = re.compile(r'^(orion_[a-zA-Z0-9_]+)_bucket\{le="([^"]+)"\} (\S+)$')
+
+
+async def scrape_buckets(http: str) -> Dict[str, Dict[str, float]]:
+    """Buckets acumulados de /metrics: {métrica: {le: conteo}}."""
+    async with httpx.AsyncClient(timeout=5) as client:
+        text = (await client.get(f"{http}/metrics")).text
+    buckets: Dict[str, Dict[str, float]] = defaultdict(dict)
+    for line in text.splitlines():
+        match = _BUCKET_RE.match(line)
+        if match:
+            buckets[match.group(1)][match.group(2)] = float(match.group(3))
+    return buckets
+
+
+def bucket_percentile(before: Dict[str, float], after: Dict[str, float], p: float) -> Optional[str]:
+    """Percentil de lo observado entre dos scrapes, como el límite del bucket que lo contiene."""
+    deltas = [(le, after[le] - before.get(le, 0.0)) for le in after]
+    deltas.sort(key=lambda item: math.inf if item[0] == "+Inf" else float(item[0]))
+    total = deltas[-1][1] if deltas else 0
+    if total <= 0:
+        return None
+    for le, cumulative in deltas:
+        if cumulative >= total * p / 100.0:
+            return f"≤{le}"
+    return "+Inf"
+
+
+# ============ EJECUCIÓN ============
+async def run_level(n: int, args, http: str, ws_url: str, frames: List[bytes], fake: FakeRealtime) -> dict:
+    fake.reset()
+    generator_lag: List[float] = []
+    lag_task = asyncio.create_task(monitor_loop_lag(generator_lag))
+    before = await scrape_buckets(http)
+    results = [CallResult(i + 1) for i in range(n)]
+
+    async def staggered(result: CallResult):
+        await asyncio.sleep(args.ramp_s * (result.call - 1) / max(1, n))
+        await twilio_call(http, ws_url, result.call, args.duration, frames, fake, result)
+
+    await asyncio.gather(*(staggered(r) for r in results))
+    lag_task.cancel()
+    after = await scrape_buckets(http)
+    async with httpx.AsyncClient(timeout=5) as client:
+        relay = (await client.get(f"{http}/api/metrics")).json().get("realtime_relay", {})
+
+    latency = [ms for r in results for ms in r.latency_ms]
+    lag_metric = "orion_event_loop_lag_ms"
+    return {
+        "calls": n,
+        "completed": sum(1 for r in results if r.completed),
+        "errors": sorted({r.error for r in results if r.error})[:3],
+        "out_latency_p50_ms": round(percentile(latency, 50), 2),
+        "out_latency_p95_ms": round(percentile(latency, 95), 2),
+        "out_latency_max_ms": round(max(latency), 2) if latency else 0.0,
+        "jitter_p95_ms": round(percentile([r.jitter_ms() for r in results], 95), 2),
+        "in_latency_p95_ms": round(percentile(fake.inbound_latency_ms, 95), 2),
+        "frames_sent": sum(r.frames_sent for r in results),
+        "frames_received": sum(r.frames_received for r in results),
+        "drops_out": sum(r.drops for r in results),
+        "drops_in": sum(fake.inbound_drops.values()),
+        "clear_p95_ms": round(percentile([ms for r in results for ms in r.clear_ms], 95), 2),
+        "tool_p95_ms": round(percentile(fake.tool_ms, 95), 2),
+        "server_loop_lag_p95": bucket_percentile(before.get(lag_metric, {}), after.get(lag_metric, {}), 95),
+        "server_loop_lag_p99": bucket_percentile(before.get(lag_metric, {}), after.get(lag_metric, {}), 99),
+        "server_cpu_us_per_frame": relay.get("cpu_us_per_frame"),
+        "generator_send_lag_max_ms": round(max((r.send_lag_ms for r in results), default=0.0), 2),
+        "generator_loop_lag_p95_ms": round(percentile(generator_lag, 95), 2),
+    }
+
+
+def print_row(row: dict, header: bool):
+    columns = (("calls", "N"), ("completed", "ok"), ("out_latency_p50_ms", "lat p50"), ("out_latency_p95_ms", "lat p95"),
+               ("jitter_p95_ms", "jitter p95"), ("drops_out", "drop out"), ("drops_in", "drop in"),
+               ("clear_p95_ms", "clear p95"), ("tool_p95_ms", "tool p95"), ("server_loop_lag_p95", "srv lag p95"),
+               ("server_cpu_us_per_frame", "cpu us/frame"), ("generator_loop_lag_p95_ms", "gen lag p95"))
+    if header:
+        print("  ".join(f"{title:>12}" for _, title in columns))
+    print("  ".join(f"{str(row[key]):>12}" for key, _ in columns))
+    for error in row["errors"]:
+        print(f"    error: {error}")
+
+
+async def main(args):
+    frames = load_frames(args.audio)
+    fake = FakeRealtime(frames, args.reply_s, args.turn_s, args.response_ms, args.tool_every, args.delta_frames)
+    fake_port = args.fake_port or free_port()
+    server = None
+    async with websockets.serve(fake.handler, "127.0.0.1", fake_port, max_size=None):
+        with tempfile.TemporaryDirectory(prefix="orion_load_") as workdir:
+            if args.target:
+                http = args.target.rstrip("/")
+                print(f"Usando {http}; debe correr con OPENAI_REALTIME_URL=ws://127.0.0.1:{fake_port}")
+            else:
+                port = free_port()
+                http = f"http://127.0.0.1:{port}"
+                server = start_server(port, fake_port, workdir, args.coalesce, args.pool_size)
+            ws_url = http.replace("http://", "ws://").replace("https://", "wss://")
+            try:
+                await wait_ready(http)
+                rows = []
+                for index, n in enumerate(int(x) for x in args.calls.split(",")):
+                    row = await run_level(n, args, http, ws_url, frames, fake)
+                    rows.append(row)
+                    print_row(row, header=index == 0)
+                    await asyncio.sleep(1)
+                if args.json:
+                    with open(args.json, "w") as f:
+                        json.dump(rows, f, indent=2)
+            finally:
+                if server:
+                    server.terminate()
+                    server.wait(timeout=15)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Carga de llamadas concurrentes sobre /ws/twilio, sin red")
+    parser.add_argument("--calls", default="1,5,10,25", help="niveles de llamadas simultáneas, separados por coma")
+    parser.add_argument("--duration", type=float, default=15.0, help="segundos de audio por llamada")
+    parser.add_argument("--ramp-s", type=float, default=1.0, help="segundos para escalonar el inicio de las llamadas")
+    parser.add_argument("--audio", help="archivo μ-law 8 kHz crudo con la voz del cliente (default: tono)")
+    parser.add_argument("--reply-s", type=float, default=3.0, help="segundos de audio por respuesta del modelo falso")
+    parser.add_argument("--turn-s", type=float, default=4.0, help="cada cuánto habla el cliente (speech_started)")
+    parser.add_argument("--response-ms", type=float, default=300.0, help="latencia del modelo falso tras speech_stopped")
+    parser.add_argument("--tool-every", type=int, default=3, help="cada cuántos turnos pedir agendar_cita (0 = nunca)")
+    parser.add_argument("--delta-frames", type=int, default=1, help="frames de 20 ms por delta de audio")
+    parser.add_argument("--coalesce", type=int, default=1, help="REALTIME_COALESCE_FRAMES del servidor lanzado")
+    parser.add_argument("--pool-size", type=int, default=1, help="REALTIME_POOL_SIZE del servidor lanzado")
+    parser.add_argument("--target", help="URL http de un servidor ya corriendo en vez de lanzar uno")
+    parser.add_argument("--fake-port", type=int, help="puerto fijo del Realtime falso (útil con --target)")
+    parser.add_argument("--json", help="guardar las filas del reporte en este archivo")
+    asyncio.run(main(parser.parse_args()))
@@ -1,7 +1,10 @@
 import os
 import logging
+import time
 from openai import OpenAI
 
+from core import llm_gateway, resilience
+
 # google-genai es opcional — fue removido de requirements.txt (2026-08-21)
 # Si no está instalado, Gemini queda deshabilitado y el servidor arranca igual
 try:
@@ -15,6 +18,9 @@ except ImportError:
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("ORION_BRAIN")
 
+# Tiempo total para responder un mensaje, incluido el hedge a Gemini
+BRAIN_DEADLINE_S = float(os.getenv("BRAIN_DEADLINE_S", "8"))
+
 # Prompts de Sistema - NEKON: Dispatcher de Plomería
 SYSTEM_PROMPTS = {
     # ESPAÑOL
@@ -98,40 +104,59 @@ class OrionBrain:
         if self.openai_key:
             self.openai_client = OpenAI(api_key=self.openai_key)
         
-        if self.gemini_key:
+        if self.gemini_key and GENAI_AVAILABLE:
             self.gemini_client = genai.Client(api_key=self.gemini_key)
 
+        # OpenAI primero; Gemini se dispara si OpenAI falla, tiene el circuito abierto o pasa su p95
+        providers = []
+        if self.openai_client:
+            providers.append(resilience.Provider("openai", self._ask_openai))
+        if self.gemini_client:
+            providers.append(resilience.Provider("gemini", self._ask_gemini))
+        self.providers = resilience.HedgedProviders("brain", providers, deadline_s=BRAIN_DEADLINE_S)
+
+    def _ask_openai(self, system_prompt: str, user_text: str, timeout_s: float) -> str:
+        result = llm_gateway.complete_sync(
+            "brain",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_text}
+            ],
+            deadline_s=timeout_s,
+            max_tokens=150,
+            temperature=0.7
+        )
+        return result.text
+
+    def _ask_gemini(self, system_prompt: str, user_text: str, timeout_s: float) -> str:
+        full_prompt = f"{system_prompt}\n\nUSER MESSAGE: {user_text}"
+        start = time.perf_counter()
+        try:
+            response = self.gemini_client.models.generate_content(
+                model="gemini-2.5-flash",
+                contents=full_prompt,
+                config={"http_options": {"timeout": int(timeout_s * 1000)}}
+            )
+            if not response.text:
+                raise ValueError("Gemini devolvió una respuesta vacía")
+        except Exception:
+            llm_gateway.record_external("brain", "gemini-2.5-flash", (time.perf_counter() - start) * 1000, False)
+            raise
+        usage = response.usage_metadata
+        llm_gateway.record_external("brain", "gemini-2.5-flash", (time.perf_counter() - start) * 1000, True,
+                                    getattr(usage, "prompt_token_count", 0) or 0,
+                                    getattr(usage, "candidates_token_count", 0) or 0)
+        return response.text
+
     def get_response(self, user_text: str, user_id: str, lang: str = "en") -> str:
-        """Obtiene respuesta de IA (Intenta OpenAI, fallback a Gemini)"""
+        """Obtiene respuesta de IA (OpenAI con hedge/fallback a Gemini, dentro de BRAIN_DEADLINE_S)"""
         system_prompt = SYSTEM_PROMPTS.get(lang, SYSTEM_PROMPTS["en"])
-        
-        # 1. Intentar OpenAI (GPT-4o-mini)
-        if self.openai_client:
-            try:
-                response = self.openai_client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_text}
-                    ],
-                    max_tokens=150,
-                    temperature=0.7
-                )
-                return response.choices[0].message.content
-            except Exception as e:
-                logger.error(f"OpenAI Error: {e}")
 
-        # 2. Intentar Gemini (Fallback) - Nuevo SDK
-        if self.gemini_client:
+        if self.providers.providers:
             try:
-                full_prompt = f"{system_prompt}\n\nUSER MESSAGE: {user_text}"
-                response = self.gemini_client.models.generate_content(
-                    model="gemini-2.5-flash",
-                    contents=full_prompt
-                )
-                return response.text
-            except Exception as e:
-                logger.error(f"Gemini Error: {e}")
+                return self.providers.call(system_prompt, user_text)
+            except (resilience.DeadlineExceeded, resilience.AllProvidersFailed) as e:
+                logger.error(f"Brain sin respuesta de IA: {e}")
 
         # Respuesta de emergencia según idioma
         if lang == "es":
@@ -139,6 +164,10 @@ class OrionBrain:
         else:
             return "🤖 Hi! I'm Alex from Morales Plumbing. System is temporarily busy, but you can reach us on WhatsApp: (669) 213-4422"
 
+    def stats(self) -> dict:
+        """Latencia, éxito, hedges y estado del circuito por proveedor (para ajustar BRAIN_DEADLINE_S / HEDGE_*)"""
+        return self.providers.stats()
+
     def transcribe_audio(self, audio_path: str) -> str:
         """Transcribe audio usando Whisper"""
         if not self.openai_client:
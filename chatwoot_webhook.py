@@ -1,10 +1,11 @@
+import asyncio
 import os
 from fastapi import Request
 import logging
-from sofia_v9_app import SofiaLinV9Engine
+from sofia_v9_app import SofiaLinV9Engine, dispatch_booking
 from twilio.rest import Client
-import requests
 from dotenv import load_dotenv
+from core import telegram
 
 load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
@@ -13,14 +14,13 @@ TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
 TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
 
 logger = logging.getLogger("OmnichannelGateway")
-engine = SofiaLinV9Engine()
+engine = SofiaLinV9Engine(booking_handler=dispatch_booking)
 
 twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN) if TWILIO_ACCOUNT_SID else None
 
-def send_telegram_message(chat_id, text):
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+async def send_telegram_message(chat_id, text):
     try:
-        requests.post(url, json={"chat_id": chat_id, "text": text})
+        await telegram.get_sender(TELEGRAM_BOT_TOKEN).send_message(chat_id, text)
     except Exception as e:
         logger.error(f"Telegram error: {e}")
 
@@ -32,13 +32,14 @@ async def telegram_webhook(request: Request):
             chat_id = payload["message"]["chat"]["id"]
             text = payload["message"]["text"]
             logger.info(f"Telegram msg from {chat_id}: {text}")
-            result = engine.process_incoming_call({
+            # El motor es síncrono (FSM, políticas y LLM vía complete_sync): fuera del event loop
+            result = await asyncio.to_thread(engine.process_incoming_call, {
                 "caller_id": str(chat_id),
                 "transcript": text,
                 "channel": "telegram"
             })
             reply = result.get("audio_response_text", "Gracias por contactar a Morales Plumbing.")
-            send_telegram_message(chat_id, reply)
+            await send_telegram_message(chat_id, reply)
             return {"status": "processed"}
     except Exception as e:
         logger.error(f"Telegram webhook error: {e}")
@@ -58,7 +59,7 @@ async def twilio_whatsapp_webhook(request: Request):
 
         resp = MessagingResponse()
         if content:
-            result = engine.process_incoming_call({
+            result = await asyncio.to_thread(engine.process_incoming_call, {
                 "caller_id": sender,
                 "transcript": content,
                 "channel": "whatsapp"
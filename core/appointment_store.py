@@ -0,0 +1,201 @@
+"""
+Appointment Store - Sofia Lin V9.1
+Citas locales en SQLite (WAL) con índices por código, teléfono, fecha y canal.
+Los códigos MP-XXXX son únicos (UNIQUE + reintento) y se reservan aquí también
+cuando la cita principal vive en Supabase.
+"""
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Optional, Tuple
+
+logger = logging.getLogger("APPOINTMENTS")
+
+APPOINTMENTS_DB_PATH = os.getenv("APPOINTMENTS_DB_PATH", "/tmp/orion_appointments.db")
+MP_CODE_DIGITS = int(os.getenv("MP_CODE_DIGITS", "4"))
+LEGACY_JSON_PATH = "/tmp/orion_appointments.json"
+
+# Columnas en el orden de la tabla (id y created_at se asignan al insertar)
+FIELDS = (
+    "code", "name", "phone", "email", "address", "status", "customer_issue", "technical_diagnosis",
+    "materials", "safety_considerations", "is_emergency", "scheduled_time", "source", "created_at",
+    "confirmed", "supabase_id",
+)
+_BOOL_FIELDS = ("is_emergency", "confirmed")
+
+
+class AppointmentStore:
+    # Colisiones seguidas antes de pasar a un código con un dígito más
+    COLLISIONS_BEFORE_WIDEN = 8
+
+    def __init__(self, path: str = APPOINTMENTS_DB_PATH, digits: int = MP_CODE_DIGITS):
+        self.path = path
+        self.digits = digits
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS appointments ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, code TEXT NOT NULL UNIQUE, name TEXT, phone TEXT, email TEXT,"
+            " address TEXT, status TEXT, customer_issue TEXT, technical_diagnosis TEXT, materials TEXT,"
+            " safety_considerations TEXT, is_emergency INTEGER NOT NULL DEFAULT 0, scheduled_time TEXT,"
+            " source TEXT, created_at TEXT NOT NULL, confirmed INTEGER NOT NULL DEFAULT 0, supabase_id TEXT)"
+        )
+        # Códigos emitidos (incluye los de citas guardadas solo en Supabase)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS mp_codes (code TEXT PRIMARY KEY, reserved_at TEXT NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_appointments_phone ON appointments (phone, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_appointments_created ON appointments (created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_appointments_source ON appointments (source, id)")
+        self._import_legacy_json()
+
+    # ============ CÓDIGOS MP ============
+    def _reserve_code(self) -> str:
+        """Inserta un código aleatorio en mp_codes (dentro de la transacción abierta); reintenta si ya existe."""
+        digits = self.digits
+        collisions = 0
+        while True:
+            code = f"MP-{random.randint(10 ** (digits - 1), 10 ** digits - 1)}"
+            try:
+                self._conn.execute("INSERT INTO mp_codes (code, reserved_at) VALUES (?, ?)",
+                                   (code, datetime.now().isoformat()))
+                return code
+            except sqlite3.IntegrityError:
+                collisions += 1
+                if collisions >= self.COLLISIONS_BEFORE_WIDEN:
+                    # El espacio de códigos está casi lleno: ampliar en vez de seguir chocando
+                    logger.warning(f"Códigos MP de {digits} dígitos saturados, usando {digits + 1}")
+                    digits += 1
+                    collisions = 0
+                    self.digits = max(self.digits, digits)
+
+    def reserve_code(self) -> str:
+        """Código MP único para una cita que se guarda fuera de este store (Supabase)."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                code = self._reserve_code()
+                self._conn.execute("COMMIT")
+                return code
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    # ============ ESCRITURA ============
+    def create(self, appointment: dict) -> dict:
+        """Guarda la cita (con un código MP nuevo si no trae uno); devuelve la cita con `id` y `code` asignados."""
+        record = {field: appointment.get(field) for field in FIELDS}
+        record["created_at"] = record["created_at"] or datetime.now().isoformat()
+        for field in _BOOL_FIELDS:
+            record[field] = 1 if record[field] else 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if not record["code"]:
+                    record["code"] = self._reserve_code()
+                else:
+                    # Código traído de fuera (migración, reserva previa): queda registrado para que
+                    # _reserve_code no lo vuelva a emitir
+                    self._conn.execute("INSERT OR IGNORE INTO mp_codes (code, reserved_at) VALUES (?, ?)",
+                                       (record["code"], record["created_at"]))
+                cursor = self._conn.execute(
+                    f"INSERT INTO appointments ({', '.join(FIELDS)}) VALUES ({', '.join('?' for _ in FIELDS)})",
+                    tuple(record[field] for field in FIELDS),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return {**appointment, "id": cursor.lastrowid, "code": record["code"]}
+
+    def update(self, code: str, **fields) -> bool:
+        fields = {k: (1 if v else 0) if k in _BOOL_FIELDS else v for k, v in fields.items() if k in FIELDS and k != "code"}
+        if not fields:
+            return False
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE appointments SET {', '.join(f'{k}=?' for k in fields)} WHERE code=?",
+                (*fields.values(), code),
+            )
+        return cursor.rowcount > 0
+
+    # ============ CONSULTAS ============
+    @staticmethod
+    def _row(row: sqlite3.Row) -> dict:
+        record = dict(row)
+        for field in _BOOL_FIELDS:
+            record[field] = bool(record[field])
+        return record
+
+    def get(self, code: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM appointments WHERE code=?", (code,)).fetchone()
+        return self._row(row) if row else None
+
+    def query(self, phone: Optional[str] = None, source: Optional[str] = None, status: Optional[str] = None,
+              is_emergency: Optional[bool] = None, since: Optional[str] = None, until: Optional[str] = None,
+              limit: int = 50, cursor: Optional[int] = None) -> Tuple[list, Optional[int]]:
+        """
+        Citas más recientes primero. Paginación por cursor (keyset sobre id): pasar el
+        `next_cursor` devuelto para la página siguiente; None = no hay más.
+        """
+        where, params = [], []
+        for column, value in (("phone", phone), ("source", source), ("status", status)):
+            if value is not None:
+                where.append(f"{column}=?")
+                params.append(value)
+        if is_emergency is not None:
+            where.append("is_emergency=?")
+            params.append(1 if is_emergency else 0)
+        if since:
+            where.append("created_at>=?")
+            params.append(since)
+        if until:
+            where.append("created_at<?")
+            params.append(until)
+        if cursor is not None:
+            where.append("id<?")
+            params.append(cursor)
+        sql = "SELECT * FROM appointments"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit + 1)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        page = [self._row(row) for row in rows[:limit]]
+        next_cursor = page[-1]["id"] if len(rows) > limit else None
+        return page, next_cursor
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM appointments").fetchone()[0]
+            codes = self._conn.execute("SELECT COUNT(*) FROM mp_codes").fetchone()[0]
+        return {"path": self.path, "appointments": count, "codes_issued": codes, "code_digits": self.digits}
+
+    def _import_legacy_json(self):
+        """Migra una sola vez el antiguo /tmp/orion_appointments.json si el store está vacío."""
+        if not os.path.exists(LEGACY_JSON_PATH):
+            return
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM appointments LIMIT 1").fetchone():
+                return
+        try:
+            with open(LEGACY_JSON_PATH, "r") as f:
+                legacy = json.load(f)
+        except Exception as e:
+            logger.error(f"No se pudo leer {LEGACY_JSON_PATH}: {e}")
+            return
+        imported = 0
+        for appointment in legacy:
+            try:
+                self.create({k: v for k, v in appointment.items() if k != "id"})
+                imported += 1
+            except sqlite3.IntegrityError:
+                continue
+        logger.info(f"📥 {imported} citas migradas desde {LEGACY_JSON_PATH}")
@@ -0,0 +1,300 @@
+"""
+Degraded Mode - Sofia Lin V9.1
+Controlador automático de SystemConfig.CURRENT_MODE a partir de latencia y errores reales
+de las dependencias (LLM, Supabase, OpenAI Realtime) en una ventana deslizante de tiempo.
+
+- LLM con p95 sobre presupuesto      -> LEVEL_1 (respuestas predefinidas)
+- Supabase lento o fallando         -> LEVEL_2 (sin validación contra la API)
+- LLM fallando (tasa de error alta) -> LEVEL_3 (IA deshabilitada, todo a humano)
+- Realtime fallando                 -> LEVEL_4 (telefonía directa a humano)
+
+El LLM se mide por clase de latencia con su propio presupuesto: respuestas habladas cortas
+(llm_voice) y turnos de texto / extracción estructurada (llm_text, que tardan 1-4 s sanos).
+El análisis en segundo plano (dispatch_analysis) no entra: nadie lo está esperando.
+use_llm(channel) decide con la ventana de ese canal, y un LEVEL_4 causado por Realtime solo
+saca de la IA a la voz; el chat de texto sigue.
+
+Histéresis: cada señal entra con un umbral y sale con otro más bajo, y el modo solo baja
+un nivel tras DEGRADED_HOLD_S estable. Mientras una dependencia está degradada se deja
+pasar una llamada de prueba cada DEGRADED_PROBE_INTERVAL_S para medir si ya se recuperó.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+from core import metrics
+from core.config import DegradedMode, SystemConfig
+
+logger = logging.getLogger("DEGRADED_MODE")
+
+DEGRADED_WINDOW_S = float(os.getenv("DEGRADED_WINDOW_S", "60"))
+DEGRADED_MIN_SAMPLES = int(os.getenv("DEGRADED_MIN_SAMPLES", "5"))
+DEGRADED_ERROR_RATE = float(os.getenv("DEGRADED_ERROR_RATE", "0.5"))
+DEGRADED_ERROR_RECOVER_RATE = float(os.getenv("DEGRADED_ERROR_RECOVER_RATE", "0.2"))
+# El p95 debe bajar a esta fracción del presupuesto para salir del modo degradado
+DEGRADED_RECOVER_RATIO = float(os.getenv("DEGRADED_RECOVER_RATIO", "0.8"))
+DEGRADED_HOLD_S = float(os.getenv("DEGRADED_HOLD_S", "30"))
+DEGRADED_EVAL_INTERVAL_S = float(os.getenv("DEGRADED_EVAL_INTERVAL_S", "1"))
+DEGRADED_PROBE_INTERVAL_S = float(os.getenv("DEGRADED_PROBE_INTERVAL_S", "5"))
+# Fijar el modo a mano (ej. LEVEL_3_AI_DISABLED durante un incidente); vacío = automático
+DEGRADED_MODE_FORCE = os.getenv("DEGRADED_MODE_FORCE", "")
+
+_SEVERITY = {mode: idx for idx, mode in enumerate(DegradedMode)}
+
+# dependencia -> (presupuesto p95 en ms, modo si se pasa de latencia, modo si falla)
+DEPENDENCIES: Dict[str, Tuple[float, Optional[DegradedMode], DegradedMode]] = {
+    # Respuestas habladas (max_tokens ~150): sanas en 0.8-2 s, la mitad del deadline de voz del gateway
+    "llm_voice": (float(os.getenv("DEGRADED_LLM_VOICE_P95_MS", "3000")),
+                  DegradedMode.LEVEL_1_LLM_DEGRADED, DegradedMode.LEVEL_3_AI_DISABLED),
+    # Texto y extracción JSON: sanas en 1.2-3.5 s
+    "llm_text": (float(os.getenv("DEGRADED_LLM_TEXT_P95_MS", "6000")),
+                 DegradedMode.LEVEL_1_LLM_DEGRADED, DegradedMode.LEVEL_3_AI_DISABLED),
+    "supabase": (float(os.getenv("DEGRADED_SUPABASE_P95_MS", str(SystemConfig.MAX_LATENCY_P95_MS))),
+                 DegradedMode.LEVEL_2_API_DEGRADED, DegradedMode.LEVEL_2_API_DEGRADED),
+    # La latencia de conexión de Realtime solo se reporta; sus fallos sí mandan la voz a humano
+    "realtime": (float(os.getenv("DEGRADED_REALTIME_P95_MS", str(SystemConfig.MAX_LATENCY_P95_MS))),
+                 None, DegradedMode.LEVEL_4_EMERGENCY),
+}
+
+# propósito de llm_gateway -> ventana del LLM; los que no están (dispatch_analysis) no se miden
+LLM_PURPOSES: Dict[str, str] = {
+    "voice_reply": "llm_voice",
+    "voice_gather": "llm_voice",
+    "text_chat": "llm_text",
+    "text_turn": "llm_text",
+    "slot_extraction": "llm_text",
+    "voice_extraction": "llm_text",
+    "engine_reply": "llm_text",
+    "brain": "llm_text",
+}
+# canal del turno -> ventana que decide si puede ir al LLM
+LLM_CHANNELS: Dict[str, str] = {"voice": "llm_voice", "text": "llm_text"}
+
+
+class DependencyWindow:
+    """Muestras (t, ms, ok) de los últimos `window_s` segundos de una dependencia."""
+
+    def __init__(self, name: str, budget_ms: float, window_s: float = DEGRADED_WINDOW_S):
+        self.name = name
+        self.budget_ms = budget_ms
+        self.window_s = window_s
+        self._samples: deque = deque()
+        self._lock = threading.Lock()
+        self.slow = False
+        self.failing = False
+        self.last_probe = 0.0
+
+    def record(self, ms: float, ok: bool):
+        now = time.monotonic()
+        with self._lock:
+            self._samples.append((now, ms, ok))
+            self._prune(now)
+
+    def _prune(self, now: float):
+        cutoff = now - self.window_s
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+
+    def summary(self) -> dict:
+        with self._lock:
+            self._prune(time.monotonic())
+            samples = list(self._samples)
+        latencies = sorted(ms for _, ms, ok in samples if ok)
+        errors = sum(1 for _, _, ok in samples if not ok)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0
+        return {
+            "samples": len(samples),
+            "p95_ms": round(p95, 2),
+            "error_rate": round(errors / len(samples), 3) if samples else 0.0,
+            "budget_ms": self.budget_ms,
+        }
+
+    def update(self, summary: dict):
+        """Umbrales con histéresis; con pocas muestras se conserva el estado anterior."""
+        if summary["samples"] == 0:
+            # Sin tráfico en toda la ventana no queda evidencia de degradación
+            self.slow = self.failing = False
+            return
+        if summary["samples"] < DEGRADED_MIN_SAMPLES:
+            return
+        if self.slow:
+            self.slow = summary["p95_ms"] > self.budget_ms * DEGRADED_RECOVER_RATIO
+        else:
+            self.slow = summary["p95_ms"] > self.budget_ms
+        if self.failing:
+            self.failing = summary["error_rate"] > DEGRADED_ERROR_RECOVER_RATE
+        else:
+            self.failing = summary["error_rate"] >= DEGRADED_ERROR_RATE
+
+    @property
+    def degraded(self) -> bool:
+        return self.slow or self.failing
+
+
+class ModeController:
+    def __init__(self, dependencies: Dict[str, Tuple[float, Optional[DegradedMode], DegradedMode]] = None):
+        self.dependencies = dependencies if dependencies is not None else DEPENDENCIES
+        self.windows = {name: DependencyWindow(name, budget) for name, (budget, _, _) in self.dependencies.items()}
+        self._lock = threading.Lock()
+        self._last_eval = 0.0
+        self._changed_at = time.monotonic()
+        self._calm_since: Optional[float] = None
+        self.forced: Optional[DegradedMode] = DegradedMode[DEGRADED_MODE_FORCE] if DEGRADED_MODE_FORCE else None
+        self.transitions = 0
+        self.reasons: Dict[str, str] = {}
+
+    def record(self, dependency: str, ms: float, ok: bool = True):
+        window = self.windows.get(dependency)
+        if window is not None:
+            window.record(ms, ok)
+
+    def record_llm(self, purpose: str, ms: float, ok: bool = True):
+        dependency = LLM_PURPOSES.get(purpose)
+        if dependency is not None:
+            self.record(dependency, ms, ok)
+
+    def _target(self) -> Tuple[DegradedMode, Dict[str, str]]:
+        target = DegradedMode.LEVEL_0_NORMAL
+        reasons = {}
+        for name, window in self.windows.items():
+            summary = window.summary()
+            window.update(summary)
+            _, slow_mode, failing_mode = self.dependencies[name]
+            candidates = []
+            if window.failing:
+                candidates.append((failing_mode, f"error_rate {summary['error_rate']:.0%}"))
+            if window.slow and slow_mode is not None:
+                candidates.append((slow_mode, f"p95 {summary['p95_ms']:.0f} ms > {window.budget_ms:.0f} ms"))
+            for mode, reason in candidates:
+                reasons[name] = reason
+                if _SEVERITY[mode] > _SEVERITY[target]:
+                    target = mode
+        return target, reasons
+
+    def evaluate(self, force: bool = False) -> DegradedMode:
+        now = time.monotonic()
+        if not force and now - self._last_eval < DEGRADED_EVAL_INTERVAL_S:
+            return SystemConfig.CURRENT_MODE
+        with self._lock:
+            self._last_eval = now
+            if self.forced is not None:
+                self._set(self.forced, {"forced": "manual"}, now)
+                return self.forced
+            target, reasons = self._target()
+            current = SystemConfig.CURRENT_MODE
+            if _SEVERITY[target] > _SEVERITY[current]:
+                # Empeorar es inmediato
+                self._calm_since = None
+                self._set(target, reasons, now)
+            elif _SEVERITY[target] < _SEVERITY[current]:
+                # Mejorar exige DEGRADED_HOLD_S estable y baja de a un nivel
+                if self._calm_since is None:
+                    self._calm_since = now
+                elif now - self._calm_since >= DEGRADED_HOLD_S and now - self._changed_at >= DEGRADED_HOLD_S:
+                    step_down = list(DegradedMode)[_SEVERITY[current] - 1]
+                    self._calm_since = None
+                    self._set(max(step_down, target, key=_SEVERITY.get), reasons, now)
+            else:
+                self._calm_since = None
+                self.reasons = reasons
+            return SystemConfig.CURRENT_MODE
+
+    def _set(self, mode: DegradedMode, reasons: Dict[str, str], now: float):
+        self.reasons = reasons
+        if mode is SystemConfig.CURRENT_MODE:
+            return
+        previous = SystemConfig.CURRENT_MODE
+        SystemConfig.CURRENT_MODE = mode
+        self._changed_at = now
+        self.transitions += 1
+        metrics.incr(f"degraded_mode.to_{mode.name.lower()}")
+        log = logger.info if _SEVERITY[mode] < _SEVERITY[previous] else logger.warning
+        log(f"Modo {previous.name} -> {mode.name} ({reasons or 'dependencias sanas'})")
+
+    def current_mode(self) -> DegradedMode:
+        return self.evaluate()
+
+    def allow_probe(self, dependency: str) -> bool:
+        """True si se puede usar la dependencia: sana, o degradada pero toca una llamada de prueba."""
+        window = self.windows.get(dependency)
+        if window is None or not window.degraded:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if now - window.last_probe >= DEGRADED_PROBE_INTERVAL_S:
+                window.last_probe = now
+                metrics.incr(f"degraded_mode.probes.{dependency}")
+                return True
+        return False
+
+    def use_llm(self, channel: str = "text") -> bool:
+        """
+        ¿Este turno puede ir al LLM? No con un modo forzado degradado, ni por voz en LEVEL_4;
+        si la ventana del LLM de ese canal está degradada, solo las pruebas.
+        """
+        mode = self.evaluate()
+        if self.forced is not None and mode is not DegradedMode.LEVEL_0_NORMAL:
+            return False
+        if channel == "voice" and mode is DegradedMode.LEVEL_4_EMERGENCY:
+            return False
+        return self.allow_probe(LLM_CHANNELS.get(channel, "llm_text"))
+
+    def force(self, mode: Optional[DegradedMode]):
+        """Fija el modo a mano (None = volver al control automático)."""
+        with self._lock:
+            self.forced = mode
+            if mode is None:
+                # Al soltar el modo manual se vuelve de inmediato a lo que indican las mediciones
+                target, reasons = self._target()
+                self._calm_since = None
+                self._set(target, reasons, time.monotonic())
+        self.evaluate(force=True)
+
+    def stats(self) -> dict:
+        return {
+            "mode": SystemConfig.CURRENT_MODE.name,
+            "forced": self.forced.name if self.forced else None,
+            "transitions": self.transitions,
+            "reasons": self.reasons,
+            "dependencies": {name: {**w.summary(), "slow": w.slow, "failing": w.failing}
+                             for name, w in self.windows.items()},
+        }
+
+
+_controller: Optional[ModeController] = None
+_controller_lock = threading.Lock()
+
+
+def get_controller() -> ModeController:
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = ModeController()
+        return _controller
+
+
+def record(dependency: str, ms: float, ok: bool = True):
+    get_controller().record(dependency, ms, ok)
+
+
+def current_mode() -> DegradedMode:
+    return get_controller().current_mode()
+
+
+def allow_probe(dependency: str) -> bool:
+    return get_controller().allow_probe(dependency)
+
+
+def record_llm(purpose: str, ms: float, ok: bool = True):
+    get_controller().record_llm(purpose, ms, ok)
+
+
+def use_llm(channel: str = "text") -> bool:
+    return get_controller().use_llm(channel)
+
+
+def at_least(mode: DegradedMode, level: DegradedMode) -> bool:
+    return _SEVERITY[mode] >= _SEVERITY[level]
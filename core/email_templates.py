@@ -0,0 +1,85 @@
+"""
+Email Templates - Sofia Lin V9.1
+Plantillas HTML de confirmación al cliente, pre-renderizadas una vez por idioma.
+Por email solo se sustituyen los campos variables (escapados con html.escape).
+"""
+import html
+from string import Template
+
+# Partes fijas de la marca (pie, logo, colores) compartidas por todos los idiomas
+_LAYOUT = """
+<html>
+<body style="font-family: 'Inter', sans-serif; background-color: #f4f4f4; margin: 0; padding: 20px;">
+    <div style="max-width: 600px; margin: 0 auto; background-color: #ffffff; border-radius: 8px; overflow: hidden; box-shadow: 0 4px 10px rgba(0,0,0,0.1);">
+        <div style="background: linear-gradient(135deg, #0A192F 0%, #112240 100%); text-align: center; padding: 30px 20px; border-bottom: 4px solid #D4AF37;">
+            <img src="https://orion-cloud-1.onrender.com/logo" alt="Morales Plumbing Logo" style="max-width: 200px;">
+            <h1 style="color: #D4AF37; margin-bottom: 0;">{title}</h1>
+        </div>
+        <div style="padding: 30px;">
+            <p style="color: #333; font-size: 16px;">{greeting} <strong>$name</strong>,</p>
+            <p style="color: #555; font-size: 16px; line-height: 1.6;">{intro}</p>
+            <div style="background-color: #f9f9f9; border-left: 4px solid #D4AF37; padding: 15px; margin: 20px 0;">
+                <p style="margin: 5px 0;"><strong>Ticket ID:</strong> $code</p>
+                <p style="margin: 5px 0;"><strong>{address_label}:</strong> $address</p>
+                <p style="margin: 5px 0;"><strong>{issue_label}:</strong> $diagnosis</p>
+            </div>
+            <p style="color: #555; font-size: 16px; line-height: 1.6;">{next_steps}</p>
+
+            <div style="background-color: #f0f7ff; border-left: 4px solid #2196F3; padding: 15px; margin: 20px 0;">
+                <p style="margin: 5px 0; color: #0a4f96;"><strong>🔧 {diy_title}</strong></p>
+                <p style="margin: 5px 0; font-size: 14px; color: #333;">{diy_body}</p>
+            </div>
+        </div>
+        <div style="background-color: #f4f4f4; text-align: center; padding: 20px; color: #777; font-size: 14px;">
+            <p style="margin: 5px 0;"><strong>MORALES PLUMBING | AI-INTEGRATED SERVICES</strong></p>
+            <p style="margin: 5px 0;">Lic. C-36 #1156542 | San Jose, CA</p>
+            <p style="margin: 5px 0;">(669) 213-4422 | moralesplumbing026@gmail.com</p>
+            <p style="margin: 5px 0;"><a href="https://www.morales-plumbing.com" style="color: #D4AF37; text-decoration: none;"><strong>www.morales-plumbing.com</strong></a></p>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+_COPY = {
+    "en": {
+        "subject": "Service Request Received - Morales Plumbing ($code)",
+        "title": "Service Request Received",
+        "greeting": "Hello",
+        "intro": "Thank you for contacting Morales Plumbing. We have successfully received your service request.",
+        "address_label": "Service Address",
+        "issue_label": "Reported Issue",
+        "next_steps": "Our technical team is currently reviewing your request. We will contact you shortly to confirm the exact time of our visit.",
+        "diy_title": "Simple Issue? Try DIY!",
+        "diy_body": 'If you believe this is a minor issue, you can check our <a href="https://www.morales-plumbing.com" style="color: #2196F3;">Do-It-Yourself (DIY) guides</a> on our website while you wait for our confirmation.',
+    },
+    "es": {
+        "subject": "Solicitud de Servicio Recibida - Morales Plumbing ($code)",
+        "title": "Solicitud de Servicio Recibida",
+        "greeting": "Hola",
+        "intro": "Gracias por contactar a Morales Plumbing. Hemos recibido correctamente su solicitud de servicio.",
+        "address_label": "Dirección del Servicio",
+        "issue_label": "Problema Reportado",
+        "next_steps": "Nuestro equipo técnico está revisando su solicitud. Le contactaremos en breve para confirmar la hora exacta de nuestra visita.",
+        "diy_title": "¿Problema Sencillo? ¡Hágalo Usted Mismo!",
+        "diy_body": 'Si cree que es un problema menor, puede revisar nuestras <a href="https://www.morales-plumbing.com" style="color: #2196F3;">guías de Hágalo Usted Mismo (DIY)</a> en nuestro sitio web mientras espera nuestra confirmación.',
+    },
+}
+
+# Pre-render: el layout se arma una sola vez por idioma al importar el módulo
+_CONFIRMATION = {
+    lang: (Template(copy["subject"]), Template(_LAYOUT.format(**{k: v for k, v in copy.items() if k != "subject"})))
+    for lang, copy in _COPY.items()
+}
+
+
+def render_confirmation(lang: str, name: str, code: str, address: str, diagnosis: str) -> tuple:
+    """Devuelve (subject, html) de la confirmación al cliente; idiomas sin plantilla usan inglés."""
+    subject, body = _CONFIRMATION.get(lang) or _CONFIRMATION["en"]
+    fields = {
+        "name": html.escape(str(name)),
+        "code": html.escape(str(code)),
+        "address": html.escape(str(address)),
+        "diagnosis": html.escape(str(diagnosis)),
+    }
+    return subject.safe_substitute(code=code), body.safe_substitute(fields)
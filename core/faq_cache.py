@@ -0,0 +1,380 @@
+"""
+FAQ Cache - Sofia Lin V9.1
+Respuestas aprobadas a las preguntas repetidas (cobertura, horarios, membresías, tarifa
+de $85, emergencias), basadas en _SOFIA_SYSTEM_PROMPT. Coincidencia exacta sobre la
+pregunta normalizada y, si no, difusa (Jaccard de términos con índice invertido) por
+idioma. Si la confianza es baja se devuelve None y el turno sigue al LLM.
+
+Las entradas con "reports_issue" (gas, inundación, aguas negras) son a la vez el reporte del
+problema: el llamador debe guardar el mensaje como descripción de la cita. Por eso nunca se
+devuelven si el mensaje niega ("No huele a gas", "There is no gas smell"): ese turno va al LLM.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional
+
+from core import metrics
+from core.slot_filling import estimate_tokens
+
+logger = logging.getLogger("FAQ_CACHE")
+
+FAQ_PATH = os.getenv("FAQ_PATH")  # JSON opcional con entradas aprobadas que reemplazan a las de abajo
+FAQ_MIN_SCORE = float(os.getenv("FAQ_MIN_SCORE", "0.6"))
+FAQ_MAX_TERMS = int(os.getenv("FAQ_MAX_TERMS", "10"))
+# Si la segunda mejor FAQ (otra respuesta) queda a menos de este margen, es ambiguo -> LLM
+FAQ_MIN_MARGIN = 0.1
+# Tokens típicos de una respuesta del LLM (max_tokens=350) para estimar el ahorro
+_REPLY_TOKENS_EST = 120
+
+FAQ_ENTRIES: List[dict] = [
+    {
+        "id": "coverage",
+        "es": {
+            "questions": ["¿Qué áreas cubren?", "¿En qué ciudades trabajan?", "¿Dónde dan servicio?",
+                          "¿Cuál es su zona de cobertura?", "¿Hasta dónde llegan?", "¿Vienen a mi ciudad?"],
+            "answer": "Atendemos todo el Condado de Santa Clara y el Área de la Bahía: San Jose, Santa Clara, Sunnyvale, "
+                      "Cupertino, Mountain View, Campbell, Los Gatos, Milpitas, Morgan Hill, Gilroy, Palo Alto y Saratoga. "
+                      "¿En qué ciudad necesita el servicio?",
+        },
+        "en": {
+            "questions": ["What areas do you cover?", "What cities do you serve?", "Where do you provide service?",
+                          "What is your service area?", "Do you come to my city?", "Which areas do you service?"],
+            "answer": "We serve all of Santa Clara County and the Bay Area: San Jose, Santa Clara, Sunnyvale, Cupertino, "
+                      "Mountain View, Campbell, Los Gatos, Milpitas, Morgan Hill, Gilroy, Palo Alto and Saratoga. "
+                      "Which city do you need service in?",
+        },
+    },
+    {
+        "id": "hours",
+        "es": {
+            "questions": ["¿Cuál es su horario?", "¿Qué horarios tienen?", "¿A qué hora abren?", "¿A qué hora pueden venir?",
+                          "¿Qué ventanas horarias tienen?", "¿Trabajan hoy?", "¿Cuándo pueden venir?"],
+            "answer": "Nuestras ventanas de servicio son: 8-10 AM, 10 AM-12 PM, 12-2 PM, 2-4 PM y 4-6 PM. "
+                      "Las emergencias críticas se despachan lo antes posible (ASAP) con recargo de urgencia. "
+                      "¿Qué ventana le queda mejor?",
+        },
+        "en": {
+            "questions": ["What are your hours?", "What time do you open?", "What time can you come?",
+                          "What time windows do you have?", "Are you open today?", "When can you come?"],
+            "answer": "Our service windows are 8-10 AM, 10 AM-12 PM, 12-2 PM, 2-4 PM and 4-6 PM. "
+                      "Critical emergencies are dispatched ASAP with an urgency surcharge. Which window works best for you?",
+        },
+    },
+    {
+        "id": "memberships",
+        "es": {
+            "questions": ["¿Qué membresías tienen?", "¿Cuánto cuestan los planes?", "¿Qué incluye el plan premium?",
+                          "¿Qué es el plan free?", "¿Tienen descuentos?", "¿Qué planes ofrecen?", "¿Qué planes tienen?"],
+            "answer": "Tenemos tres membresías: Plan Free ($0.00/mes) con 3 evaluaciones presenciales al año sin Diagnostic Fee "
+                      "y cotización formal por escrito; Plan Standard ($19.99/mes) con 10% de descuento en el PriceBook y 1 "
+                      "inspección preventiva anual; y Plan Premium ($49.99/mes) con 20% de descuento, atención 24/7 sin recargos "
+                      "y 2 mantenimientos especializados (SeeSnake + descalcificación de calentador).",
+        },
+        "en": {
+            "questions": ["What memberships do you have?", "How much are the plans?", "What does the premium plan include?",
+                          "What is the free plan?", "Do you have discounts?", "What plans do you offer?"],
+            "answer": "We have three memberships: Free Plan ($0.00/mo) with 3 in-person evaluations a year with no Diagnostic Fee "
+                      "and a formal written quote; Standard Plan ($19.99/mo) with 10% off the PriceBook and 1 annual preventive "
+                      "inspection; and Premium Plan ($49.99/mo) with 20% off, 24/7 service with no surcharges and 2 specialized "
+                      "maintenances (SeeSnake + water heater descaling).",
+        },
+    },
+    {
+        "id": "diagnostic_fee",
+        "es": {
+            "questions": ["¿Cobran $85?", "¿Cobran 85 dólares por la visita?", "¿Cuánto cobran por la visita?",
+                          "¿Cobran por el diagnóstico?", "¿La inspección tiene costo?", "¿Cobran por ir a ver?"],
+            "answer": "No cobramos una tarifa fija de $85. Con nuestro Plan Free ($0.00/mes) la evaluación presencial no tiene "
+                      "costo de diagnóstico y recibe una cotización formal por escrito. ¿Le agendo la evaluación?",
+        },
+        "en": {
+            "questions": ["Do you charge $85?", "Do you charge 85 dollars for the visit?", "How much is the visit?",
+                          "Do you charge for the diagnosis?", "Is there a fee for the inspection?", "Do you charge to come look?"],
+            "answer": "We don't charge a flat $85 fee. With our Free Plan ($0.00/mo) the in-person evaluation has no diagnostic "
+                      "fee and you get a formal written quote. Would you like me to schedule the evaluation?",
+        },
+    },
+    {
+        "id": "quote",
+        "es": {
+            "questions": ["¿Cuánto cuesta la reparación?", "¿Me puede dar un precio?", "¿Cuánto me va a costar?",
+                          "¿Me da una cotización?", "¿Cuánto cobran?"],
+            "answer": "Para darle un precio exacto y justo, un plomero certificado debe hacer la evaluación presencial según el "
+                      "Código de Plomería de California; no cotizamos a ciegas por mensaje. Con el Plan Free ($0.00/mes) esa "
+                      "evaluación no tiene costo de diagnóstico. ¿Le agendo una visita?",
+        },
+        "en": {
+            "questions": ["How much does the repair cost?", "Can you give me a price?", "How much will it cost?",
+                          "Can I get a quote?", "How much do you charge?"],
+            "answer": "To give you an exact, fair price a certified plumber needs to do an in-person evaluation under the "
+                      "California Plumbing Code; we don't quote blind over messages. With the Free Plan ($0.00/mo) that "
+                      "evaluation has no diagnostic fee. Shall I schedule a visit?",
+        },
+    },
+    {
+        "id": "gas_emergency",
+        "reports_issue": True,
+        "es": {
+            "questions": ["Huele a gas", "Hay olor a gas", "Tengo una fuga de gas", "Siento olor a gas en mi casa", "¿Qué hago si huele a gas?"],
+            "answer": "⚠️ Por su seguridad: evacúe de inmediato, no encienda luces ni genere chispas, cierre la llave principal de "
+                      "gas si es seguro hacerlo y llame al 911 / PG&E (1-800-743-5000). Nuestro despachador de guardia le atiende "
+                      "al (669) 234-2444.",
+        },
+        "en": {
+            "questions": ["I smell gas", "There is a gas smell", "I have a gas leak", "It smells like gas in my house", "What do I do if I smell gas?"],
+            "answer": "⚠️ For your safety: evacuate immediately, don't turn on lights or create sparks, shut off the main gas valve "
+                      "if it is safe to do so and call 911 / PG&E (1-800-743-5000). Our on-call dispatcher is at (669) 234-2444.",
+        },
+    },
+    {
+        "id": "flooding",
+        "reports_issue": True,
+        "es": {
+            "questions": ["Se está inundando mi casa", "Tengo una inundación", "Hay agua por todos lados", "Se reventó un tubo",
+                          "¿Qué hago si se inunda?"],
+            "answer": "⚠️ Cierre de inmediato la válvula de paso principal de agua (Main Shutoff Valve). Le enviamos ayuda de "
+                      "emergencia: llame al despacho de guardia (669) 234-2444 o envíeme su nombre, dirección y teléfono.",
+        },
+        "en": {
+            "questions": ["My house is flooding", "I have a flood", "There is water everywhere", "A pipe burst",
+                          "What do I do if it floods?"],
+            "answer": "⚠️ Shut off the main water valve (Main Shutoff Valve) right away. We'll send emergency help: call our "
+                      "on-call dispatch at (669) 234-2444 or send me your name, address and phone.",
+        },
+    },
+    {
+        "id": "sewage",
+        "reports_issue": True,
+        "es": {
+            "questions": ["Se regresan las aguas negras", "Hay aguas negras en el piso", "Se desbordó el drenaje",
+                          "Sale agua sucia del drenaje"],
+            "answer": "⚠️ No tenga contacto físico con el agua y suspenda el uso de sanitarios y drenajes. Podemos enviar un técnico: "
+                      "llame al (669) 234-2444 o envíeme su nombre, dirección y teléfono.",
+        },
+        "en": {
+            "questions": ["Sewage is backing up", "There is sewage on the floor", "The drain overflowed",
+                          "Dirty water is coming out of the drain"],
+            "answer": "⚠️ Avoid any physical contact with the water and stop using toilets and drains. We can send a technician: "
+                      "call (669) 234-2444 or send me your name, address and phone.",
+        },
+    },
+    {
+        "id": "license",
+        "es": {
+            "questions": ["¿Tienen licencia?", "¿Cuál es su número de licencia?", "¿Están licenciados?", "¿Son plomeros certificados?"],
+            "answer": "Sí. Morales Plumbing tiene licencia estatal CSLB Lic. C-36 #1156542 (San Jose, California) y nuestros "
+                      "técnicos son plomeros certificados.",
+        },
+        "en": {
+            "questions": ["Are you licensed?", "What is your license number?", "Do you have a license?", "Are your plumbers certified?"],
+            "answer": "Yes. Morales Plumbing holds California state license CSLB Lic. C-36 #1156542 (San Jose, California) and our "
+                      "technicians are certified plumbers.",
+        },
+    },
+    {
+        "id": "contact",
+        "es": {
+            "questions": ["¿Cuál es su teléfono?", "¿Cómo los contacto?", "¿Cuál es su correo?", "¿Tienen página web?",
+                          "¿A qué número llamo?"],
+            "answer": "Central: (669) 213-4422 | Despacho de guardia: (669) 234-2444 | Correo: moralesplumbing026@gmail.com | "
+                      "Web: www.moralesplumbing.com",
+        },
+        "en": {
+            "questions": ["What is your phone number?", "How do I contact you?", "What is your email?", "Do you have a website?",
+                          "What number do I call?"],
+            "answer": "Office: (669) 213-4422 | On-call dispatch: (669) 234-2444 | Email: moralesplumbing026@gmail.com | "
+                      "Web: www.moralesplumbing.com",
+        },
+    },
+]
+
+_STOPWORDS = {
+    "es": {"el", "la", "los", "las", "un", "una", "unos", "unas", "de", "del", "al", "a", "en", "y", "o", "que", "es",
+           "son", "su", "sus", "mi", "mis", "me", "se", "lo", "le", "les", "por", "para", "con", "hola", "buenas",
+           "buenos", "dias", "tardes", "noches", "favor", "porfa", "cual", "cuales", "como", "usted", "ustedes", "yo",
+           "tengo", "tiene", "tienen", "hay", "esta", "estan", "hacen", "puede", "pueden", "quisiera", "quiero",
+           "saber", "gracias", "si", "ya", "muy", "mas", "todo", "todos"},
+    "en": {"the", "a", "an", "of", "to", "in", "on", "and", "or", "is", "are", "do", "does", "you", "your", "i", "my",
+           "me", "we", "it", "for", "with", "what", "which", "hi", "hello", "hey", "please", "can", "could", "would",
+           "there", "have", "has", "get", "want", "know", "thanks", "thank", "yes", "any", "all", "guys", "this"},
+}
+
+# Negaciones: son términos de contenido y además anulan las FAQ que reportan un problema
+# ("don't" queda como "don t" tras normalize)
+_NEGATIONS = {
+    "es": {"no", "nunca", "ni", "tampoco", "sin", "nada", "ningun", "ninguna"},
+    "en": {"no", "not", "never", "nothing", "without", "none", "dont", "don", "doesn", "doesnt", "isn", "isnt",
+           "aren", "arent", "wasn", "didn", "didnt", "haven", "havent", "cannot"},
+}
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(text: str) -> str:
+    """minúsculas, sin acentos ni puntuación, espacios colapsados."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return _NON_WORD.sub(" ", text).strip()
+
+
+def terms(text: str, lang: str) -> frozenset:
+    """Términos de contenido: sin stopwords y con plural simple recortado."""
+    stop = _STOPWORDS.get(lang, set())
+    out = set()
+    for word in normalize(text).split():
+        if word in stop:
+            continue
+        if len(word) > 4 and word.endswith("s"):
+            word = word[:-1]
+        out.add(word)
+    return frozenset(out)
+
+
+def negated(text: str, lang: str) -> bool:
+    negations = _NEGATIONS.get(lang, _NEGATIONS["es"] | _NEGATIONS["en"])
+    return any(word in negations for word in normalize(text).split())
+
+
+class FAQHit:
+    def __init__(self, faq_id: str, answer: str, score: float, kind: str, reports_issue: bool = False):
+        self.faq_id = faq_id
+        self.answer = answer
+        self.score = score
+        self.kind = kind  # "exact" | "fuzzy"
+        self.reports_issue = reports_issue
+
+
+class FAQCache:
+    def __init__(self, entries: Optional[List[dict]] = None, min_score: float = FAQ_MIN_SCORE,
+                 max_terms: int = FAQ_MAX_TERMS):
+        self.min_score = min_score
+        self.max_terms = max_terms
+        self._exact: Dict[str, Dict[str, tuple]] = {}     # lang -> {pregunta normalizada: (id, respuesta)}
+        self._questions: Dict[str, List[tuple]] = {}      # lang -> [(términos, id, respuesta)]
+        self._reports_issue = set()                        # ids de FAQ que describen un problema
+        self._index: Dict[str, Dict[str, set]] = {}       # lang -> {término: {índices en _questions}}
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits_exact = 0
+        self.hits_fuzzy = 0
+        self.tokens_saved = 0
+        self.lookup_ns = 0
+        self.hits_by_id: Dict[str, int] = {}
+        self._build(entries if entries is not None else FAQ_ENTRIES)
+
+    def _build(self, entries: List[dict]):
+        for entry in entries:
+            if entry.get("reports_issue"):
+                self._reports_issue.add(entry["id"])
+            for lang, content in entry.items():
+                if lang in ("id", "reports_issue"):
+                    continue
+                exact = self._exact.setdefault(lang, {})
+                questions = self._questions.setdefault(lang, [])
+                index = self._index.setdefault(lang, {})
+                for question in content["questions"]:
+                    exact[normalize(question)] = (entry["id"], content["answer"])
+                    question_terms = terms(question, lang)
+                    if not question_terms:
+                        continue
+                    for term in question_terms:
+                        index.setdefault(term, set()).add(len(questions))
+                    questions.append((question_terms, entry["id"], content["answer"]))
+
+    def _match(self, text: str, lang: str) -> Optional[FAQHit]:
+        found = self._exact.get(lang, {}).get(normalize(text))
+        if found:
+            return FAQHit(found[0], found[1], 1.0, "exact")
+        query = terms(text, lang)
+        if not query or len(query) > self.max_terms:
+            return None
+        questions = self._questions.get(lang, [])
+        index = self._index.get(lang, {})
+        candidates = set()
+        for term in query:
+            candidates |= index.get(term, set())
+        best: Dict[str, tuple] = {}  # id -> (score, respuesta): la mejor pregunta de cada FAQ
+        for idx in candidates:
+            question_terms, faq_id, answer = questions[idx]
+            score = len(query & question_terms) / len(query | question_terms)
+            if score > best.get(faq_id, (0.0,))[0]:
+                best[faq_id] = (score, answer)
+        if not best:
+            return None
+        ranked = sorted(best.items(), key=lambda item: item[1][0], reverse=True)
+        faq_id, (score, answer) = ranked[0]
+        if score < self.min_score:
+            return None
+        if len(ranked) > 1 and score - ranked[1][1][0] < FAQ_MIN_MARGIN:
+            return None
+        return FAQHit(faq_id, answer, round(score, 3), "fuzzy")
+
+    def lookup(self, text: str, lang: str = "es", context_chars: int = 0) -> Optional[FAQHit]:
+        """
+        Respuesta aprobada para `text` o None (el turno va al LLM). `context_chars` es el tamaño
+        del prompt que se habría enviado, para estimar los tokens ahorrados.
+        """
+        start = time.perf_counter_ns()
+        hit = self._match(text or "", lang)
+        if hit and hit.faq_id in self._reports_issue:
+            if negated(text, lang):
+                # "No huele a gas" no es un reporte de gas: sin instrucciones de evacuación ni cita de emergencia
+                metrics.incr("faq.negated_issue")
+                hit = None
+            else:
+                hit.reports_issue = True
+        elapsed = time.perf_counter_ns() - start
+        with self._lock:
+            self.lookups += 1
+            self.lookup_ns += elapsed
+            if hit:
+                if hit.kind == "exact":
+                    self.hits_exact += 1
+                else:
+                    self.hits_fuzzy += 1
+                self.hits_by_id[hit.faq_id] = self.hits_by_id.get(hit.faq_id, 0) + 1
+                self.tokens_saved += estimate_tokens(text) + (context_chars // 4) + _REPLY_TOKENS_EST
+        metrics.incr("faq.hit" if hit else "faq.miss")
+        return hit
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.hits_exact + self.hits_fuzzy
+            return {
+                "lookups": self.lookups,
+                "hit_rate": round(hits / self.lookups, 4) if self.lookups else 0.0,
+                "hits_exact": self.hits_exact,
+                "hits_fuzzy": self.hits_fuzzy,
+                "tokens_saved_est": self.tokens_saved,
+                "avg_lookup_us": round(self.lookup_ns / self.lookups / 1000, 2) if self.lookups else 0.0,
+                "hits_by_id": dict(self.hits_by_id),
+                "min_score": self.min_score,
+            }
+
+
+def _load_entries() -> Optional[List[dict]]:
+    if not FAQ_PATH:
+        return None
+    try:
+        with open(FAQ_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"No se pudo leer FAQ_PATH={FAQ_PATH}, usando las FAQ integradas: {e}")
+        return None
+
+
+_cache: Optional[FAQCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> FAQCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = FAQCache(_load_entries())
+        return _cache
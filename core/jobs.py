@@ -0,0 +1,129 @@
+"""
+Jobs - Sofia Lin V9.1
+Pipeline de trabajos en segundo plano: un pool de hilos ejecuta las etapas de cada
+trabajo en orden, con reintentos (backoff exponencial), tiempo por etapa y estado
+consultable. Pensado para los efectos secundarios que no deben frenar la respuesta
+al cliente (análisis técnico, notificaciones).
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Callable, List, Optional, Tuple
+
+from core import metrics
+
+logger = logging.getLogger("JOBS")
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_RETRIES = int(os.getenv("JOB_MAX_RETRIES", "3"))
+JOB_RETRY_BACKOFF_S = float(os.getenv("JOB_RETRY_BACKOFF_S", "1.0"))
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "500"))
+
+# Una etapa recibe el contexto compartido del trabajo y puede escribir en él
+Stage = Tuple[str, Callable[[dict], Any]]
+
+
+class JobPipeline:
+    def __init__(self, name: str, max_workers: int = JOB_WORKERS, max_retries: int = JOB_MAX_RETRIES,
+                 backoff_s: float = JOB_RETRY_BACKOFF_S, history: int = JOB_HISTORY):
+        self.name = name
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-job")
+        self._jobs: "OrderedDict[str, dict]" = OrderedDict()
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self.max_workers = max_workers
+
+    def submit(self, job_id: str, stages: List[Stage], context: Optional[dict] = None) -> str:
+        """Encola el trabajo y regresa de inmediato; las etapas corren en el pool."""
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "created_at": datetime.now().isoformat(),
+            "finished_at": None,
+            "total_ms": None,
+            "stages": OrderedDict((name, {"status": "pending", "attempts": 0, "ms": None, "error": None})
+                                  for name, _ in stages),
+        }
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"JobPipeline {self.name} cerrado")
+            self._jobs[job_id] = job
+            while len(self._jobs) > self.history:
+                old_id, old_job = next(iter(self._jobs.items()))
+                if old_job["status"] in ("queued", "running"):
+                    break
+                self._jobs.pop(old_id)
+            future = self._executor.submit(self._run, job, stages, context if context is not None else {})
+            self._futures[job_id] = future
+        future.add_done_callback(lambda _f, jid=job_id: self._futures.pop(jid, None))
+        metrics.incr(f"jobs.{self.name}.submitted")
+        return job_id
+
+    def _run(self, job: dict, stages: List[Stage], context: dict):
+        job["status"] = "running"
+        start = time.perf_counter()
+        failed = False
+        for name, fn in stages:
+            stage = job["stages"][name]
+            stage["status"] = "running"
+            stage_start = time.perf_counter()
+            for attempt in range(1, self.max_retries + 1):
+                stage["attempts"] = attempt
+                try:
+                    fn(context)
+                    stage["status"] = "done"
+                    stage["error"] = None
+                    break
+                except Exception as e:
+                    stage["error"] = str(e)
+                    logger.warning(f"Job {job['id']} etapa {name} intento {attempt}/{self.max_retries} falló: {e}")
+                    if attempt < self.max_retries:
+                        time.sleep(self.backoff_s * (2 ** (attempt - 1)) * (0.5 + random.random()))
+            else:
+                stage["status"] = "failed"
+                failed = True
+                metrics.incr(f"jobs.{self.name}.{name}.failed")
+            stage["ms"] = round((time.perf_counter() - stage_start) * 1000, 2)
+            metrics.observe(f"jobs.{self.name}.{name}_ms", stage["ms"])
+
+        job["total_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        job["finished_at"] = datetime.now().isoformat()
+        # Las etapas son independientes: un fallo no cancela las siguientes
+        job["status"] = "partial" if failed else "done"
+        metrics.observe(f"jobs.{self.name}.total_ms", job["total_ms"])
+        logger.info(f"🧵 Job {job['id']} {job['status']} en {job['total_ms']} ms")
+
+    def status(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {**job, "stages": {name: dict(stage) for name, stage in job["stages"].items()}}
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            pending = len(self._futures)
+        return {"name": self.name, "workers": self.max_workers, "pending": pending, "jobs": counts}
+
+    def shutdown(self, timeout_s: float = 10):
+        """Deja de aceptar trabajos y espera hasta `timeout_s` a los pendientes."""
+        with self._lock:
+            self._closed = True
+            pending = list(self._futures.values())
+        if pending:
+            done, not_done = wait(pending, timeout=timeout_s)
+            if not_done:
+                logger.warning(f"JobPipeline {self.name}: {len(not_done)} trabajos sin terminar al apagar")
+        self._executor.shutdown(wait=False, cancel_futures=True)
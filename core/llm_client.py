@@ -0,0 +1,160 @@
+"""
+LLM Client - Sofia Lin V9.1
+Clientes OpenAI compartidos por proceso (conexiones keep-alive) y límite de
+concurrencia para que las llamadas al LLM no bloqueen el event loop de uvicorn.
+
+LLM_MAX_CONCURRENCY es el total del proceso y se reparte explícitamente: LLM_SYNC_CONCURRENCY
+para los hilos (chat_completion_sync) y el resto para el event loop (chat_completion), así la
+suma de los dos semáforos nunca pasa el total.
+"""
+import asyncio
+import os
+import threading
+import time
+from typing import Optional
+
+import httpx
+import openai
+
+from core import degraded_mode
+
+# Límites configurables por variables de entorno
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "32"))
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+# Al menos un cupo por lado (con LLM_MAX_CONCURRENCY=1 el total efectivo es 2)
+LLM_SYNC_CONCURRENCY = max(1, min(int(os.getenv("LLM_SYNC_CONCURRENCY", str(LLM_MAX_CONCURRENCY // 4))),
+                                  LLM_MAX_CONCURRENCY - 1))
+LLM_ASYNC_CONCURRENCY = max(1, LLM_MAX_CONCURRENCY - LLM_SYNC_CONCURRENCY)
+
+_async_client: Optional[openai.AsyncOpenAI] = None
+_sync_client: Optional[openai.OpenAI] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_client_lock = threading.Lock()
+_in_flight = 0
+_waiting = 0
+_sync_semaphore = threading.BoundedSemaphore(LLM_SYNC_CONCURRENCY)
+_sync_lock = threading.Lock()
+_sync_in_flight = 0
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE,
+        keepalive_expiry=60,
+    )
+
+
+def get_async_client() -> openai.AsyncOpenAI:
+    """Cliente async único por proceso, reutiliza el pool de conexiones HTTP."""
+    global _async_client
+    if _async_client is None:
+        _async_client = openai.AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            timeout=LLM_TIMEOUT_S,
+            max_retries=LLM_MAX_RETRIES,
+            http_client=httpx.AsyncClient(limits=_limits(), timeout=LLM_TIMEOUT_S),
+        )
+    return _async_client
+
+
+def get_sync_client() -> openai.OpenAI:
+    """Cliente síncrono compartido para código que corre fuera del event loop (hilos, scripts)."""
+    global _sync_client
+    with _client_lock:
+        if _sync_client is None:
+            _sync_client = openai.OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                timeout=LLM_TIMEOUT_S,
+                max_retries=LLM_MAX_RETRIES,
+                http_client=httpx.Client(limits=_limits(), timeout=LLM_TIMEOUT_S),
+            )
+    return _sync_client
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(LLM_ASYNC_CONCURRENCY)
+    return _semaphore
+
+
+async def chat_completion(max_retries: Optional[int] = None, purpose: Optional[str] = None, **kwargs):
+    """
+    chat.completions.create async, limitado por LLM_ASYNC_CONCURRENCY llamadas simultáneas.
+    `max_retries` reemplaza los reintentos del SDK (llm_gateway los hace él, con deadline).
+    `purpose` (el de llm_gateway) elige la ventana de degraded_mode donde cuenta la latencia.
+    """
+    global _in_flight, _waiting
+    _waiting += 1
+    try:
+        await _get_semaphore().acquire()
+    finally:
+        _waiting -= 1
+    _in_flight += 1
+    start = time.perf_counter()
+    ok = False
+    try:
+        client = get_async_client()
+        if max_retries is not None:
+            client = client.with_options(max_retries=max_retries)
+        response = await client.chat.completions.create(**kwargs)
+        ok = True
+        return response
+    finally:
+        _in_flight -= 1
+        _get_semaphore().release()
+        # La espera en el semáforo no cuenta: solo la latencia propia del proveedor
+        if purpose:
+            degraded_mode.record_llm(purpose, (time.perf_counter() - start) * 1000, ok)
+
+
+def chat_completion_sync(max_retries: Optional[int] = None, timeout_s: Optional[float] = None,
+                         purpose: Optional[str] = None, **kwargs):
+    """Igual que chat_completion para hilos, con su parte del total (LLM_SYNC_CONCURRENCY)."""
+    global _sync_in_flight
+    if not _sync_semaphore.acquire(timeout=timeout_s):
+        raise TimeoutError(f"Sin cupo en LLM_SYNC_CONCURRENCY tras {timeout_s:.1f} s")
+    with _sync_lock:
+        _sync_in_flight += 1
+    start = time.perf_counter()
+    ok = False
+    try:
+        client = get_sync_client()
+        if max_retries is not None:
+            client = client.with_options(max_retries=max_retries)
+        response = client.chat.completions.create(**kwargs)
+        ok = True
+        return response
+    finally:
+        with _sync_lock:
+            _sync_in_flight -= 1
+        _sync_semaphore.release()
+        if purpose:
+            degraded_mode.record_llm(purpose, (time.perf_counter() - start) * 1000, ok)
+
+
+def stats() -> dict:
+    return {
+        "max_concurrency": LLM_MAX_CONCURRENCY,
+        "async_concurrency": LLM_ASYNC_CONCURRENCY,
+        "sync_concurrency": LLM_SYNC_CONCURRENCY,
+        "in_flight": _in_flight,
+        "waiting": _waiting,
+        "sync_in_flight": _sync_in_flight,
+    }
+
+
+async def aclose():
+    """Cierra los clientes compartidos (shutdown del lifespan)."""
+    global _async_client, _sync_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+    with _client_lock:
+        if _sync_client is not None:
+            _sync_client.close()
+            _sync_client = None
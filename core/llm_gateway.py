@@ -0,0 +1,289 @@
+"""
+LLM Gateway - Sofia Lin V9.1
+Punto único de las llamadas de chat al LLM (main, voice_server, SofiaLinV9Engine, OrionBrain).
+
+- Concurrencia: el límite global de llm_client (LLM_MAX_CONCURRENCY, repartido entre event
+  loop e hilos) más uno por propósito, para que el análisis técnico en segundo plano no le
+  quite cupo a la voz.
+- Deadline por llamada; los reintentos (backoff exponencial con jitter, solo errores
+  transitorios) nunca lo pasan, y el timeout de cada intento es lo que queda del deadline.
+- Parseo: texto, JSON sin fences ```json y tool calls en un LLMResult.
+- Contabilidad por propósito: llamadas, errores, reintentos, tokens y latencia (también en
+  metrics como llm.<propósito>_ms y llm.<propósito>.prompt_tokens / completion_tokens).
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import openai
+
+from core import llm_client, metrics
+from core.resilience import DeadlineExceeded
+
+logger = logging.getLogger("LLM_GATEWAY")
+
+LLM_DEFAULT_MODEL = os.getenv("LLM_DEFAULT_MODEL", "gpt-4o-mini")
+LLM_RETRY_BASE_MS = float(os.getenv("LLM_RETRY_BASE_MS", "250"))
+# No se reintenta si después del backoff quedaría menos que esto del deadline
+LLM_RETRY_MIN_S = float(os.getenv("LLM_RETRY_MIN_S", "1"))
+
+# propósito -> (máx. llamadas simultáneas, deadline en s, reintentos)
+PURPOSES: Dict[str, Tuple[int, float, int]] = {
+    "text_chat": (16, 20, 1),          # sofia_chat y respuesta de sofia_text_chat
+    "text_turn": (16, 20, 1),          # turno único con salida estructurada
+    "slot_extraction": (16, 15, 1),    # extracción incremental de datos de la cita
+    "voice_extraction": (8, 8, 1),
+    "voice_reply": (16, 6, 1),         # ask_voice_ai: el cliente está esperando en la línea
+    "voice_gather": (16, 6, 1),        # voice_server.ask_openai
+    "dispatch_analysis": (4, 30, 2),   # análisis técnico en hilos del pipeline de despacho
+    "engine_reply": (8, 10, 1),        # SofiaLinV9Engine
+    "brain": (8, 8, 0),                # OrionBrain: el hedge a Gemini hace de reintento
+}
+DEFAULT_PURPOSE = (8, 15, 1)
+
+
+def _overrides() -> Dict[str, int]:
+    """LLM_PURPOSE_CONCURRENCY="dispatch_analysis=2,voice_reply=24" ajusta el cupo por propósito."""
+    limits = {}
+    for item in os.getenv("LLM_PURPOSE_CONCURRENCY", "").split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip().isdigit():
+            limits[name.strip()] = int(value)
+    return limits
+
+
+LLM_PURPOSE_CONCURRENCY = _overrides()
+
+# Errores transitorios: vale la pena otro intento
+RETRYABLE = (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError,
+             openai.InternalServerError, asyncio.TimeoutError, TimeoutError)
+
+
+def strip_fences(raw: str) -> str:
+    """Quita los fences ```json ... ``` que el modelo a veces agrega alrededor del JSON."""
+    return (raw or "").strip().replace("```json", "").replace("```", "").strip()
+
+
+def parse_json(raw: str):
+    return json.loads(strip_fences(raw))
+
+
+class LLMResult:
+    """Respuesta ya parseada de una llamada (el objeto del SDK queda en `response`)."""
+
+    def __init__(self, purpose: str, response, attempts: int, ms: float):
+        self.purpose = purpose
+        self.response = response
+        self.message = response.choices[0].message
+        self.attempts = attempts
+        self.ms = ms
+
+    @property
+    def text(self) -> str:
+        return (self.message.content or "").strip()
+
+    @property
+    def tool_calls(self) -> list:
+        return self.message.tool_calls or []
+
+    def json(self):
+        return parse_json(self.message.content)
+
+
+class PurposeStats:
+    def __init__(self, name: str):
+        self.name = name
+        limit, self.deadline_s, self.retries = PURPOSES.get(name, DEFAULT_PURPOSE)
+        self.limit = LLM_PURPOSE_CONCURRENCY.get(name, limit)
+        self.sync_semaphore = threading.BoundedSemaphore(self.limit)
+        self.async_semaphore: Optional[asyncio.Semaphore] = None
+        self.calls = 0
+        self.errors = 0
+        self.retried = 0
+        self.deadline_exceeded = 0
+        self.in_flight = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.models: Dict[str, int] = {}
+
+    def get_async_semaphore(self) -> asyncio.Semaphore:
+        if self.async_semaphore is None:
+            self.async_semaphore = asyncio.Semaphore(self.limit)
+        return self.async_semaphore
+
+    def account(self, model: str, ms: float, ok: bool, prompt_tokens: int = 0, completion_tokens: int = 0):
+        self.calls += 1
+        if not ok:
+            self.errors += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.models[model] = self.models.get(model, 0) + prompt_tokens + completion_tokens
+        metrics.observe(f"llm.{self.name}_ms", ms)
+        if prompt_tokens or completion_tokens:
+            metrics.incr(f"llm.{self.name}.prompt_tokens", prompt_tokens)
+            metrics.incr(f"llm.{self.name}.completion_tokens", completion_tokens)
+
+    def stats(self) -> dict:
+        hist = metrics.histogram(f"llm.{self.name}_ms").snapshot()
+        return {
+            "concurrency": self.limit,
+            "in_flight": self.in_flight,
+            "deadline_s": self.deadline_s,
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retried,
+            "deadline_exceeded": self.deadline_exceeded,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "tokens_by_model": dict(self.models),
+            "p50_ms": hist["p50_ms"],
+            "p95_ms": hist["p95_ms"],
+        }
+
+
+_purposes: Dict[str, PurposeStats] = {}
+_purposes_lock = threading.Lock()
+
+
+def purpose(name: str) -> PurposeStats:
+    stats = _purposes.get(name)
+    if stats is None:
+        with _purposes_lock:
+            stats = _purposes.setdefault(name, PurposeStats(name))
+    return stats
+
+
+def _usage(response) -> Tuple[int, int]:
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return 0, 0
+    return usage.prompt_tokens or 0, usage.completion_tokens or 0
+
+
+def _backoff_s(attempt: int) -> float:
+    # Full jitter: entre 0 y base * 2^intento
+    return random.uniform(0, LLM_RETRY_BASE_MS * (2 ** attempt)) / 1000
+
+
+def _retry_backoff(stats: PurposeStats, error: Exception, attempt: int, retries: int, deadline: float) -> Optional[float]:
+    """Segundos a esperar antes del siguiente intento, o None si no se reintenta."""
+    if not isinstance(error, RETRYABLE):
+        return None
+    backoff = _backoff_s(attempt)
+    if deadline - time.monotonic() - backoff < LLM_RETRY_MIN_S:
+        if isinstance(error, (openai.APITimeoutError, asyncio.TimeoutError, TimeoutError)):
+            stats.deadline_exceeded += 1
+        return None
+    if attempt >= retries:
+        return None
+    stats.retried += 1
+    logger.warning(f"LLM {stats.name}: {type(error).__name__}, reintento {attempt + 1}/{retries} en {backoff * 1000:.0f} ms")
+    return backoff
+
+
+# ============ ASYNC ============
+async def complete(purpose_name: str, messages: list, model: str = LLM_DEFAULT_MODEL,
+                   deadline_s: Optional[float] = None, retries: Optional[int] = None, **kwargs) -> LLMResult:
+    """chat.completions por el gateway; los kwargs extra (max_tokens, tools, response_format...) van al SDK."""
+    stats = purpose(purpose_name)
+    retries = stats.retries if retries is None else retries
+    deadline = time.monotonic() + (deadline_s if deadline_s is not None else stats.deadline_s)
+    start = time.perf_counter()
+    semaphore = stats.get_async_semaphore()
+    try:
+        await asyncio.wait_for(semaphore.acquire(), max(0.0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        stats.deadline_exceeded += 1
+        raise DeadlineExceeded(f"{purpose_name}: sin cupo antes del deadline")
+    stats.in_flight += 1
+    try:
+        attempt = 0
+        while True:
+            attempt_start = time.perf_counter()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                stats.deadline_exceeded += 1
+                raise DeadlineExceeded(f"{purpose_name}: deadline vencido antes del intento {attempt + 1}")
+            try:
+                # wait_for cubre también la espera en el semáforo global de llm_client
+                response = await asyncio.wait_for(
+                    llm_client.chat_completion(model=model, messages=messages, timeout=remaining, max_retries=0,
+                                               purpose=purpose_name, **kwargs),
+                    remaining
+                )
+            except Exception as e:
+                stats.account(model, (time.perf_counter() - attempt_start) * 1000, False)
+                backoff = _retry_backoff(stats, e, attempt, retries, deadline)
+                if backoff is None:
+                    if deadline - time.monotonic() <= 0:
+                        raise DeadlineExceeded(f"{purpose_name}: sin respuesta en {attempt + 1} intento(s)") from e
+                    raise
+                attempt += 1
+                await asyncio.sleep(backoff)
+                continue
+            stats.account(model, (time.perf_counter() - attempt_start) * 1000, True, *_usage(response))
+            return LLMResult(purpose_name, response, attempt + 1, (time.perf_counter() - start) * 1000)
+    finally:
+        stats.in_flight -= 1
+        semaphore.release()
+
+
+# ============ SYNC (hilos) ============
+def complete_sync(purpose_name: str, messages: list, model: str = LLM_DEFAULT_MODEL,
+                  deadline_s: Optional[float] = None, retries: Optional[int] = None, **kwargs) -> LLMResult:
+    """Igual que complete() para código que corre fuera del event loop."""
+    stats = purpose(purpose_name)
+    retries = stats.retries if retries is None else retries
+    deadline = time.monotonic() + (deadline_s if deadline_s is not None else stats.deadline_s)
+    start = time.perf_counter()
+    if not stats.sync_semaphore.acquire(timeout=max(0.0, deadline - time.monotonic())):
+        stats.deadline_exceeded += 1
+        raise DeadlineExceeded(f"{purpose_name}: sin cupo antes del deadline")
+    stats.in_flight += 1
+    try:
+        attempt = 0
+        while True:
+            attempt_start = time.perf_counter()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                stats.deadline_exceeded += 1
+                raise DeadlineExceeded(f"{purpose_name}: deadline vencido antes del intento {attempt + 1}")
+            try:
+                response = llm_client.chat_completion_sync(model=model, messages=messages, timeout=remaining,
+                                                           timeout_s=remaining, max_retries=0, purpose=purpose_name,
+                                                           **kwargs)
+            except Exception as e:
+                stats.account(model, (time.perf_counter() - attempt_start) * 1000, False)
+                backoff = _retry_backoff(stats, e, attempt, retries, deadline)
+                if backoff is None:
+                    if deadline - time.monotonic() <= 0:
+                        raise DeadlineExceeded(f"{purpose_name}: sin respuesta en {attempt + 1} intento(s)") from e
+                    raise
+                attempt += 1
+                time.sleep(backoff)
+                continue
+            stats.account(model, (time.perf_counter() - attempt_start) * 1000, True, *_usage(response))
+            return LLMResult(purpose_name, response, attempt + 1, (time.perf_counter() - start) * 1000)
+    finally:
+        stats.in_flight -= 1
+        stats.sync_semaphore.release()
+
+
+def record_external(purpose_name: str, model: str, ms: float, ok: bool,
+                    prompt_tokens: int = 0, completion_tokens: int = 0):
+    """Contabiliza una llamada a otro proveedor (ej. Gemini en OrionBrain) bajo el mismo propósito."""
+    purpose(purpose_name).account(model, ms, ok, prompt_tokens, completion_tokens)
+
+
+def stats() -> dict:
+    with _purposes_lock:
+        purposes = dict(_purposes)
+    return {
+        "global": llm_client.stats(),
+        "purposes": {name: p.stats() for name, p in sorted(purposes.items())},
+    }
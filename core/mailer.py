@@ -0,0 +1,232 @@
+"""
+Mailer - Sofia Lin V9.1
+Envío de correo compartido por proceso: sesiones SMTP autenticadas que se mantienen
+abiertas entre envíos (reconexión automática si el servidor las cierra) y una ventana
+corta de agrupado para que los emails de una misma cita salgan por la misma sesión.
+"""
+import logging
+import os
+import queue
+import smtplib
+import ssl
+import threading
+import time
+from concurrent.futures import Future
+from email.message import Message
+from typing import Optional, Sequence
+
+from core import metrics
+
+logger = logging.getLogger("MAILER")
+
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))            # 587 = STARTTLS, 465 = SSL directo
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "2"))     # sesiones SMTP simultáneas
+SMTP_TIMEOUT_S = float(os.getenv("SMTP_TIMEOUT_S", "20"))
+SMTP_IDLE_S = float(os.getenv("SMTP_IDLE_S", "240"))       # tras este tiempo sin uso se verifica con NOOP
+MAIL_FLUSH_MS = float(os.getenv("MAIL_FLUSH_MS", "250"))   # ventana para agrupar mensajes en un envío
+MAIL_MAX_BATCH = int(os.getenv("MAIL_MAX_BATCH", "20"))
+
+
+def _is_connection_error(e: Exception) -> bool:
+    """La sesión murió (se reconecta y se reintenta el mensaje una vez); un rechazo del mensaje no."""
+    if isinstance(e, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    if isinstance(e, smtplib.SMTPResponseException):
+        return e.smtp_code == 421
+    return isinstance(e, OSError) and not isinstance(e, smtplib.SMTPException)
+
+
+class Mailer:
+    def __init__(self, user: Optional[str], password: Optional[str], host: str = SMTP_HOST, port: int = SMTP_PORT,
+                 pool_size: int = SMTP_POOL_SIZE, flush_ms: float = MAIL_FLUSH_MS, max_batch: int = MAIL_MAX_BATCH,
+                 timeout_s: float = SMTP_TIMEOUT_S, idle_s: float = SMTP_IDLE_S):
+        self.user = user
+        self.password = password
+        self.host = host
+        self.port = port
+        self.pool_size = max(1, pool_size)
+        self.flush_s = flush_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.timeout_s = timeout_s
+        self.idle_s = idle_s
+        self._queue: "queue.Queue" = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self._open_connections = 0
+        self._sent = 0
+        self._failed = 0
+        self._batches = 0
+        self._reconnects = 0
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.user and self.password)
+
+    def submit(self, msg: Message, to_addrs: Optional[Sequence[str]] = None) -> Future:
+        """Encola el mensaje; el Future se resuelve cuando el servidor lo acepta (o con la excepción)."""
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Mailer cerrado")
+            self._start_workers()
+        self._queue.put((msg, to_addrs, future, time.perf_counter()))
+        return future
+
+    def send(self, msg: Message, to_addrs: Optional[Sequence[str]] = None, timeout: Optional[float] = None):
+        """Envío bloqueante (para hilos/scripts): espera a que el mensaje salga o lanza el error."""
+        return self.submit(msg, to_addrs).result(timeout=timeout if timeout is not None else self.timeout_s * 3)
+
+    def _start_workers(self):
+        while len(self._threads) < self.pool_size:
+            thread = threading.Thread(target=self._worker, name=f"smtp-{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    # ============ SESIÓN SMTP ============
+    def _connect(self) -> smtplib.SMTP:
+        context = ssl.create_default_context()
+        if self.port == 465:
+            conn = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout_s, context=context)
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout_s)
+            conn.starttls(context=context)
+        if self.user and self.password:
+            conn.login(self.user, self.password)
+        with self._lock:
+            self._open_connections += 1
+        return conn
+
+    def _close(self, conn: Optional[smtplib.SMTP]):
+        if conn is None:
+            return
+        try:
+            conn.quit()
+        except Exception:
+            conn.close()
+        with self._lock:
+            self._open_connections -= 1
+
+    def _ensure(self, conn: Optional[smtplib.SMTP], last_used: float) -> smtplib.SMTP:
+        """Reutiliza la sesión; si estuvo inactiva mucho tiempo se comprueba con NOOP antes de usarla."""
+        if conn is not None and time.monotonic() - last_used > self.idle_s:
+            try:
+                if conn.noop()[0] != 250:
+                    raise smtplib.SMTPServerDisconnected("NOOP rechazado")
+            except Exception:
+                self._close(conn)
+                conn = None
+        return conn if conn is not None else self._connect()
+
+    # ============ LOOP DE ENVÍO ============
+    def _next_batch(self) -> Optional[list]:
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.flush_s
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Devolver la señal de parada para que el loop termine después de este lote
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _worker(self):
+        conn = None
+        last_used = 0.0
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            with self._lock:
+                self._batches += 1
+            for msg, to_addrs, future, queued_at in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    for attempt in (1, 2):
+                        try:
+                            session, conn = conn, None
+                            conn = self._ensure(session, last_used)
+                            conn.send_message(msg, to_addrs=to_addrs)
+                            break
+                        except Exception as e:
+                            if not _is_connection_error(e):
+                                raise
+                            self._close(conn)
+                            conn = None
+                            if attempt == 2:
+                                raise
+                            with self._lock:
+                                self._reconnects += 1
+                            metrics.incr("mail.reconnects")
+                    last_used = time.monotonic()
+                except Exception as e:
+                    with self._lock:
+                        self._failed += 1
+                    metrics.incr("mail.failed")
+                    logger.error(f"Error enviando email a {to_addrs or msg.get('To')}: {e}")
+                    future.set_exception(e)
+                    continue
+                with self._lock:
+                    self._sent += 1
+                metrics.incr("mail.sent")
+                metrics.observe("mail.send_ms", (time.perf_counter() - queued_at) * 1000)
+                future.set_result(True)
+        self._close(conn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "host": f"{self.host}:{self.port}",
+                "pool_size": self.pool_size,
+                "open_connections": self._open_connections,
+                "queued": self._queue.qsize(),
+                "sent": self._sent,
+                "failed": self._failed,
+                "batches": self._batches,
+                "reconnects": self._reconnects,
+            }
+
+    def close(self, timeout_s: float = 10):
+        """Envía lo que quede en cola, cierra las sesiones SMTP y detiene los hilos."""
+        with self._lock:
+            self._closed = True
+            threads = list(self._threads)
+        for _ in threads:
+            self._queue.put(None)
+        deadline = time.monotonic() + timeout_s
+        for thread in threads:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+
+
+_mailer: Optional[Mailer] = None
+_mailer_lock = threading.Lock()
+
+
+def get_mailer() -> Mailer:
+    """Mailer único por proceso con las credenciales EMAIL_USER / EMAIL_PASS (leídas al primer uso, tras load_dotenv)."""
+    global _mailer
+    with _mailer_lock:
+        if _mailer is None:
+            _mailer = Mailer(os.getenv("EMAIL_USER"), os.getenv("EMAIL_PASS"),
+                             host=os.getenv("SMTP_HOST", SMTP_HOST), port=int(os.getenv("SMTP_PORT", SMTP_PORT)))
+        return _mailer
+
+
+def close():
+    global _mailer
+    with _mailer_lock:
+        mailer, _mailer = _mailer, None
+    if mailer is not None:
+        mailer.close()
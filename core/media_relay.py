@@ -0,0 +1,151 @@
+"""
+Media Relay - Sofia Lin V9.1
+Camino rápido para los frames de audio del puente Twilio <-> OpenAI Realtime: reconoce
+los sobres `media` y `response.output_audio.delta` por prefijo y extrae/arma el payload
+base64 con operaciones de string, sin json.loads/json.dumps por frame. Cualquier otro
+mensaje (o un formato inesperado) cae al parseo JSON normal.
+"""
+import base64
+import os
+import threading
+import time
+from typing import Optional
+
+from core import metrics
+
+# Frames de 20 ms de Twilio que se agrupan en un solo input_audio_buffer.append (1 = sin agrupar)
+REALTIME_COALESCE_FRAMES = max(1, int(os.getenv("REALTIME_COALESCE_FRAMES", "1")))
+
+_TWILIO_MEDIA_PREFIX = '{"event":"media"'
+_OPENAI_DELTA_PREFIXES = ('{"type":"response.output_audio.delta"', '{"type":"response.audio.delta"')
+
+
+def _string_field(msg: str, key: str) -> Optional[str]:
+    """Valor de un campo string plano ("key":"valor"); None si no está o trae escapes."""
+    marker = f'"{key}":"'
+    start = msg.find(marker)
+    if start < 0:
+        return None
+    start += len(marker)
+    end = msg.find('"', start)
+    if end < 0:
+        return None
+    value = msg[start:end]
+    return None if "\\" in value else value
+
+
+def twilio_media_payload(msg: str) -> Optional[str]:
+    """Payload base64 si `msg` es un frame `media` de Twilio; None = usar json.loads."""
+    if not msg.startswith(_TWILIO_MEDIA_PREFIX):
+        return None
+    return _string_field(msg, "payload")
+
+
+def openai_audio_delta(msg: str) -> Optional[str]:
+    """Audio base64 si `msg` es un response.output_audio.delta; None = usar json.loads."""
+    if not msg.startswith(_OPENAI_DELTA_PREFIXES):
+        return None
+    return _string_field(msg, "delta")
+
+
+def openai_append(payload: str) -> str:
+    return '{"type":"input_audio_buffer.append","audio":"' + payload + '"}'
+
+
+def twilio_media(stream_sid: str, payload: str) -> str:
+    return '{"event":"media","streamSid":"' + stream_sid + '","media":{"payload":"' + payload + '"}}'
+
+
+class FrameCoalescer:
+    """
+    Junta N frames base64 en uno (decodifica y re-codifica: cada frame trae su propio padding).
+    Quien lo usa llama flush() en stop, mark y antes de un clear para no perder ni demorar
+    los frames de un grupo incompleto.
+    """
+
+    def __init__(self, frames: int = REALTIME_COALESCE_FRAMES):
+        self.frames = frames
+        self._pending = []
+
+    def add(self, payload: str) -> Optional[str]:
+        if self.frames <= 1:
+            return payload
+        self._pending.append(payload)
+        if len(self._pending) < self.frames:
+            return None
+        return self.flush()
+
+    def flush(self) -> Optional[str]:
+        if not self._pending:
+            return None
+        if len(self._pending) == 1:
+            payload = self._pending[0]
+        else:
+            payload = base64.b64encode(b"".join(base64.b64decode(p) for p in self._pending)).decode("ascii")
+        self._pending = []
+        return payload
+
+
+# Totales del proceso (todas las llamadas), expuestos en /api/metrics
+_totals = {"calls": 0, "frames_in": 0, "frames_out": 0, "appends_sent": 0, "slow_path": 0,
+           "relay_cpu_ms": 0.0, "audio_s": 0.0}
+_totals_lock = threading.Lock()
+
+
+class RelayStats:
+    """Contadores por llamada: frames en cada sentido y CPU gastada en el relay (parseo + armado)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.frames_in = 0
+        self.frames_out = 0
+        self.appends_sent = 0
+        self.slow_path = 0
+        self.cpu_ns = 0
+
+    def summary(self) -> dict:
+        elapsed_s = max(time.perf_counter() - self.started, 1e-6)
+        cpu_ms = self.cpu_ns / 1e6
+        # Fracción de un core que consume esta llamada -> cuántas así caben en un core
+        core_share = (cpu_ms / 1000.0) / elapsed_s
+        return {
+            "duration_s": round(elapsed_s, 2),
+            "frames_in": self.frames_in,
+            "frames_out": self.frames_out,
+            "appends_sent": self.appends_sent,
+            "slow_path": self.slow_path,
+            "frames_in_per_s": round(self.frames_in / elapsed_s, 1),
+            "frames_out_per_s": round(self.frames_out / elapsed_s, 1),
+            "relay_cpu_ms": round(cpu_ms, 2),
+            "cpu_us_per_frame": round(self.cpu_ns / 1e3 / max(1, self.frames_in + self.frames_out), 2),
+            "calls_per_core": round(1 / core_share) if core_share > 0 else None,
+        }
+
+    def finish(self) -> dict:
+        summary = self.summary()
+        with _totals_lock:
+            _totals["calls"] += 1
+            _totals["frames_in"] += self.frames_in
+            _totals["frames_out"] += self.frames_out
+            _totals["appends_sent"] += self.appends_sent
+            _totals["slow_path"] += self.slow_path
+            _totals["relay_cpu_ms"] += self.cpu_ns / 1e6
+            _totals["audio_s"] += summary["duration_s"]
+        metrics.observe("realtime.relay.cpu_ms_per_call", summary["relay_cpu_ms"])
+        metrics.incr("realtime.frames_in", self.frames_in)
+        metrics.incr("realtime.frames_out", self.frames_out)
+        return summary
+
+
+def stats() -> dict:
+    with _totals_lock:
+        totals = dict(_totals)
+    frames = totals["frames_in"] + totals["frames_out"]
+    totals["relay_cpu_ms"] = round(totals["relay_cpu_ms"], 2)
+    totals["audio_s"] = round(totals["audio_s"], 2)
+    totals["cpu_us_per_frame"] = round(totals["relay_cpu_ms"] * 1000 / frames, 2) if frames else 0.0
+    # Llamadas simultáneas que un core sostiene solo en relay (CPU de relay por segundo de llamada)
+    cpu_share = (totals["relay_cpu_ms"] / 1000.0) / totals["audio_s"] if totals["audio_s"] else 0.0
+    totals["calls_per_core"] = round(1 / cpu_share) if cpu_share > 0 else None
+    totals["coalesce_frames"] = REALTIME_COALESCE_FRAMES
+    return totals
@@ -0,0 +1,125 @@
+"""
+Métricas - Sofia Lin V9.1
+Histogramas de latencia (ventana deslizante) y contadores en memoria, por proceso.
+Los histogramas también acumulan buckets fijos para exponerlos en formato Prometheus.
+"""
+import bisect
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict
+
+# Límites superiores (ms) de los buckets acumulados; incluye el objetivo p95 de 1500 ms
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 750, 1000, 1500, 2500, 5000, 10000, 30000)
+
+
+class LatencyHistogram:
+    """Guarda las últimas `window` muestras (ms) para calcular percentiles recientes."""
+
+    def __init__(self, window: int = 2048):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)  # el último es +Inf
+
+    def observe(self, ms: float):
+        with self._lock:
+            self._samples.append(ms)
+            self.buckets[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+            self.count += 1
+            self.total_ms += ms
+            if ms > self.max_ms:
+                self.max_ms = ms
+
+    def percentile(self, p: float) -> float:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return 0.0
+        idx = min(len(samples) - 1, max(0, int(round(p / 100.0 * len(samples))) - 1))
+        return samples[idx]
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50), 2),
+            "p95_ms": round(self.percentile(95), 2),
+            "p99_ms": round(self.percentile(99), 2),
+            "max_ms": round(self.max_ms, 2),
+        }
+
+
+_histograms: Dict[str, LatencyHistogram] = {}
+_counters: Dict[str, float] = {}
+_registry_lock = threading.Lock()
+
+
+def histogram(name: str) -> LatencyHistogram:
+    hist = _histograms.get(name)
+    if hist is None:
+        with _registry_lock:
+            hist = _histograms.setdefault(name, LatencyHistogram())
+    return hist
+
+
+def observe(name: str, ms: float):
+    histogram(name).observe(ms)
+
+
+def incr(name: str, value: float = 1):
+    with _registry_lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+@contextmanager
+def timer(name: str):
+    """Mide el bloque y lo registra en el histograma `name` (ms)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, (time.perf_counter() - start) * 1000)
+
+
+def snapshot() -> dict:
+    with _registry_lock:
+        hists = dict(_histograms)
+        counters = dict(_counters)
+    return {
+        "histograms": {name: h.snapshot() for name, h in sorted(hists.items())},
+        "counters": dict(sorted(counters.items())),
+    }
+
+
+def _prom_name(name: str) -> str:
+    return "orion_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def prometheus() -> str:
+    """Histogramas (buckets acumulados, _sum, _count) y contadores en formato de texto de Prometheus."""
+    with _registry_lock:
+        hists = dict(_histograms)
+        counters = dict(_counters)
+    lines = []
+    for name, hist in sorted(hists.items()):
+        metric = _prom_name(name)
+        with hist._lock:
+            buckets, count, total = list(hist.buckets), hist.count, hist.total_ms
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, n in zip(BUCKETS_MS, buckets):
+            cumulative += n
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{le="+Inf"}} {count}')
+        lines.append(f"{metric}_sum {total}")
+        lines.append(f"{metric}_count {count}")
+    for name, value in sorted(counters.items()):
+        metric = _prom_name(name) + "_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
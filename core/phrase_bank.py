@@ -0,0 +1,196 @@
+"""
+Phrase Bank - Sofia Lin V9.1
+Frases fijas de voz (saludos, despedidas, "¿Algo más?") pre-renderizadas una sola vez:
+MP3 para <Play> de Twilio y μ-law 8 kHz para inyectarlas directo en el Media Stream.
+Se generan al arrancar (en segundo plano) o en build con:
+
+    python -m core.phrase_bank [--force]
+"""
+import array
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+from typing import Dict, Optional
+
+logger = logging.getLogger("PHRASE_BANK")
+
+PHRASE_BANK_DIR = os.getenv("PHRASE_BANK_DIR", "/tmp/orion_phrases")
+PHRASE_TTS_MODEL = os.getenv("PHRASE_TTS_MODEL", "gpt-4o-mini-tts")
+PHRASE_TTS_VOICE = os.getenv("PHRASE_TTS_VOICE", "coral")
+
+# id -> texto exacto; el id se usa en /phrases/{id}.mp3
+PHRASES: Dict[str, str] = {
+    "realtime_greeting_es": "Gracias por llamar a Morales Plumbing, le atiende Sofia Lin. ¿En qué podemos ayudarle hoy?",
+    "greeting_es": "Hola, soy Nekon, dispatcher de Morales Plumbing. ¿En qué te puedo ayudar?",
+    "greeting_en": "Hello, I'm Nekon, dispatcher for Morales Plumbing. How can I help you?",
+    "no_input_goodbye_es": "No escuché nada. Hasta luego.",
+    "no_input_goodbye_en": "I didn't hear anything. Goodbye.",
+    "farewell_es": "Fue un placer servirle. Morales Plumbing le desea excelente día. ¡Hasta luego!",
+    "farewell_en": "It was a pleasure serving you. Morales Plumbing wishes you a great day. Goodbye!",
+    "anything_else_es": "¿Algo más?",
+    "anything_else_en": "Anything else?",
+    "goodbye_es": "Bueno, hasta luego.",
+    "goodbye_en": "Alright, goodbye.",
+    "repeat_es": "No te escuché. ¿Puedes repetir?",
+    "repeat_en": "I didn't hear you. Can you repeat?",
+}
+
+
+# ============ PCM 24 kHz -> μ-law 8 kHz (G.711, sin audioop) ============
+_ULAW_TABLE: Optional[bytes] = None
+
+
+def _ulaw_encode(sample: int) -> int:
+    """G.711 μ-law de una muestra int16 (mismo resultado que audioop.lin2ulaw)."""
+    value = sample >> 2
+    mask = 0xFF
+    if value < 0:
+        value = -value
+        mask = 0x7F
+    value = min(value, 8159) + 0x21
+    segment = (value >> 6).bit_length()
+    if segment >= 8:
+        return 0x7F ^ mask
+    return ((segment << 4) | ((value >> (segment + 1)) & 0x0F)) ^ mask
+
+
+def _ulaw_table() -> bytes:
+    """Tabla de 65536 entradas indexada por la muestra int16 como unsigned."""
+    global _ULAW_TABLE
+    if _ULAW_TABLE is None:
+        _ULAW_TABLE = bytes(_ulaw_encode(i - 65536 if i >= 32768 else i) for i in range(65536))
+    return _ULAW_TABLE
+
+
+def pcm16_to_ulaw(pcm: bytes, in_rate: int = 24000, out_rate: int = 8000) -> bytes:
+    """PCM16 little-endian mono -> μ-law. Promedia cada bloque de muestras (filtro pasa-bajo simple) al diezmar."""
+    samples = array.array("h")
+    samples.frombytes(pcm[:len(pcm) - len(pcm) % 2])
+    if sys.byteorder == "big":
+        samples.byteswap()
+    step = max(1, in_rate // out_rate)
+    table = _ulaw_table()
+    out = bytearray(len(samples) // step)
+    for idx in range(len(out)):
+        base = idx * step
+        avg = sum(samples[base:base + step]) // step
+        out[idx] = table[avg & 0xFFFF]
+    return bytes(out)
+
+
+class PhraseBank:
+    def __init__(self, directory: str = PHRASE_BANK_DIR, phrases: Optional[Dict[str, str]] = None,
+                 model: str = PHRASE_TTS_MODEL, voice: str = PHRASE_TTS_VOICE):
+        self.directory = directory
+        self.phrases = phrases if phrases is not None else PHRASES
+        self.model = model
+        self.voice = voice
+        self._ulaw: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._ready = self._manifest()
+
+    def _fingerprint(self, phrase_id: str) -> str:
+        raw = "\x1f".join((self.model, self.voice, self.phrases[phrase_id]))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, "manifest.json")
+
+    def _manifest(self) -> dict:
+        try:
+            with open(self._manifest_path(), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def path(self, phrase_id: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{phrase_id}.{ext}")
+
+    def is_ready(self, phrase_id: str) -> bool:
+        """True si el audio existe y corresponde al texto/voz actuales."""
+        if phrase_id not in self.phrases:
+            return False
+        return (self._ready.get(phrase_id) == self._fingerprint(phrase_id)
+                and os.path.exists(self.path(phrase_id, "mp3")) and os.path.exists(self.path(phrase_id, "ulaw")))
+
+    def mp3_path(self, phrase_id: str) -> Optional[str]:
+        return self.path(phrase_id, "mp3") if self.is_ready(phrase_id) else None
+
+    def ulaw(self, phrase_id: str) -> Optional[bytes]:
+        """μ-law 8 kHz listo para el Media Stream de Twilio (en memoria tras la primera lectura)."""
+        audio = self._ulaw.get(phrase_id)
+        if audio is None and self.is_ready(phrase_id):
+            with open(self.path(phrase_id, "ulaw"), "rb") as f:
+                audio = f.read()
+            self._ulaw[phrase_id] = audio
+        return audio
+
+    async def _render(self, client, phrase_id: str):
+        text = self.phrases[phrase_id]
+        mp3 = await client.audio.speech.create(model=self.model, voice=self.voice, input=text, response_format="mp3")
+        pcm = await client.audio.speech.create(model=self.model, voice=self.voice, input=text, response_format="pcm")
+        ulaw = await asyncio.to_thread(pcm16_to_ulaw, pcm.content)
+        for ext, data in (("mp3", mp3.content), ("ulaw", ulaw)):
+            tmp = self.path(phrase_id, f"{ext}.tmp")
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self.path(phrase_id, ext))
+        with self._lock:
+            manifest = self._manifest()
+            manifest[phrase_id] = self._fingerprint(phrase_id)
+            with open(self._manifest_path() + ".tmp", "w") as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(self._manifest_path() + ".tmp", self._manifest_path())
+            self._ready = manifest
+            self._ulaw.pop(phrase_id, None)
+
+    async def warm(self, client=None, force: bool = False) -> dict:
+        """Renderiza las frases que falten (o todas con force). Devuelve {id: "ok" | "cached" | error}."""
+        if client is None:
+            from core import llm_client
+            client = llm_client.get_async_client()
+        results = {}
+        # Otro worker (o el build) pudo haberlas renderizado ya
+        self._ready = self._manifest()
+        for phrase_id in self.phrases:
+            if not force and self.is_ready(phrase_id):
+                results[phrase_id] = "cached"
+                continue
+            try:
+                await self._render(client, phrase_id)
+                results[phrase_id] = "ok"
+            except Exception as e:
+                logger.error(f"No se pudo renderizar la frase {phrase_id}: {e}")
+                results[phrase_id] = str(e)
+        rendered = sum(1 for r in results.values() if r == "ok")
+        logger.info(f"🔈 Phrase bank: {rendered} renderizadas, {len(results) - rendered} ya listas o con error")
+        return results
+
+    def stats(self) -> dict:
+        return {"directory": self.directory, "phrases": len(self.phrases),
+                "ready": sum(1 for phrase_id in self.phrases if self.is_ready(phrase_id))}
+
+
+_bank: Optional[PhraseBank] = None
+_bank_lock = threading.Lock()
+
+
+def get_bank() -> PhraseBank:
+    global _bank
+    with _bank_lock:
+        if _bank is None:
+            _bank = PhraseBank()
+        return _bank
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    results = asyncio.run(get_bank().warm(force="--force" in sys.argv))
+    for phrase_id, result in results.items():
+        print(f"{phrase_id}: {result}")
+    sys.exit(0 if all(r in ("ok", "cached") for r in results.values()) else 1)
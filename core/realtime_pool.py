@@ -0,0 +1,276 @@
+"""
+Realtime Pool - Sofia Lin V9.1
+Sesiones de OpenAI Realtime ya conectadas y configuradas (session.update confirmado)
+listas para que una llamada entrante las tome sin esperar el handshake. Se rellenan en
+segundo plano, /incoming-call calienta una por llamada y las que superan el TTL se
+reciclan antes de que el servidor las cierre. Un pedido de /incoming-call que ningún Media
+Stream consume (el cliente cuelga, Twilio falla) caduca a los REALTIME_PREWARM_TTL_S y las
+sesiones que sobran por encima del objetivo se cierran.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Callable, Optional, Tuple
+
+import websockets
+from websockets.protocol import State
+
+from core import degraded_mode, metrics
+
+logger = logging.getLogger("REALTIME_POOL")
+
+OPENAI_REALTIME_URL = os.getenv("OPENAI_REALTIME_URL", "wss://api.openai.com/v1/realtime")
+REALTIME_POOL_SIZE = int(os.getenv("REALTIME_POOL_SIZE", "1"))
+REALTIME_POOL_TTL_S = float(os.getenv("REALTIME_POOL_TTL_S", "600"))
+REALTIME_CONNECT_TIMEOUT_S = float(os.getenv("REALTIME_CONNECT_TIMEOUT_S", "10"))
+# Sesiones calentadas por /incoming-call por encima del tamaño base (tope ante ráfagas)
+REALTIME_POOL_MAX_WARM = int(os.getenv("REALTIME_POOL_MAX_WARM", "8"))
+# Tiempo para que el Media Stream de la llamada tome la sesión que pidió /incoming-call
+REALTIME_PREWARM_TTL_S = float(os.getenv("REALTIME_PREWARM_TTL_S", str(REALTIME_CONNECT_TIMEOUT_S * 3)))
+
+
+class RealtimeSession:
+    def __init__(self, ws, connect_ms: float):
+        self.ws = ws
+        self.connect_ms = connect_ms
+        self.created = time.monotonic()
+
+    def age_s(self) -> float:
+        return time.monotonic() - self.created
+
+    def is_open(self) -> bool:
+        return self.ws.state is State.OPEN
+
+
+class RealtimePool:
+    """
+    `session_update` devuelve el evento session.update completo (prompt, audio, tools).
+    acquire() entrega (ws, "pooled" | "cold"); la conexión pasa a ser de la llamada y
+    la cierra quien la tomó.
+    """
+
+    def __init__(self, model: str, session_update: Callable[[], dict], size: int = REALTIME_POOL_SIZE,
+                 ttl_s: float = REALTIME_POOL_TTL_S, url: str = OPENAI_REALTIME_URL):
+        self.model = model
+        self.session_update = session_update
+        self.size = size
+        self.ttl_s = ttl_s
+        self.url = url
+        self._ready: "deque[RealtimeSession]" = deque()
+        self._opening = 0
+        # Momento de cada pedido de /incoming-call aún no consumido (caducan a los REALTIME_PREWARM_TTL_S)
+        self._wanted: "deque[float]" = deque(maxlen=REALTIME_POOL_MAX_WARM)
+        self._tasks = set()
+        self._waiters: "deque[asyncio.Future]" = deque()  # llamadas esperando una sesión que ya se está abriendo
+        self._maintainer: Optional[asyncio.Task] = None
+        self.acquired_pooled = 0
+        self.acquired_prewarmed = 0
+        self.acquired_cold = 0
+        self.recycled = 0
+        self.failures = 0
+        self.prewarm_expired = 0
+
+    @property
+    def configured(self) -> bool:
+        return bool(os.getenv("OPENAI_API_KEY"))
+
+    async def connect(self) -> RealtimeSession:
+        """Abre y configura una sesión; espera el session.updated para que quede lista de verdad."""
+        start = time.perf_counter()
+        try:
+            session = await self._handshake(start)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            degraded_mode.record("realtime", (time.perf_counter() - start) * 1000, False)
+            raise
+        degraded_mode.record("realtime", session.connect_ms, True)
+        return session
+
+    async def _handshake(self, start: float) -> RealtimeSession:
+        ws = await websockets.connect(f"{self.url}?model={self.model}",
+                                      additional_headers={"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"},
+                                      open_timeout=REALTIME_CONNECT_TIMEOUT_S)
+        connected = time.perf_counter()
+        metrics.observe("realtime.connect_ms", (connected - start) * 1000)
+        try:
+            await ws.send(json.dumps(self.session_update()))
+            await asyncio.wait_for(self._session_updated(ws), REALTIME_CONNECT_TIMEOUT_S)
+        except BaseException:
+            await ws.close()
+            raise
+        metrics.observe("realtime.session_ack_ms", (time.perf_counter() - connected) * 1000)
+        return RealtimeSession(ws, (time.perf_counter() - start) * 1000)
+
+    @staticmethod
+    async def _session_updated(ws):
+        async for raw in ws:
+            event = json.loads(raw)
+            if event.get("type") == "session.updated":
+                return
+            if event.get("type") == "error":
+                raise RuntimeError(f"session.update rechazado: {event.get('error')}")
+        raise ConnectionError("Realtime cerró la conexión antes de confirmar la sesión")
+
+    # ============ LLENADO ============
+    def _pending_prewarms(self) -> int:
+        cutoff = time.monotonic() - REALTIME_PREWARM_TTL_S
+        while self._wanted and self._wanted[0] < cutoff:
+            self._wanted.popleft()
+            self.prewarm_expired += 1
+        return len(self._wanted)
+
+    def _target(self) -> int:
+        return self.size + self._pending_prewarms()
+
+    def _fill(self):
+        if not self.configured:
+            return
+        missing = self._target() - len(self._ready) - self._opening
+        for _ in range(max(0, missing)):
+            self._opening += 1
+            task = asyncio.create_task(self._open_one())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                return waiter
+        return None
+
+    async def _open_one(self):
+        try:
+            session = await self.connect()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"No se pudo pre-conectar una sesión Realtime: {e}")
+            session = None
+        finally:
+            self._opening -= 1
+        waiter = self._next_waiter()
+        if waiter is not None:
+            # None = la llamada que esperaba abre su propia conexión
+            waiter.set_result(session)
+        elif session is not None:
+            self._ready.append(session)
+
+    def prewarm(self):
+        """Llamado desde /incoming-call: deja una sesión abriéndose para el WebSocket que viene."""
+        self._wanted.append(time.monotonic())
+        self._fill()
+
+    def probe(self):
+        """
+        Conexión de prueba para degraded_mode (connect() registra latencia/error) que se cierra
+        al confirmar la sesión: no cuenta como demanda del pool.
+        """
+        if not self.configured:
+            return
+        task = asyncio.create_task(self._probe_once())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _probe_once(self):
+        try:
+            session = await self.connect()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"Prueba de Realtime fallida: {e}")
+            return
+        metrics.incr("realtime.probes_ok")
+        await session.ws.close()
+
+    # ============ USO ============
+    async def acquire(self) -> Tuple[object, str]:
+        """(ws, origen): "pooled" = ya lista, "prewarmed" = se estaba abriendo desde /incoming-call, "cold"."""
+        if self._wanted:
+            self._wanted.popleft()
+        if not self._ready and self._opening > len(self._waiters):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                session = await asyncio.wait_for(waiter, REALTIME_CONNECT_TIMEOUT_S)
+            except asyncio.TimeoutError:
+                session = None
+            if session is not None:
+                self.acquired_prewarmed += 1
+                self._fill()
+                return session.ws, "prewarmed"
+        while self._ready:
+            session = self._ready.popleft()
+            if session.is_open() and session.age_s() < self.ttl_s:
+                self.acquired_pooled += 1
+                self._fill()
+                return session.ws, "pooled"
+            await self._discard(session)
+        self.acquired_cold += 1
+        self._fill()
+        session = await self.connect()
+        return session.ws, "cold"
+
+    async def _discard(self, session: RealtimeSession):
+        self.recycled += 1
+        try:
+            await session.ws.close()
+        except Exception:
+            pass
+
+    async def _maintain(self, interval_s: float):
+        """Recicla sesiones vencidas o cerradas por el servidor y mantiene el tamaño objetivo."""
+        while True:
+            await self.maintain_once()
+            await asyncio.sleep(interval_s)
+
+    async def maintain_once(self):
+        for session in list(self._ready):
+            if not session.is_open() or session.age_s() >= self.ttl_s:
+                try:
+                    self._ready.remove(session)
+                except ValueError:
+                    continue
+                await self._discard(session)
+        # Sesiones de pedidos que caducaron: se cierran las más viejas en vez de reconectarlas cada TTL
+        surplus = len(self._ready) - self._target()
+        for _ in range(max(0, surplus)):
+            await self._discard(self._ready.popleft())
+        self._fill()
+
+    def start(self, interval_s: float = 15.0):
+        if self._maintainer is None and self.configured:
+            self._maintainer = asyncio.create_task(self._maintain(interval_s))
+
+    async def close(self):
+        if self._maintainer is not None:
+            self._maintainer.cancel()
+            self._maintainer = None
+        for task in list(self._tasks):
+            task.cancel()
+        waiter = self._next_waiter()
+        while waiter is not None:
+            waiter.set_result(None)
+            waiter = self._next_waiter()
+        while self._ready:
+            await self._discard(self._ready.popleft())
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "ttl_s": self.ttl_s,
+            "ready": len(self._ready),
+            "opening": self._opening,
+            "prewarm_pending": self._pending_prewarms(),
+            "prewarm_expired": self.prewarm_expired,
+            "acquired_pooled": self.acquired_pooled,
+            "acquired_prewarmed": self.acquired_prewarmed,
+            "acquired_cold": self.acquired_cold,
+            "recycled": self.recycled,
+            "failures": self.failures,
+        }
@@ -0,0 +1,235 @@
+"""
+Resilience - Sofia Lin V9.1
+Selección de proveedor con circuit breaker por proveedor, deadline explícito y hedging:
+si el primario no contesta dentro de su p95 observado se dispara el siguiente, gana la
+primera respuesta válida y la otra se cancela (si aún no arrancó) o se descarta.
+
+Las llamadas son síncronas y corren en un pool de hilos compartido; cada proveedor recibe
+el tiempo que queda del deadline como timeout propio, así una llamada perdedora que ya
+estaba en vuelo termina sola a más tardar en el deadline.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, List, Optional
+
+from core import metrics
+
+logger = logging.getLogger("RESILIENCE")
+
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_S = float(os.getenv("BREAKER_RESET_S", "30"))
+# Antes de tener HEDGE_MIN_SAMPLES latencias propias, el hedge se dispara a HEDGE_DEFAULT_MS
+HEDGE_DEFAULT_MS = float(os.getenv("HEDGE_DEFAULT_MS", "1500"))
+HEDGE_MIN_MS = float(os.getenv("HEDGE_MIN_MS", "200"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WORKERS = int(os.getenv("HEDGE_WORKERS", "16"))
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class AllProvidersFailed(Exception):
+    pass
+
+
+# ============ CIRCUIT BREAKER ============
+class CircuitBreaker:
+    """closed -> open tras `failure_threshold` fallos seguidos; a los `reset_timeout_s` deja pasar una prueba (half_open)."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURES, reset_timeout_s: float = BREAKER_RESET_S):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout_s:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"Circuito {self.name} cerrado de nuevo")
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                    metrics.incr(f"breaker.{self.name}.trips")
+                    logger.warning(f"Circuito {self.name} abierto tras {self.consecutive_failures} fallos seguidos")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """La llamada autorizada no llegó a hacerse (cancelada): libera la prueba half_open sin juzgar."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.consecutive_failures, "trips": self.trips}
+
+
+# ============ PROVEEDORES ============
+class Provider:
+    """`call(*args, timeout_s)` de un proveedor, con su breaker y sus latencias."""
+
+    def __init__(self, name: str, call: Callable[..., object], breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self.call = call
+        self.breaker = breaker or CircuitBreaker(name)
+        self.latency = metrics.LatencyHistogram(window=512)
+        self.successes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.wins = 0
+        self.hedges = 0      # veces que se disparó como respaldo de un primario lento
+        self.discarded = 0   # respuestas que llegaron cuando otro ya había ganado
+
+    def hedge_delay_s(self) -> float:
+        """Cuánto esperar a este proveedor antes de disparar el siguiente: su p95 observado."""
+        if self.latency.count < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_MS / 1000
+        return max(HEDGE_MIN_MS, self.latency.percentile(95)) / 1000
+
+    def run(self, args: tuple, deadline: float):
+        timeout_s = deadline - time.monotonic()
+        if timeout_s <= 0:
+            # Esperó en la cola del pool hasta pasar el deadline: no se llama ni se juzga al proveedor
+            self.breaker.release()
+            raise DeadlineExceeded(f"{self.name}: deadline vencido antes de llamar")
+        start = time.perf_counter()
+        try:
+            result = self.call(*args, timeout_s=timeout_s)
+        except Exception as e:
+            self.failures += 1
+            if isinstance(e, TimeoutError) or "timeout" in type(e).__name__.lower():
+                self.timeouts += 1
+            self.breaker.record_failure()
+            raise
+        ms = (time.perf_counter() - start) * 1000
+        self.latency.observe(ms)
+        self.successes += 1
+        self.breaker.record_success()
+        return result
+
+    def stats(self) -> dict:
+        calls = self.successes + self.failures
+        return {
+            "breaker": self.breaker.stats(),
+            "calls": calls,
+            "success_rate": round(self.successes / calls, 4) if calls else 0.0,
+            "timeouts": self.timeouts,
+            "wins": self.wins,
+            "hedges": self.hedges,
+            "discarded": self.discarded,
+            "hedge_delay_ms": round(self.hedge_delay_s() * 1000, 1),
+            "latency": self.latency.snapshot(),
+        }
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+        return _executor
+
+
+class HedgedProviders:
+    """Proveedores en orden de preferencia, llamados con hedging dentro de un deadline."""
+
+    def __init__(self, name: str, providers: List[Provider], deadline_s: float,
+                 executor: Optional[ThreadPoolExecutor] = None):
+        self.name = name
+        self.providers = providers
+        self.deadline_s = deadline_s
+        self.executor = executor
+
+    def call(self, *args, deadline_s: Optional[float] = None):
+        deadline = time.monotonic() + (deadline_s if deadline_s is not None else self.deadline_s)
+        executor = self.executor or get_executor()
+        queue = list(self.providers)
+        start = time.perf_counter()
+        in_flight = {}
+        errors = []
+
+        def launch() -> bool:
+            # El breaker se consulta recién al lanzar, para no gastar la prueba half_open de un proveedor que no se usa
+            while queue:
+                provider = queue.pop(0)
+                if provider.breaker.allow():
+                    if in_flight:
+                        provider.hedges += 1
+                        metrics.incr(f"{self.name}.{provider.name}.hedges")
+                    in_flight[executor.submit(provider.run, args, deadline)] = provider
+                    return True
+                errors.append(f"{provider.name}: circuito abierto")
+            return False
+
+        if not launch():
+            metrics.incr(f"{self.name}.all_open")
+            raise AllProvidersFailed(f"{self.name}: todos los circuitos abiertos")
+        try:
+            while in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    metrics.incr(f"{self.name}.deadline_exceeded")
+                    raise DeadlineExceeded(f"{self.name}: sin respuesta en el deadline ({'; '.join(errors) or 'en vuelo'})")
+                # El último lanzado decide cuándo se dispara el siguiente (su p95), dejándole al
+                # respaldo al menos la mitad del tiempo que queda
+                wait_s = min(remaining / 2, list(in_flight.values())[-1].hedge_delay_s()) if queue else remaining
+                done, _ = wait(in_flight, timeout=wait_s, return_when=FIRST_COMPLETED)
+                for future in done:
+                    provider = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        errors.append(f"{provider.name}: {e}")
+                        logger.error(f"{self.name} {provider.name} Error: {e}")
+                        continue
+                    provider.wins += 1
+                    metrics.incr(f"{self.name}.{provider.name}.wins")
+                    metrics.observe(f"{self.name}.response_ms", (time.perf_counter() - start) * 1000)
+                    return result
+                if not in_flight or not done:
+                    # Falló el anterior (fallback inmediato) o se pasó de su p95 (hedge)
+                    launch()
+            raise AllProvidersFailed(f"{self.name}: {'; '.join(errors)}")
+        finally:
+            # Perdedores: se cancelan si no arrancaron; los que ya corren terminan en su timeout y se descartan
+            for future, provider in in_flight.items():
+                if future.cancel():
+                    provider.breaker.release()
+                else:
+                    provider.discarded += 1
+
+    def stats(self) -> dict:
+        return {"deadline_s": self.deadline_s, "providers": {p.name: p.stats() for p in self.providers}}
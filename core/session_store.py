@@ -0,0 +1,462 @@
+"""
+Session Store - Sofia Lin V9.1
+Memoria de conversación acotada: expiración por inactividad (TTL), tope de sesiones
+(LRU) y tope de mensajes por sesión, con callbacks de desalojo y estadísticas.
+
+Backends intercambiables (SESSION_BACKEND):
+- memory: diccionario del proceso (default, un solo worker).
+- sqlite: archivo SQLite compartido por todos los workers del nodo.
+- redis: cualquier servidor compatible con el protocolo Redis (varios nodos).
+
+Desde el event loop se usan las variantes async (aget, aset, aappend, apop, asweep): en los
+backends con I/O (commit de SQLite, ida y vuelta a Redis) corren en un hilo con
+asyncio.to_thread; en el de memoria se llaman directo.
+"""
+import abc
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+# redis es opcional — solo se necesita con SESSION_BACKEND=redis
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    redis = None
+    REDIS_AVAILABLE = False
+
+logger = logging.getLogger("SESSION_STORE")
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()
+SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", "/tmp/orion_sessions.db")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", "1800"))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "5000"))
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "40"))
+
+# on_evict(key, value, reason) — reason: "ttl" | "lru"
+EvictCallback = Callable[[str, Any, str], None]
+
+
+def approx_bytes(value: Any) -> int:
+    """Tamaño aproximado del contenido (texto UTF-8) de una sesión."""
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, dict):
+        return sum(approx_bytes(k) + approx_bytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(approx_bytes(v) for v in value)
+    return 8
+
+
+def trim_messages(messages: list, max_messages: int) -> list:
+    """Conserva los mensajes system iniciales y los últimos turnos hasta `max_messages`."""
+    if max_messages <= 0 or len(messages) <= max_messages:
+        return messages
+    head = 0
+    while head < len(messages) and isinstance(messages[head], dict) and messages[head].get("role") == "system":
+        head += 1
+    tail = messages[len(messages) - max(1, max_messages - head):]
+    # Un mensaje "tool" sin su assistant/tool_calls previo es rechazado por la API
+    while tail and isinstance(tail[0], dict) and tail[0].get("role") == "tool":
+        tail = tail[1:]
+    return messages[:head] + tail
+
+
+class SessionBackend(abc.ABC):
+    """
+    Interfaz común de los backends. `append` es atómico: agrega y devuelve el historial
+    resultante en una sola operación, así dos workers no se pisan la misma conversación.
+    Los valores devueltos no se deben mutar: toda escritura pasa por set/append/pop.
+    """
+
+    # True si las operaciones hacen I/O: las variantes async las sacan del event loop
+    blocking = True
+
+    def __init__(self, name: str, ttl_seconds: float = SESSION_TTL_S, max_entries: int = SESSION_MAX_ENTRIES,
+                 max_messages: int = SESSION_MAX_MESSAGES, on_evict: Optional[EvictCallback] = None):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_messages = max_messages
+        self.on_evict = on_evict
+        self._evictions = {"ttl": 0, "lru": 0}
+        self._trimmed = 0
+
+    @abc.abstractmethod
+    def get(self, key: str, default: Any = None) -> Any:
+        ...
+
+    @abc.abstractmethod
+    def set(self, key: str, value: Any):
+        ...
+
+    @abc.abstractmethod
+    def append(self, key: str, *messages: Any, initial: Optional[list] = None) -> list:
+        """Agrega mensajes (creando la sesión con `initial` si no existe) y devuelve el historial."""
+
+    @abc.abstractmethod
+    def pop(self, key: str, default: Any = None) -> Any:
+        ...
+
+    @abc.abstractmethod
+    def sweep(self) -> int:
+        """Expira/desaloja sesiones; devuelve cuántas quedan vivas."""
+
+    @abc.abstractmethod
+    def stats(self) -> dict:
+        ...
+
+    # ============ ASYNC (event loop) ============
+    async def _off_loop(self, fn: Callable, *args, **kwargs) -> Any:
+        if not self.blocking:
+            return fn(*args, **kwargs)
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+    async def aget(self, key: str, default: Any = None) -> Any:
+        return await self._off_loop(self.get, key, default)
+
+    async def aset(self, key: str, value: Any):
+        await self._off_loop(self.set, key, value)
+
+    async def aappend(self, key: str, *messages: Any, initial: Optional[list] = None) -> list:
+        return await self._off_loop(self.append, key, *messages, initial=initial)
+
+    async def apop(self, key: str, default: Any = None) -> Any:
+        return await self._off_loop(self.pop, key, default)
+
+    async def asweep(self) -> int:
+        return await self._off_loop(self.sweep)
+
+    def _evict(self, key: str, value: Any, reason: str):
+        self._evictions[reason] += 1
+        if self.on_evict:
+            try:
+                self.on_evict(key, value, reason)
+            except Exception as e:
+                logger.error(f"Session evict callback error ({self.name}): {e}")
+
+    def _cap(self, value: Any) -> Any:
+        if not isinstance(value, list):
+            return value
+        trimmed = trim_messages(value, self.max_messages)
+        self._trimmed += len(value) - len(trimmed)
+        return trimmed
+
+    def _base_stats(self, live: int, size: int) -> dict:
+        return {
+            "backend": type(self).__name__,
+            "live_sessions": live,
+            "bytes_held": size,
+            "evictions": dict(self._evictions),
+            "trimmed_messages": self._trimmed,
+            "ttl_seconds": self.ttl_seconds,
+            "max_entries": self.max_entries,
+            "max_messages": self.max_messages,
+        }
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any):
+        self.set(key, value)
+
+    def __delitem__(self, key: str):
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def __len__(self) -> int:
+        return self.sweep()
+
+
+class SessionStore(SessionBackend):
+    """Backend en memoria del proceso: OrderedDict con TTL por inactividad y desalojo LRU."""
+
+    blocking = False  # sin I/O: un hilo por operación costaría más que la operación
+
+    def __init__(self, name: str, **kwargs):
+        super().__init__(name, **kwargs)
+        self._data: "OrderedDict[str, list]" = OrderedDict()  # key -> [value, last_access]
+        self._lock = threading.RLock()
+
+    def _expire(self, now: float):
+        # El OrderedDict está ordenado por último acceso: las expiradas están al inicio
+        while self._data:
+            key, (value, last_access) = next(iter(self._data.items()))
+            if now - last_access < self.ttl_seconds:
+                break
+            del self._data[key]
+            self._evict(key, value, "ttl")
+
+    def _touch(self, key: str, value: Any, now: float):
+        self._data[key] = [value, now]
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            old_key, (old_value, _) = self._data.popitem(last=False)
+            self._evict(old_key, old_value, "lru")
+
+    def sweep(self) -> int:
+        with self._lock:
+            self._expire(time.monotonic())
+            return len(self._data)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            self._touch(key, entry[0], now)
+            return entry[0]
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            self._touch(key, self._cap(value), now)
+
+    def append(self, key: str, *messages: Any, initial: Optional[list] = None) -> list:
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            entry = self._data.get(key)
+            history = list(entry[0]) if entry else list(initial or [])
+            history.extend(messages)
+            history = self._cap(history)
+            self._touch(key, history, now)
+            return history
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[0] if entry else default
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._expire(time.monotonic())
+            values = [entry[0] for entry in self._data.values()]
+            return self._base_stats(len(values), sum(approx_bytes(v) for v in values))
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """
+    Backend SQLite (WAL) compartido entre workers del mismo nodo. `append` corre dentro de
+    BEGIN IMMEDIATE, así la lectura + escritura del historial es atómica entre procesos.
+    """
+
+    SWEEP_EVERY_WRITES = 200
+
+    def __init__(self, name: str, path: str = SESSION_SQLITE_PATH, **kwargs):
+        super().__init__(name, **kwargs)
+        self.path = path
+        self._lock = threading.RLock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, last_access REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_access ON sessions (namespace, last_access)")
+
+    def _read(self, key: str, now: float) -> Optional[Any]:
+        row = self._conn.execute(
+            "SELECT value FROM sessions WHERE namespace=? AND key=? AND last_access>=?",
+            (self.name, key, now - self.ttl_seconds),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write(self, key: str, value: Any, now: float):
+        self._conn.execute(
+            "INSERT INTO sessions (namespace, key, value, last_access) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(namespace, key) DO UPDATE SET value=excluded.value, last_access=excluded.last_access",
+            (self.name, key, json.dumps(value, ensure_ascii=False), now),
+        )
+
+    def _after_write(self):
+        self._writes += 1
+        if self._writes % self.SWEEP_EVERY_WRITES == 0:
+            self.sweep()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = time.time()
+        with self._lock:
+            value = self._read(key, now)
+            if value is None:
+                return default
+            self._conn.execute("UPDATE sessions SET last_access=? WHERE namespace=? AND key=?", (now, self.name, key))
+            return value
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._write(key, self._cap(value), time.time())
+        self._after_write()
+
+    def append(self, key: str, *messages: Any, initial: Optional[list] = None) -> list:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                history = self._read(key, now)
+                history = list(history) if history is not None else list(initial or [])
+                history.extend(messages)
+                history = self._cap(history)
+                self._write(key, history, now)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._after_write()
+        return history
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                value = self._read(key, now)
+                self._conn.execute("DELETE FROM sessions WHERE namespace=? AND key=?", (self.name, key))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return default if value is None else value
+
+    def sweep(self) -> int:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                expired = self._conn.execute(
+                    "SELECT key, value FROM sessions WHERE namespace=? AND last_access<?",
+                    (self.name, now - self.ttl_seconds),
+                ).fetchall()
+                self._conn.execute(
+                    "DELETE FROM sessions WHERE namespace=? AND last_access<?", (self.name, now - self.ttl_seconds)
+                )
+                live = self._conn.execute("SELECT COUNT(*) FROM sessions WHERE namespace=?", (self.name,)).fetchone()[0]
+                overflow = []
+                if live > self.max_entries:
+                    overflow = self._conn.execute(
+                        "SELECT key, value FROM sessions WHERE namespace=? ORDER BY last_access LIMIT ?",
+                        (self.name, live - self.max_entries),
+                    ).fetchall()
+                    self._conn.executemany(
+                        "DELETE FROM sessions WHERE namespace=? AND key=?", [(self.name, k) for k, _ in overflow]
+                    )
+                    live -= len(overflow)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        for key, value in expired:
+            self._evict(key, json.loads(value), "ttl")
+        for key, value in overflow:
+            self._evict(key, json.loads(value), "lru")
+        return live
+
+    def stats(self) -> dict:
+        live = self.sweep()
+        with self._lock:
+            size = self._conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(CAST(value AS BLOB))), 0) FROM sessions WHERE namespace=?", (self.name,)
+            ).fetchone()[0]
+        return {**self._base_stats(live, size), "path": self.path}
+
+
+class RedisSessionBackend(SessionBackend):
+    """
+    Backend sobre el protocolo Redis (Redis, Valkey, KeyDB o un stand-in local como fakeredis).
+    Cada sesión es un JSON con PEXPIRE deslizante; `append` usa WATCH/MULTI/EXEC.
+    El tope de sesiones lo aplica el servidor (maxmemory-policy allkeys-lru) y el TTL
+    lo expira Redis, por eso aquí no hay callbacks de desalojo.
+    """
+
+    def __init__(self, name: str, url: str = REDIS_URL, client: Any = None, **kwargs):
+        super().__init__(name, **kwargs)
+        if client is None:
+            if not REDIS_AVAILABLE:
+                raise RuntimeError("SESSION_BACKEND=redis requiere el paquete 'redis'")
+            client = redis.Redis.from_url(url)
+        self._client = client
+        self._prefix = f"sofia:{name}:"
+        self._ttl_ms = int(self.ttl_seconds * 1000)
+
+    def _key(self, key: str) -> str:
+        return self._prefix + key
+
+    def get(self, key: str, default: Any = None) -> Any:
+        pipe = self._client.pipeline(transaction=True)
+        pipe.get(self._key(key))
+        pipe.pexpire(self._key(key), self._ttl_ms)
+        raw, _ = pipe.execute()
+        return json.loads(raw) if raw is not None else default
+
+    def set(self, key: str, value: Any):
+        self._client.set(self._key(key), json.dumps(self._cap(value), ensure_ascii=False), px=self._ttl_ms)
+
+    def append(self, key: str, *messages: Any, initial: Optional[list] = None) -> list:
+        redis_key = self._key(key)
+        result = {}
+
+        def _append(pipe):
+            raw = pipe.get(redis_key)
+            history = json.loads(raw) if raw is not None else list(initial or [])
+            history.extend(messages)
+            history = self._cap(history)
+            pipe.multi()
+            pipe.set(redis_key, json.dumps(history, ensure_ascii=False), px=self._ttl_ms)
+            result["history"] = history
+
+        self._client.transaction(_append, redis_key)
+        return result["history"]
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        pipe = self._client.pipeline(transaction=True)
+        pipe.get(self._key(key))
+        pipe.delete(self._key(key))
+        raw, _ = pipe.execute()
+        return json.loads(raw) if raw is not None else default
+
+    def _keys(self) -> list:
+        return list(self._client.scan_iter(match=self._prefix + "*", count=500))
+
+    def sweep(self) -> int:
+        return len(self._keys())
+
+    def stats(self) -> dict:
+        keys = self._keys()
+        size = 0
+        if keys:
+            pipe = self._client.pipeline(transaction=False)
+            for k in keys:
+                pipe.strlen(k)
+            size = sum(pipe.execute())
+        return self._base_stats(len(keys), size)
+
+
+def open_session_store(name: str, **kwargs) -> SessionBackend:
+    """Crea el store `name` sobre el backend configurado en SESSION_BACKEND."""
+    if SESSION_BACKEND == "sqlite":
+        return SQLiteSessionBackend(name, path=SESSION_SQLITE_PATH, **kwargs)
+    if SESSION_BACKEND == "redis":
+        return RedisSessionBackend(name, url=REDIS_URL, **kwargs)
+    return SessionStore(name, **kwargs)
+
+
+_MISSING = object()
@@ -0,0 +1,138 @@
+"""
+Slot Filling - Sofia Lin V9.1
+Estado incremental de los datos de la cita por sesión. Cada turno se extrae solo del
+último mensaje del cliente + los campos ya conocidos; el historial completo se
+re-extrae únicamente cuando hay conflicto (o la respuesta incremental no es válida).
+"""
+import json
+import logging
+from typing import Callable, Optional, Tuple
+
+from core import llm_gateway, metrics
+
+logger = logging.getLogger("SLOT_FILLING")
+
+
+class SlotSchema:
+    """Campos de la cita para un canal: descripción de cada campo y cuáles son obligatorios."""
+
+    def __init__(self, name: str, fields: dict, required: tuple):
+        self.name = name
+        self.fields = fields      # {campo: descripción para el extractor}
+        self.required = required  # campos que deben estar definidos para agendar
+
+    def empty(self) -> dict:
+        slots = {field: None for field in self.fields}
+        slots["is_emergency"] = False
+        return slots
+
+
+def estimate_tokens(text: str) -> int:
+    """Aproximación barata (~4 caracteres por token) para comparar tamaños de prompt."""
+    return max(1, len(text) // 4)
+
+
+def history_text(messages: list) -> str:
+    return "\n".join(f"{m['role']}: {m['content']}" for m in messages if m["role"] != "system")
+
+
+def _last_turn(messages: list) -> Tuple[Optional[str], str]:
+    """Devuelve (último mensaje de Sofia antes del cliente, último mensaje del cliente)."""
+    user_msg, assistant_msg = "", None
+    for idx in range(len(messages) - 1, -1, -1):
+        if messages[idx]["role"] == "user":
+            user_msg = messages[idx]["content"]
+            for prev in range(idx - 1, -1, -1):
+                if messages[prev]["role"] == "assistant":
+                    assistant_msg = messages[prev]["content"]
+                    break
+            break
+    return assistant_msg, user_msg
+
+
+def build_incremental_prompt(schema: SlotSchema, slots: dict, messages: list) -> str:
+    assistant_msg, user_msg = _last_turn(messages)
+    known = {field: slots.get(field) for field in schema.fields}
+    known["is_emergency"] = bool(slots.get("is_emergency"))
+    field_lines = "\n".join(f'  "{field}": "{desc}"' for field, desc in schema.fields.items())
+    return f"""Actualiza los datos de una cita de Morales Plumbing a partir del NUEVO mensaje del cliente.
+Datos ya conocidos (JSON):
+{json.dumps(known, ensure_ascii=False)}
+
+Última pregunta de Sofia: {json.dumps(assistant_msg or "", ensure_ascii=False)}
+Nuevo mensaje del cliente: {json.dumps(user_msg, ensure_ascii=False)}
+
+Campos posibles:
+{field_lines}
+
+Devuelve ÚNICAMENTE un JSON con los campos que el nuevo mensaje agrega o corrige (omite los demás), más:
+  "is_emergency": true si el nuevo mensaje revela fuga grave/emergencia activa, sino false,
+  "conflict": true SOLO si el cliente contradice o corrige un dato ya conocido sin dejar claro el valor correcto, sino false
+
+JSON:"""
+
+
+def merge_slots(schema: SlotSchema, slots: dict, update: dict) -> dict:
+    merged = dict(slots)
+    for field in schema.fields:
+        value = update.get(field)
+        if value not in (None, "", "null"):
+            merged[field] = value
+    merged["is_emergency"] = bool(slots.get("is_emergency")) or bool(update.get("is_emergency"))
+    merged["is_complete"] = all(merged.get(field) for field in schema.required)
+    return merged
+
+
+def _history_tokens(messages: list) -> int:
+    """Tamaño aproximado del historial sin armar el prompt completo."""
+    return max(1, sum(len(m.get("content") or "") for m in messages if m["role"] != "system") // 4)
+
+
+async def update_slots(schema: SlotSchema, slots: Optional[dict], messages: list,
+                       full_prompt: Callable[[], str], max_tokens: int = 250) -> dict:
+    """
+    Actualiza los slots con el último turno del cliente. Solo si el extractor marca
+    `conflict` (o su JSON no es válido) se vuelve a extraer sobre el historial completo.
+    Los errores de transporte (timeout, conexión) se propagan: re-extraer en ese caso
+    duplicaría la carga sobre un proveedor que ya está fallando.
+    """
+    slots = slots or schema.empty()
+    prompt = build_incremental_prompt(schema, slots, messages)
+
+    result = await llm_gateway.complete(
+        "slot_extraction",
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=max_tokens,
+        temperature=0
+    )
+    try:
+        update = result.json()
+    except ValueError as e:
+        logger.error(f"Incremental slot extraction returned invalid JSON ({schema.name}): {e}")
+        update = None
+    if update is not None and not isinstance(update, dict):
+        update = None
+
+    if update is not None and not update.get("conflict"):
+        merged = merge_slots(schema, slots, update)
+        # Ahorro neto aproximado: en los primeros turnos puede ser negativo (el prompt incremental lleva el JSON de slots)
+        history_estimate = _history_tokens(messages)
+        saved = history_estimate - estimate_tokens(prompt)
+        metrics.incr(f"slots.{schema.name}.incremental_turns")
+        metrics.incr(f"slots.{schema.name}.tokens_saved", saved)
+        logger.info(f"🧩 Slots {schema.name}: prompt≈{estimate_tokens(prompt)} tokens "
+                    f"(historial≈{history_estimate}, ahorro≈{saved})")
+        return merged
+
+    # Conflicto o JSON inválido: re-extracción completa desde cero
+    metrics.incr(f"slots.{schema.name}.full_reextractions")
+    prompt = full_prompt()
+    result = await llm_gateway.complete(
+        "slot_extraction",
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=max_tokens + 100,
+        temperature=0
+    )
+    full = result.json()
+    logger.info(f"🧩 Slots {schema.name}: re-extracción completa (prompt≈{estimate_tokens(prompt)} tokens)")
+    return merge_slots(schema, schema.empty(), full)
@@ -0,0 +1,206 @@
+"""
+Telegram - Sofia Lin V9.1
+Envío a la Bot API de Telegram con clientes HTTP compartidos por proceso (keep-alive,
+HTTP/2 si está instalado `h2`). Respeta el `retry_after` de los 429 y registra la
+latencia de cada método en core.metrics (telegram.<método>_ms).
+
+En el event loop solo se espera inline hasta TELEGRAM_INLINE_RETRY_AFTER_S: un
+retry_after mayor frenaría la respuesta del webhook (Twilio/Chatwoot reintentan y el
+mensaje sale duplicado), así que el reintento se difiere a un JobPipeline y la llamada
+devuelve el 429 de inmediato. Los hilos (call_sync) sí esperan el retry_after completo.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Optional
+
+import httpx
+
+from core import metrics
+from core.jobs import JobPipeline
+
+try:
+    import h2  # noqa: F401  (httpx solo negocia HTTP/2 si el paquete está instalado)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger("TELEGRAM")
+
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+TELEGRAM_TIMEOUT_S = float(os.getenv("TELEGRAM_TIMEOUT_S", "15"))
+TELEGRAM_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_MAX_CONNECTIONS", "20"))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+TELEGRAM_MAX_RETRY_AFTER_S = float(os.getenv("TELEGRAM_MAX_RETRY_AFTER_S", "30"))
+# Máximo que un envío desde el event loop espera inline un 429; más que eso se difiere
+TELEGRAM_INLINE_RETRY_AFTER_S = float(os.getenv("TELEGRAM_INLINE_RETRY_AFTER_S", "1"))
+TELEGRAM_RETRY_WORKERS = int(os.getenv("TELEGRAM_RETRY_WORKERS", "2"))
+
+
+def _retry_after(resp: httpx.Response) -> float:
+    """Segundos a esperar según el 429 (cuerpo `parameters.retry_after` o cabecera Retry-After)."""
+    try:
+        seconds = float(resp.json().get("parameters", {}).get("retry_after", 0))
+    except Exception:
+        seconds = 0.0
+    if not seconds:
+        try:
+            seconds = float(resp.headers.get("Retry-After", 1))
+        except ValueError:
+            seconds = 1.0
+    return min(max(seconds, 0.0), TELEGRAM_MAX_RETRY_AFTER_S)
+
+
+class TelegramSender:
+    """
+    Un cliente async (event loop de uvicorn) y uno síncrono (hilos del pipeline de
+    trabajos, scripts) reutilizados para todos los envíos del mismo bot.
+    Los métodos devuelven el httpx.Response; quien necesite fallar llama raise_for_status().
+    """
+
+    def __init__(self, token: str, base_url: str = TELEGRAM_API_URL, max_retries: int = TELEGRAM_MAX_RETRIES):
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._sync_client: Optional[httpx.Client] = None
+        self._lock = threading.Lock()
+
+    def _url(self, method: str) -> str:
+        return f"{self.base_url}/bot{self.token}/{method}"
+
+    @staticmethod
+    def _limits() -> httpx.Limits:
+        return httpx.Limits(max_connections=TELEGRAM_MAX_CONNECTIONS,
+                            max_keepalive_connections=TELEGRAM_MAX_CONNECTIONS, keepalive_expiry=120)
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(http2=HTTP2_AVAILABLE, limits=self._limits(),
+                                                   timeout=TELEGRAM_TIMEOUT_S)
+        return self._async_client
+
+    def _get_sync_client(self) -> httpx.Client:
+        with self._lock:
+            if self._sync_client is None:
+                self._sync_client = httpx.Client(http2=HTTP2_AVAILABLE, limits=self._limits(),
+                                                 timeout=TELEGRAM_TIMEOUT_S)
+            return self._sync_client
+
+    def _observe(self, method: str, resp: httpx.Response, start: float):
+        metrics.observe(f"telegram.{method}_ms", (time.perf_counter() - start) * 1000)
+        if resp.status_code >= 400:
+            metrics.incr(f"telegram.http_{resp.status_code}")
+            if resp.status_code != 429:
+                logger.warning(f"Telegram {method} respondió {resp.status_code}: {resp.text[:200]}")
+
+    async def call(self, method: str, **kwargs) -> httpx.Response:
+        """POST al método de la Bot API (kwargs = json/data/files de httpx)."""
+        client = self._get_async_client()
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            resp = await client.post(self._url(method), **kwargs)
+            self._observe(method, resp, start)
+            if resp.status_code != 429 or attempt == self.max_retries:
+                return resp
+            wait_s = _retry_after(resp)
+            if wait_s > TELEGRAM_INLINE_RETRY_AFTER_S:
+                self._defer(method, wait_s, kwargs)
+                return resp
+            logger.warning(f"Telegram {method} 429: reintento en {wait_s}s")
+            await asyncio.sleep(wait_s)
+        return resp
+
+    def _defer(self, method: str, wait_s: float, kwargs: dict):
+        """Reintento del 429 en el pipeline de Telegram, tras el retry_after, sin frenar al llamador."""
+        def resend(ctx: dict):
+            time.sleep(ctx.pop("wait_s", 0))
+            self.call_sync(method, **kwargs).raise_for_status()
+
+        job_id = f"tg-{method}-{uuid.uuid4().hex[:8]}"
+        get_retry_jobs().submit(job_id, [("resend", resend)], {"wait_s": wait_s})
+        metrics.incr("telegram.deferred")
+        logger.warning(f"Telegram {method} 429: reintento diferido en {wait_s}s ({job_id})")
+
+    def call_sync(self, method: str, **kwargs) -> httpx.Response:
+        client = self._get_sync_client()
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            resp = client.post(self._url(method), **kwargs)
+            self._observe(method, resp, start)
+            if resp.status_code != 429 or attempt == self.max_retries:
+                return resp
+            wait_s = _retry_after(resp)
+            logger.warning(f"Telegram {method} 429: reintento en {wait_s}s")
+            time.sleep(wait_s)
+        return resp
+
+    async def send_message(self, chat_id, text: str, parse_mode: Optional[str] = None) -> httpx.Response:
+        payload = {"chat_id": chat_id, "text": text}
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
+        return await self.call("sendMessage", json=payload)
+
+    def send_message_sync(self, chat_id, text: str, parse_mode: Optional[str] = None) -> httpx.Response:
+        payload = {"chat_id": chat_id, "text": text}
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
+        return self.call_sync("sendMessage", json=payload)
+
+    async def send_voice(self, chat_id, voice) -> httpx.Response:
+        """`voice` puede ser una URL/file_id o los bytes del MP3."""
+        if isinstance(voice, (bytes, bytearray)):
+            return await self.call("sendVoice", data={"chat_id": chat_id},
+                                   files={"voice": ("audio.mp3", bytes(voice), "audio/mpeg")})
+        return await self.call("sendVoice", json={"chat_id": chat_id, "voice": voice})
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        with self._lock:
+            if self._sync_client is not None:
+                self._sync_client.close()
+                self._sync_client = None
+
+
+_senders = {}
+_senders_lock = threading.Lock()
+_retry_jobs: Optional[JobPipeline] = None
+_retry_jobs_lock = threading.Lock()
+
+
+def get_retry_jobs() -> JobPipeline:
+    """Pipeline compartido para los reenvíos diferidos por 429."""
+    global _retry_jobs
+    with _retry_jobs_lock:
+        if _retry_jobs is None:
+            _retry_jobs = JobPipeline("telegram", max_workers=TELEGRAM_RETRY_WORKERS)
+        return _retry_jobs
+
+
+def get_sender(token: Optional[str] = None) -> TelegramSender:
+    """Sender compartido por token (default TELEGRAM_BOT_TOKEN, leído al primer uso)."""
+    token = token or os.getenv("TELEGRAM_BOT_TOKEN") or ""
+    with _senders_lock:
+        sender = _senders.get(token)
+        if sender is None:
+            sender = _senders[token] = TelegramSender(token)
+        return sender
+
+
+async def aclose():
+    """Espera los reenvíos diferidos y cierra los clientes de todos los senders (lifespan de FastAPI)."""
+    global _retry_jobs
+    with _retry_jobs_lock:
+        jobs, _retry_jobs = _retry_jobs, None
+    if jobs is not None:
+        await asyncio.to_thread(jobs.shutdown, TELEGRAM_MAX_RETRY_AFTER_S)
+    with _senders_lock:
+        senders = list(_senders.values())
+        _senders.clear()
+    for sender in senders:
+        await sender.aclose()
@@ -0,0 +1,195 @@
+"""
+TTS Cache - Sofia Lin V9.1
+Caché de audio TTS direccionado por contenido: sha256(texto, voz, modelo, velocidad,
+formato). Un LRU en memoria delante de un nivel en disco con tope de tamaño; las
+síntesis idénticas concurrentes se agrupan en una sola llamada.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("TTS_CACHE")
+
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "/tmp/orion_tts_cache")
+TTS_CACHE_MAX_DISK_MB = float(os.getenv("TTS_CACHE_MAX_DISK_MB", "256"))
+TTS_CACHE_MAX_MEMORY_MB = float(os.getenv("TTS_CACHE_MAX_MEMORY_MB", "32"))
+
+
+def cache_key(text: str, voice: str, model: str, speed: float = 1.0, fmt: str = "mp3") -> str:
+    raw = "\x1f".join((model, voice, f"{float(speed):.3f}", fmt, text))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def etag(key: str) -> str:
+    return f'"{key}"'
+
+
+class TTSCache:
+    def __init__(self, directory: str = TTS_CACHE_DIR, max_disk_bytes: int = int(TTS_CACHE_MAX_DISK_MB * 1024 * 1024),
+                 max_memory_bytes: int = int(TTS_CACHE_MAX_MEMORY_MB * 1024 * 1024)):
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()  # key -> tamaño, en orden de último uso
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.shared_inflight = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.audio")
+
+    def _load_index(self):
+        """Reconstruye el índice del disco (orden por mtime) al arrancar el worker."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".audio"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-len(".audio")], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    # ============ MEMORIA ============
+    def _remember(self, key: str, data: bytes):
+        if len(data) > self.max_memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    # ============ DISCO ============
+    def _evict_disk(self):
+        while self._disk_bytes > self.max_disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                self.hits_memory += 1
+                return data
+            on_disk = key in self._disk
+        if on_disk:
+            try:
+                with open(self._path(key), "rb") as f:
+                    data = f.read()
+                os.utime(self._path(key))
+            except OSError:
+                data = None
+            with self._lock:
+                if data is None:
+                    self._disk_bytes -= self._disk.pop(key, 0)
+                else:
+                    self._disk.move_to_end(key)
+                    self._remember(key, data)
+                    self.hits_disk += 1
+                    return data
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, data: bytes):
+        if not data:
+            return
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.error(f"No se pudo escribir el audio en caché: {e}")
+            with self._lock:
+                self._remember(key, data)
+            return
+        with self._lock:
+            self._remember(key, data)
+            self._disk_bytes += len(data) - self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            self._evict_disk()
+
+    async def get_or_create(self, key: str, synthesize: Callable[[], Awaitable[Optional[bytes]]]) -> Tuple[Optional[bytes], bool]:
+        """
+        Devuelve (audio, hit). En un miss llama a `synthesize` una sola vez aunque lleguen
+        varias peticiones iguales al mismo tiempo; un resultado vacío no se guarda.
+        """
+        data = self.get(key)
+        if data is not None:
+            return data, True
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.shared_inflight += 1
+            return await asyncio.shield(pending), False
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            data = await synthesize()
+            if data:
+                await asyncio.to_thread(self.put, key, data)
+            future.set_result(data)
+            return data, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Evitar "exception was never retrieved" si nadie más esperaba este audio
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.hits_memory + self.hits_disk
+            total = hits + self.misses
+            return {
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "shared_inflight": self.shared_inflight,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "max_disk_bytes": self.max_disk_bytes,
+            }
+
+
+_cache: Optional[TTSCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> TTSCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = TTSCache()
+        return _cache
@@ -1,12 +1,12 @@
 import os
 import time
 import imaplib
-import smtplib
 import email
 from email.message import EmailMessage
 import logging
 from dotenv import load_dotenv
-from sofia_v9_app import SofiaLinV9Engine
+from sofia_v9_app import SofiaLinV9Engine, dispatch_booking
+from core import mailer
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("EmailWorker")
@@ -15,7 +15,7 @@ load_dotenv()
 EMAIL_USER = os.getenv('EMAIL_USER')
 EMAIL_PASS = os.getenv('EMAIL_PASS')
 
-engine = SofiaLinV9Engine()
+engine = SofiaLinV9Engine(booking_handler=dispatch_booking)
 
 def check_and_reply():
     try:
@@ -73,10 +73,8 @@ def send_reply(to_email, subject, body):
         msg['From'] = EMAIL_USER
         msg['To'] = to_email
         
-        server = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-        server.login(EMAIL_USER, EMAIL_PASS)
-        server.send_message(msg)
-        server.quit()
+        # Sesión SMTP persistente compartida (no se abre una conexión por respuesta)
+        mailer.get_mailer().send(msg)
         logger.info(f"Respuesta enviada a {to_email}")
     except Exception as e:
         logger.error(f"Error enviando email: {e}")
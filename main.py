@@ -1,13 +1,57 @@
 import os
 import logging
-import httpx
 import re
-from fastapi import FastAPI, Request
+import asyncio
+import time
+import zlib
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from urllib.parse import quote
+from core import degraded_mode, email_templates, faq_cache, llm_client, llm_gateway, mailer, media_relay, metrics, phrase_bank, realtime_pool, slot_filling, telegram, tts_cache
+from core.session_store import open_session_store
+from core.appointment_store import AppointmentStore
+from core.jobs import JobPipeline
+from core.config import DegradedMode, SystemConfig
+
+async def _sweep_sessions_forever(interval_s: float = 60):
+    """Expira sesiones abandonadas aunque no lleguen nuevos mensajes."""
+    while True:
+        await asyncio.sleep(interval_s)
+        for store in (text_sessions, text_slots, call_sessions, call_slots):
+            await store.asweep()
+
+async def _monitor_event_loop_lag(interval_s: float = 0.25):
+    """Retraso del event loop (ms): cuánto tarda en despertar un sleep; crece cuando el loop está saturado."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval_s)
+        metrics.observe("event_loop.lag_ms", max(0.0, (loop.time() - start - interval_s) * 1000))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    sweeper = asyncio.create_task(_sweep_sessions_forever())
+    loop_lag = asyncio.create_task(_monitor_event_loop_lag())
+    # Frases fijas de voz (saludo realtime, etc.): se renderizan en segundo plano si faltan
+    phrases = asyncio.create_task(phrase_bank.get_bank().warm()) if os.getenv("OPENAI_API_KEY") else None
+    # Sesiones OpenAI Realtime pre-conectadas para las llamadas entrantes
+    realtime_sessions.start()
+    yield
+    await realtime_sessions.close()
+    sweeper.cancel()
+    loop_lag.cancel()
+    if phrases:
+        phrases.cancel()
+    # Dar tiempo a que terminen las notificaciones de citas en curso
+    await asyncio.to_thread(dispatch_jobs.shutdown, 10)
+    await asyncio.to_thread(mailer.close)
+    await telegram.aclose()
+    # Cerrar clientes compartidos (pool keep-alive) al apagar el worker
+    await llm_client.aclose()
 
 # ConfiguraciÃ³n
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # ============ LOGGER ============
 import logging
@@ -25,7 +69,13 @@ else:
 
 
 # ============ MEMORIA DE SESIÃ“N DE VOZ ============
-call_sessions = {}
+def _log_evicted_session(key: str, value, reason: str):
+    logger.info(f"🧹 Sesión desalojada ({reason}): {key} ({len(value) if isinstance(value, list) else 1} items)")
+
+# Sesiones acotadas: TTL por inactividad + tope LRU + tope de mensajes (core/session_store.py)
+# Con SESSION_BACKEND=sqlite|redis la memoria se comparte entre workers (uvicorn --workers N)
+call_sessions = open_session_store("call_sessions", ttl_seconds=900, on_evict=_log_evicted_session)
+call_slots = open_session_store("call_slots", ttl_seconds=900)  # {call_sid: {campo: valor}} — estado incremental de la cita por llamada
 
 
 # CORS
@@ -101,13 +151,18 @@ INFORMACION CORPORATIVA Y REGLAS MAESTRAS INMUTABLES
      6. Ventana horaria de preferencia (de las 5 oficiales: 8-10 AM, 10-12 PM, 12-2 PM, 2-4 PM, 4-6 PM)
    - Una vez recopilados los datos, el sistema generará automáticamente la confirmación formal con código MP-XXXX."""
 
-def sofia_chat(text: str, lang: str = "es") -> str:
-    """Motor de texto nativo de Sofia Lin — OpenAI gpt-4o-mini directo. Sin dependencias externas."""
+async def sofia_chat(text: str, lang: str = "es") -> str:
+    """Motor de texto nativo de Sofia Lin — OpenAI gpt-4o-mini async con cliente compartido."""
+    # Preguntas frecuentes con respuesta aprobada: sin ir al LLM
+    faq = faq_cache.get_cache().lookup(text, lang, context_chars=len(_SOFIA_SYSTEM_PROMPT))
+    if faq:
+        return faq.answer
+    if not degraded_mode.use_llm():
+        metrics.incr("degraded_mode.predefined_replies")
+        return _degraded_reply(lang)
     try:
-        import openai
-        client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
+        result = await llm_gateway.complete(
+            "text_chat",
             messages=[
                 {"role": "system", "content": _SOFIA_SYSTEM_PROMPT},
                 {"role": "user", "content": text}
@@ -115,7 +170,7 @@ def sofia_chat(text: str, lang: str = "es") -> str:
             max_tokens=350,
             temperature=0.3
         )
-        return response.choices[0].message.content.strip()
+        return result.text
     except Exception as e:
         logger.error(f"Sofia chat error: {e}")
         if lang == "es":
@@ -123,29 +178,225 @@ def sofia_chat(text: str, lang: str = "es") -> str:
         return "Thank you for contacting Morales Plumbing. Please call us at (669) 213-4422 or our dispatch line at (669) 234-2444."
 
 # ============ MEMORIA DE CONVERSACIÓN POR CANAL DE TEXTO ============
-text_sessions: dict = {}  # {user_id: [{"role": ..., "content": ...}]}
+text_sessions = open_session_store("text_sessions", on_evict=_log_evicted_session)  # {user_id: [{"role": ..., "content": ...}]}
+text_slots = open_session_store("text_slots")  # {user_id: {campo: valor}} — estado incremental de la cita
+
+TEXT_SLOT_SCHEMA = slot_filling.SlotSchema(
+    "text",
+    fields={
+        "name": "nombre y apellido del cliente",
+        "phone": "teléfono de contacto",
+        "email": "correo electrónico",
+        "address": "dirección completa del servicio con ciudad",
+        "diagnosis": "descripción del problema reportado por el cliente con sus propias palabras",
+        "time_window": "ventana horaria preferida o acordada (ej. 8-10 AM, 10-12 PM, 12-2 PM, 2-4 PM, 4-6 PM, Hoy ASAP)",
+    },
+    required=("name", "phone", "address", "diagnosis", "time_window"),
+)
+
+# Modo de turno: "two_call" (extracción JSON + respuesta), "single" (una llamada con salida estructurada)
+# o "ab" (reparte conversaciones entre ambos para comparar p95 en /api/metrics)
+SOFIA_TURN_MODE = os.getenv("SOFIA_TURN_MODE", "two_call").lower()
+
+_SINGLE_TURN_INSTRUCTIONS = """
+================================================================================
+FORMATO DE SALIDA (OBLIGATORIO)
+================================================================================
+Responde SIEMPRE con un objeto JSON con dos claves:
+- "reply": tu siguiente mensaje para el cliente, en su idioma, siguiendo el flujo de despacho.
+- "appointment": los datos de la cita extraídos de TODA la conversación:
+  name (nombre y apellido), phone, email, address (dirección completa con ciudad),
+  diagnosis (problema con las palabras del cliente), time_window (8-10 AM, 10-12 PM, 12-2 PM, 2-4 PM, 4-6 PM u Hoy ASAP),
+  is_emergency (true si es fuga grave/emergencia activa),
+  is_complete (true SOLO si name, phone, address, diagnosis y time_window están todos definidos).
+Usa null en los campos que el cliente aún no ha proporcionado."""
+
+_NULLABLE_STRING = {"type": ["string", "null"]}
+_SINGLE_TURN_SCHEMA = {
+    "name": "sofia_turn",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "additionalProperties": False,
+        "required": ["reply", "appointment"],
+        "properties": {
+            "reply": {"type": "string"},
+            "appointment": {
+                "type": "object",
+                "additionalProperties": False,
+                "required": ["name", "phone", "email", "address", "diagnosis", "time_window", "is_emergency", "is_complete"],
+                "properties": {
+                    "name": _NULLABLE_STRING,
+                    "phone": _NULLABLE_STRING,
+                    "email": _NULLABLE_STRING,
+                    "address": _NULLABLE_STRING,
+                    "diagnosis": _NULLABLE_STRING,
+                    "time_window": _NULLABLE_STRING,
+                    "is_emergency": {"type": "boolean"},
+                    "is_complete": {"type": "boolean"},
+                },
+            },
+        },
+    },
+}
 
-def sofia_text_chat(text: str, user_id: str, lang: str = "es") -> str:
+def _text_turn_mode(user_id: str) -> str:
+    if SOFIA_TURN_MODE == "ab":
+        return "single" if zlib.crc32(user_id.encode("utf-8")) % 2 else "two_call"
+    return "single" if SOFIA_TURN_MODE == "single" else "two_call"
+
+def _text_fallback_reply(lang: str) -> str:
+    if lang == "es":
+        return "Gracias por contactar a Morales Plumbing. Llámenos al (669) 213-4422 o al despacho directo (669) 234-2444."
+    return "Thank you for contacting Morales Plumbing. Please call (669) 213-4422 or direct dispatch (669) 234-2444."
+
+def _degraded_reply(lang: str) -> str:
+    """Respuesta predefinida cuando el modo degradado no deja ir al LLM (LEVEL_1 en adelante)."""
+    if degraded_mode.at_least(SystemConfig.CURRENT_MODE, DegradedMode.LEVEL_3_AI_DISABLED):
+        return _text_fallback_reply(lang)
+    if lang == "es":
+        return ("Gracias por escribir a Morales Plumbing. En este momento tenemos alta demanda: envíenos su nombre, "
+                "dirección, teléfono y el problema, y un despachador le confirmará la visita. Urgencias: (669) 234-2444.")
+    return ("Thanks for contacting Morales Plumbing. We are experiencing high demand: send us your name, address, "
+            "phone and the issue, and a dispatcher will confirm your visit. Emergencies: (669) 234-2444.")
+
+async def _book_text_appointment(appt: dict, user_id: str, lang: str) -> str:
+    """Agenda la cita extraída y devuelve la confirmación oficial con código MP-XXXX."""
+    name = appt.get("name") or "Cliente"
+    phone = appt.get("phone") or "No provisto"
+    email = appt.get("email") or "No provisto"
+    address = appt.get("address") or "No provisto"
+    diagnosis = appt.get("diagnosis") or "Evaluación e Inspección en Sitio"
+    time_window = appt.get("time_window") or "Por coordinar en ventana oficial"
+    is_emergency = appt.get("is_emergency", False)
+
+    code = await asyncio.to_thread(
+        save_appointment,
+        name=name,
+        phone=phone,
+        email=email,
+        address=address,
+        status="Pendiente",
+        diagnosis=diagnosis,
+        materials="Evaluación técnica presencial",
+        is_emergency=is_emergency,
+        scheduled_time=time_window,
+        source="telegram" if "tg_" in user_id else "whatsapp",
+        lang=lang
+    )
+    # Limpiar sesión para evitar doble guardado
+    await text_sessions.apop(user_id, None)
+    await text_slots.apop(user_id, None)
+
+    if lang == "es":
+        return (
+            f"🔧 *MORALES PLUMBING — CONFIRMACIÓN DE CITA DE SERVICIO*\n\n"
+            f"📋 *Código de Orden:* `{code}`\n"
+            f"👤 *Cliente:* {name}\n"
+            f"📍 *Dirección de Servicio:* {address}\n"
+            f"📞 *Teléfono:* {phone}\n"
+            f"📧 *Correo:* {email}\n"
+            f"🛠️ *Problema Reportado:* {diagnosis}\n"
+            f"⏰ *Ventana Horaria Asignada:* {time_window}\n"
+            f"💳 *Membresía Aplicada:* Plan Free ($0.00/mes — 0 Diagnostic Fee)\n\n"
+            f"🚗 *Próximos pasos:* Uno de nuestros plomeros certificados acudirá con su camión taller en la ventana programada. "
+            f"Recibirá un mensaje de notificación cuando el técnico esté en camino (On-My-Way) con seguimiento satelital.\n\n"
+            f"📞 *Central:* (669) 213-4422 | *Despacho de Guardia:* (669) 234-2444\n"
+            f"🌐 *Web:* www.moralesplumbing.com"
+        )
+    return (
+        f"🔧 *MORALES PLUMBING — SERVICE APPOINTMENT CONFIRMATION*\n\n"
+        f"📋 *Order Code:* `{code}`\n"
+        f"👤 *Customer:* {name}\n"
+        f"📍 *Service Address:* {address}\n"
+        f"📞 *Phone:* {phone}\n"
+        f"📧 *Email:* {email}\n"
+        f"🛠️ *Reported Issue:* {diagnosis}\n"
+        f"⏰ *Assigned Time Window:* {time_window}\n"
+        f"💳 *Applied Membership:* Plan Free ($0.00/mo — $0 Diagnostic Fee)\n\n"
+        f"🚗 *Next steps:* A certified technician with a mobile workshop unit will arrive within the scheduled window. "
+        f"You will receive an On-My-Way tracking notification once the technician is en route.\n\n"
+        f"📞 *Office:* (669) 213-4422 | *Direct Dispatch:* (669) 234-2444\n"
+        f"🌐 *Web:* www.moralesplumbing.com"
+    )
+
+async def sofia_text_chat(text: str, user_id: str, lang: str = "es") -> str:
     """
     Sofia Lin con memoria de conversación y agendamiento según el Manual Maestro.
     Recopila datos completos, extrae con OpenAI, agenda en Supabase y genera
     la confirmación oficial estructurada con código MP-XXXX.
     """
-    import openai, json as _json
-
-    # Iniciar historial si no existe
-    if user_id not in text_sessions:
-        text_sessions[user_id] = [{"role": "system", "content": _SOFIA_SYSTEM_PROMPT}]
-
-    text_sessions[user_id].append({"role": "user", "content": text})
-
-    # --- Intentar extraer datos de cita del historial completo ---
-    history_text = "\n".join(
-        f"{m['role']}: {m['content']}"
-        for m in text_sessions[user_id]
-        if m["role"] != "system"
+    # Iniciar historial si no existe y agregar el mensaje en una sola operación atómica
+    history = await text_sessions.aappend(
+        user_id, {"role": "user", "content": text},
+        initial=[{"role": "system", "content": _SOFIA_SYSTEM_PROMPT}]
     )
-    extract_prompt = f"""Analiza esta conversación de Morales Plumbing y extrae los datos de la cita según el manual operativo.
+
+    # Pregunta frecuente: respuesta aprobada al instante, queda en el historial para el LLM de los turnos siguientes.
+    # Con una cita en curso no se consulta: el turno debe pasar por la extracción de datos
+    slots = await text_slots.aget(user_id)
+    if slots and any(slots.get(field) for field in TEXT_SLOT_SCHEMA.fields):
+        metrics.incr("faq.skipped_booking")
+        faq = None
+    else:
+        faq = faq_cache.get_cache().lookup(text, lang, context_chars=sum(len(m.get("content") or "") for m in history))
+    if faq:
+        if faq.reports_issue:
+            # "Se reventó un tubo en la cocina": el mensaje ya es la descripción del problema de la cita
+            issue = slot_filling.merge_slots(TEXT_SLOT_SCHEMA, slots or TEXT_SLOT_SCHEMA.empty(),
+                                             {"diagnosis": text, "is_emergency": True})
+            await text_slots.aset(user_id, issue)
+        await text_sessions.aappend(user_id, {"role": "assistant", "content": faq.answer})
+        return faq.answer
+
+    # Modo degradado: respuesta predefinida; el mensaje queda en el historial para cuando vuelva el LLM
+    if not degraded_mode.use_llm():
+        metrics.incr("degraded_mode.predefined_replies")
+        reply = _degraded_reply(lang)
+        await text_sessions.aappend(user_id, {"role": "assistant", "content": reply})
+        return reply
+
+    mode = _text_turn_mode(user_id)
+    with metrics.timer(f"text_turn.{mode}_ms"):
+        if mode == "single":
+            return await _text_turn_single(user_id, history, lang)
+        return await _text_turn_two_call(user_id, history, lang)
+
+async def _text_turn_single(user_id: str, history: list, lang: str) -> str:
+    """Un solo round-trip: respuesta + datos de la cita en una salida estructurada."""
+    messages = [{"role": "system", "content": _SOFIA_SYSTEM_PROMPT + "\n" + _SINGLE_TURN_INSTRUCTIONS}]
+    messages += [m for m in history if m["role"] != "system"]
+    try:
+        result = await llm_gateway.complete(
+            "text_turn",
+            messages=messages,
+            max_tokens=600,
+            temperature=0.3,
+            response_format={"type": "json_schema", "json_schema": _SINGLE_TURN_SCHEMA}
+        )
+        turn = result.json()
+        # La completitud se recalcula con los campos obligatorios, no se confía en el is_complete del modelo
+        appt = slot_filling.merge_slots(TEXT_SLOT_SCHEMA, await text_slots.aget(user_id) or TEXT_SLOT_SCHEMA.empty(),
+                                        turn.get("appointment") or {})
+        ai_reply = (turn.get("reply") or "").strip()
+        if not ai_reply and not appt.get("is_complete"):
+            raise ValueError("respuesta vacía en salida estructurada")
+    except Exception as e:
+        # Si la salida estructurada falla, el turno se resuelve con el flujo de dos llamadas
+        logger.error(f"Sofia single-turn error, usando two_call: {e}")
+        metrics.incr("text_turn.single_fallbacks")
+        return await _text_turn_two_call(user_id, history, lang)
+
+    await text_slots.aset(user_id, appt)
+    if appt.get("is_complete"):
+        return await _book_text_appointment(appt, user_id, lang)
+    await text_sessions.aappend(user_id, {"role": "assistant", "content": ai_reply})
+    return ai_reply
+
+def _text_extract_prompt(history: list) -> str:
+    """Prompt de extracción sobre el historial completo (solo para re-extracción por conflicto)."""
+    history_text = slot_filling.history_text(history)
+    return f"""Analiza esta conversación de Morales Plumbing y extrae los datos de la cita según el manual operativo.
 Devuelve ÚNICAMENTE un JSON válido con esta estructura exacta:
 {{
   "name": "nombre y apellido del cliente o null",
@@ -163,96 +414,37 @@ Historial de Conversación:
 
 JSON:"""
 
+async def _text_turn_two_call(user_id: str, history: list, lang: str) -> str:
+    """Flujo clásico: extracción de datos (incremental) y luego respuesta conversacional."""
     try:
-        client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-        # Extraer datos
-        ext = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": extract_prompt}],
-            max_tokens=350,
-            temperature=0
+        # Extraer datos solo del último turno + campos ya conocidos
+        appt = await slot_filling.update_slots(
+            TEXT_SLOT_SCHEMA, await text_slots.aget(user_id), history,
+            full_prompt=lambda: _text_extract_prompt(history),
+            max_tokens=350
         )
-        raw = ext.choices[0].message.content.strip()
-        raw = raw.replace("```json", "").replace("```", "").strip()
-        appt = _json.loads(raw)
+        await text_slots.aset(user_id, appt)
 
         if appt.get("is_complete"):
-            name = appt.get("name") or "Cliente"
-            phone = appt.get("phone") or "No provisto"
-            email = appt.get("email") or "No provisto"
-            address = appt.get("address") or "No provisto"
-            diagnosis = appt.get("diagnosis") or "Evaluación e Inspección en Sitio"
-            time_window = appt.get("time_window") or "Por coordinar en ventana oficial"
-            is_emergency = appt.get("is_emergency", False)
-
-            code = save_appointment(
-                name=name,
-                phone=phone,
-                email=email,
-                address=address,
-                status="Pendiente",
-                diagnosis=diagnosis,
-                materials="Evaluación técnica presencial",
-                is_emergency=is_emergency,
-                scheduled_time=time_window,
-                source="telegram" if "tg_" in user_id else "whatsapp"
-            )
-            # Limpiar sesión para evitar doble guardado
-            del text_sessions[user_id]
-            
-            if lang == "es":
-                return (
-                    f"🔧 *MORALES PLUMBING — CONFIRMACIÓN DE CITA DE SERVICIO*\n\n"
-                    f"📋 *Código de Orden:* `{code}`\n"
-                    f"👤 *Cliente:* {name}\n"
-                    f"📍 *Dirección de Servicio:* {address}\n"
-                    f"📞 *Teléfono:* {phone}\n"
-                    f"📧 *Correo:* {email}\n"
-                    f"🛠️ *Problema Reportado:* {diagnosis}\n"
-                    f"⏰ *Ventana Horaria Asignada:* {time_window}\n"
-                    f"💳 *Membresía Aplicada:* Plan Free ($0.00/mes — 0 Diagnostic Fee)\n\n"
-                    f"🚗 *Próximos pasos:* Uno de nuestros plomeros certificados acudirá con su camión taller en la ventana programada. "
-                    f"Recibirá un mensaje de notificación cuando el técnico esté en camino (On-My-Way) con seguimiento satelital.\n\n"
-                    f"📞 *Central:* (669) 213-4422 | *Despacho de Guardia:* (669) 234-2444\n"
-                    f"🌐 *Web:* www.moralesplumbing.com"
-                )
-            else:
-                return (
-                    f"🔧 *MORALES PLUMBING — SERVICE APPOINTMENT CONFIRMATION*\n\n"
-                    f"📋 *Order Code:* `{code}`\n"
-                    f"👤 *Customer:* {name}\n"
-                    f"📍 *Service Address:* {address}\n"
-                    f"📞 *Phone:* {phone}\n"
-                    f"📧 *Email:* {email}\n"
-                    f"🛠️ *Reported Issue:* {diagnosis}\n"
-                    f"⏰ *Assigned Time Window:* {time_window}\n"
-                    f"💳 *Applied Membership:* Plan Free ($0.00/mo — $0 Diagnostic Fee)\n\n"
-                    f"🚗 *Next steps:* A certified technician with a mobile workshop unit will arrive within the scheduled window. "
-                    f"You will receive an On-My-Way tracking notification once the technician is en route.\n\n"
-                    f"📞 *Office:* (669) 213-4422 | *Direct Dispatch:* (669) 234-2444\n"
-                    f"🌐 *Web:* www.moralesplumbing.com"
-                )
-
+            return await _book_text_appointment(appt, user_id, lang)
 
     except Exception as e:
         logger.error(f"Appointment extraction error: {e}")
 
     # --- Respuesta conversacional con historial y contexto completo del manual ---
     try:
-        client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=text_sessions[user_id],
+        result = await llm_gateway.complete(
+            "text_chat",
+            messages=history,
             max_tokens=350,
             temperature=0.3
         )
-        ai_reply = resp.choices[0].message.content.strip()
-        text_sessions[user_id].append({"role": "assistant", "content": ai_reply})
+        ai_reply = result.text
+        await text_sessions.aappend(user_id, {"role": "assistant", "content": ai_reply})
         return ai_reply
     except Exception as e:
         logger.error(f"Sofia text chat error: {e}")
-        return "Gracias por contactar a Morales Plumbing. Llámenos al (669) 213-4422 o al despacho directo (669) 234-2444." if lang == "es" else "Thank you for contacting Morales Plumbing. Please call (669) 213-4422 or direct dispatch (669) 234-2444."
+        return _text_fallback_reply(lang)
 
 # ============ URLS ACTUALIZADAS (Clonadas de orion-clean) ============
 MANUAL_URL = 'https://orion-cloud-1.onrender.com/manual'
@@ -290,28 +482,134 @@ def get_tts_url(text: str, lang: str = "es") -> str:
     text_encoded = quote(text[:200])
     return f"https://translate.google.com/translate_tts?ie=UTF-8&q={text_encoded}&tl={lang}&client=tw-ob"
 
-async def get_openai_tts(text: str, lang: str = "es") -> bytes:
-    """Genera audio con OpenAI TTS HD - Voz masculina natural"""
-    try:
-        import openai
-        client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        # Voces masculinas: onyx (California cool), echo (elegante)
-        voice = "onyx" if lang == "en" else "echo"  # onyx=California, echo=elegante paisa
-        response = client.audio.speech.create(
-            model="tts-1-hd",  # HD = Alta definiciÃ³n, mÃ¡s natural
+# Modelos y formatos TTS que el cliente web puede pedir (tts-1 / opus = menor latencia)
+TTS_DEFAULT_MODEL = "tts-1-hd"  # HD = Alta definiciÃ³n, mÃ¡s natural
+TTS_MODELS = ("tts-1-hd", "tts-1", "gpt-4o-mini-tts")
+TTS_FORMATS = {"mp3": "audio/mpeg", "opus": "audio/ogg", "aac": "audio/aac", "flac": "audio/flac", "wav": "audio/wav"}
+
+def _tts_params(text: str, lang: str, model: str, fmt: str) -> tuple:
+    """(texto recortado, voz, clave de caché) para una síntesis"""
+    # Voces masculinas: onyx (California cool), echo (elegante)
+    voice = "onyx" if lang == "en" else "echo"  # onyx=California, echo=elegante paisa
+    text = text[:4096]
+    return text, voice, tts_cache.cache_key(text, voice, model, 1.0, fmt)
+
+async def synthesize_tts(text: str, lang: str = "es", model: str = TTS_DEFAULT_MODEL, fmt: str = "mp3") -> tuple:
+    """Audio TTS (cacheado por contenido) -> (clave sha256, bytes o None, hit de caché)"""
+    text, voice, key = _tts_params(text, lang, model, fmt)
+
+    async def _synthesize():
+        start = time.perf_counter()
+        response = await llm_client.get_async_client().audio.speech.create(
+            model=model,
             voice=voice,
-            input=text[:4096],
-            speed=1.0
+            input=text,
+            speed=1.0,
+            response_format=fmt
         )
+        # Sin streaming el primer byte llega con el audio completo
+        metrics.observe("tts.buffered_ttfb_ms", (time.perf_counter() - start) * 1000)
         return response.content
+
+    try:
+        audio, hit = await tts_cache.get_cache().get_or_create(key, _synthesize)
+        return key, audio, hit
     except Exception as e:
         logger.error(f"OpenAI TTS error: {e}")
-        return None
+        return key, None, False
+
+async def stream_tts(text: str, lang: str = "es", model: str = TTS_DEFAULT_MODEL, fmt: str = "mp3"):
+    """
+    Abre la síntesis en streaming y devuelve (clave, generador de chunks). El audio completo
+    se guarda en la caché al terminar, así la siguiente petición igual es un hit.
+    """
+    text, voice, key = _tts_params(text, lang, model, fmt)
+    start = time.perf_counter()
+    stream_cm = llm_client.get_async_client().audio.speech.with_streaming_response.create(
+        model=model,
+        voice=voice,
+        input=text,
+        speed=1.0,
+        response_format=fmt
+    )
+    response = await stream_cm.__aenter__()
+
+    async def _chunks():
+        parts = []
+        complete = False
+        try:
+            async for chunk in response.iter_bytes(4096):
+                if not parts:
+                    ttfb_ms = (time.perf_counter() - start) * 1000
+                    metrics.observe("tts.stream_ttfb_ms", ttfb_ms)
+                    logger.info(f"🔊 TTS stream {model}/{fmt}: primer chunk en {ttfb_ms:.0f} ms")
+                parts.append(chunk)
+                yield chunk
+            complete = True
+        finally:
+            await stream_cm.__aexit__(None, None, None)
+            if complete and parts:
+                await asyncio.to_thread(tts_cache.get_cache().put, key, b"".join(parts))
+
+    return key, _chunks()
+
+async def get_openai_tts(text: str, lang: str = "es") -> bytes:
+    """Genera audio con OpenAI TTS HD - Voz masculina natural"""
+    _, audio, _ = await synthesize_tts(text, lang)
+    return audio
 
 @app.get("/")
 def health():
     return {"status": "ok", "system": "Morales Plumbing CLOUD v4 - Full Commands (Synced with orion-clean)"}
 
+@app.get("/api/metrics")
+def api_metrics():
+    """Latencias (p50/p95/p99) y contadores del proceso, ej. text_turn.single_ms vs text_turn.two_call_ms"""
+    return {
+        "metrics": metrics.snapshot(),
+        "llm": llm_gateway.stats(),
+        "mail": mailer.get_mailer().stats(),
+        "tts_cache": tts_cache.get_cache().stats(),
+        "faq_cache": faq_cache.get_cache().stats(),
+        "sessions": {store.name: store.stats() for store in (text_sessions, text_slots, call_sessions, call_slots)},
+        "realtime_relay": media_relay.stats(),
+        "realtime_pool": realtime_sessions.stats(),
+        "latency_slo": latency_slo(),
+        "degraded_mode": degraded_mode.get_controller().stats(),
+    }
+
+# Latencias de voz que deben cumplir SystemConfig.MAX_LATENCY_P95_MS
+SLO_HISTOGRAMS = ("realtime.response_latency_ms", "realtime.ttft_pooled_ms", "realtime.ttft_prewarmed_ms", "realtime.ttft_cold_ms")
+
+def latency_slo() -> dict:
+    target = SystemConfig.MAX_LATENCY_P95_MS
+    histograms = metrics.snapshot()["histograms"]
+    checks = {}
+    for name in SLO_HISTOGRAMS:
+        if name in histograms:
+            p95 = histograms[name]["p95_ms"]
+            checks[name] = {"p95_ms": p95, "ok": p95 <= target}
+    return {"target_p95_ms": target, "ok": all(c["ok"] for c in checks.values()), "checks": checks}
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Histogramas y contadores en formato Prometheus (para scraping)"""
+    from fastapi.responses import PlainTextResponse
+    return PlainTextResponse(metrics.prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/jobs")
+def api_jobs():
+    """Estado del pipeline de despacho (trabajos pendientes / done / partial)"""
+    return dispatch_jobs.stats()
+
+@app.get("/api/jobs/{job_id}")
+def api_job_status(job_id: str):
+    """Etapas de un trabajo (job_id = código MP de la cita): intentos, ms y último error"""
+    job = dispatch_jobs.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 @app.get("/manual")
 async def get_manual():
     from fastapi.responses import FileResponse
@@ -322,32 +620,58 @@ async def get_logo():
     from fastapi.responses import FileResponse
     return FileResponse("logo_portada.png")
 
+@app.get("/phrases/{phrase_id}.mp3")
+async def get_phrase(phrase_id: str):
+    """Frase de voz pre-renderizada (Twilio <Play>)"""
+    from fastapi.responses import FileResponse
+    path = phrase_bank.get_bank().mp3_path(phrase_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Phrase not rendered")
+    return FileResponse(path, media_type="audio/mpeg", headers={"Cache-Control": "public, max-age=86400"})
+
 # ============ TTS API FOR WEB ============
 @app.post("/api/tts")
 async def api_tts(request: Request):
-    """TTS endpoint for web chatbot - works on all devices"""
-    from fastapi.responses import Response
+    """TTS endpoint for web chatbot - works on all devices.
+    Optional body fields: stream (chunked audio as it is synthesized), model (TTS_MODELS), format (TTS_FORMATS)."""
+    from fastapi.responses import Response, StreamingResponse
     try:
         data = await request.json()
         text = data.get("text", "")
         lang = data.get("lang", "es")
+        model = data.get("model") if data.get("model") in TTS_MODELS else TTS_DEFAULT_MODEL
+        fmt = data.get("format") if data.get("format") in TTS_FORMATS else "mp3"
+        media_type = TTS_FORMATS[fmt]
         
         if not text:
-            return Response(content=b"", media_type="audio/mpeg")
+            return Response(content=b"", media_type=media_type)
         
-        # Use OpenAI TTS
-        audio_bytes = await get_openai_tts(text)
+        # Streaming: a cache hit is served whole below; a miss is forwarded chunk by chunk
+        if data.get("stream"):
+            _, _, key = _tts_params(text, "es", model, fmt)  # misma voz por defecto que synthesize_tts
+            if tts_cache.get_cache().get(key) is None:
+                key, chunks = await stream_tts(text, model=model, fmt=fmt)
+                headers = {"Cache-Control": "no-cache", "X-Cache": "MISS", "ETag": tts_cache.etag(key)}
+                return StreamingResponse(chunks, media_type=media_type, headers=headers)
+        
+        # Use OpenAI TTS (cached by content: same text/voice/model -> same ETag)
+        key, audio_bytes, hit = await synthesize_tts(text, model=model, fmt=fmt)
         if audio_bytes:
+            tag = tts_cache.etag(key)
+            if request.headers.get("if-none-match") == tag:
+                return Response(status_code=304, headers={"ETag": tag})
             # Add proper headers to avoid Range request errors
             headers = {
                 "Content-Length": str(len(audio_bytes)),
                 "Accept-Ranges": "none",  # Disable range requests
-                "Cache-Control": "no-cache"
+                "Cache-Control": "no-cache",  # revalidate with If-None-Match
+                "ETag": tag,
+                "X-Cache": "HIT" if hit else "MISS"
             }
-            return Response(content=audio_bytes, media_type="audio/mpeg", headers=headers)
+            return Response(content=audio_bytes, media_type=media_type, headers=headers)
         else:
             # Fallback: return empty audio
-            return Response(content=b"", media_type="audio/mpeg")
+            return Response(content=b"", media_type=media_type)
     except Exception as e:
         logger.error(f"TTS API error: {e}")
         return Response(content=b"", media_type="audio/mpeg")
@@ -365,7 +689,7 @@ async def web_chat(request: Request):
             error_msg = "Por favor envÃ­a un mensaje." if lang == "es" else "Please send a message."
             return {"response": error_msg, "error": True}
         
-        response = sofia_chat(message, lang)
+        response = await sofia_chat(message, lang)
         return {"response": response, "error": False}
     except Exception as e:
         logger.error(f"Web chat error: {e}")
@@ -386,8 +710,9 @@ async def api_web_appointment(request: Request):
         is_emergency = data.get("is_emergency", False)
         scheduled_time = data.get("scheduled_time", "ASAP" if is_emergency else "Por coordinar")
         
-        # Guarda la cita en Supabase + Email a Cliente y Owner + Telegram
-        code = save_appointment(
+        # Guarda la cita en Supabase; Email a Cliente y Owner + Telegram salen en segundo plano
+        code = await asyncio.to_thread(
+            save_appointment,
             name=name, phone=phone, email=email, address=address, status="Cliente Web", 
             diagnosis=diagnosis, materials=materials, is_emergency=is_emergency, 
             scheduled_time=scheduled_time, source="website"
@@ -490,7 +815,7 @@ _Escribe cualquier cosa para hablar con Nekon_"""
             query = text[7:].strip()
             if query:
                 await send_telegram_message(chat_id, "ðŸ¤–ðŸŽ™ï¸ Procesando con voz natural...")
-                response = sofia_text_chat(query, f"tg_{user_id}", lang)
+                response = await sofia_text_chat(query, f"tg_{user_id}", lang)
                 await send_telegram_message(chat_id, response)
                 audio_bytes = await get_openai_tts(response, lang)
                 if audio_bytes:
@@ -509,7 +834,7 @@ _Escribe cualquier cosa para hablar con Nekon_"""
                 texto = match.group(2).strip()
                 idioma = match.group(3).strip()
                 prompt = f"Translate this text to {idioma}: \"{texto}\". Return ONLY the translation."
-                translation = sofia_chat(prompt, "en")
+                translation = await sofia_chat(prompt, "en")
                 await send_telegram_message(chat_id, f"ðŸŒ *{idioma.upper()}:*\n{translation}")
             else:
                 await send_telegram_message(chat_id, "âŒ Uso: /tr [texto] a [idioma]\nEj: /tr hello a espaÃ±ol")
@@ -584,10 +909,7 @@ Lic. C-36 #1156542 | San Jose, CA
 
 ðŸªª <b>Tarjeta Digital:</b>
 <a href="https://agem2024.github.io/morales-plumbing-web/tarjeta_presentacion.html">Click aquÃ­ para abrir la tarjeta digital</a>"""
-            url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-            payload = {"chat_id": chat_id, "text": mp_text, "parse_mode": "HTML"}
-            async with httpx.AsyncClient() as client:
-                await client.post(url, json=payload)
+            await telegram.get_sender(TELEGRAM_TOKEN).send_message(chat_id, mp_text, parse_mode="HTML")
             return {"ok": True}
             
 
@@ -669,7 +991,7 @@ _Escribe cualquier pregunta para XONA_"""
             return {"ok": True}
         
         # ============ SOFIA RESPONDE A TODO — CON MEMORIA Y AGENDAMIENTO ============
-        response = sofia_text_chat(text, f"tg_{user_id}", lang)
+        response = await sofia_text_chat(text, f"tg_{user_id}", lang)
         await send_telegram_message(chat_id, response)
 
     except Exception as e:
@@ -679,26 +1001,15 @@ _Escribe cualquier pregunta para XONA_"""
 
 async def send_telegram_message(chat_id: int, text: str):
     """EnvÃ­a mensaje de texto a Telegram"""
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-    payload = {"chat_id": chat_id, "text": text, "parse_mode": "Markdown"}
-    async with httpx.AsyncClient() as client:
-        await client.post(url, json=payload)
+    await telegram.get_sender(TELEGRAM_TOKEN).send_message(chat_id, text, parse_mode="Markdown")
 
 async def send_telegram_voice(chat_id: int, voice_url: str):
     """EnvÃ­a audio/voz a Telegram (URL)"""
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendVoice"
-    payload = {"chat_id": chat_id, "voice": voice_url}
-    async with httpx.AsyncClient() as client:
-        await client.post(url, json=payload)
+    await telegram.get_sender(TELEGRAM_TOKEN).send_voice(chat_id, voice_url)
 
 async def send_telegram_voice_bytes(chat_id: int, audio_bytes: bytes):
     """EnvÃ­a audio como bytes a Telegram (para OpenAI TTS)"""
-    import io
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendVoice"
-    files = {"voice": ("audio.mp3", io.BytesIO(audio_bytes), "audio/mpeg")}
-    data = {"chat_id": chat_id}
-    async with httpx.AsyncClient() as client:
-        await client.post(url, data=data, files=files)
+    await telegram.get_sender(TELEGRAM_TOKEN).send_voice(chat_id, audio_bytes)
 
 # ============ TWILIO VOICE ENDPOINTS ============
 from fastapi import Form
@@ -741,8 +1052,8 @@ When you have all 6, say: "Perfect, I've scheduled your appointment. We'll confi
 Rule 3 (ANTI-SPAM): If you detect the caller is trying to sell services (marketing, SEO, insurance, web design), or is a telemarketing robot, or asks for the owner to pitch a service, say: "We are not interested, thank you for calling" and do not schedule an appointment. Do not provide any additional information.
 """
 
-# Archivo compartido de citas (accesible por todos los bots)
-APPOINTMENTS_FILE = "/tmp/orion_appointments.json"
+# Store local de citas (SQLite indexado, accesible por todos los bots vía /api/appointments)
+appointment_store = AppointmentStore()
 
 def create_calendar_event(name: str, phone: str, address: str, diagnosis: str, materials: str, is_emergency: bool, scheduled_time: str):
     """Create a 2-hour event in Google Calendar"""
@@ -798,8 +1109,7 @@ def generate_technical_dispatch_analysis(customer_issue: str) -> dict:
     - safety_considerations: Protocolos de seguridad operacional, corte de válvulas y Cal/OSHA Title 8.
     """
     try:
-        import openai, json as _json
-        client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        # Corre en hilos (save_appointment); va por el gateway síncrono
         prompt = f"""Eres el Asistente Técnico y Dispatcher Maestro de MORALES PLUMBING (Lic. C-36 #1156542, San Jose CA).
 El cliente reportó el siguiente problema con sus palabras cotidianas:
 "{customer_issue}"
@@ -811,14 +1121,13 @@ Devuelve ÚNICAMENTE un JSON con:
   "materials_and_tools": "Lista de repuestos y herramientas requeridas en el camión taller según el PriceBook oficial",
   "safety_considerations": "Medidas de seguridad, cierre de válvulas, prevención de daños y bioseguridad Cal/OSHA Title 8"
 }}"""
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
+        result = llm_gateway.complete_sync(
+            "dispatch_analysis",
             messages=[{"role": "user", "content": prompt}],
             max_tokens=350,
             temperature=0.2
         )
-        raw = resp.choices[0].message.content.strip().replace("```json", "").replace("```", "").strip()
-        return _json.loads(raw)
+        return result.json()
     except Exception as e:
         logger.error(f"Error generando análisis técnico: {e}")
         return {
@@ -827,36 +1136,29 @@ Devuelve ÚNICAMENTE un JSON con:
             "safety_considerations": "Verificar válvula principal de corte de agua y aplicar EPP estándar"
         }
 
-def save_appointment(name: str, phone: str, email: str, address: str, status: str, diagnosis: str, materials: str, is_emergency: bool, scheduled_time: str, source: str = "phone") -> str:
-    """Guarda cita en base de datos y envía reporte dual al técnico/owner (versión cliente + análisis técnico Sofia AI)"""
-    import json
-    import random
+# Pipeline de efectos secundarios de cada cita (análisis técnico + notificaciones)
+dispatch_jobs = JobPipeline("dispatch")
+
+def save_appointment(name: str, phone: str, email: str, address: str, status: str, diagnosis: str, materials: str, is_emergency: bool, scheduled_time: str, source: str = "phone", lang: str = "en") -> str:
+    """
+    Guarda la cita y devuelve el código MP de inmediato. El análisis técnico dual y las
+    notificaciones (Telegram + Email) corren en segundo plano en dispatch_jobs.
+    """
     from datetime import datetime
     import requests
-    import smtplib
-    from email.mime.text import MIMEText
-    from email.mime.multipart import MIMEMultipart
     
     try:
-        code = f"MP-{random.randint(1000, 9999)}"
-        
-        # Generar análisis técnico dual (Traducción CPC + Repuestos + Seguridad)
-        tech_data = generate_technical_dispatch_analysis(diagnosis)
-        tech_diag = tech_data.get("technical_diagnosis", diagnosis)
-        tech_mat = tech_data.get("materials_and_tools", materials)
-        tech_safety = tech_data.get("safety_considerations", "Aplicar protocolos estándar de seguridad")
-
         appointment = {
-            "code": code,
+            "code": None,
             "name": name,
             "phone": phone,
             "email": email,
             "address": address,
             "status": status,
             "customer_issue": diagnosis,
-            "technical_diagnosis": tech_diag,
-            "materials": tech_mat,
-            "safety_considerations": tech_safety,
+            "technical_diagnosis": None,
+            "materials": materials,
+            "safety_considerations": None,
             "is_emergency": is_emergency,
             "scheduled_time": scheduled_time,
             "source": source,
@@ -864,155 +1166,206 @@ def save_appointment(name: str, phone: str, email: str, address: str, status: st
             "confirmed": False
         }
 
-        # Guardar en Supabase (Base de Datos Principal)
-        if SUPABASE_URL and SUPABASE_KEY:
+        # Guardar en Supabase (Base de Datos Principal); con Supabase degradado (LEVEL_2) va al almacén local
+        store = "supabase" if SUPABASE_URL and SUPABASE_KEY and degraded_mode.allow_probe("supabase") else "local"
+        if store == "supabase":
+            # El código MP se reserva localmente igual (único aunque la cita viva en Supabase)
+            code = appointment["code"] = appointment_store.reserve_code()
             try:
-                headers = {
-                    "apikey": SUPABASE_KEY,
-                    "Authorization": f"Bearer {SUPABASE_KEY}",
-                    "Content-Type": "application/json",
-                    "Prefer": "return=minimal"
-                }
                 supabase_payload = {
                     "customer_name": name,
                     "customer_phone": phone,
                     "service_address": address,
-                    "issue_description": f"Cliente: {diagnosis} | Técnico: {tech_diag}",
+                    "issue_description": f"Cliente: {diagnosis}",
                     "status": "pending",
                     "channel": source
                 }
-                requests.post(f"{SUPABASE_URL}/rest/v1/appointments", headers=headers, json=supabase_payload, timeout=5)
+                sb_start = time.perf_counter()
+                try:
+                    resp = requests.post(f"{SUPABASE_URL}/rest/v1/appointments", headers=_supabase_headers("return=representation"), json=supabase_payload, timeout=5)
+                except Exception:
+                    degraded_mode.record("supabase", (time.perf_counter() - sb_start) * 1000, False)
+                    raise
+                degraded_mode.record("supabase", (time.perf_counter() - sb_start) * 1000, resp.ok)
+                rows = resp.json() if resp.ok else []
+                if rows and isinstance(rows, list):
+                    appointment["supabase_id"] = rows[0].get("id")
                 logger.info(f"📅 Cita guardada en SUPABASE: {name} (Código: {code})")
             except Exception as sb_e:
                 logger.error(f"Error guardando en Supabase: {sb_e}")
         else:
-            appointments = []
-            if os.path.exists(APPOINTMENTS_FILE):
-                with open(APPOINTMENTS_FILE, 'r') as f:
-                    appointments = json.load(f)
-            appointment["id"] = len(appointments) + 1
-            appointments.append(appointment)
-            with open(APPOINTMENTS_FILE, 'w') as f:
-                json.dump(appointments, f, indent=2)
+            appointment = appointment_store.create(appointment)
+            code = appointment["code"]
             logger.info(f"📅 Cita guardada en LOCAL: {name} (Código: {code})")
 
-        # Notificar por Telegram al Despachador / Técnico con INFORME DUAL
-        try:
-            tg_token = os.getenv("TELEGRAM_BOT_TOKEN")
-            tg_chat = os.getenv("TELEGRAM_OWNER_ID")
-            if tg_token and tg_chat:
-                tipo_t = "🚨 EMERGENCIA P1/P0" if is_emergency else f"📅 {scheduled_time}"
-                msg_tg = (
-                    f"🚨 *NUEVA ORDEN DE SERVICIO — MORALES PLUMBING* 🚨\n\n"
-                    f"📋 *Ticket ID:* `{code}` | *Prioridad:* {tipo_t}\n"
-                    f"👤 *Cliente:* {name}\n"
-                    f"📞 *Teléfono:* {phone}\n"
-                    f"📧 *Email:* {email}\n"
-                    f"📍 *Dirección:* {address}\n"
-                    f"⏰ *Ventana:* {scheduled_time}\n\n"
-                    f"🗣️ *VERSIÓN DEL CLIENTE (Palabras Cotidianas):*\n"
-                    f"\"{diagnosis}\"\n\n"
-                    f"🔬 *ANÁLISIS TÉCNICO DE DESPACHO (SOFIA AI - CPC):*\n"
-                    f"• *Diagnóstico:* {tech_diag}\n"
-                    f"• *Materiales/Herramientas a Bordo:* {tech_mat}\n"
-                    f"• *Seguridad (Cal/OSHA):* {tech_safety}"
-                )
-                requests.post(f"https://api.telegram.org/bot{tg_token}/sendMessage", data={"chat_id": tg_chat, "text": msg_tg, "parse_mode": "Markdown"})
-        except Exception as e:
-            logger.error(f"Error enviando Telegram: {e}")
-
-        # Notificar por Email (Al Owner y al Cliente)
-        try:
-            email_user = os.getenv("EMAIL_USER")
-            email_pass = os.getenv("EMAIL_PASS")
-            if email_user and email_pass:
-                server = smtplib.SMTP('smtp.gmail.com', 587)
-                server.starttls()
-                server.login(email_user, email_pass)
-                
-                # 1. Email interno al Owner / Técnico con REPORTE DUAL
-                msg_owner = MIMEMultipart()
-                msg_owner['From'] = email_user
-                msg_owner['To'] = email_user
-                msg_owner['Subject'] = f"Nueva Orden de Trabajo - {name} ({code})"
-                body_owner = (
-                    f"MORALES PLUMBING — REPORTE DE DESPACHO TÉCNICO\n\n"
-                    f"Ticket ID: {code}\n"
-                    f"Cliente: {name}\n"
-                    f"Teléfono: {phone}\n"
-                    f"Email: {email}\n"
-                    f"Dirección: {address}\n"
-                    f"Ventana Asignada: {scheduled_time}\n"
-                    f"Origen: {source}\n\n"
-                    f"--- VERSIÓN DEL CLIENTE ---\n"
-                    f"{diagnosis}\n\n"
-                    f"--- ANÁLISIS TÉCNICO PRELIMINAR (SOFIA AI) ---\n"
-                    f"Diagnóstico CPC: {tech_diag}\n"
-                    f"Materiales Sugeridos: {tech_mat}\n"
-                    f"Consideraciones de Seguridad: {tech_safety}\n"
-                )
-                msg_owner.attach(MIMEText(body_owner, 'plain'))
-                server.sendmail(email_user, email_user, msg_owner.as_string())
-
-                
-                # 2. Email HTML al Cliente (Si dejÃ³ email)
-                if email and "@" in email:
-                    msg_client = MIMEMultipart()
-                    msg_client['From'] = email_user
-                    msg_client['To'] = email
-                    msg_client['Subject'] = f"Service Request Received - Morales Plumbing ({code})"
-                    
-                    html_client = f"""
-                    <html>
-                    <body style="font-family: 'Inter', sans-serif; background-color: #f4f4f4; margin: 0; padding: 20px;">
-                        <div style="max-width: 600px; margin: 0 auto; background-color: #ffffff; border-radius: 8px; overflow: hidden; box-shadow: 0 4px 10px rgba(0,0,0,0.1);">
-                            <div style="background: linear-gradient(135deg, #0A192F 0%, #112240 100%); text-align: center; padding: 30px 20px; border-bottom: 4px solid #D4AF37;">
-                                <img src="https://orion-cloud-1.onrender.com/logo" alt="Morales Plumbing Logo" style="max-width: 200px;">
-                                <h1 style="color: #D4AF37; margin-bottom: 0;">Service Request Received</h1>
-                            </div>
-                            <div style="padding: 30px;">
-                                <p style="color: #333; font-size: 16px;">Hello <strong>{name}</strong>,</p>
-                                <p style="color: #555; font-size: 16px; line-height: 1.6;">Thank you for contacting Morales Plumbing. We have successfully received your service request.</p>
-                                <div style="background-color: #f9f9f9; border-left: 4px solid #D4AF37; padding: 15px; margin: 20px 0;">
-                                    <p style="margin: 5px 0;"><strong>Ticket ID:</strong> {code}</p>
-                                    <p style="margin: 5px 0;"><strong>Service Address:</strong> {address}</p>
-                                    <p style="margin: 5px 0;"><strong>Reported Issue:</strong> {diagnosis}</p>
-                                </div>
-                                <p style="color: #555; font-size: 16px; line-height: 1.6;">Our technical team is currently reviewing your request. We will contact you shortly to confirm the exact time of our visit.</p>
-                                
-                                <div style="background-color: #f0f7ff; border-left: 4px solid #2196F3; padding: 15px; margin: 20px 0;">
-                                    <p style="margin: 5px 0; color: #0a4f96;"><strong>ðŸ”§ Simple Issue? Try DIY!</strong></p>
-                                    <p style="margin: 5px 0; font-size: 14px; color: #333;">If you believe this is a minor issue, you can check our <a href="https://www.morales-plumbing.com" style="color: #2196F3;">Do-It-Yourself (DIY) guides</a> on our website while you wait for our confirmation.</p>
-                                </div>
-                            </div>
-                            <div style="background-color: #f4f4f4; text-align: center; padding: 20px; color: #777; font-size: 14px;">
-                                <p style="margin: 5px 0;"><strong>MORALES PLUMBING | AI-INTEGRATED SERVICES</strong></p>
-                                <p style="margin: 5px 0;">Lic. C-36 #1156542 | San Jose, CA</p>
-                                <p style="margin: 5px 0;">(669) 213-4422 | moralesplumbing026@gmail.com</p>
-                                <p style="margin: 5px 0;"><a href="https://www.morales-plumbing.com" style="color: #D4AF37; text-decoration: none;"><strong>www.morales-plumbing.com</strong></a></p>
-                            </div>
-                        </div>
-                    </body>
-                    </html>
-                    """
-                    msg_client.attach(MIMEText(html_client, 'html'))
-                    server.sendmail(email_user, email, msg_client.as_string())
-                    logger.info(f"ðŸ“§ HTML Confirmation Email sent to client {email}")
-                
-                server.quit()
-        except Exception as e:
-            logger.error(f"Error enviando Email: {e}")
+        # Análisis técnico + notificaciones fuera del request (reintentos y tiempos por etapa en /api/jobs)
+        dispatch_jobs.submit(code, [
+            ("technical_analysis", _job_technical_analysis),
+            ("record_enrichment", _job_enrich_record),
+            ("telegram", _job_notify_telegram),
+            ("emails", _job_send_emails),
+        ], context={"appointment": dict(appointment), "lang": lang, "store": store})
 
         return code
     except Exception as e:
         logger.error(f"Error guardando cita: {e}")
         return ""
 
-def extract_appointment_info(call_history: list, lang: str = "es") -> dict:
-    """Usa IA para extraer info de cita usando TODO el historial"""
+def _supabase_headers(prefer: str = "return=minimal") -> dict:
+    return {
+        "apikey": SUPABASE_KEY,
+        "Authorization": f"Bearer {SUPABASE_KEY}",
+        "Content-Type": "application/json",
+        "Prefer": prefer
+    }
+
+# ============ ETAPAS DEL PIPELINE DE DESPACHO (corren en hilos de dispatch_jobs) ============
+def _job_technical_analysis(ctx: dict):
+    """Genera el análisis técnico dual (Traducción CPC + Repuestos + Seguridad)"""
+    appt = ctx["appointment"]
+    tech_data = generate_technical_dispatch_analysis(appt["customer_issue"])
+    appt["technical_diagnosis"] = tech_data.get("technical_diagnosis", appt["customer_issue"])
+    appt["materials"] = tech_data.get("materials_and_tools", appt["materials"])
+    appt["safety_considerations"] = tech_data.get("safety_considerations", "Aplicar protocolos estándar de seguridad")
+
+def _job_enrich_record(ctx: dict):
+    """Completa el registro ya guardado con el análisis técnico"""
+    import requests
+
+    appt = ctx["appointment"]
+    if ctx.get("store", "supabase") == "supabase" and SUPABASE_URL and SUPABASE_KEY:
+        if not appt.get("supabase_id"):
+            return
+        start = time.perf_counter()
+        try:
+            resp = requests.patch(
+                f"{SUPABASE_URL}/rest/v1/appointments?id=eq.{appt['supabase_id']}",
+                headers=_supabase_headers(),
+                json={"issue_description": f"Cliente: {appt['customer_issue']} | Técnico: {appt['technical_diagnosis']}"},
+                timeout=5
+            )
+        except Exception:
+            degraded_mode.record("supabase", (time.perf_counter() - start) * 1000, False)
+            raise
+        degraded_mode.record("supabase", (time.perf_counter() - start) * 1000, resp.ok)
+        resp.raise_for_status()
+        return
+    appointment_store.update(
+        appt["code"],
+        technical_diagnosis=appt["technical_diagnosis"],
+        materials=appt["materials"],
+        safety_considerations=appt["safety_considerations"]
+    )
+
+def _job_notify_telegram(ctx: dict):
+    """Notificar por Telegram al Despachador / Técnico con INFORME DUAL"""
+    tg_token = os.getenv("TELEGRAM_BOT_TOKEN")
+    tg_chat = os.getenv("TELEGRAM_OWNER_ID")
+    if not (tg_token and tg_chat):
+        return
+    appt = ctx["appointment"]
+    code, name, phone, email, address = appt["code"], appt["name"], appt["phone"], appt["email"], appt["address"]
+    is_emergency, scheduled_time, diagnosis = appt["is_emergency"], appt["scheduled_time"], appt["customer_issue"]
+    tech_diag, tech_mat, tech_safety = appt["technical_diagnosis"], appt["materials"], appt["safety_considerations"]
+    tipo_t = "🚨 EMERGENCIA P1/P0" if is_emergency else f"📅 {scheduled_time}"
+    msg_tg = (
+        f"🚨 *NUEVA ORDEN DE SERVICIO — MORALES PLUMBING* 🚨\n\n"
+        f"📋 *Ticket ID:* `{code}` | *Prioridad:* {tipo_t}\n"
+        f"👤 *Cliente:* {name}\n"
+        f"📞 *Teléfono:* {phone}\n"
+        f"📧 *Email:* {email}\n"
+        f"📍 *Dirección:* {address}\n"
+        f"⏰ *Ventana:* {scheduled_time}\n\n"
+        f"🗣️ *VERSIÓN DEL CLIENTE (Palabras Cotidianas):*\n"
+        f"\"{diagnosis}\"\n\n"
+        f"🔬 *ANÁLISIS TÉCNICO DE DESPACHO (SOFIA AI - CPC):*\n"
+        f"• *Diagnóstico:* {tech_diag}\n"
+        f"• *Materiales/Herramientas a Bordo:* {tech_mat}\n"
+        f"• *Seguridad (Cal/OSHA):* {tech_safety}"
+    )
+    resp = telegram.get_sender(tg_token).send_message_sync(tg_chat, msg_tg, parse_mode="Markdown")
+    resp.raise_for_status()
+
+def _job_send_emails(ctx: dict):
+    """Email interno al Owner / Técnico con REPORTE DUAL + confirmación HTML al Cliente (si dejó email)"""
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+
+    mail = mailer.get_mailer()
+    if not mail.configured:
+        return
+    email_user = mail.user
+    appt = ctx["appointment"]
+    code, name, phone, email, address = appt["code"], appt["name"], appt["phone"], appt["email"], appt["address"]
+    scheduled_time, source, diagnosis = appt["scheduled_time"], appt["source"], appt["customer_issue"]
+    tech_diag, tech_mat, tech_safety = appt["technical_diagnosis"], appt["materials"], appt["safety_considerations"]
+
+    pending = {}
+    sent = ctx.setdefault("emails_sent", set())
+    if "owner" not in sent:
+        msg_owner = MIMEMultipart()
+        msg_owner['From'] = email_user
+        msg_owner['To'] = email_user
+        msg_owner['Subject'] = f"Nueva Orden de Trabajo - {name} ({code})"
+        body_owner = (
+            f"MORALES PLUMBING — REPORTE DE DESPACHO TÉCNICO\n\n"
+            f"Ticket ID: {code}\n"
+            f"Cliente: {name}\n"
+            f"Teléfono: {phone}\n"
+            f"Email: {email}\n"
+            f"Dirección: {address}\n"
+            f"Ventana Asignada: {scheduled_time}\n"
+            f"Origen: {source}\n\n"
+            f"--- VERSIÓN DEL CLIENTE ---\n"
+            f"{diagnosis}\n\n"
+            f"--- ANÁLISIS TÉCNICO PRELIMINAR (SOFIA AI) ---\n"
+            f"Diagnóstico CPC: {tech_diag}\n"
+            f"Materiales Sugeridos: {tech_mat}\n"
+            f"Consideraciones de Seguridad: {tech_safety}\n"
+        )
+        msg_owner.attach(MIMEText(body_owner, 'plain'))
+        pending["owner"] = mail.submit(msg_owner)
+    if "customer" not in sent and email and "@" in email:
+        subject, html_client = email_templates.render_confirmation(ctx.get("lang", "en"), name, code, address, diagnosis)
+        msg_client = MIMEMultipart()
+        msg_client['From'] = email_user
+        msg_client['To'] = email
+        msg_client['Subject'] = subject
+        msg_client.attach(MIMEText(html_client, 'html'))
+        pending["customer"] = mail.submit(msg_client)
+
+    # Ambos salen en la misma ventana de envío; en un reintento solo se reenvía el que falló
+    errors = []
+    for kind, future in pending.items():
+        try:
+            future.result(timeout=mail.timeout_s * 3)
+            sent.add(kind)
+        except Exception as e:
+            errors.append(f"{kind}: {e}")
+    if "customer" in pending and "customer" in sent:
+        logger.info(f"📧 HTML Confirmation Email sent to client {email}")
+    if errors:
+        raise RuntimeError("; ".join(errors))
+
+VOICE_SLOT_SCHEMA = slot_filling.SlotSchema(
+    "voice",
+    fields={
+        "name": "client name",
+        "phone": "phone number",
+        "email": "email address",
+        "address": "service address",
+        "status": "owner/renter",
+        "diagnosis": "brief description of problem",
+        "materials": "list of minimum recommended tools/materials for this job based on diagnosis",
+        "scheduled_time": "ISO 8601 format date-time if scheduled, or 'ASAP' if emergency",
+    },
+    required=("name", "phone", "email", "address", "status", "diagnosis", "scheduled_time"),
+)
+
+def _voice_extract_prompt(call_history: list) -> str:
     history_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in call_history if msg['role'] != 'system'])
     
-    prompt = f"""Extract appointment and dispatcher info from this conversation history.
+    return f"""Extract appointment and dispatcher info from this conversation history.
 Return JSON only:
 {{
   "name": "client name or null",
@@ -1032,60 +1385,66 @@ Conversation History:
 
 JSON:"""
 
+async def extract_appointment_info(call_history: list, lang: str = "es", slots: dict = None) -> dict:
+    """
+    Usa IA para extraer info de cita. Con `slots` (estado previo de la llamada) solo se
+    procesa el último turno; sin estado se extrae sobre TODO el historial.
+    """
+    if slots is not None:
+        try:
+            return await slot_filling.update_slots(
+                VOICE_SLOT_SCHEMA, slots, call_history,
+                full_prompt=lambda: _voice_extract_prompt(call_history),
+                max_tokens=400
+            )
+        except Exception as e:
+            logger.error(f"Voice AI OpenAI extract error: {e}")
+            return {**slots, "is_complete": False}
+
     try:
-        import openai
-        client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
+        result = await llm_gateway.complete(
+            "voice_extraction",
+            messages=[{"role": "user", "content": _voice_extract_prompt(call_history)}],
             max_tokens=500
         )
-        
-        import json
-        raw_json = response.choices[0].message.content.strip()
-        if raw_json.startswith('```json'):
-            raw_json = raw_json[7:]
-        if raw_json.startswith('```'):
-            raw_json = raw_json[3:]
-        if raw_json.endswith('```'):
-            raw_json = raw_json[:-3]
-        result = json.loads(raw_json.strip())
-        return result
+        return result.json()
     except Exception as e:
         logger.error(f"Voice AI OpenAI extract error: {e}")
         return {"is_complete": False}
 
-def ask_voice_ai(user_input: str, call_sid: str, lang: str = "es") -> str:
+async def ask_voice_ai(user_input: str, call_sid: str, lang: str = "es") -> str:
     """Get AI response for voice calls - with conversation memory and extraction"""
     system_msg = VOICE_PROMPT_ES if lang == "es" else VOICE_PROMPT_EN
     
-    # Iniciar historial de sesiÃ³n si no existe
-    if call_sid not in call_sessions:
-        call_sessions[call_sid] = [{"role": "system", "content": system_msg}]
-        
-    # AÃ±adir input del usuario al historial
-    call_sessions[call_sid].append({"role": "user", "content": user_input})
+    # Iniciar historial de sesiÃ³n si no existe y aÃ±adir input del usuario (atómico)
+    history = await call_sessions.aappend(
+        call_sid, {"role": "user", "content": user_input},
+        initial=[{"role": "system", "content": system_msg}]
+    )
     
-    # Extraer info usando TODO el historial
-    appointment_info = extract_appointment_info(call_sessions[call_sid], lang)
+    # Extraer info del último turno sobre el estado previo de la llamada
+    appointment_info = await extract_appointment_info(history, lang, slots=await call_slots.aget(call_sid, {}))
+    await call_slots.aset(call_sid, appointment_info)
     
     if appointment_info.get("is_complete"):
-        code = save_appointment(
+        code = await asyncio.to_thread(
+            save_appointment,
             name=appointment_info.get("name", "Cliente"),
             phone=appointment_info.get("phone", "No provisto"),
             email=appointment_info.get("email", "No provisto"),
             address=appointment_info.get("address", "No provisto"),
             status=appointment_info.get("status", "No provisto"),
             diagnosis=appointment_info.get("diagnosis", "InspecciÃ³n General"),
-            materials=appointment_info.get("materials", "Kit bÃ¡sico"),
+            materials=appointment_info.get("materials") or "Kit bÃ¡sico",
             is_emergency=appointment_info.get("is_emergency", False),
             scheduled_time=appointment_info.get("scheduled_time", "ASAP"),
-            source="phone_call"
+            source="phone_call",
+            lang=lang
         )
         
         # Limpiar sesiÃ³n para evitar doble guardado
-        del call_sessions[call_sid]
+        await call_sessions.apop(call_sid, None)
+        await call_slots.apop(call_sid, None)
         
         if lang == "es":
             return f"Perfecto, he agendado su cita con cÃ³digo {code}. Enviaremos a nuestro tÃ©cnico de inmediato."
@@ -1093,18 +1452,15 @@ def ask_voice_ai(user_input: str, call_sid: str, lang: str = "es") -> str:
             return f"Perfect, I've scheduled your appointment with code {code}. We will send our technician right away."
     
     try:
-        import openai
-        client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=call_sessions[call_sid],
+        result = await llm_gateway.complete(
+            "voice_reply",
+            messages=history,
             max_tokens=150
         )
-        ai_response = response.choices[0].message.content.strip()
+        ai_response = result.text
         
         # Guardar respuesta de la IA en el historial
-        call_sessions[call_sid].append({"role": "assistant", "content": ai_response})
+        await call_sessions.aappend(call_sid, {"role": "assistant", "content": ai_response})
         return ai_response
     except Exception as e:
         logger.error(f"Voice AI OpenAI error: {e}")
@@ -1112,8 +1468,22 @@ def ask_voice_ai(user_input: str, call_sid: str, lang: str = "es") -> str:
 
 # API endpoint para ver citas (accesible por otros bots)
 @app.get("/api/appointments")
-def get_appointments():
-    return {"appointments": []}
+def get_appointments(phone: str = None, source: str = None, status: str = None, is_emergency: bool = None,
+                     since: str = None, until: str = None, limit: int = 50, cursor: int = None):
+    """Citas locales, más recientes primero. Filtros opcionales; paginar pasando `next_cursor` como `cursor`."""
+    limit = max(1, min(limit, 200))
+    appointments, next_cursor = appointment_store.query(
+        phone=phone, source=source, status=status, is_emergency=is_emergency,
+        since=since, until=until, limit=limit, cursor=cursor
+    )
+    return {"appointments": appointments, "next_cursor": next_cursor}
+
+@app.get("/api/appointments/{code}")
+def get_appointment(code: str):
+    appointment = appointment_store.get(code)
+    if appointment is None:
+        raise HTTPException(status_code=404, detail="Appointment not found")
+    return appointment
 
 @app.get("/voice")
 def voice_status():
@@ -1121,7 +1491,6 @@ def voice_status():
 
 # ============ TWILIO VOICE ENDPOINTS (OPENAI REALTIME API) ============
 from twilio.twiml.voice_response import VoiceResponse, Connect
-import websockets
 import json
 import base64
 import asyncio
@@ -1131,6 +1500,8 @@ from fastapi.responses import Response
 from fastapi import Request
 
 OPENAI_REALTIME_MODEL = "gpt-realtime-2.1-mini"
+# 8000 bytes de μ-law = 1 s de audio por mensaje al inyectar frases pre-renderizadas
+GREETING_CHUNK_BYTES = 8000
 
 SYSTEM_PROMPT_SOFIA = """You are Sofia Lin, the Master AI Dispatcher for MORALES PLUMBING (AI-INTEGRATED SERVICES), based in San Jose, California.
 You have been trained exhaustively on the 112 sections of the official Morales Plumbing Operations & Dispatch Manual (Version 8.0/9.0).
@@ -1187,21 +1558,79 @@ INFORMACION CORPORATIVA Y REGLAS MAESTRAS INMUTABLES
    - Al tener los datos completos, ejecutar la herramienta agendar_cita para registrar la cita oficial.
 """
 
+def realtime_session_update() -> dict:
+    """Evento session.update de Sofia: audio/pcmu (G.711 u-law nativo) + VAD anti-ruido + voz 'marin' + tools"""
+    return {
+        "type": "session.update",
+        "session": {
+            "type": "realtime",
+            "instructions": SYSTEM_PROMPT_SOFIA,
+            "audio": {
+                "input": {
+                    "format": {"type": "audio/pcmu"},
+                    "turn_detection": {
+                        "type": "server_vad",
+                        "threshold": 0.85,  # Alto rechazo de ruido ambiental / TV / música
+                        "prefix_padding_ms": 300,
+                        "silence_duration_ms": 800  # Pausa humana natural sin cortes prematuros
+                    }
+                },
+                "output": {
+                    "format": {"type": "audio/pcmu"},
+                    "voice": "marin"  # Voz ultra-natural y humana de Realtime 2.1
+                }
+            },
+            "tools": [
+                {
+                    "type": "function",
+                    "name": "agendar_cita",
+                    "description": "Agenda una cita técnica de inspección para Morales Plumbing.",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "nombre": {"type": "string", "description": "Nombre del cliente"},
+                            "telefono": {"type": "string", "description": "Teléfono de contacto"},
+                            "direccion": {"type": "string", "description": "Dirección del servicio"},
+                            "problema": {"type": "string", "description": "Descripción del problema reportado por el cliente"}
+                        },
+                        "required": ["nombre", "telefono", "direccion", "problema"]
+                    }
+                }
+            ]
+        }
+    }
+
+# Sesiones Realtime pre-conectadas (REALTIME_POOL_SIZE / REALTIME_POOL_TTL_S)
+realtime_sessions = realtime_pool.RealtimePool(OPENAI_REALTIME_MODEL, realtime_session_update)
+
 @app.api_route("/incoming-call", methods=["GET", "POST"])
 async def incoming_call_ws(request: Request):
     """Handle incoming call using Twilio Media Streams connected to OpenAI Realtime"""
     response = VoiceResponse()
+    if degraded_mode.at_least(degraded_mode.current_mode(), DegradedMode.LEVEL_3_AI_DISABLED):
+        # IA deshabilitada / emergencia: la llamada va directo al despachador humano
+        metrics.incr("degraded_mode.direct_dials")
+        if degraded_mode.allow_probe("realtime"):
+            # Conexión de prueba suelta (no del pool) para medir si Realtime ya se recuperó
+            realtime_sessions.probe()
+        response.dial(SystemConfig.HUMAN_DISPATCH_NUMBER)
+        return Response(content=str(response), media_type="application/xml")
     base_url = os.getenv("BASE_URL", "https://orion-cloud-1.onrender.com")
     ws_url = base_url.replace("https://", "wss://").replace("http://", "ws://")
     
     connect = Connect()
     connect.stream(url=f"{ws_url}/ws/twilio")
     response.append(connect)
+    # Abrir la sesión Realtime mientras Twilio procesa el TwiML y conecta el Media Stream
+    realtime_sessions.prewarm()
     return Response(content=str(response), media_type="application/xml")
 
 @app.websocket("/ws/twilio")
 async def twilio_ws(websocket: WebSocket):
     await websocket.accept()
+    call_start = time.perf_counter()
+    first_audio_at = None
+    speech_stopped_at = None
     stream_sid = None
     logger.info("📞 Nueva llamada WebSocket entrante (Twilio -> OpenAI Realtime)")
     
@@ -1211,160 +1640,249 @@ async def twilio_ws(websocket: WebSocket):
         await websocket.close()
         return
 
-    openai_url = f"wss://api.openai.com/v1/realtime?model={OPENAI_REALTIME_MODEL}"
-    headers = {
-        "Authorization": f"Bearer {openai_api_key}"
-    }
-
     try:
-        async with websockets.connect(openai_url, additional_headers=headers) as openai_ws:
-            logger.info("🧠 Conectado a OpenAI Realtime API exitosamente")
-            
-            # Configure Session with audio/pcmu (G.711 u-law nativo) + VAD Anti-Ruido + Voz Natural 'marin'
-            session_update = {
-                "type": "session.update",
-                "session": {
-                    "type": "realtime",
-                    "instructions": SYSTEM_PROMPT_SOFIA,
-                    "audio": {
-                        "input": {
-                            "format": {"type": "audio/pcmu"},
-                            "turn_detection": {
-                                "type": "server_vad",
-                                "threshold": 0.85,  # Alto rechazo de ruido ambiental / TV / música
-                                "prefix_padding_ms": 300,
-                                "silence_duration_ms": 800  # Pausa humana natural sin cortes prematuros
-                            }
-                        },
-                        "output": {
-                            "format": {"type": "audio/pcmu"},
-                            "voice": "marin"  # Voz ultra-natural y humana de Realtime 2.1
-                        }
-                    },
-                    "tools": [
-                        {
-                            "type": "function",
-                            "name": "agendar_cita",
-                            "description": "Agenda una cita técnica de inspección para Morales Plumbing.",
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "nombre": {"type": "string", "description": "Nombre del cliente"},
-                                    "telefono": {"type": "string", "description": "Teléfono de contacto"},
-                                    "direccion": {"type": "string", "description": "Dirección del servicio"},
-                                    "problema": {"type": "string", "description": "Descripción del problema reportado por el cliente"}
-                                },
-                                "required": ["nombre", "telefono", "direccion", "problema"]
-                            }
-                        }
-                    ]
-                }
-            }
-            await openai_ws.send(json.dumps(session_update))
+        # Sesión ya configurada del pool si hay una lista; si no, conexión en frío
+        openai_ws, session_source = await realtime_sessions.acquire()
+        metrics.observe(f"realtime.session_ready_{session_source}_ms", (time.perf_counter() - call_start) * 1000)
+        async with openai_ws:
+            logger.info(f"🧠 Conectado a OpenAI Realtime API exitosamente (sesión {session_source})")
+
+            def on_audio_out():
+                """
+                TTFT de la llamada (WebSocket de Twilio abierto -> primer audio al cliente) y latencia
+                de respuesta (speech_stopped del cliente -> primer delta de audio de la respuesta).
+                """
+                nonlocal first_audio_at, speech_stopped_at
+                now = time.perf_counter()
+                if first_audio_at is None:
+                    first_audio_at = now
+                    metrics.observe(f"realtime.ttft_{session_source}_ms", (now - call_start) * 1000)
+                if speech_stopped_at is not None:
+                    metrics.observe("realtime.response_latency_ms", (now - speech_stopped_at) * 1000)
+                    speech_stopped_at = None
+
+
+            relay = media_relay.RelayStats()
+            coalescer = media_relay.FrameCoalescer()
+
+            async def flush_audio() -> bool:
+                """Manda a OpenAI los frames que el coalescer tenía a medio juntar; False si falló el envío."""
+                payload = coalescer.flush()
+                if not payload:
+                    return True
+                try:
+                    await openai_ws.send(media_relay.openai_append(payload))
+                    relay.appends_sent += 1
+                    return True
+                except Exception as ws_err:
+                    logger.error(f"Error reenviando audio a OpenAI: {ws_err}")
+                    return False
 
             async def receive_from_twilio():
                 nonlocal stream_sid
                 try:
                     while True:
                         msg = await websocket.receive_text()
+
+                        # Camino rápido: frame de audio de 20 ms sin json.loads/json.dumps
+                        cpu_start = time.thread_time_ns()
+                        payload = media_relay.twilio_media_payload(msg)
+                        if payload is not None:
+                            relay.frames_in += 1
+                            payload = coalescer.add(payload)
+                            out = media_relay.openai_append(payload) if payload else None
+                            relay.cpu_ns += time.thread_time_ns() - cpu_start
+                            if out:
+                                try:
+                                    await openai_ws.send(out)
+                                    relay.appends_sent += 1
+                                except Exception as ws_err:
+                                    logger.error(f"Error reenviando audio a OpenAI: {ws_err}")
+                                    break
+                            continue
+
                         data = json.loads(msg)
+                        relay.cpu_ns += time.thread_time_ns() - cpu_start
                         
                         if data['event'] == 'start':
                             stream_sid = data['start']['streamSid']
                             logger.info(f"▶️ Twilio Stream Started: {stream_sid}")
                             
-                            # Disparar saludo inicial ahora que stream_sid está listo y activo
-                            initial_response = {
-                                "type": "response.create",
-                                "response": {
-                                    "instructions": "Saluda cordialmente: 'Gracias por llamar a Morales Plumbing, le atiende Sofia Lin. ¿En qué podemos ayudarle hoy?'"
+                            # Saludo pre-renderizado: suena de inmediato mientras la sesión del modelo termina de calentar
+                            greeting = phrase_bank.get_bank().ulaw("realtime_greeting_es")
+                            if greeting:
+                                for offset in range(0, len(greeting), GREETING_CHUNK_BYTES):
+                                    await websocket.send_text(json.dumps({
+                                        "event": "media",
+                                        "streamSid": stream_sid,
+                                        "media": {"payload": base64.b64encode(greeting[offset:offset + GREETING_CHUNK_BYTES]).decode()}
+                                    }))
+                                    if first_audio_at is None:
+                                        on_audio_out()
+                                # Que el modelo sepa que ya saludó (sin generar otra respuesta)
+                                await openai_ws.send(json.dumps({
+                                    "type": "conversation.item.create",
+                                    "item": {
+                                        "type": "message",
+                                        "role": "assistant",
+                                        "content": [{"type": "output_text", "text": phrase_bank.PHRASES["realtime_greeting_es"]}]
+                                    }
+                                }))
+                                metrics.incr("realtime.greeting.prerendered")
+                            else:
+                                # Disparar saludo inicial ahora que stream_sid está listo y activo
+                                initial_response = {
+                                    "type": "response.create",
+                                    "response": {
+                                        "instructions": "Saluda cordialmente: 'Gracias por llamar a Morales Plumbing, le atiende Sofia Lin. ¿En qué podemos ayudarle hoy?'"
+                                    }
                                 }
-                            }
-                            await openai_ws.send(json.dumps(initial_response))
+                                await openai_ws.send(json.dumps(initial_response))
+                                metrics.incr("realtime.greeting.live")
                         
                         elif data['event'] == 'media':
-                            try:
-                                audio_append = {
-                                    "type": "input_audio_buffer.append",
-                                    "audio": data['media']['payload']
-                                }
-                                await openai_ws.send(json.dumps(audio_append))
-                            except Exception as ws_err:
-                                logger.error(f"Error reenviando audio a OpenAI: {ws_err}")
-                                break
+                            # Sobre con otro orden de claves o escapes: mismo reenvío por el camino lento
+                            relay.frames_in += 1
+                            relay.slow_path += 1
+                            payload = coalescer.add(data['media']['payload'])
+                            if payload:
+                                try:
+                                    await openai_ws.send(media_relay.openai_append(payload))
+                                    relay.appends_sent += 1
+                                except Exception as ws_err:
+                                    logger.error(f"Error reenviando audio a OpenAI: {ws_err}")
+                                    break
                                 
+                        elif data['event'] == 'mark':
+                            # Twilio terminó de reproducir hasta la marca: lo que el cliente ya dijo no espera al grupo
+                            if not await flush_audio():
+                                break
+
                         elif data['event'] == 'stop':
                             logger.info("⏹️ Twilio Stream Stopped")
+                            # Los últimos frames (menos de REALTIME_COALESCE_FRAMES) no se pierden al colgar
+                            await flush_audio()
                             break
                 except WebSocketDisconnect:
                     logger.info("Twilio WebSocket disconnected.")
                 except Exception as e:
                     logger.error(f"Twilio receive error: {e}")
+                finally:
+                    # Colgó el cliente: cerrar la sesión Realtime para que receive_from_openai termine también
+                    await openai_ws.close()
+
+            tool_tasks = set()
+
+            async def run_tool(func_name, call_id, raw_arguments):
+                """Ejecuta la herramienta fuera del event loop y responde al modelo en cuanto el registro queda guardado."""
+                start = time.perf_counter()
+                try:
+                    arguments = json.loads(raw_arguments)
+                except ValueError:
+                    arguments = {}
+                logger.info(f"🔔 Tool Executed: {func_name} with {arguments}")
+
+                if func_name == "agendar_cita":
+                    code = await asyncio.to_thread(
+                        save_appointment,
+                        name=arguments.get("nombre", "Cliente Desconocido"),
+                        phone=arguments.get("telefono", "Sin Teléfono"),
+                        email="No provisto",
+                        address=arguments.get("direccion", "Sin Dirección"),
+                        status="Pendiente",
+                        diagnosis=arguments.get("problema", "Inspección General"),
+                        materials="Por evaluar",
+                        is_emergency=False,
+                        scheduled_time="Por coordinar",
+                        source="phone_openai_realtime"
+                    )
+                    if code:
+                        output = {"status": "success", "code": code, "message": f"Cita registrada en el sistema de Morales Plumbing. Código: {code}."}
+                    else:
+                        output = {"status": "error", "message": "No se pudo registrar la cita; ofrece que un técnico devuelva la llamada."}
+                else:
+                    output = {"status": "error", "message": f"Herramienta desconocida: {func_name}"}
+                metrics.observe(f"realtime.tool.{func_name}_ms", (time.perf_counter() - start) * 1000)
+
+                try:
+                    await openai_ws.send(json.dumps({
+                        "type": "conversation.item.create",
+                        "item": {
+                            "type": "function_call_output",
+                            "call_id": call_id,
+                            "output": json.dumps(output)
+                        }
+                    }))
+                    await openai_ws.send(json.dumps({"type": "response.create"}))
+                except Exception as e:
+                    logger.error(f"No se pudo enviar el resultado de {func_name} a OpenAI: {e}")
 
             async def receive_from_openai():
+                nonlocal speech_stopped_at
                 try:
                     async for raw_msg in openai_ws:
+                        # Camino rápido: delta de audio -> frame media de Twilio armado como string
+                        cpu_start = time.thread_time_ns()
+                        delta = media_relay.openai_audio_delta(raw_msg) if isinstance(raw_msg, str) else None
+                        if delta is not None:
+                            out = media_relay.twilio_media(stream_sid, delta) if delta and stream_sid else None
+                            relay.cpu_ns += time.thread_time_ns() - cpu_start
+                            if out:
+                                relay.frames_out += 1
+                                await websocket.send_text(out)
+                                if first_audio_at is None or speech_stopped_at is not None:
+                                    on_audio_out()
+                            continue
+
+                        received_at = time.perf_counter()
                         event = json.loads(raw_msg)
+                        relay.cpu_ns += time.thread_time_ns() - cpu_start
                         event_type = event.get("type")
                         
                         # Audio stream chunk back to Twilio (soporta response.output_audio.delta y response.audio.delta)
                         if event_type in ("response.output_audio.delta", "response.audio.delta") and stream_sid:
                             delta = event.get("delta")
                             if delta:
-                                media_msg = {
-                                    "event": "media",
-                                    "streamSid": stream_sid,
-                                    "media": {
-                                        "payload": delta
-                                    }
-                                }
-                                await websocket.send_text(json.dumps(media_msg))
+                                relay.frames_out += 1
+                                relay.slow_path += 1
+                                await websocket.send_text(media_relay.twilio_media(stream_sid, delta))
+                                if first_audio_at is None or speech_stopped_at is not None:
+                                    on_audio_out()
                             
                         # Handle Caller Interruption (Barge-in): Clear audio buffer on Twilio immediately!
                         elif event_type == "input_audio_buffer.speech_started" and stream_sid:
-                            logger.info("🗣️ Interrupción detectada: silenciando audio previo en Twilio")
+                            logger.debug("🗣️ Interrupción detectada: silenciando audio previo en Twilio")
+                            # El audio del cliente a medio agrupar va antes del clear, sin esperar al resto del grupo
+                            await flush_audio()
                             await websocket.send_text(json.dumps({"event": "clear", "streamSid": stream_sid}))
+                            metrics.observe("realtime.barge_in_clear_ms", (time.perf_counter() - received_at) * 1000)
+                            # El cliente volvió a hablar: la medición de respuesta pendiente ya no aplica
+                            speech_stopped_at = None
+
+                        elif event_type == "input_audio_buffer.speech_stopped":
+                            speech_stopped_at = received_at
                             
-                        # Function / Tool Calling
+                        # Function / Tool Calling: corre en un hilo para no cortar el audio
                         elif event_type == "response.function_call_arguments.done":
-                            func_name = event.get("name")
-                            call_id = event.get("call_id")
-                            arguments = json.loads(event.get("arguments", "{}"))
-                            
-                            logger.info(f"🔔 Tool Executed: {func_name} with {arguments}")
-                            
-                            if func_name == "agendar_cita":
-                                save_appointment(
-                                    name=arguments.get("nombre", "Cliente Desconocido"),
-                                    phone=arguments.get("telefono", "Sin Teléfono"),
-                                    email="No provisto",
-                                    address=arguments.get("direccion", "Sin Dirección"),
-                                    status="Pendiente",
-                                    diagnosis=arguments.get("problema", "Inspección General"),
-                                    materials="Por evaluar",
-                                    is_emergency=False,
-                                    scheduled_time="Por coordinar",
-                                    source="phone_openai_realtime"
-                                )
-                                
-                                tool_output = {
-                                    "type": "conversation.item.create",
-                                    "item": {
-                                        "type": "function_call_output",
-                                        "call_id": call_id,
-                                        "output": json.dumps({"status": "success", "message": "Cita registrada en el sistema de Morales Plumbing."})
-                                    }
-                                }
-                                await openai_ws.send(json.dumps(tool_output))
-                                await openai_ws.send(json.dumps({"type": "response.create"}))
+                            task = asyncio.create_task(run_tool(event.get("name"), event.get("call_id"), event.get("arguments") or "{}"))
+                            tool_tasks.add(task)
+                            task.add_done_callback(tool_tasks.discard)
                                 
                 except Exception as e:
                     logger.error(f"OpenAI Realtime receive error: {e}")
 
-            await asyncio.wait_for(
-                asyncio.gather(receive_from_twilio(), receive_from_openai(), return_exceptions=True),
-                timeout=900
-            )
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(receive_from_twilio(), receive_from_openai(), return_exceptions=True),
+                    timeout=900
+                )
+            finally:
+                # Una cita en curso se termina de guardar aunque el cliente haya colgado
+                if tool_tasks:
+                    await asyncio.wait(tool_tasks, timeout=30)
+                summary = relay.finish()
+                logger.info(f"📊 Relay {stream_sid}: {summary['frames_in']} in / {summary['frames_out']} out, "
+                            f"{summary['relay_cpu_ms']} ms CPU, ~{summary['calls_per_core']} llamadas/core")
             
     except asyncio.TimeoutError:
         logger.info("⏳ Llamada alcanzó duración máxima (15 min).")
@@ -1399,7 +1917,7 @@ async def inject_whatsapp(request: Request):
             lang = "en" if all(ord(c) < 128 for c in content) and not any(
                 w in content.lower() for w in ["hola","gracias","quiero","necesito","ayuda","cita","plomero","agua","problema"]
             ) else "es"
-            reply = sofia_text_chat(content, f"wa_{sender}", lang)
+            reply = await sofia_text_chat(content, f"wa_{sender}", lang)
             resp.message(reply)
         return FResponse(content=str(resp), media_type="application/xml")
     except Exception as e:
@@ -1,24 +1,501 @@
 """
 LangGraph Orchestrator - State Machine determinista
+Nodos: triage -> collect -> confirm -> book, con transfer como salida desde cualquiera.
+El estado de cada conversación se guarda por caller_id en un session store (sobrevive
+entre mensajes y, con SESSION_BACKEND=sqlite/redis, entre workers). Pedir el siguiente
+dato, leer el resumen e interpretar el sí/no se resuelven aquí sin LLM; solo cuando el
+cliente pregunta algo fuera del flujo el turno se marca `needs_llm` y el motor responde
+con el LLM y repite la pregunta pendiente.
+
+step() y transfer() leen, modifican y guardan el estado bajo un lock por caller_id: dos
+mensajes simultáneos del mismo remitente se procesan uno detrás del otro (dentro del proceso).
 """
-from typing import TypedDict, Optional
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, TypedDict
+
+from core import metrics
+from core.session_store import open_session_store
+from policy_engine.intent_classifier import normalize
+
+logger = logging.getLogger("FSM")
+
+FSM_STATE_TTL_S = float(os.getenv("FSM_STATE_TTL_S", "1800"))
+
+# Orden en que se piden los datos de la cita
+FIELD_ORDER = ("issue", "name", "address", "phone", "time_window")
+
+FIELD_PROMPTS = {
+    "es": {
+        "issue": "¿En qué podemos ayudarle? Cuénteme brevemente el problema de plomería.",
+        "name": "¿Me regala su nombre completo, por favor?",
+        "address": "¿Cuál es la dirección del servicio, con número y ciudad?",
+        "phone": "¿A qué número de teléfono podemos contactarle?",
+        "time_window": "¿Qué horario le acomoda? Tenemos de 8-10 AM, 10-12 PM, 12-2 PM, 2-4 PM o 4-6 PM.",
+    },
+    "en": {
+        "issue": "How can we help you? Please briefly describe the plumbing problem.",
+        "name": "May I have your full name, please?",
+        "address": "What is the service address, including the number and city?",
+        "phone": "What phone number can we reach you at?",
+        "time_window": "What time works for you? We have 8-10 AM, 10-12 PM, 12-2 PM, 2-4 PM or 4-6 PM.",
+    },
+}
+
+RETRY_PROMPTS = {
+    "es": {
+        "issue": "Disculpe, no entendí el problema. ¿Me lo describe con un poco más de detalle?",
+        "name": "Disculpe, no capté su nombre. ¿Me lo repite, por favor?",
+        "address": "Necesito la dirección completa con número de casa y ciudad. ¿Me la repite?",
+        "phone": "No capté un número válido. ¿Me lo dicta con código de área?",
+        "time_window": "¿En qué horario le gustaría la visita?",
+    },
+    "en": {
+        "issue": "Sorry, I didn't catch the problem. Could you describe it in a bit more detail?",
+        "name": "Sorry, I didn't catch your name. Could you repeat it?",
+        "address": "I need the full address with house number and city. Could you repeat it?",
+        "phone": "That didn't sound like a valid number. Could you give it to me with the area code?",
+        "time_window": "What time window would you like for the visit?",
+    },
+}
+
+CONFIRM_TEMPLATE = {
+    "es": "Perfecto, confirmo: {name}, en {address}, teléfono {phone}, por {issue}, en el horario {time_window}. ¿Es correcto?",
+    "en": "Great, let me confirm: {name}, at {address}, phone {phone}, for {issue}, in the {time_window} window. Is that correct?",
+}
+CONFIRM_RETRY = {
+    "es": "¿Los datos son correctos? Responda sí o no, por favor.",
+    "en": "Are those details correct? Please answer yes or no.",
+}
+CORRECTION_PROMPT = {
+    "es": "Entendido, corrijamos ese dato.",
+    "en": "Understood, let's fix that.",
+}
+BOOKED_REPLY = {
+    "es": "¡Listo, {name}! Su cita quedó registrada con el código {code}. Un técnico de Morales Plumbing le contactará para confirmar la visita.",
+    "en": "All set, {name}! Your appointment is booked under code {code}. A Morales Plumbing technician will contact you to confirm the visit.",
+}
+
+_YES = {"si", "yes", "yeah", "yep", "correcto", "correct", "claro", "ok", "okay", "exacto", "right", "confirmo",
+        "dale", "perfecto", "afirmativo", "sure", "asi", "eso"}
+_NO = {"no", "nope", "incorrecto", "incorrect", "wrong", "cambiar", "change", "corregir", "equivocado", "mal"}
+# Expresiones con "no" que son conformidad ("Sí, no hay problema")
+_NO_IDIOMS = (("no", "hay", "problema"), ("no", "problema"), ("sin", "problema"), ("no", "te", "preocupes"),
+              ("no", "problem"), ("no", "problems"), ("no", "worries"))
+# Palabras que indican qué dato quiere corregir el cliente al decir "no". "problema" no está:
+# aparece en frases de conformidad y en cualquier descripción ("el problema es que...")
+_FIELD_WORDS = {
+    "name": {"nombre", "name"},
+    "address": {"direccion", "domicilio", "address", "calle", "street"},
+    "phone": {"telefono", "celular", "numero", "phone", "number"},
+    "time_window": {"hora", "horario", "dia", "cuando", "time", "day", "window"},
+    "issue": {"falla", "motivo", "descripcion", "issue", "description"},
+}
+_GREETINGS = {"hola", "buenas", "buenos", "buen", "dia", "dias", "tardes", "noches", "hello", "hi", "hey", "good",
+              "morning", "afternoon", "evening", "sofia", "que", "tal", "alo", "bueno", "again", "otra", "vez", "de", "nuevo",
+              "there"}
+_ES_HINTS = {"hola", "necesito", "ocupo", "tengo", "por", "favor", "gracias", "mi", "el", "la", "de", "que", "se",
+             "en", "una", "un", "con", "para", "bano", "cocina", "fuga", "si", "me", "llamo", "calle"}
+_EN_HINTS = {"hi", "hello", "need", "have", "please", "thanks", "my", "the", "of", "is", "a", "an", "with", "for",
+             "bathroom", "kitchen", "leak", "yes", "name", "street", "i", "it"}
+_TIME_WORDS = {"hoy", "manana", "tarde", "noche", "asap", "ahorita", "ya", "lunes", "martes", "miercoles", "jueves",
+               "viernes", "sabado", "domingo", "today", "tomorrow", "morning", "afternoon", "evening", "now", "monday",
+               "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday", "am", "pm"}
+_NAME_PREFIXES = ("me llamo", "mi nombre es", "soy", "my name is", "i am", "i'm", "im", "this is", "it's", "its")
+
+_WORD_RE = re.compile(r"[\w']+")
+
 
 class SofiaState(TypedDict):
     call_id: str
     customer_phone: str
-    current_fsm_state: str
+    current_fsm_state: str     # triage | collect | confirm | book | booked | transfer
     collected_fields: dict
     confidence_score: float
     requires_human: bool
+    lang: str
+    channel: str
+    pending_field: Optional[str]
+    confirmed: bool
+    booking_code: Optional[str]
+    transfer_reason: Optional[str]
+    turns: int
+    # Transitorios del turno (se sobrescriben en cada mensaje)
+    reply: Optional[str]
+    needs_llm: bool
+
+
+def new_state(caller_id: str, call_id: str = "000", channel: str = "", lang: str = "es") -> SofiaState:
+    state: SofiaState = {
+        "call_id": call_id,
+        "customer_phone": caller_id,
+        "current_fsm_state": "triage",
+        "collected_fields": {},
+        "confidence_score": 0.95,
+        "requires_human": False,
+        "lang": lang if lang in FIELD_PROMPTS else "es",
+        "channel": channel,
+        "pending_field": None,
+        "confirmed": False,
+        "booking_code": None,
+        "transfer_reason": None,
+        "turns": 0,
+        "reply": None,
+        "needs_llm": False,
+    }
+    # El teléfono del canal (voz, WhatsApp) ya es el de contacto; Telegram trae un chat_id y email una dirección
+    phone = _parse_phone(caller_id.replace("whatsapp:", "")) if channel not in ("telegram", "email") else None
+    if phone:
+        state["collected_fields"]["phone"] = phone
+    if channel == "email" and "@" in caller_id:
+        state["collected_fields"]["email"] = caller_id
+    return state
+
+
+# ============ INTERPRETACIÓN DETERMINISTA ============
+def _words(message: str) -> list:
+    return _WORD_RE.findall(normalize(message))
+
+
+def _is_question(message: str) -> bool:
+    return "?" in message or "¿" in message
+
+
+def _detect_lang(words: list, current: str) -> str:
+    es = sum(1 for w in words if w in _ES_HINTS)
+    en = sum(1 for w in words if w in _EN_HINTS)
+    if es > en:
+        return "es"
+    if en > es:
+        return "en"
+    return current
+
+
+def _parse_phone(text: str) -> Optional[str]:
+    digits = re.sub(r"\D", "", text)
+    if len(digits) == 10:
+        return f"+1{digits}"
+    if len(digits) == 11 and digits.startswith("1"):
+        return f"+{digits}"
+    if text.strip().startswith("+") and 10 <= len(digits) <= 15:
+        return f"+{digits}"
+    return None
+
+
+def _parse_name(message: str) -> Optional[str]:
+    text = message.strip().strip(".!")
+    lowered = normalize(text)
+    for prefix in _NAME_PREFIXES:
+        if lowered.startswith(prefix + " "):
+            text = text[len(prefix) + 1:].strip()
+            break
+    words = text.split()
+    if not 1 <= len(words) <= 5 or any(ch.isdigit() for ch in text):
+        return None
+    return " ".join(w.capitalize() if w.islower() else w for w in words)
+
+
+def _parse_field(field: str, message: str) -> Optional[str]:
+    text = message.strip()
+    if field == "phone":
+        return _parse_phone(text)
+    if field == "name":
+        return _parse_name(text)
+    if field == "address":
+        # Dirección de EE.UU.: número de casa + calle como mínimo
+        return text.strip(".") if any(ch.isdigit() for ch in text) and len(text.split()) >= 2 else None
+    if field == "issue":
+        return text if len(text.split()) >= 2 else None
+    if field == "time_window":
+        ok = any(ch.isdigit() for ch in text) or any(w in _TIME_WORDS for w in _words(text))
+        return text.strip(".") if ok else None
+    return text.strip(".") or None
+
+
+def _strip_idioms(words: list) -> list:
+    out, idx = [], 0
+    while idx < len(words):
+        for idiom in _NO_IDIOMS:
+            if tuple(words[idx:idx + len(idiom)]) == idiom:
+                idx += len(idiom)
+                break
+        else:
+            out.append(words[idx])
+            idx += 1
+    return out
+
+
+def _yes_no(words: list) -> Optional[bool]:
+    """El primer sí/no del mensaje decide, sin contar "no hay problema" / "no problem"."""
+    for word in _strip_idioms(words):
+        if word in _NO:
+            return False
+        if word in _YES:
+            return True
+    return None
+
+
+def _strip_greeting(message: str) -> str:
+    """Quita el saludo inicial ("Hola, buenas tardes, ...") conservando el resto tal como lo escribió el cliente."""
+    for match in _WORD_RE.finditer(message):
+        if normalize(match.group()) not in _GREETINGS:
+            return message[match.start():].strip()
+    return ""
+
+
+def next_missing_field(state: SofiaState) -> Optional[str]:
+    for field in FIELD_ORDER:
+        if not state["collected_fields"].get(field):
+            return field
+    return None
+
+
+# ============ NODOS ============
+def triage_node(state: SofiaState, message: str) -> SofiaState:
+    """Primer mensaje: idioma y, si ya describe el problema, se toma como `issue`."""
+    words = _words(message)
+    state["lang"] = _detect_lang(words, state["lang"])
+    if _is_question(message):
+        state["needs_llm"] = True
+    elif words and not all(w in _GREETINGS for w in words):
+        issue = _parse_field("issue", _strip_greeting(message))
+        if issue:
+            state["collected_fields"]["issue"] = issue
+    return state
+
 
-def triage_node(state: SofiaState) -> SofiaState:
-    # 1. Verificar Policy Engine para identificar emergencias (Gas P0)
-    # 2. Si hay emergencia, state["requires_human"] = True
+def collect_node(state: SofiaState, message: str) -> SofiaState:
+    """Respuesta a la pregunta pendiente: se valida y guarda, o se vuelve a pedir."""
+    field = state["pending_field"] or next_missing_field(state)
+    if field is None:
+        return state
+    if _is_question(message):
+        state["needs_llm"] = True
+        return state
+    value = _parse_field(field, message)
+    if value:
+        state["collected_fields"][field] = value
+    else:
+        state["reply"] = RETRY_PROMPTS[state["lang"]][field]
     return state
 
+
+def confirm_node(state: SofiaState, message: str) -> SofiaState:
+    words = _strip_idioms(_words(message))
+    answer = _yes_no(words)
+    fields = [f for f, hints in _FIELD_WORDS.items() if any(w in hints for w in words)]
+    # "Sí, pero el teléfono está mal": un no que nombra un dato es corrección aunque empiece con sí
+    if fields and any(w in _NO for w in words):
+        answer = False
+    if answer is True:
+        state["confirmed"] = True
+    elif answer is False:
+        # Sin dato concreto se vuelve a pedir todo menos el problema y el teléfono del canal
+        for field in fields or ("name", "address", "time_window"):
+            state["collected_fields"].pop(field, None)
+        state["reply"] = CORRECTION_PROMPT[state["lang"]]
+    elif _is_question(message):
+        state["needs_llm"] = True
+    else:
+        state["reply"] = CONFIRM_RETRY[state["lang"]]
+    return state
+
+
+def book_node(state: SofiaState, booking_handler: Callable[[dict, SofiaState], str]) -> SofiaState:
+    fields = state["collected_fields"]
+    try:
+        code = booking_handler(dict(fields), state)
+    except Exception as e:
+        logger.error(f"Error agendando cita de {state['customer_phone']}: {e}")
+        code = ""
+    if not code:
+        return transfer_node(state, "Booking failed - dispatcher must schedule manually")
+    state["booking_code"] = code
+    state["current_fsm_state"] = "booked"
+    state["reply"] = BOOKED_REPLY[state["lang"]].format(name=fields.get("name", ""), code=code)
+    return state
+
+
+def transfer_node(state: SofiaState, reason: str) -> SofiaState:
+    state["requires_human"] = True
+    state["transfer_reason"] = reason
+    state["current_fsm_state"] = "transfer"
+    state["reply"] = None
+    return state
+
+
 def routing_decision(state: SofiaState) -> str:
     if state["requires_human"]:
         return "transfer_to_human"
-    if not state["collected_fields"].get("address"):
-        return "collect_address"
-    return "process_appointment"
+    if next_missing_field(state):
+        return "collect"
+    if not state["confirmed"]:
+        return "confirm"
+    return "book"
+
+
+def prompt_for(state: SofiaState) -> Optional[str]:
+    """Pregunta del nodo actual (la que el cliente debe contestar en el siguiente mensaje)."""
+    lang = state["lang"]
+    if state["current_fsm_state"] == "collect" and state["pending_field"]:
+        return FIELD_PROMPTS[lang][state["pending_field"]]
+    if state["current_fsm_state"] == "confirm":
+        fields = state["collected_fields"]
+        return CONFIRM_TEMPLATE[lang].format(**{f: fields.get(f, "") for f in FIELD_ORDER})
+    return None
+
+
+# ============ RESERVA POR DEFECTO ============
+_appointments = None
+_appointments_lock = threading.Lock()
+
+
+def store_appointment(fields: dict, state: SofiaState) -> str:
+    """Handler de reserva por defecto: la cita va al AppointmentStore local y se devuelve el código MP."""
+    global _appointments
+    from core.appointment_store import AppointmentStore
+    with _appointments_lock:
+        if _appointments is None:
+            _appointments = AppointmentStore()
+    record = _appointments.create({
+        "name": fields.get("name"),
+        "phone": fields.get("phone"),
+        "email": fields.get("email"),
+        "address": fields.get("address"),
+        "status": "pending",
+        "customer_issue": fields.get("issue"),
+        "scheduled_time": fields.get("time_window"),
+        "is_emergency": False,
+        "source": state["channel"] or "sofia_v9",
+    })
+    return record["code"]
+
+
+# ============ ORQUESTADOR ============
+class CallerLocks:
+    """Un lock por caller_id mientras haya quien lo use; al soltarlo el último, se borra."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks: Dict[str, list] = {}  # caller_id -> [lock, usuarios]
+
+    @contextmanager
+    def hold(self, caller_id: str):
+        with self._lock:
+            entry = self._locks.setdefault(caller_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    self._locks.pop(caller_id, None)
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class FSMTurn:
+    def __init__(self, state: SofiaState, node_ms: Dict[str, float], repeated: bool = False):
+        self.state = state
+        self.node_ms = node_ms
+        self.reply = state["reply"]
+        self.needs_llm = state["needs_llm"]
+        # Si el nodo vuelve a pedir lo mismo, el aviso de reintento ya es la pregunta
+        self.prompt = None if repeated and self.reply else prompt_for(state)
+
+    @property
+    def action(self) -> str:
+        if self.state["current_fsm_state"] == "transfer":
+            return "transfer_to_human"
+        if self.state["current_fsm_state"] == "booked":
+            return "booked"
+        return "continue_call"
+
+    @property
+    def reason(self) -> str:
+        return self.state["transfer_reason"] or ""
+
+    def text(self) -> str:
+        """Respuesta determinista completa (aviso/corrección + siguiente pregunta)."""
+        return " ".join(part for part in (self.reply, self.prompt) if part)
+
+
+class ConversationFSM:
+    """
+    step() avanza un mensaje: el nodo actual consume la respuesta y routing_decision elige
+    el siguiente, que deja su pregunta (collect/confirm) o se ejecuta de inmediato (book).
+    Cada nodo se mide en `fsm.<nodo>_ms`.
+    """
+
+    def __init__(self, store=None, booking_handler: Optional[Callable[[dict, SofiaState], str]] = None):
+        self.store = store if store is not None else open_session_store("fsm_states", ttl_seconds=FSM_STATE_TTL_S)
+        self.booking_handler = booking_handler or store_appointment
+        self._callers = CallerLocks()
+
+    def load(self, caller_id: str, call_id: str = "000", channel: str = "", lang: str = "es") -> SofiaState:
+        state = self.store.get(caller_id)
+        # Una conversación cerrada (cita agendada o transferida) empieza de nuevo
+        if not state or state["current_fsm_state"] in ("booked", "transfer"):
+            state = new_state(caller_id, call_id, channel, lang)
+        return state
+
+    def _run(self, node: str, node_ms: Dict[str, float], func, *args) -> SofiaState:
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            node_ms[node] = round(node_ms.get(node, 0.0) + elapsed, 3)
+            metrics.observe(f"fsm.{node}_ms", elapsed)
+
+    def step(self, caller_id: str, message: str, call_id: str = "000", channel: str = "",
+             lang: Optional[str] = None) -> FSMTurn:
+        with self._callers.hold(caller_id):
+            return self._step(caller_id, message, call_id, channel, lang)
+
+    def _step(self, caller_id: str, message: str, call_id: str, channel: str, lang: Optional[str]) -> FSMTurn:
+        state = self.load(caller_id, call_id, channel, lang or "es")
+        state["turns"] += 1
+        state["reply"] = None
+        state["needs_llm"] = False
+        node_ms: Dict[str, float] = {}
+
+        node = state["current_fsm_state"]
+        asked = (node, state["pending_field"])
+        if node == "triage":
+            state = self._run("triage", node_ms, triage_node, state, message)
+        elif node == "collect":
+            state = self._run("collect", node_ms, collect_node, state, message)
+        elif node == "confirm":
+            state = self._run("confirm", node_ms, confirm_node, state, message)
+
+        next_node = routing_decision(state)
+        if next_node == "collect":
+            state["current_fsm_state"] = "collect"
+            state["pending_field"] = next_missing_field(state)
+        elif next_node == "confirm":
+            state["current_fsm_state"] = "confirm"
+            state["pending_field"] = None
+        elif next_node == "book":
+            state = self._run("book", node_ms, book_node, state, self.booking_handler)
+        else:
+            state = self._run("transfer", node_ms, transfer_node, state, state["transfer_reason"] or "FSM transfer")
+
+        self.store.set(caller_id, state)
+        metrics.incr("fsm.llm_turns" if state["needs_llm"] else "fsm.deterministic_turns")
+        return FSMTurn(state, node_ms, repeated=asked == (state["current_fsm_state"], state["pending_field"]))
+
+    def transfer(self, caller_id: str, reason: str, call_id: str = "000", channel: str = "") -> SofiaState:
+        """Registra una transferencia decidida fuera del FSM (emergencia L4, modo degradado)."""
+        with self._callers.hold(caller_id):
+            state = self.load(caller_id, call_id, channel)
+            state = transfer_node(state, reason)
+            self.store.set(caller_id, state)
+            return state
@@ -0,0 +1,140 @@
+"""
+Policy Audit - Sofia Lin V9.1
+Bitácora de decisiones del PolicyEngine en un ring buffer en memoria. Registrar una
+decisión es un deque.append (atómico bajo el GIL, sin lock ni I/O en la llamada); un hilo
+en segundo plano vacía el buffer a un archivo JSONL cada POLICY_AUDIT_FLUSH_S, o antes si
+el ring pasa de POLICY_AUDIT_HIGH_WATER de su capacidad.
+
+Pérdida: record() nunca bloquea, así que si las decisiones llegan más rápido de lo que el
+flush escribe (del orden de 10^6 entradas/s en un núcleo, compartido con quien decide por
+el GIL) el ring sobrescribe las más viejas y las cuenta en stats()["dropped"]. Con el
+tráfico real (decenas de decisiones por turno) eso no ocurre; en un benchmark de varios
+hilos decidiendo sin pausa sí puede pasar.
+"""
+import atexit
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+logger = logging.getLogger("POLICY_AUDIT")
+
+POLICY_AUDIT_PATH = os.getenv("POLICY_AUDIT_PATH", "/tmp/orion_policy_audit.jsonl")
+POLICY_AUDIT_CAPACITY = int(os.getenv("POLICY_AUDIT_CAPACITY", "50000"))
+POLICY_AUDIT_FLUSH_S = float(os.getenv("POLICY_AUDIT_FLUSH_S", "5"))
+POLICY_AUDIT_HIGH_WATER = float(os.getenv("POLICY_AUDIT_HIGH_WATER", "0.25"))
+
+# Orden de los campos de cada entrada (tuplas en el buffer, dict solo al escribir)
+ENTRY_FIELDS = ("ts", "action", "outcome", "level", "rule", "reason")
+
+
+class AuditLog:
+    def __init__(self, path: Optional[str] = POLICY_AUDIT_PATH, capacity: int = POLICY_AUDIT_CAPACITY,
+                 flush_interval_s: float = POLICY_AUDIT_FLUSH_S, high_water: float = POLICY_AUDIT_HIGH_WATER):
+        self.path = path
+        self.capacity = capacity
+        self.flush_interval_s = flush_interval_s
+        self._ring: deque = deque(maxlen=capacity)
+        self._high_water = max(1, int(capacity * high_water))
+        self._seq = itertools.count(1)  # next() es atómico en CPython, a diferencia de += 1
+        self.recorded = 0
+        self.flushed = 0
+        self.flush_errors = 0
+        self.last_flush_ms = 0.0
+        self._flush_lock = threading.Lock()  # solo entre flushes (hilo vs atexit/close), nunca en record()
+        self._stop = threading.Event()
+        self._wake = threading.Event()  # flush anticipado cuando el ring pasa la marca
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, action: str, outcome: str, level: int, rule: str, reason: str):
+        ring = self._ring
+        ring.append((time.time(), action, outcome, level, rule, reason))
+        self.recorded = next(self._seq)
+        if len(ring) >= self._high_water and not self._wake.is_set():
+            self._wake.set()
+
+    def recent(self, limit: int = 50) -> list:
+        """Últimas entradas aún no vaciadas (para /api/metrics o depuración)."""
+        entries = list(self._ring)[-limit:]
+        return [dict(zip(ENTRY_FIELDS, entry)) for entry in entries]
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            start = time.perf_counter()
+            batch = []
+            while True:
+                try:
+                    batch.append(self._ring.popleft())
+                except IndexError:
+                    break
+            if batch and self.path:
+                # Las decisiones se repiten: el JSON de (acción, resultado, nivel, regla, motivo)
+                # se arma una vez por lote y cada línea solo agrega su ts
+                tails = {}
+                lines = []
+                for entry in batch:
+                    tail = tails.get(entry[1:])
+                    if tail is None:
+                        tail = tails[entry[1:]] = json.dumps(dict(zip(ENTRY_FIELDS[1:], entry[1:])),
+                                                             ensure_ascii=False)[1:] + "\n"
+                    lines.append(f'{{"ts": {entry[0]!r}, {tail}')
+                try:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write("".join(lines))
+                except OSError as e:
+                    self.flush_errors += 1
+                    logger.error(f"No se pudo escribir la auditoría de políticas en {self.path}: {e}")
+            self.flushed += len(batch)
+            self.last_flush_ms = (time.perf_counter() - start) * 1000
+            return len(batch)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval_s)
+            self._wake.clear()
+            self.flush()
+
+    def start(self):
+        if self._thread is None and self.flush_interval_s > 0:
+            self._thread = threading.Thread(target=self._run, name="policy-audit-flush", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> dict:
+        pending = len(self._ring)
+        return {
+            "path": self.path,
+            "capacity": self.capacity,
+            "pending": pending,
+            "recorded": self.recorded,
+            "flushed": self.flushed,
+            # Lo que el ring sobrescribió antes de llegar al archivo
+            "dropped": max(0, self.recorded - self.flushed - pending),
+            "flush_errors": self.flush_errors,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+        }
+
+
+_audit: Optional[AuditLog] = None
+_audit_lock = threading.Lock()
+
+
+def get_audit_log() -> AuditLog:
+    global _audit
+    with _audit_lock:
+        if _audit is None:
+            _audit = AuditLog()
+            _audit.start()
+            atexit.register(_audit.close)
+        return _audit
@@ -1,8 +1,28 @@
 """
 Policy Engine - Human Override Matrix
 Clasifica y bloquea acciones según los niveles L0 a L4.
+
+Las reglas viven en rules.json (POLICY_RULES_PATH) y se compilan al cargar en una tabla de
+decisión: por acción, filas ordenadas (predicados sobre el contexto -> resultado), la
+primera que cumple decide. En las tablas densas (POLICY_MEMO_MIN_ROWS filas o más) las
+decisiones se memorizan por (acción, valores de las claves de contexto que esa acción
+consulta); en las chicas evaluar las filas cuesta menos que armar la huella. Cada decisión
+queda en el ring buffer de auditoría.
 """
+import json
+import logging
+import os
+import threading
 from enum import Enum
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from policy_engine.audit import AuditLog, get_audit_log
+
+logger = logging.getLogger("POLICY_ENGINE")
+
+POLICY_RULES_PATH = os.getenv("POLICY_RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json"))
+POLICY_CACHE_SIZE = int(os.getenv("POLICY_CACHE_SIZE", "4096"))
+POLICY_MEMO_MIN_ROWS = int(os.getenv("POLICY_MEMO_MIN_ROWS", "8"))
 
 class ActionLevel(Enum):
     L0_INFORMATIONAL = 0   # Sofia can do it
@@ -11,28 +31,224 @@ class ActionLevel(Enum):
     L3_HIGH_IMPACT = 3     # Requires human confirmation
     L4_SAFETY_CRITICAL = 4 # HUMAN ONLY
 
+# allow = Sofia ejecuta; confirm = falta confirmación humana; deny = bloqueada; transfer = solo humano
+OUTCOMES = ("allow", "confirm", "deny", "transfer")
+
+
+class PolicyDecision:
+    """Resultado de una fila; se arma al compilar y se comparte entre llamadas (no se modifica)."""
+
+    __slots__ = ("action", "level", "level_value", "outcome", "rule", "reason")
+
+    def __init__(self, action: str, level: ActionLevel, outcome: str, rule: str, reason: str):
+        self.action = action
+        self.level = level
+        self.level_value = level.value  # Enum.value es un descriptor lento para el camino caliente
+        self.outcome = outcome
+        self.rule = rule
+        self.reason = reason
+
+    @property
+    def allowed(self) -> bool:
+        return self.outcome == "allow"
+
+    def to_dict(self) -> dict:
+        return {"action": self.action, "level": self.level.name, "outcome": self.outcome,
+                "rule": self.rule, "reason": self.reason}
+
+
+class BatchDecision:
+    """Decisiones de todas las acciones de un turno; `transfer` es la primera que exige humano."""
+
+    def __init__(self, decisions: List[PolicyDecision]):
+        self.decisions = decisions
+        self.allowed = all(d.allowed for d in decisions)
+        self.transfer = next((d for d in decisions if d.outcome == "transfer"), None)
+        self.blocked = [d for d in decisions if not d.allowed]
+
+    def to_dict(self) -> dict:
+        return {"allowed": self.allowed, "transfer": self.transfer.to_dict() if self.transfer else None,
+                "decisions": [d.to_dict() for d in self.decisions]}
+
+
+# ============ COMPILACIÓN ============
+def _predicate(key: str, spec: Any) -> Callable[[dict], bool]:
+    """`valor` = igualdad, `[a, b]` = pertenencia, `{"gt"|"gte"|"lt"|"lte"|"exists": x}` = comparación."""
+    if isinstance(spec, list):
+        allowed = frozenset(spec)
+        return lambda ctx: ctx.get(key) in allowed
+    if isinstance(spec, dict):
+        checks = []
+        for op, operand in spec.items():
+            if op == "gt":
+                checks.append(lambda v, o=operand: v is not None and v > o)
+            elif op == "gte":
+                checks.append(lambda v, o=operand: v is not None and v >= o)
+            elif op == "lt":
+                checks.append(lambda v, o=operand: v is not None and v < o)
+            elif op == "lte":
+                checks.append(lambda v, o=operand: v is not None and v <= o)
+            elif op == "exists":
+                checks.append(lambda v, o=operand: (v is not None) == bool(o))
+            else:
+                raise ValueError(f"Operador de política desconocido: {op}")
+        return lambda ctx: all(check(ctx.get(key)) for check in checks)
+    if isinstance(spec, bool):
+        # True/False comparan por verdad (un "yes" o 1 en human_confirmed cuenta)
+        return lambda ctx: bool(ctx.get(key)) is spec
+    return lambda ctx: ctx.get(key) == spec
+
+
+class CompiledAction:
+    """Filas (predicados, decisión) de una acción y las claves de contexto que consultan."""
+
+    def __init__(self, action: str, level: ActionLevel, rows: list):
+        self.action = action
+        self.level = level
+        self.rows: List[Tuple[Tuple[Callable[[dict], bool], ...], PolicyDecision]] = []
+        keys = []
+        for idx, row in enumerate(rows):
+            outcome = row.get("outcome", "allow")
+            if outcome not in OUTCOMES:
+                raise ValueError(f"Resultado inválido en la regla de {action}: {outcome}")
+            when = row.get("when", {})
+            for key in when:
+                if key not in keys:
+                    keys.append(key)
+            predicates = tuple(_predicate(key, spec) for key, spec in when.items())
+            reason = row.get("reason", "").format(action=action, level=level.name)
+            self.rows.append((predicates, PolicyDecision(action, level, outcome, row.get("id", f"{action}#{idx}"), reason)))
+        self.keys = tuple(keys)
+        # Sin fila aplicable: se trata como crítica
+        self.no_match = PolicyDecision(action, level, "transfer", "no_match", f"Policy Block: {action} has no matching rule")
+        # Sin predicados la decisión no depende del contexto: se resuelve una vez al compilar
+        self.constant: Optional[PolicyDecision] = self.decide({}) if not self.keys else None
+
+    def decide(self, context: dict) -> PolicyDecision:
+        for predicates, decision in self.rows:
+            for predicate in predicates:
+                if not predicate(context):
+                    break
+            else:
+                return decision
+        return self.no_match
+
+
+def compile_rules(spec: dict) -> Tuple[Dict[str, CompiledAction], Callable[[str], CompiledAction]]:
+    level_rows = {ActionLevel[name]: rows for name, rows in spec.get("levels", {}).items()}
+    table = {}
+    for action, entry in spec.get("actions", {}).items():
+        level = ActionLevel[entry["level"]]
+        # Las reglas propias de la acción van antes que las de su nivel
+        table[action] = CompiledAction(action, level, entry.get("rules", []) + level_rows.get(level, []))
+    default_level = ActionLevel[spec.get("default_level", "L4_SAFETY_CRITICAL")]
+    default_rows = level_rows.get(default_level, [])
+
+    def default(action: str) -> CompiledAction:
+        return CompiledAction(action, default_level, default_rows)
+
+    return table, default
+
+
+# ============ MOTOR ============
 class PolicyEngine:
-    def __init__(self):
-        self.rules = {
-            "get_weather": ActionLevel.L0_INFORMATIONAL,
-            "lookup_appointment": ActionLevel.L1_LOW_RISK,
-            "create_appointment": ActionLevel.L2_BUSINESS_IMPACT,
-            "refund_payment": ActionLevel.L3_HIGH_IMPACT,
-            "gas_leak_emergency": ActionLevel.L4_SAFETY_CRITICAL
-        }
+    def __init__(self, rules_path: str = POLICY_RULES_PATH, audit: Optional[AuditLog] = None,
+                 cache_size: int = POLICY_CACHE_SIZE, memo_min_rows: int = POLICY_MEMO_MIN_ROWS):
+        self.rules_path = rules_path
+        self.audit = audit if audit is not None else get_audit_log()
+        self.cache_size = cache_size
+        self.memo_min_rows = memo_min_rows
+        self._cache: Dict[tuple, PolicyDecision] = {}
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.reload()
+
+    def reload(self):
+        """Vuelve a leer y compilar rules.json (la tabla se reemplaza de una vez)."""
+        with open(self.rules_path, "r", encoding="utf-8") as f:
+            spec = json.load(f)
+        table, default = compile_rules(spec)
+        with self._lock:
+            self._table = table
+            self._default = default
+            self._cache = {}
+        # Vista simple acción -> nivel (compatibilidad con el dict de reglas anterior)
+        self.rules = {action: compiled.level for action, compiled in table.items()}
+        logger.info(f"Políticas cargadas: {len(table)} acciones desde {self.rules_path}")
+
+    def _compiled(self, action_name: str) -> CompiledAction:
+        compiled = self._table.get(action_name)
+        if compiled is None:
+            compiled = self._default(action_name)
+            with self._lock:
+                self._table.setdefault(action_name, compiled)
+        return compiled
+
+    def decide(self, action_name: str, context: Optional[dict] = None) -> PolicyDecision:
+        compiled = self._table.get(action_name) or self._compiled(action_name)
+        decision = compiled.constant
+        if decision is None:
+            if len(compiled.rows) >= self.memo_min_rows:
+                decision = self._decide_keyed(compiled, context or {})
+            else:
+                decision = compiled.decide(context or {})
+        self.audit.record(action_name, decision.outcome, decision.level_value, decision.rule, decision.reason)
+        if decision.outcome == "transfer":
+            self.trigger_human_transfer(reason=decision.reason, audit=False)
+        return decision
+
+    def _decide_keyed(self, compiled: CompiledAction, context: dict) -> PolicyDecision:
+        # Huella: solo las claves que las reglas de esta acción consultan
+        key = (compiled.action, *map(context.get, compiled.keys))
+        with self._lock:
+            try:
+                decision = self._cache.get(key)
+            except TypeError:  # valores no hasheables en el contexto: se evalúa sin caché
+                return compiled.decide(context)
+            if decision is not None:
+                self.cache_hits += 1
+                return decision
+            self.cache_misses += 1
+        decision = compiled.decide(context)
+        with self._lock:
+            if len(self._cache) >= self.cache_size:
+                self._cache = {}
+            self._cache[key] = decision
+        return decision
 
     def evaluate_action(self, action_name: str, context: dict) -> bool:
-        level = self.rules.get(action_name, ActionLevel.L4_SAFETY_CRITICAL)
-        
-        if level == ActionLevel.L4_SAFETY_CRITICAL:
-            self.trigger_human_transfer(reason=f"Policy Block: {action_name} is L4")
-            return False
-            
-        if level == ActionLevel.L3_HIGH_IMPACT and not context.get("human_confirmed"):
-            return False
-            
-        return True
-
-    def trigger_human_transfer(self, reason: str):
-        # Envía el payload a Chatwoot y desvía la llamada
-        print(f"[KILL SWITCH / TRANSFER] Triggered. Reason: {reason}")
+        return self.decide(action_name, context).allowed
+
+    def evaluate_batch(self, actions: Iterable[Union[str, Tuple[str, dict]]],
+                       context: Optional[dict] = None) -> BatchDecision:
+        """
+        Todas las acciones propuestas en un turno (o una lista de tool calls) de una vez.
+        Cada elemento es el nombre o (nombre, contexto propio); el contexto propio se
+        combina con el del turno.
+        """
+        context = context or {}
+        decisions = []
+        for item in actions:
+            if isinstance(item, str):
+                decisions.append(self.decide(item, context))
+            else:
+                name, own = item
+                decisions.append(self.decide(name, {**context, **own} if own else context))
+        return BatchDecision(decisions)
+
+    def trigger_human_transfer(self, reason: str, audit: bool = True):
+        # Envía el payload a Chatwoot y desvía la llamada (la auditoría se escribe en segundo plano)
+        if audit:
+            self.audit.record("human_transfer", "transfer", ActionLevel.L4_SAFETY_CRITICAL.value, "manual", reason)
+        logger.warning("[KILL SWITCH / TRANSFER] Triggered. Reason: %s", reason)
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits, lookups, entries = self.cache_hits, self.cache_hits + self.cache_misses, len(self._cache)
+        return {
+            "actions": len(self.rules),
+            "cache_entries": entries,
+            "cache_hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "audit": self.audit.stats(),
+        }
@@ -0,0 +1,403 @@
+"""
+Intent Classifier - Sofia Lin V9.1
+Detección de intenciones críticas (fuga de gas, inundación, aguas negras) y de spam en los
+9 idiomas de brain.py, antes de cualquier llamada al LLM. Todas las frases se compilan en un
+solo autómata Aho-Corasick: el transcript se recorre una vez, carácter por carácter, sin
+importar cuántas frases haya (decenas de microsegundos por transcript).
+
+Las frases se comparan sobre texto normalizado (minúsculas, sin acentos latinos, variantes
+de alif/ta marbuta unificadas). En idiomas con espacios la coincidencia exige límite de
+palabra; un `*` final marca una raíz ("se inund*" -> se inundó, se inunda). En chino y japonés
+no hay límites de palabra y la frase se busca tal cual.
+
+"La tubería se reventó el año pasado" o "el inodoro se desbordó ayer pero ya está bien" no
+son incidentes en curso: una marca de pasado/resuelto (RESOLVED_MARKERS, en el mismo
+autómata) en la misma oración descarta las coincidencias de inundación y aguas negras. La
+fuga de gas no se descarta así: ante la duda, va a humano.
+"""
+import bisect
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from policy_engine.human_override import ActionLevel
+
+# intent -> (acción del PolicyEngine, nivel, etiqueta para el motivo de transferencia)
+INTENTS: Dict[str, Tuple[str, ActionLevel, str]] = {
+    "gas_leak": ("gas_leak_emergency", ActionLevel.L4_SAFETY_CRITICAL, "Gas Leak"),
+    "flooding": ("flooding_emergency", ActionLevel.L4_SAFETY_CRITICAL, "Active Flooding"),
+    "biohazard": ("sewage_biohazard", ActionLevel.L4_SAFETY_CRITICAL, "Sewage / Biohazard"),
+    "spam": ("spam_rejection", ActionLevel.L1_LOW_RISK, "Spam / Telemarketing"),
+}
+
+# intent -> idioma -> frases (se escriben como las diría el cliente; la normalización quita acentos)
+PHRASES: Dict[str, Dict[str, List[str]]] = {
+    "gas_leak": {
+        "en": ["smell gas", "smell of gas", "smells like gas", "smelling gas", "gas smell*", "gas leak*",
+               "leaking gas", "gas is leaking", "smell rotten eggs", "rotten egg smell"],
+        "es": ["huele a gas", "olor a gas", "fuga de gas", "escape de gas", "se sale el gas",
+               "se esta saliendo el gas", "huele a huevo podrido"],
+        "fr": ["odeur de gaz", "sent le gaz", "fuite de gaz", "ça sent le gaz"],
+        "de": ["riecht nach gas", "gasgeruch*", "gasleck*", "gas tritt aus", "gas strömt aus"],
+        "it": ["odore di gas", "puzza di gas", "fuga di gas", "perdita di gas", "sento odore di gas"],
+        "zh": ["煤气味", "燃气味", "天然气味", "煤气泄漏", "燃气泄漏", "天然气泄漏", "闻到煤气", "闻到燃气", "漏煤气", "漏燃气"],
+        "ja": ["ガス臭", "ガスの臭い", "ガスのにおい", "ガスの匂い", "ガス漏れ", "ガスが漏れ"],
+        "hi": ["गैस की गंध", "गैस की बदबू", "गैस लीक", "गैस रिसाव", "गैस का रिसाव"],
+        "ar": ["رائحة غاز", "رائحة الغاز", "ريحة غاز", "ريحة الغاز", "تسرب غاز", "تسرب الغاز", "تسريب غاز", "تسريب الغاز"],
+    },
+    "flooding": {
+        "en": ["is flooding", "are flooding", "it's flooding", "flooding the", "flooding everywhere", "is flooded",
+               "are flooded", "got flooded", "burst pipe", "pipe burst*", "pipe has burst", "busted pipe",
+               "water everywhere", "water pouring", "water is pouring", "water gushing", "gushing water", "water spraying"],
+        "es": ["se inund*", "se esta inundando", "esta inundad*", "estan inundad*", "tengo una inundacion",
+               "hay una inundacion", "tubo roto", "tuberia rota", "tubo reventado", "tuberia reventada", "se revento",
+               "agua por todos lados", "agua por todas partes", "sale mucha agua", "chorro de agua"],
+        "fr": ["est inondé*", "sont inondé*", "s'inonde", "j'ai une inondation", "il y a une inondation",
+               "tuyau a éclaté", "tuyau éclaté", "dégât des eaux", "dégâts des eaux", "eau partout"],
+        "de": ["ist überschwemmt", "ist überflutet", "sind überflutet", "wird überflutet", "steht unter wasser",
+               "wasserrohrbruch", "rohrbruch", "rohr geplatzt", "rohr ist geplatzt", "wasser überall", "überall wasser"],
+        "it": ["si allag*", "si sta allagando", "è allagat*", "sono allagat*", "è inondat*", "ho un allagamento",
+               "c'è un allagamento", "tubo scoppiato", "tubo rotto", "acqua dappertutto", "acqua ovunque"],
+        "zh": ["淹水", "水淹", "水管爆", "水管破裂", "爆管", "到处都是水", "漏水很严重"],
+        "ja": ["水浸し", "浸水して", "浸水した", "水道管が破裂", "水道管破裂", "水があふれ", "水が溢れ", "水が噴き出"],
+        "hi": ["बाढ़ आ गई", "बाढ़ जैसा", "पाइप फट", "पानी भर गया", "हर जगह पानी", "पानी ही पानी"],
+        "ar": ["فيضان في البيت", "فيضان في المنزل", "غرق البيت", "غرقت", "انفجار ماسورة", "انفجار الماسورة",
+               "انفجر الأنبوب", "ماسورة مكسورة", "الماء في كل مكان", "المياه في كل مكان", "مية في كل مكان"],
+    },
+    # Solo incidentes en curso (retorno, desborde, aguas negras en el piso): "inspección de la línea
+    # de drenaje" o "limpieza de fosa séptica" son pedidos de rutina y no deben ir a L4
+    "biohazard": {
+        "en": ["sewage back*", "sewage is back*", "sewage coming up", "sewage on the floor", "sewage overflow*",
+               "sewage everywhere", "sewage leak*", "raw sewage", "sewer back*", "sewer is back*", "sewer line back*",
+               "backed up sewer", "toilet overflow*", "overflowing toilet", "septic tank overflow*", "septic backup",
+               "raw waste"],
+        "es": ["se regresan las aguas negras", "se regresaron las aguas negras", "se salen las aguas negras",
+               "salen aguas negras", "brotan aguas negras", "aguas negras en el piso", "aguas negras por todos lados",
+               "se regresa el drenaje", "drenaje se regresa", "desborde de drenaje", "drenaje desbordado",
+               "se desbordo el drenaje", "sale agua sucia del drenaje", "inodoro desbord*", "escusado desbord*",
+               "fosa septica desbord*"],
+        "fr": ["refoulement d'égout", "égout refoulé", "égout qui refoule", "égouts refoulent", "eaux usées qui remontent",
+               "eaux usées sur le sol", "eaux d'égout sur le sol", "toilettes débord*", "fosse septique déborde"],
+        "de": ["abwasser läuft über", "abwasser tritt aus", "abwasser kommt hoch", "abwasser im keller",
+               "abwasser auf dem boden", "kanalrückstau", "rückstau", "toilette läuft über", "toilette ist übergelaufen",
+               "klärgrube läuft über"],
+        "it": ["acque nere che risalgono", "acque nere sul pavimento", "liquami sul pavimento", "liquami in casa",
+               "fogna trabocca", "fogna che trabocca", "rigurgito", "wc trabocca", "fossa settica trabocca"],
+        "zh": ["污水倒灌", "污水溢出", "污水冒出", "地上都是污水", "粪水溢出", "粪水冒出", "下水道反水", "下水道倒灌",
+               "马桶溢出", "马桶满出来", "化粪池满了", "化粪池溢出"],
+        "ja": ["汚水が逆流", "汚水があふれ", "汚水が溢れ", "下水が逆流", "下水の逆流", "トイレがあふれ", "トイレが溢れ",
+               "浄化槽があふれ", "浄化槽が溢れ"],
+        "hi": ["सीवर बैक", "सीवर ओवरफ्लो", "सीवर का पानी वापस", "सीवर का पानी घर में", "गंदा पानी वापस",
+               "गंदा पानी फर्श पर", "नाली का पानी वापस", "सेप्टिक टैंक ओवरफ्लो", "टॉयलेट ओवरफ्लो"],
+        "ar": ["طفح المجاري", "طفحت المجاري", "رجوع المجاري", "ارتداد المجاري", "مياه الصرف في البيت",
+               "مياه المجاري في البيت", "مياه الصرف على الأرض", "طفح البيارة"],
+    },
+    # Solo frases de quien vende ("su ficha", "le ofrecemos"): el spam se cuelga sin pasar por el
+    # FSM, así que "los encontré en su ficha de Google" o "soy Seo-yeon" no pueden coincidir
+    "spam": {
+        "en": ["we offer seo", "seo services for your", "search engine optimization services", "improve your ranking*",
+               "improve your google ranking*", "rank higher on google", "first page of google",
+               "your google business listing is", "verify your google listing", "verify your business listing",
+               "update your business listing", "courtesy call about your warranty", "your extended warranty is",
+               "lower your credit card processing", "pre-approved for a business loan", "approved for business funding",
+               "more leads for your business", "we generate leads", "this is not a sales call"],
+        "es": ["le ofrecemos seo", "servicios de seo para su", "mejorar su posicionamiento", "posicionar su negocio",
+               "verificar su ficha de google", "actualizar su ficha de google", "su perfil de google esta",
+               "somos una agencia de marketing", "prestamo para su negocio", "financiamiento para su negocio",
+               "mas clientes para su negocio", "le llamamos para ofrecerle"],
+        "fr": ["améliorer votre référencement", "nous sommes une agence", "votre fiche google est",
+               "vérifier votre fiche google", "prêt professionnel pré-approuvé", "offre exclusive"],
+        "de": ["ihre suchmaschinenoptimierung", "ihr google eintrag ist", "wir sind eine marketingagentur",
+               "geschäftskredit für ihr", "exklusives angebot"],
+        "it": ["migliorare il suo posizionamento", "ottimizzazione seo per", "siamo un'agenzia di marketing",
+               "la sua scheda google", "offerta esclusiva", "prestito aziendale pre-approvato"],
+        "zh": ["搜索引擎优化服务", "网络推广服务", "营销服务", "推广服务", "贷款服务"],
+        "ja": ["seo対策のご案内", "営業のお電話", "集客のご案内", "広告のご案内", "融資のご案内"],
+        "hi": ["एसईओ सेवा", "मार्केटिंग सेवा", "लोन ऑफर"],
+        "ar": ["خدمات تحسين محركات البحث", "خدمات التسويق", "عرض حصري", "قرض تجاري", "تمويل لمشروعك"],
+    },
+}
+
+# Intenciones que una marca de pasado/resuelto en la misma oración descarta
+RESOLVABLE = ("flooding", "biohazard")
+_RESOLVED = "_resolved"
+
+# idioma -> marcas de incidente pasado o ya resuelto
+RESOLVED_MARKERS: Dict[str, List[str]] = {
+    "en": ["last year", "last month", "last week", "last winter", "years ago", "months ago", "weeks ago",
+           "a while ago", "a while back", "already fixed", "was fixed", "got fixed", "been fixed", "was repaired"],
+    "es": ["el año pasado", "el mes pasado", "la semana pasada", "el invierno pasado", "hace años", "hace meses",
+           "hace semanas", "hace tiempo", "ya esta bien", "ya quedo", "ya se arreglo", "ya lo arreglaron",
+           "ya lo repararon", "ya esta arreglad*", "ya esta reparad*"],
+    "fr": ["l'année dernière", "le mois dernier", "la semaine dernière", "il y a des années", "il y a quelques mois",
+           "déjà réparé*", "a été réparé*"],
+    "de": ["letztes jahr", "letzten monat", "letzte woche", "vor jahren", "vor einigen monaten",
+           "schon repariert", "wurde repariert", "ist wieder in ordnung"],
+    "it": ["l'anno scorso", "il mese scorso", "la settimana scorsa", "anni fa", "mesi fa", "già riparat*", "è stato riparat*"],
+    "zh": ["去年", "上个月", "上周", "几年前", "已经修好", "修好了"],
+    "ja": ["去年", "昨年", "先月", "先週", "数年前", "修理済み", "直りました", "もう直った"],
+    "hi": ["पिछले साल", "पिछले महीने", "पिछले हफ्ते", "साल पहले", "ठीक हो गया", "ठीक करवा लिया"],
+    "ar": ["السنة الماضية", "العام الماضي", "الشهر الماضي", "الأسبوع الماضي", "من سنوات", "تم إصلاح", "تم تصليح"],
+}
+
+# Fin de oración para el alcance de las marcas ("pero ya está bien" sigue en la misma oración)
+_SENTENCE_END = re.compile(r"[.!?;\n。！？；]")
+
+
+# ============ NORMALIZACIÓN ============
+def _build_fold_table() -> Dict[int, str]:
+    table = {}
+    # Latín con diacríticos -> letra base (á->a, ü->u, ç->c); ß ya lo convierte casefold()
+    for cp in range(0xC0, 0x250):
+        base = unicodedata.normalize("NFKD", chr(cp))[0]
+        if base.isascii() and base.isalpha():
+            table[cp] = base.lower()
+    # Árabe: variantes de alif, ta marbuta y alif maqsura
+    for ch in "أإآٱ":
+        table[ord(ch)] = "ا"
+    table[ord("ة")] = "ه"
+    table[ord("ى")] = "ي"
+    # Apóstrofos tipográficos de los transcripts
+    table[0x2019] = "'"
+    table[0x2018] = "'"
+    return table
+
+
+_FOLD = _build_fold_table()
+# Tashkeel y tatweel: se eliminan (no cambian la palabra)
+_ARABIC_MARKS = re.compile("[\u064B-\u0652\u0640]")
+
+
+def _prepare(text: str) -> str:
+    """NFC + casefold + sin tashkeel. El plegado 1:1 de acentos lo hace el autómata al transitar."""
+    if not unicodedata.is_normalized("NFC", text):
+        text = unicodedata.normalize("NFC", text)
+    text = text.casefold()
+    return text if text.isascii() else _ARABIC_MARKS.sub("", text)
+
+
+def normalize(text: str) -> str:
+    """Forma comparable completa: minúsculas, sin acentos latinos ni tashkeel, alif unificado."""
+    return _prepare(text).translate(_FOLD)
+
+
+def _is_cjk(ch: str) -> bool:
+    # Kana, ideogramas CJK y formas de ancho completo: sin espacios entre palabras
+    return 0x2E80 <= ord(ch) <= 0x9FFF or 0xF900 <= ord(ch) <= 0xFAFF or 0xFF00 <= ord(ch) <= 0xFFEF
+
+
+# Tope de transiciones memorizadas por estado (acota la memoria ante texto con muchos símbolos)
+_MAX_CACHED_TRANSITIONS = 512
+
+
+def _is_word_char(ch: str) -> bool:
+    # Un kanji/kana pegado a "seo" no cuenta como parte de la palabra
+    return ch.isalnum() and not _is_cjk(ch)
+
+
+class IntentMatch:
+    def __init__(self, intent: str, lang: str, phrase: str, start: int, end: int):
+        self.intent = intent
+        self.lang = lang
+        self.phrase = phrase
+        self.start = start
+        self.end = end
+
+    def to_dict(self) -> dict:
+        return {"intent": self.intent, "lang": self.lang, "phrase": self.phrase, "start": self.start, "end": self.end}
+
+
+class IntentResult:
+    """Intenciones encontradas; `intent` es la de mayor nivel (la que decide la ruta)."""
+
+    def __init__(self, matches: List[IntentMatch]):
+        self.matches = matches
+        self.intents: List[str] = []
+        for match in matches:
+            if match.intent not in self.intents:
+                self.intents.append(match.intent)
+        self.intent: Optional[str] = max(self.intents, key=lambda i: INTENTS[i][1].value) if self.intents else None
+
+    @property
+    def level(self) -> ActionLevel:
+        return INTENTS[self.intent][1] if self.intent else ActionLevel.L0_INFORMATIONAL
+
+    @property
+    def action(self) -> Optional[str]:
+        return INTENTS[self.intent][0] if self.intent else None
+
+    @property
+    def label(self) -> str:
+        return INTENTS[self.intent][2] if self.intent else ""
+
+    @property
+    def is_emergency(self) -> bool:
+        return self.level == ActionLevel.L4_SAFETY_CRITICAL
+
+    @property
+    def is_spam(self) -> bool:
+        return self.intents == ["spam"]
+
+    def phrase(self) -> str:
+        """Frase que disparó la intención principal (para el motivo de la transferencia)."""
+        for match in self.matches:
+            if match.intent == self.intent:
+                return match.phrase
+        return ""
+
+    def to_dict(self) -> dict:
+        return {"intent": self.intent, "level": self.level.name, "intents": self.intents,
+                "matches": [m.to_dict() for m in self.matches]}
+
+
+# ============ AUTÓMATA ============
+class IntentClassifier:
+    def __init__(self, phrases: Optional[Dict[str, Dict[str, List[str]]]] = None,
+                 resolved_markers: Optional[Dict[str, List[str]]] = None):
+        self.phrases = phrases if phrases is not None else PHRASES
+        self.resolved_markers = resolved_markers if resolved_markers is not None else RESOLVED_MARKERS
+        # Por patrón: (intent, idioma, frase original, longitud normalizada, límite inicial, límite final)
+        self._patterns: List[Tuple[str, str, str, int, bool, bool]] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[int, ...]] = [()]
+        self._compile()
+        self.classified = 0
+        self.chars_scanned = 0
+        self.scan_ns = 0
+        self.hits: Dict[str, int] = {intent: 0 for intent in INTENTS}
+        self.resolved = 0
+        self._stats_lock = threading.Lock()
+
+    def _compile(self):
+        start = time.perf_counter()
+        outputs: List[List[int]] = [[]]
+        for intent, by_lang in [*self.phrases.items(), (_RESOLVED, self.resolved_markers)]:
+            if intent not in INTENTS and intent != _RESOLVED:
+                raise ValueError(f"Intención desconocida en frases: {intent}")
+            for lang, phrases in by_lang.items():
+                for phrase in phrases:
+                    stem = phrase.endswith("*")
+                    key = normalize(phrase.rstrip("*")).strip()
+                    if not key:
+                        continue
+                    bounded = not _is_cjk(key[0])
+                    self._patterns.append((intent, lang, phrase.rstrip("*"), len(key), bounded, bounded and not stem))
+                    state = 0
+                    for ch in key:
+                        nxt = self._goto[state].get(ch)
+                        if nxt is None:
+                            nxt = len(self._goto)
+                            self._goto[state][ch] = nxt
+                            self._goto.append({})
+                            outputs.append([])
+                        state = nxt
+                    outputs[state].append(len(self._patterns) - 1)
+
+        # Enlaces de falla por BFS; cada estado hereda las salidas de su sufijo más largo
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(ch, 0)
+                outputs[nxt].extend(outputs[self._fail[nxt]])
+        self._out = [tuple(o) for o in outputs]
+        # Transiciones ya resueltas (goto + fallas): se completan al vuelo, así cada carácter
+        # cuesta un solo dict.get en vez de recorrer la cadena de fallas
+        self._delta: List[Dict[str, int]] = [dict(g) for g in self._goto]
+        self.compile_ms = (time.perf_counter() - start) * 1000
+
+    def _resolve(self, state: int, raw: str) -> int:
+        origin = state
+        ch = _FOLD.get(ord(raw), raw)
+        while state and ch not in self._goto[state]:
+            state = self._fail[state]
+        nxt = self._goto[state].get(ch, 0)
+        transitions = self._delta[origin]
+        if len(transitions) < _MAX_CACHED_TRANSITIONS:
+            transitions[raw] = nxt
+        return nxt
+
+    def scan(self, text: str) -> List[IntentMatch]:
+        """Coincidencias válidas (incluidas las marcas de resuelto) sobre el texto preparado, en orden."""
+        delta, out, patterns = self._delta, self._out, self._patterns
+        matches = []
+        state = 0
+        for idx, ch in enumerate(text):
+            nxt = delta[state].get(ch)
+            state = self._resolve(state, ch) if nxt is None else nxt
+            if not out[state]:
+                continue
+            for pattern_idx in out[state]:
+                intent, lang, phrase, length, bound_start, bound_end = patterns[pattern_idx]
+                begin = idx - length + 1
+                if bound_start and begin > 0 and _is_word_char(text[begin - 1]):
+                    continue
+                if bound_end and idx + 1 < len(text) and _is_word_char(text[idx + 1]):
+                    continue
+                matches.append(IntentMatch(intent, lang, phrase, begin, idx + 1))
+        return matches
+
+    def classify(self, transcript: str) -> IntentResult:
+        start = time.perf_counter_ns()
+        text = _prepare(transcript or "")
+        matches = self.scan(text)
+        resolved = 0
+        if any(m.intent == _RESOLVED for m in matches):
+            kept = self._drop_resolved(text, matches)
+            resolved = sum(1 for m in matches if m.intent in RESOLVABLE) - sum(1 for m in kept if m.intent in RESOLVABLE)
+            matches = kept
+        result = IntentResult(matches)
+        elapsed = time.perf_counter_ns() - start
+        with self._stats_lock:
+            self.classified += 1
+            self.resolved += resolved
+            self.chars_scanned += len(text)
+            self.scan_ns += elapsed
+            for intent in result.intents:
+                self.hits[intent] += 1
+        return result
+
+    @staticmethod
+    def _drop_resolved(text: str, matches: List[IntentMatch]) -> List[IntentMatch]:
+        """Quita las marcas y las coincidencias RESOLVABLE que comparten oración con una marca."""
+        ends = [m.start() for m in _SENTENCE_END.finditer(text)]
+        resolved_sentences = {bisect.bisect_left(ends, m.start) for m in matches if m.intent == _RESOLVED}
+        return [m for m in matches if m.intent != _RESOLVED
+                and not (m.intent in RESOLVABLE and bisect.bisect_left(ends, m.start) in resolved_sentences)]
+
+    def classify_many(self, transcripts: Iterable[str]) -> List[IntentResult]:
+        return [self.classify(t) for t in transcripts]
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "patterns": len(self._patterns),
+                "states": len(self._goto),
+                "compile_ms": round(self.compile_ms, 2),
+                "classified": self.classified,
+                "hits": dict(self.hits),
+                "resolved": self.resolved,
+                "avg_us": round(self.scan_ns / 1e3 / self.classified, 2) if self.classified else 0.0,
+                "chars_per_s": round(self.chars_scanned / (self.scan_ns / 1e9)) if self.scan_ns else None,
+            }
+
+
+_classifier: Optional[IntentClassifier] = None
+_classifier_lock = threading.Lock()
+
+
+def get_classifier() -> IntentClassifier:
+    global _classifier
+    with _classifier_lock:
+        if _classifier is None:
+            _classifier = IntentClassifier()
+        return _classifier
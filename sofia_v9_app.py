@@ -5,12 +5,13 @@ Integrates Policy Engine, Data Layer, LangGraph FSM, and real LLM (OpenAI/Gemini
 import os
 import json
 import logging
-import requests
-from typing import Dict, Any
+from typing import Dict, Any, Callable, Optional
 
 from policy_engine.human_override import PolicyEngine, ActionLevel
-from orchestrator.langgraph_fsm import triage_node, routing_decision
+from policy_engine import intent_classifier
+from orchestrator.langgraph_fsm import ConversationFSM
 from core.config import SystemConfig, DegradedMode
+from core import degraded_mode, llm_gateway, metrics
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -18,10 +19,43 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# LLM degradado (LEVEL_1/2 sin turno de prueba): en lugar de generar, se responde esto y se sigue con la pregunta pendiente
+DEGRADED_LLM_REPLIES = {
+    "es": "Con gusto, un despachador le responderá esa pregunta al confirmar su visita.",
+    "en": "Sure, a dispatcher will answer that when they confirm your visit.",
+}
+
+# Canales de texto: un LEVEL_4 (Realtime caído) no los manda a humano, solo a la voz
+TEXT_CHANNELS = {"telegram", "whatsapp", "email"}
+
+def dispatch_booking(fields: dict, state: dict) -> str:
+    """
+    booking_handler de los canales del motor (Telegram, WhatsApp, email): misma ruta que la
+    voz y el chat de main (Supabase/almacén local + pipeline de despacho con Telegram y emails),
+    para que el despacho se entere de la cita.
+    """
+    from main import save_appointment  # main importa chatwoot_webhook -> este módulo: import diferido
+    return save_appointment(
+        name=fields.get("name") or "Cliente",
+        phone=fields.get("phone") or state.get("customer_phone") or "No provisto",
+        email=fields.get("email") or "No provisto",
+        address=fields.get("address") or "No provisto",
+        status="No provisto",
+        diagnosis=fields.get("issue") or "Inspección General",
+        materials="Kit básico",
+        is_emergency=False,
+        scheduled_time=fields.get("time_window") or "ASAP",
+        source=state.get("channel") or "sofia_v9",
+        lang=state.get("lang", "es"),
+    )
+
 class SofiaLinV9Engine:
-    def __init__(self):
+    def __init__(self, booking_handler: Optional[Callable[[dict, dict], str]] = None):
         self.config = SystemConfig()
         self.policy_engine = PolicyEngine()
+        self.intent_classifier = intent_classifier.get_classifier()
+        # Estado de la conversación por caller_id; booking_handler(campos, estado) -> código MP
+        self.fsm = ConversationFSM(booking_handler=booking_handler)
         self.openai_key = os.getenv("OPENAI_API_KEY")
         logger.info(f"Sofia Lin V9.1 Engine Initialized. Mode: {self.config.CURRENT_MODE}")
 
@@ -31,44 +65,66 @@ class SofiaLinV9Engine:
         """
         caller_id = call_data.get("caller_id", "Unknown")
         transcript = call_data.get("transcript", "")
+        call_id = call_data.get("call_id", "000")
+        channel = call_data.get("channel", "")
+        llm_channel = "text" if channel in TEXT_CHANNELS else "voice"
         
         logger.info(f"Incoming stream from {caller_id}: {transcript}")
 
-        # 1. DEGRADED MODE CHECK
-        if self.config.CURRENT_MODE == DegradedMode.LEVEL_4_EMERGENCY:
+        # 1. DEGRADED MODE CHECK (el controlador lo ajusta según la latencia/errores medidos)
+        mode = degraded_mode.current_mode()
+        if mode == DegradedMode.LEVEL_4_EMERGENCY and (llm_channel == "voice" or degraded_mode.get_controller().forced):
             return self._trigger_human_transfer("System in L4 Emergency Mode")
             
-        if self.config.CURRENT_MODE == DegradedMode.LEVEL_3_AI_DISABLED:
+        if mode == DegradedMode.LEVEL_3_AI_DISABLED:
             return self._trigger_human_transfer("AI Disabled - Routing to Dispatch")
 
-        # 2. POLICY ENGINE - PRE-PROCESSING SAFETY CHECK
-        if "gas" in transcript.lower() and "smell" in transcript.lower():
-            if not self.policy_engine.evaluate_action("gas_leak_emergency", {}):
-                return self._trigger_human_transfer("L4 Safety Critical - Gas Leak Detected")
-
-        # 3. STATE MACHINE / ORCHESTRATION (LangGraph)
-        state = {
-            "call_id": call_data.get("call_id", "000"),
-            "customer_phone": caller_id,
-            "current_fsm_state": "triage",
-            "collected_fields": {},
-            "confidence_score": 0.95,
-            "requires_human": False
-        }
-        
-        state = triage_node(state)
-        next_action = routing_decision(state)
-        
-        if next_action == "transfer_to_human":
-            return self._trigger_human_transfer("LangGraph required human transfer")
-
-        # 4. LLM GENERATION (Real Intelligence)
-        response_text = self._generate_llm_response(transcript)
+        # 2. POLICY ENGINE - PRE-PROCESSING SAFETY CHECK (autómata multilingüe, antes de cualquier LLM)
+        intents = self.intent_classifier.classify(transcript)
+        for intent in intents.intents:
+            metrics.incr(f"intent.{intent}")
+        if intents.intents:
+            # Todas las intenciones del mensaje se evalúan juntas contra la tabla de políticas
+            decisions = self.policy_engine.evaluate_batch(
+                [intent_classifier.INTENTS[intent][0] for intent in intents.intents], {"channel": channel}
+            )
+            if decisions.transfer is not None:
+                reason = f"L4 Safety Critical - {intents.label} Detected ('{intents.phrase()}')"
+                self.fsm.transfer(caller_id, reason, call_id=call_id, channel=channel)
+                return self._trigger_human_transfer(reason)
+            if intents.is_spam:
+                logger.info(f"Spam/telemarketing de {caller_id} ('{intents.phrase()}'), cerrando sin LLM")
+                return {
+                    "status": "rejected",
+                    "audio_response_text": "No estamos interesados, muchas gracias.",
+                    "action": "end_call"
+                }
+
+        # 3. STATE MACHINE / ORCHESTRATION (estado persistido por caller_id entre mensajes)
+        turn = self.fsm.step(caller_id, transcript, call_id=call_id, channel=channel, lang=call_data.get("lang"))
+
+        if turn.action == "transfer_to_human":
+            return self._trigger_human_transfer(turn.reason)
+
+        # 4. LLM GENERATION - solo si el cliente pregunta algo fuera del flujo; luego se repite la pregunta pendiente
+        if turn.needs_llm and not degraded_mode.use_llm(llm_channel):
+            metrics.incr("degraded_mode.predefined_replies")
+            response_text = DEGRADED_LLM_REPLIES.get(turn.state["lang"], DEGRADED_LLM_REPLIES["es"])
+            if turn.prompt:
+                response_text = f"{response_text} {turn.prompt}"
+        elif turn.needs_llm:
+            response_text = self._generate_llm_response(transcript)
+            if turn.prompt:
+                response_text = f"{response_text} {turn.prompt}"
+        else:
+            response_text = turn.text()
         
         return {
             "status": "success",
             "audio_response_text": response_text,
-            "action": "continue_call"
+            "action": "booked" if turn.action == "booked" else "continue_call",
+            "fsm_state": turn.state["current_fsm_state"],
+            "booking_code": turn.state["booking_code"],
         }
 
     def _generate_llm_response(self, text: str) -> str:
@@ -125,24 +181,17 @@ INFORMACION CORPORATIVA Y REGLAS MAESTRAS INMUTABLES
    - Recopilar: Nombre del cliente, Direccion exacta del servicio, Telefono de contacto y Descripcion detallada del problema.
    - Al tener los datos, ejecutar la herramienta agendar_cita para registrar la cita en el sistema oficial de Morales Plumbing.
 """
-        headers = {
-            "Authorization": f"Bearer {self.openai_key}",
-            "Content-Type": "application/json"
-        }
-        payload = {
-            "model": "gpt-4o-mini",
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": text}
-            ],
-            "max_tokens": 150,
-            "temperature": 0.3
-        }
-        
         try:
-            resp = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload, timeout=10)
-            resp.raise_for_status()
-            return resp.json()["choices"][0]["message"]["content"]
+            result = llm_gateway.complete_sync(
+                "engine_reply",
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": text}
+                ],
+                max_tokens=150,
+                temperature=0.3
+            )
+            return result.text
         except Exception as e:
             logger.error(f"LLM Error: {e}")
             return "Disculpe, nuestro sistema de inteligencia artificial está experimentando un ligero retraso. Un despachador se comunicará con usted."
@@ -0,0 +1,23 @@
+"""Configuración común: la raíz del repo en sys.path y almacenes en un directorio temporal."""
+import os
+import sys
+import tempfile
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+_TMP = tempfile.mkdtemp(prefix="orion_tests_")
+os.environ.setdefault("APPOINTMENTS_DB_PATH", os.path.join(_TMP, "appointments.db"))
+os.environ.setdefault("POLICY_AUDIT_PATH", os.path.join(_TMP, "policy_audit.jsonl"))
+os.environ.setdefault("SESSION_BACKEND", "memory")
+
+
+def fake_completion(content: str, prompt_tokens: int = 10, completion_tokens: int = 5, tool_calls=None):
+    """Objeto con la forma de una respuesta de chat.completions del SDK de OpenAI."""
+    message = types.SimpleNamespace(content=content, tool_calls=tool_calls)
+    return types.SimpleNamespace(
+        choices=[types.SimpleNamespace(message=message)],
+        usage=types.SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens),
+    )
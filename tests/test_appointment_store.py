@@ -0,0 +1,61 @@
+import random
+import sqlite3
+
+import pytest
+
+from core.appointment_store import AppointmentStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AppointmentStore(path=str(tmp_path / "appointments.db"))
+
+
+def test_generated_codes_are_unique_and_widen_when_saturated(tmp_path):
+    store = AppointmentStore(path=str(tmp_path / "a.db"), digits=1)
+    random.seed(3)
+    codes = [store.create({"name": f"c{i}"})["code"] for i in range(30)]
+    assert len(set(codes)) == 30
+    assert store.digits >= 2  # solo hay 9 códigos de un dígito
+
+
+def test_provided_code_is_reserved_in_the_same_transaction(store, monkeypatch):
+    store.create({"name": "Ana", "code": "MP-1234"})
+    draws = iter([1234, 1234, 5678])
+    monkeypatch.setattr(random, "randint", lambda a, b: next(draws))
+    assert store.reserve_code() == "MP-5678"
+    assert store.stats()["codes_issued"] == 2
+
+
+def test_duplicate_code_is_rejected_and_rolled_back(store):
+    store.create({"name": "Ana", "code": "MP-1234"})
+    with pytest.raises(sqlite3.IntegrityError):
+        store.create({"name": "Luis", "code": "MP-1234"})
+    assert store.get("MP-1234")["name"] == "Ana"
+    assert store.stats()["appointments"] == 1
+
+
+def test_reserved_code_can_be_stored_locally_later(store):
+    code = store.reserve_code()
+    assert store.create({"name": "Ana", "code": code})["code"] == code
+    assert store.stats()["codes_issued"] == 1
+
+
+def test_cursor_paging_walks_every_row_once(store):
+    for i in range(7):
+        store.create({"name": f"c{i}", "phone": "408" if i % 2 else "669", "is_emergency": i == 3})
+    seen, cursor = [], None
+    while True:
+        page, cursor = store.query(limit=3, cursor=cursor)
+        seen.extend(row["name"] for row in page)
+        if cursor is None:
+            break
+    assert seen == [f"c{i}" for i in range(6, -1, -1)]
+
+    page, cursor = store.query(phone="408", limit=2)
+    assert [row["name"] for row in page] == ["c5", "c3"] and cursor is not None
+    page, cursor = store.query(phone="408", limit=2, cursor=cursor)
+    assert [row["name"] for row in page] == ["c1"] and cursor is None
+
+    page, _ = store.query(is_emergency=True)
+    assert [row["name"] for row in page] == ["c3"] and page[0]["is_emergency"] is True
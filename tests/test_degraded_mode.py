@@ -0,0 +1,104 @@
+import random
+import types
+
+import pytest
+
+from core import degraded_mode
+from core.config import DegradedMode, SystemConfig
+from core.degraded_mode import ModeController
+
+
+class Clock:
+    """Reloj manual para degraded_mode (ventanas, hold y pruebas)."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(degraded_mode, "time", types.SimpleNamespace(monotonic=clock))
+    monkeypatch.setattr(SystemConfig, "CURRENT_MODE", DegradedMode.LEVEL_0_NORMAL)
+    return clock
+
+
+@pytest.fixture
+def controller(clock):
+    return ModeController()
+
+
+def traffic(controller, clock, purpose: str, low_ms: float, high_ms: float, seconds: int, ok: bool = True):
+    """Un turno por segundo con latencias uniformes en [low_ms, high_ms]; evalúa tras cada uno."""
+    rng = random.Random(7)
+    for _ in range(seconds):
+        controller.record_llm(purpose, rng.uniform(low_ms, high_ms), ok)
+        clock.now += 1
+        controller.evaluate()
+
+
+def test_healthy_text_latencies_do_not_trip(controller, clock):
+    traffic(controller, clock, "text_chat", 1200, 3500, seconds=120)
+    traffic(controller, clock, "slot_extraction", 1500, 4000, seconds=60)
+    assert controller.evaluate(force=True) is DegradedMode.LEVEL_0_NORMAL
+    assert all(controller.use_llm() for _ in range(10))
+
+
+def test_background_purposes_are_not_measured(controller, clock):
+    traffic(controller, clock, "dispatch_analysis", 15000, 25000, seconds=60)
+    assert controller.windows["llm_text"].summary()["samples"] == 0
+    assert controller.evaluate(force=True) is DegradedMode.LEVEL_0_NORMAL
+
+
+def test_slow_voice_trips_only_voice_and_recovers(controller, clock):
+    traffic(controller, clock, "voice_reply", 4000, 6000, seconds=10)
+    assert controller.evaluate(force=True) is DegradedMode.LEVEL_1_LLM_DEGRADED
+    assert "llm_voice" in controller.reasons
+    # La voz solo deja pasar pruebas; el texto, con su ventana sana, sigue con el LLM
+    assert controller.use_llm("voice") is True
+    assert controller.use_llm("voice") is False
+    assert controller.use_llm("text") is True
+
+    # El proveedor se recupera: las pruebas (una cada DEGRADED_PROBE_INTERVAL_S) miden 0.8-2 s
+    for _ in range(150):
+        clock.now += 1
+        if controller.use_llm("voice"):
+            controller.record_llm("voice_reply", random.uniform(800, 2000))
+    assert controller.evaluate(force=True) is DegradedMode.LEVEL_0_NORMAL
+    assert not controller.windows["llm_voice"].degraded
+
+
+def test_slow_text_trips_and_recovers_after_hold(controller, clock):
+    traffic(controller, clock, "text_turn", 7000, 9000, seconds=10)
+    assert controller.evaluate(force=True) is DegradedMode.LEVEL_1_LLM_DEGRADED
+    traffic(controller, clock, "text_turn", 1200, 3500, seconds=int(degraded_mode.DEGRADED_WINDOW_S))
+    # Ventana sana otra vez, pero el modo espera DEGRADED_HOLD_S antes de bajar
+    assert controller.evaluate(force=True) is DegradedMode.LEVEL_1_LLM_DEGRADED
+    traffic(controller, clock, "text_turn", 1200, 3500, seconds=int(degraded_mode.DEGRADED_HOLD_S) + 2)
+    assert controller.evaluate(force=True) is DegradedMode.LEVEL_0_NORMAL
+
+
+def test_idle_window_clears_degradation(controller, clock):
+    traffic(controller, clock, "text_chat", 7000, 9000, seconds=10)
+    assert controller.windows["llm_text"].slow
+    clock.now += degraded_mode.DEGRADED_WINDOW_S + 1
+    controller.evaluate(force=True)
+    assert not controller.windows["llm_text"].slow
+
+
+def test_realtime_emergency_keeps_text_chat(controller, clock):
+    for _ in range(10):
+        controller.record("realtime", 500, ok=False)
+    assert controller.evaluate(force=True) is DegradedMode.LEVEL_4_EMERGENCY
+    assert controller.use_llm("voice") is False
+    assert all(controller.use_llm("text") for _ in range(10))
+
+
+def test_forced_mode_blocks_every_channel(controller, clock):
+    controller.force(DegradedMode.LEVEL_3_AI_DISABLED)
+    assert controller.use_llm("text") is False and controller.use_llm("voice") is False
+    controller.force(None)
+    assert controller.use_llm("text") is True
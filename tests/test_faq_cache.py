@@ -0,0 +1,84 @@
+import asyncio
+import json
+
+import pytest
+
+from conftest import fake_completion
+from core.faq_cache import FAQCache
+
+main = pytest.importorskip("main")
+
+
+def test_lookup_marks_issue_reports():
+    cache = FAQCache()
+    burst = cache.lookup("a pipe burst in my kitchen", "en")
+    assert burst.faq_id == "flooding" and burst.reports_issue
+    hours = cache.lookup("What are your hours?", "en")
+    assert hours.faq_id == "hours" and not hours.reports_issue
+
+
+@pytest.mark.parametrize("text,lang", [
+    ("No huele a gas", "es"),
+    ("Ya no hay olor a gas", "es"),
+    ("No tengo una inundación", "es"),
+    ("There is no gas smell", "en"),
+    ("I do not smell gas", "en"),
+    ("I don't smell gas anymore", "en"),
+])
+def test_negated_reports_are_not_issue_hits(text, lang):
+    assert FAQCache().lookup(text, lang) is None
+
+
+def test_negation_does_not_block_other_faqs():
+    hit = FAQCache().lookup("Do you have a license?", "en")
+    assert hit.faq_id == "license" and not hit.reports_issue
+
+
+class FakeGateway:
+    def __init__(self):
+        self.calls = 0
+
+    async def complete(self, purpose, messages, **kwargs):
+        from core.llm_gateway import LLMResult
+        self.calls += 1
+        payload = {"reply": "Anotado, ¿algo más?", "appointment": {"diagnosis": messages[-1]["content"]}}
+        return LLMResult(purpose, fake_completion(json.dumps(payload)), 1, 1.0)
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    gateway = FakeGateway()
+    monkeypatch.setattr(main, "llm_gateway", gateway)
+    monkeypatch.setattr(main, "_text_turn_mode", lambda user_id: "single")
+    monkeypatch.setattr(main.degraded_mode, "use_llm", lambda: True)
+    return gateway
+
+
+def test_issue_faq_on_first_turn_keeps_the_description(gateway):
+    user = "tg_faq_first_turn"
+    reply = asyncio.run(main.sofia_text_chat("a pipe burst in my kitchen", user, "en"))
+    assert reply.startswith("⚠️")
+    assert gateway.calls == 0
+    slots = main.text_slots.get(user)
+    assert slots["diagnosis"] == "a pipe burst in my kitchen" and slots["is_emergency"] is True
+
+
+@pytest.mark.parametrize("text,lang", [
+    ("When can you come?", "en"),
+    ("Sale agua sucia del drenaje del baño", "es"),
+    ("a pipe burst in my kitchen", "en"),
+])
+def test_no_faq_hits_mid_booking(gateway, text, lang):
+    user = f"tg_faq_mid_{lang}_{len(text)}"
+    main.text_slots.set(user, {**main.TEXT_SLOT_SCHEMA.empty(), "name": "Ana Ruiz"})
+    reply = asyncio.run(main.sofia_text_chat(text, user, lang))
+    assert reply == "Anotado, ¿algo más?"
+    assert gateway.calls == 1
+    assert main.text_slots.get(user)["diagnosis"] == text
+
+
+def test_negated_report_goes_to_llm_without_emergency(gateway):
+    user = "tg_faq_negated"
+    reply = asyncio.run(main.sofia_text_chat("No huele a gas", user, "es"))
+    assert reply == "Anotado, ¿algo más?" and gateway.calls == 1
+    assert not main.text_slots.get(user).get("is_emergency")
@@ -0,0 +1,81 @@
+import pytest
+
+from policy_engine.human_override import ActionLevel
+from policy_engine.intent_classifier import IntentClassifier
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return IntentClassifier()
+
+
+@pytest.mark.parametrize("text,intent", [
+    ("I smell gas in the kitchen", "gas_leak"),
+    ("Huele a gas en la cocina", "gas_leak"),
+    ("My basement is flooding", "flooding"),
+    ("Se inundó el baño", "flooding"),
+    ("Il bagno si è allagato", "flooding"),
+    ("Sewage is backing up into the tub", "biohazard"),
+    ("There is sewage on the floor", "biohazard"),
+    ("Se regresan las aguas negras por la coladera", "biohazard"),
+    ("La fogna trabocca in cantina", "biohazard"),
+    ("सीवर का पानी घर में आ गया", "biohazard"),
+    ("We offer SEO for plumbers", "spam"),
+    ("Hi, we can improve your ranking on Google", "spam"),
+    ("This is a courtesy call about your warranty", "spam"),
+    ("Hi, a pipe burst in my kitchen", "flooding"),
+    ("The toilet overflowed last week. Now the basement is flooding!", "flooding"),
+])
+def test_active_incidents_are_detected(classifier, text, intent):
+    assert classifier.classify(text).intent == intent
+
+
+@pytest.mark.parametrize("text", [
+    "I need a sewage line inspection",
+    "Can you quote a sewer camera inspection?",
+    "We want a new flood light and a flood sensor",
+    "My insurance asked for a flood zone certificate",
+    "Necesito limpieza de la fosa séptica",
+    "Quiero revisar la línea de aguas negras",
+    "Devo far controllare la fogna del condominio",
+    "सीवर लाइन की जांच करवानी है",
+    "Ich brauche eine Rückstausicherung",
+])
+def test_routine_requests_are_not_l4(classifier, text):
+    result = classifier.classify(text)
+    assert result.level != ActionLevel.L4_SAFETY_CRITICAL, result.to_dict()
+
+
+@pytest.mark.parametrize("text", [
+    "I found you on your Google business listing, my kitchen sink is leaking",
+    "this is Seo-yeon Kim, my toilet is clogged",
+    "Los encontré en su perfil de Google, tengo una fuga en el lavabo",
+    "My extended warranty on the water heater expired, can you replace it?",
+])
+def test_customers_are_not_spam(classifier, text):
+    assert classifier.classify(text).intent is None
+
+
+@pytest.mark.parametrize("text", [
+    "the pipe burst last year, now I need a new faucet",
+    "inodoro desbordó ayer pero ya está bien",
+    "Se reventó un tubo el año pasado, ya lo arreglaron",
+    "我家去年水管爆了，已经修好",
+])
+def test_past_incidents_are_not_l4(classifier, text):
+    assert classifier.classify(text).intent is None
+
+
+def test_resolved_marker_never_hides_gas(classifier):
+    assert classifier.classify("The pipe burst last year and I smell gas").intent == "gas_leak"
+
+
+def test_highest_level_intent_wins(classifier):
+    result = classifier.classify("This is not a sales call, I smell gas")
+    assert result.intents == ["spam", "gas_leak"]
+    assert result.intent == "gas_leak" and result.is_emergency and not result.is_spam
+
+
+def test_cjk_phrases_match_without_spaces(classifier):
+    assert classifier.classify("我家马桶溢出了").intent == "biohazard"
+    assert classifier.classify("台所でガス漏れがあります").intent == "gas_leak"
@@ -0,0 +1,61 @@
+import threading
+
+from core.jobs import JobPipeline
+
+
+def flaky(failures: int):
+    calls = []
+
+    def stage(context):
+        calls.append(1)
+        if len(calls) <= failures:
+            raise ConnectionError("caído")
+        context["flaky"] = len(calls)
+    return stage, calls
+
+
+def test_stage_retries_until_success():
+    pipeline = JobPipeline("t", max_workers=1, max_retries=3, backoff_s=0)
+    stage, calls = flaky(2)
+    context = {}
+    pipeline.submit("a", [("flaky", stage)], context)
+    pipeline.shutdown()
+    job = pipeline.status("a")
+    assert job["status"] == "done"
+    stage = job["stages"]["flaky"]
+    assert (stage["status"], stage["attempts"], stage["error"]) == ("done", 3, None)
+    assert context["flaky"] == 3 and len(calls) == 3
+
+
+def test_failed_stage_does_not_stop_later_stages():
+    pipeline = JobPipeline("t", max_workers=1, max_retries=2, backoff_s=0)
+    stage, calls = flaky(5)
+    ran = []
+    pipeline.submit("a", [("flaky", stage), ("notify", lambda ctx: ran.append(1))])
+    pipeline.shutdown()
+    job = pipeline.status("a")
+    assert job["status"] == "partial"
+    assert job["stages"]["flaky"]["status"] == "failed" and len(calls) == 2
+    assert job["stages"]["notify"]["status"] == "done" and ran == [1]
+
+
+def test_submit_returns_before_stages_run():
+    pipeline = JobPipeline("t", max_workers=1, backoff_s=0)
+    gate = threading.Event()
+    pipeline.submit("a", [("slow", lambda ctx: gate.wait(5))])
+    assert pipeline.status("a")["status"] in ("queued", "running")
+    assert pipeline.stats()["pending"] == 1
+    gate.set()
+    pipeline.shutdown()
+    assert pipeline.status("a")["status"] == "done"
+
+
+def test_history_keeps_unfinished_jobs():
+    pipeline = JobPipeline("t", max_workers=1, backoff_s=0, history=2)
+    gate = threading.Event()
+    pipeline.submit("slow", [("wait", lambda ctx: gate.wait(5))])
+    for i in range(3):
+        pipeline.submit(f"j{i}", [("noop", lambda ctx: None)])
+    assert pipeline.status("slow") is not None
+    gate.set()
+    pipeline.shutdown()
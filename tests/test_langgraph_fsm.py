@@ -0,0 +1,114 @@
+import threading
+import time
+
+import pytest
+
+from core.session_store import SessionStore
+from orchestrator import langgraph_fsm
+from orchestrator.langgraph_fsm import ConversationFSM
+
+
+@pytest.mark.parametrize("text,answer", [
+    ("Sí", True),
+    ("Sí, no hay problema", True),
+    ("Yes, no problem", True),
+    ("Claro, sin problema", True),
+    ("No", False),
+    ("No, está mal", False),
+    ("Nope, wrong address", False),
+    ("Mmm, déjeme ver", None),
+])
+def test_yes_no(text, answer):
+    assert langgraph_fsm._yes_no(langgraph_fsm._words(text)) is answer
+
+
+def confirm(message: str, lang: str = "es") -> dict:
+    state = langgraph_fsm.new_state("tg_1", channel="telegram", lang=lang)
+    state["collected_fields"] = {"issue": "fuga en la cocina", "name": "Ana Ruiz", "address": "12 Main St, San Jose",
+                                 "phone": "+14085551234", "time_window": "8-10 AM"}
+    state["current_fsm_state"] = "confirm"
+    return langgraph_fsm.confirm_node(state, message)
+
+
+@pytest.mark.parametrize("message", ["Sí, no hay problema", "Yes, no problem", "Correcto, el problema es ese"])
+def test_confirm_accepts_yes_idioms_and_keeps_issue(message):
+    state = confirm(message)
+    assert state["confirmed"] is True
+    assert state["collected_fields"]["issue"] == "fuga en la cocina"
+
+
+def test_confirm_correction_clears_named_field_only():
+    state = confirm("Sí, pero el teléfono está mal")
+    assert state["confirmed"] is False
+    assert "phone" not in state["collected_fields"]
+    assert state["collected_fields"]["name"] == "Ana Ruiz"
+    assert state["reply"] == langgraph_fsm.CORRECTION_PROMPT["es"]
+
+
+def test_plain_no_keeps_issue_and_phone():
+    state = confirm("No")
+    assert set(state["collected_fields"]) == {"issue", "phone"}
+
+
+@pytest.mark.parametrize("message,issue", [
+    ("Hola, tengo una fuga en la cocina", "tengo una fuga en la cocina"),
+    ("Buenas tardes Sofía, se tapó el baño", "se tapó el baño"),
+    ("Hi there, my water heater is leaking", "my water heater is leaking"),
+])
+def test_triage_strips_greeting_from_issue(message, issue):
+    state = langgraph_fsm.triage_node(langgraph_fsm.new_state("tg_1", channel="telegram"), message)
+    assert state["collected_fields"]["issue"] == issue
+
+
+def test_full_conversation_books_once():
+    booked = []
+    fsm = ConversationFSM(store=SessionStore("fsm_test"),
+                          booking_handler=lambda fields, state: booked.append(fields) or "MP-4321")
+    caller = "+14085551234"
+    turns = ["Hola, tengo una fuga en la cocina", "Ana Ruiz", "12 Main St, San Jose", "mañana 8-10 AM",
+             "Sí, no hay problema"]
+    for message in turns:
+        turn = fsm.step(caller, message, channel="voice")
+    assert turn.action == "booked" and "MP-4321" in turn.text()
+    assert booked == [{"issue": "tengo una fuga en la cocina", "name": "Ana Ruiz", "address": "12 Main St, San Jose",
+                       "phone": "+14085551234", "time_window": "mañana 8-10 AM"}]
+
+
+class SlowStore(SessionStore):
+    """Store que tarda en leer: sin lock por caller, dos turnos simultáneos se pisarían."""
+
+    def get(self, key, default=None):
+        value = super().get(key, default)
+        time.sleep(0.02)
+        return value
+
+
+def test_concurrent_messages_from_one_caller_are_serialized():
+    fsm = ConversationFSM(store=SlowStore("fsm_race"))
+    threads = [threading.Thread(target=fsm.step, args=("tg_race", message), kwargs={"channel": "telegram"})
+               for message in ("Hola, tengo una fuga en la cocina", "Ana Ruiz")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    state = fsm.store.get("tg_race")
+    assert state["turns"] == 2 and state["collected_fields"]["issue"] == "tengo una fuga en la cocina"
+    assert len(fsm._callers) == 0
+
+
+def test_engine_channels_book_through_dispatch(monkeypatch):
+    main = pytest.importorskip("main")
+    import chatwoot_webhook
+    import sofia_v9_app
+
+    calls = []
+    monkeypatch.setattr(main, "save_appointment", lambda **kwargs: calls.append(kwargs) or "MP-7777")
+    assert chatwoot_webhook.engine.fsm.booking_handler is sofia_v9_app.dispatch_booking
+    fsm = ConversationFSM(store=SessionStore("fsm_dispatch"), booking_handler=sofia_v9_app.dispatch_booking)
+    for message in ["Hola, tengo una fuga en la cocina", "Ana Ruiz", "12 Main St, San Jose", "+14085551234",
+                    "mañana 8-10 AM", "Sí"]:
+        turn = fsm.step("tg_dispatch", message, channel="telegram")
+    assert turn.action == "booked" and "MP-7777" in turn.text()
+    assert len(calls) == 1
+    booked = calls[0]
+    assert (booked["name"], booked["diagnosis"], booked["source"]) == ("Ana Ruiz", "tengo una fuga en la cocina", "telegram")
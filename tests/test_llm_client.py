@@ -0,0 +1,83 @@
+import asyncio
+import types
+
+import pytest
+
+from conftest import fake_completion
+from core import llm_client
+
+
+class FakeCompletions:
+    """chat.completions falso que cuenta cuántas llamadas hay en vuelo a la vez."""
+
+    def __init__(self, delay_s: float = 0.01):
+        self.delay_s = delay_s
+        self.in_flight = 0
+        self.peak = 0
+        self.kwargs = []
+
+    async def create(self, **kwargs):
+        self.kwargs.append(kwargs)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay_s)
+            return fake_completion("ok")
+        finally:
+            self.in_flight -= 1
+
+
+class FakeAsyncClient:
+    def __init__(self):
+        self.chat = types.SimpleNamespace(completions=FakeCompletions())
+        self.options = []
+
+    def with_options(self, **options):
+        self.options.append(options)
+        return self
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = FakeAsyncClient()
+    monkeypatch.setattr(llm_client, "get_async_client", lambda: client)
+    monkeypatch.setattr(llm_client, "_semaphore", None)
+    monkeypatch.setattr(llm_client, "LLM_ASYNC_CONCURRENCY", 2)
+    recorded = []
+    monkeypatch.setattr(llm_client.degraded_mode, "record_llm", lambda purpose, ms, ok: recorded.append((purpose, ok)))
+    client.recorded = recorded
+    return client
+
+
+def test_async_client_is_shared_per_process(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(llm_client, "_async_client", None)
+    first = llm_client.get_async_client()
+    assert llm_client.get_async_client() is first
+    asyncio.run(llm_client.aclose())
+    assert llm_client._async_client is None
+
+
+def test_concurrency_is_capped_by_the_async_semaphore(client):
+    async def scenario():
+        results = await asyncio.gather(*(llm_client.chat_completion(model="m", messages=[], purpose="text_chat")
+                                         for _ in range(6)))
+        assert all(r.choices[0].message.content == "ok" for r in results)
+        stats = llm_client.stats()
+        assert (stats["in_flight"], stats["waiting"]) == (0, 0)
+
+    asyncio.run(scenario())
+    assert client.chat.completions.peak == 2
+    assert client.recorded == [("text_chat", True)] * 6
+
+
+def test_max_retries_override_and_failure_recorded(client):
+    async def boom(**kwargs):
+        raise ConnectionError("caído")
+
+    client.chat.completions.create = boom
+    with pytest.raises(ConnectionError):
+        asyncio.run(llm_client.chat_completion(max_retries=0, purpose="voice_reply", model="m", messages=[]))
+    assert client.options == [{"max_retries": 0}]
+    assert client.recorded == [("voice_reply", False)]
+    assert llm_client.stats()["in_flight"] == 0
@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+
+from conftest import fake_completion
+from core import llm_client, llm_gateway
+from core.resilience import DeadlineExceeded
+
+
+def api_timeout() -> openai.APITimeoutError:
+    return openai.APITimeoutError(request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "LLM_RETRY_MIN_S", 0.05)
+    monkeypatch.setattr(llm_gateway, "_backoff_s", lambda attempt: 0.01)
+
+
+def scripted(monkeypatch, outcomes: list, delay_s: float = 0.0):
+    """chat_completion / chat_completion_sync que devuelven (o lanzan) `outcomes` en orden."""
+    calls = []
+
+    def next_outcome(kwargs):
+        calls.append(kwargs)
+        outcome = outcomes[min(len(calls), len(outcomes)) - 1]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return fake_completion(outcome)
+
+    async def chat_completion(**kwargs):
+        await asyncio.sleep(delay_s)
+        return next_outcome(kwargs)
+
+    def chat_completion_sync(**kwargs):
+        time.sleep(delay_s)
+        return next_outcome(kwargs)
+
+    monkeypatch.setattr(llm_client, "chat_completion", chat_completion)
+    monkeypatch.setattr(llm_client, "chat_completion_sync", chat_completion_sync)
+    return calls
+
+
+def test_retries_transient_error_within_deadline(monkeypatch):
+    calls = scripted(monkeypatch, [api_timeout(), "hola"])
+    result = asyncio.run(llm_gateway.complete("test_retry", [{"role": "user", "content": "hi"}], deadline_s=2))
+    assert (result.text, result.attempts) == ("hola", 2)
+    # Cada intento recibe como timeout lo que queda del deadline, sin reintentos del SDK
+    assert calls[1]["timeout"] < calls[0]["timeout"] <= 2
+    assert all(c["max_retries"] == 0 and c["purpose"] == "test_retry" for c in calls)
+    assert llm_gateway.purpose("test_retry").retried == 1
+
+
+def test_sync_retries_transient_error(monkeypatch):
+    calls = scripted(monkeypatch, [TimeoutError("slow"), '```json\n{"ok": true}\n```'])
+    result = llm_gateway.complete_sync("test_retry_sync", [{"role": "user", "content": "hi"}], deadline_s=2)
+    assert result.json() == {"ok": True} and result.attempts == 2
+    assert calls[0]["timeout_s"] <= 2
+
+
+def test_non_retryable_error_raises_immediately(monkeypatch):
+    calls = scripted(monkeypatch, [ValueError("bad request"), "nunca"])
+    with pytest.raises(ValueError):
+        asyncio.run(llm_gateway.complete("test_fatal", [{"role": "user", "content": "hi"}], deadline_s=2))
+    assert len(calls) == 1
+
+
+def test_retries_stop_at_limit(monkeypatch):
+    calls = scripted(monkeypatch, [api_timeout()])
+    with pytest.raises(openai.APITimeoutError):
+        asyncio.run(llm_gateway.complete("test_limit", [{"role": "user", "content": "hi"}], deadline_s=2, retries=2))
+    assert len(calls) == 3
+
+
+def test_no_retry_when_deadline_too_close(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "LLM_RETRY_MIN_S", 1)
+    calls = scripted(monkeypatch, [api_timeout(), "tarde"])
+    with pytest.raises(openai.APITimeoutError):
+        asyncio.run(llm_gateway.complete("test_close", [{"role": "user", "content": "hi"}], deadline_s=0.5))
+    assert len(calls) == 1
+    assert llm_gateway.purpose("test_close").deadline_exceeded == 1
+
+
+def test_slow_provider_raises_deadline_exceeded(monkeypatch):
+    scripted(monkeypatch, ["tarde"], delay_s=1.0)
+    start = time.perf_counter()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(llm_gateway.complete("test_deadline", [{"role": "user", "content": "hi"}], deadline_s=0.2))
+    assert time.perf_counter() - start < 0.6
+
+
+def test_sync_and_async_limits_share_the_total():
+    assert llm_client.LLM_SYNC_CONCURRENCY + llm_client.LLM_ASYNC_CONCURRENCY == llm_client.LLM_MAX_CONCURRENCY
+    assert llm_client.stats()["sync_concurrency"] == llm_client.LLM_SYNC_CONCURRENCY
@@ -0,0 +1,96 @@
+import smtplib
+from email.message import EmailMessage
+
+import pytest
+
+from core import mailer
+from core.mailer import Mailer
+
+
+class FakeSMTP:
+    """Servidor SMTP falso: registra sesiones y mensajes; `fail` = excepciones para los próximos envíos."""
+
+    sessions = []
+    fail = []
+
+    def __init__(self, host, port, timeout=None):
+        self.sent = []
+        self.closed = False
+        FakeSMTP.sessions.append(self)
+
+    def starttls(self, context=None):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def noop(self):
+        return (250, b"OK")
+
+    def send_message(self, msg, to_addrs=None):
+        if FakeSMTP.fail:
+            raise FakeSMTP.fail.pop(0)
+        self.sent.append(msg["Subject"])
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    FakeSMTP.sessions = []
+    FakeSMTP.fail = []
+    monkeypatch.setattr(mailer.smtplib, "SMTP", FakeSMTP)
+    return FakeSMTP
+
+
+def message(subject: str) -> EmailMessage:
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["To"] = "cliente@example.com"
+    msg.set_content("hola")
+    return msg
+
+
+def test_messages_in_the_flush_window_share_one_session(smtp):
+    mail = Mailer("u", "p", pool_size=1, flush_ms=300)
+    futures = [mail.submit(message(f"m{i}")) for i in range(3)]
+    assert all(f.result(timeout=5) for f in futures)
+    mail.send(message("m3"))
+    stats = mail.stats()
+    mail.close()
+    assert len(smtp.sessions) == 1 and smtp.sessions[0].sent == ["m0", "m1", "m2", "m3"]
+    assert (stats["sent"], stats["batches"], stats["open_connections"]) == (4, 2, 1)
+    assert smtp.sessions[0].closed and mail.stats()["open_connections"] == 0
+
+
+def test_dropped_session_reconnects_and_resends(smtp):
+    smtp.fail = [smtplib.SMTPServerDisconnected("cerrada")]
+    mail = Mailer("u", "p", pool_size=1, flush_ms=0)
+    mail.send(message("cita"))
+    stats = mail.stats()
+    mail.close()
+    assert len(smtp.sessions) == 2 and smtp.sessions[1].sent == ["cita"]
+    assert (stats["sent"], stats["reconnects"], stats["failed"]) == (1, 1, 0)
+
+
+def test_rejected_message_fails_without_dropping_the_session(smtp):
+    smtp.fail = [smtplib.SMTPRecipientsRefused({"x@example.com": (550, b"no such user")})]
+    mail = Mailer("u", "p", pool_size=1, flush_ms=0)
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        mail.send(message("malo"))
+    mail.send(message("bueno"))
+    stats = mail.stats()
+    mail.close()
+    assert len(smtp.sessions) == 1 and smtp.sessions[0].sent == ["bueno"]
+    assert (stats["sent"], stats["failed"], stats["reconnects"]) == (1, 1, 0)
+
+
+def test_closed_mailer_rejects_new_messages(smtp):
+    mail = Mailer("u", "p", pool_size=1)
+    mail.close()
+    with pytest.raises(RuntimeError):
+        mail.submit(message("tarde"))
@@ -0,0 +1,84 @@
+import asyncio
+import base64
+import functools
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from core import media_relay
+from core.media_relay import FrameCoalescer
+
+main = pytest.importorskip("main")
+
+
+def frame(byte: int) -> str:
+    return base64.b64encode(bytes([byte]) * 160).decode("ascii")
+
+
+def appended(sent: list) -> list:
+    """Bytes de cada input_audio_buffer.append enviado a OpenAI."""
+    return [base64.b64decode(json.loads(m)["audio"]) for m in sent if '"input_audio_buffer.append"' in m]
+
+
+class FakeRealtime:
+    """Sesión Realtime falsa: guarda lo enviado y no emite eventos hasta que la cierran."""
+
+    def __init__(self):
+        self.sent = []
+        self.closed = asyncio.Event()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def send(self, msg):
+        self.sent.append(msg)
+
+    async def close(self):
+        self.closed.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await self.closed.wait()
+        raise StopAsyncIteration
+
+
+def test_flush_joins_an_incomplete_group():
+    coalescer = FrameCoalescer(3)
+    assert coalescer.add(frame(1)) is None and coalescer.add(frame(2)) is None
+    assert base64.b64decode(coalescer.flush()) == bytes([1]) * 160 + bytes([2]) * 160
+    assert coalescer.flush() is None
+
+
+@pytest.fixture
+def realtime(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(media_relay, "FrameCoalescer", functools.partial(FrameCoalescer, 3))
+    session = FakeRealtime()
+
+    async def acquire():
+        return session, "cold"
+
+    monkeypatch.setattr(main.realtime_sessions, "acquire", acquire)
+    return session
+
+
+def media(byte: int) -> str:
+    return json.dumps({"event": "media", "media": {"payload": frame(byte)}}, separators=(",", ":"))
+
+
+def test_mark_and_stop_flush_buffered_frames(realtime):
+    with TestClient(main.app).websocket_connect("/ws/twilio") as ws:
+        for byte in (1, 2, 3, 4):
+            ws.send_text(media(byte))
+        ws.send_text(json.dumps({"event": "mark", "mark": {"name": "greeting"}}))
+        ws.send_text(media(5))
+        ws.send_text(json.dumps({"event": "stop"}))
+    chunks = appended(realtime.sent)
+    assert [len(c) // 160 for c in chunks] == [3, 1, 1]
+    assert b"".join(chunks) == b"".join(bytes([b]) * 160 for b in (1, 2, 3, 4, 5))
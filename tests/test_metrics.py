@@ -0,0 +1,68 @@
+import pytest
+
+from core import metrics
+from core.config import SystemConfig
+from core.metrics import LatencyHistogram
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    """Registro vacío por test (el de verdad es global al proceso)."""
+    monkeypatch.setattr(metrics, "_histograms", {})
+    monkeypatch.setattr(metrics, "_counters", {})
+
+
+def test_percentiles_and_snapshot():
+    hist = LatencyHistogram()
+    for ms in range(1, 101):
+        hist.observe(ms)
+    assert (hist.percentile(50), hist.percentile(95), hist.percentile(99)) == (50, 95, 99)
+    snap = hist.snapshot()
+    assert (snap["count"], snap["avg_ms"], snap["max_ms"]) == (100, 50.5, 100)
+    assert LatencyHistogram().snapshot()["p95_ms"] == 0.0
+
+
+def test_percentiles_use_the_recent_window_but_totals_do_not():
+    hist = LatencyHistogram(window=10)
+    for _ in range(10):
+        hist.observe(5000)
+    for _ in range(10):
+        hist.observe(100)
+    assert hist.percentile(95) == 100
+    assert (hist.count, hist.max_ms) == (20, 5000)
+
+
+def test_bucket_bounds_are_inclusive():
+    for ms in (1500, 1500.5, 40000):
+        metrics.observe("realtime.response_latency_ms", ms)
+    text = metrics.prometheus()
+    assert 'orion_realtime_response_latency_ms_bucket{le="1000"} 0' in text
+    assert 'orion_realtime_response_latency_ms_bucket{le="1500"} 1' in text
+    assert 'orion_realtime_response_latency_ms_bucket{le="2500"} 2' in text
+    assert 'orion_realtime_response_latency_ms_bucket{le="30000"} 2' in text
+    assert 'orion_realtime_response_latency_ms_bucket{le="+Inf"} 3' in text
+    assert "orion_realtime_response_latency_ms_count 3" in text
+
+
+def test_timer_and_counters():
+    with metrics.timer("bloque_ms"):
+        pass
+    metrics.incr("realtime.frames_in", 160)
+    metrics.incr("realtime.frames_in", 40)
+    snap = metrics.snapshot()
+    assert snap["histograms"]["bloque_ms"]["count"] == 1
+    assert snap["counters"]["realtime.frames_in"] == 200
+    assert "# TYPE orion_realtime_frames_in_total counter\norion_realtime_frames_in_total 200" in metrics.prometheus()
+
+
+def test_latency_slo_flags_slow_voice_p95():
+    main = pytest.importorskip("main")
+    target = SystemConfig.MAX_LATENCY_P95_MS
+    for _ in range(20):
+        metrics.observe("realtime.ttft_pooled_ms", target / 2)
+    assert main.latency_slo()["ok"] is True
+    for _ in range(20):
+        metrics.observe("realtime.response_latency_ms", target * 2)
+    slo = main.latency_slo()
+    assert slo["ok"] is False and slo["checks"]["realtime.ttft_pooled_ms"]["ok"] is True
+    assert set(slo["checks"]) == {"realtime.ttft_pooled_ms", "realtime.response_latency_ms"}
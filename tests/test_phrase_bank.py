@@ -0,0 +1,74 @@
+import asyncio
+import types
+
+import pytest
+from twilio.twiml.voice_response import VoiceResponse
+
+from core import phrase_bank
+from core.phrase_bank import PhraseBank, pcm16_to_ulaw
+
+PHRASES = {"hola": "Hola, ¿en qué le ayudo?", "adios": "Hasta luego."}
+
+
+class FakeSpeech:
+    """audio.speech falso: `fail` = textos cuya síntesis falla."""
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.calls = 0
+
+    async def create(self, model, voice, input, response_format):
+        self.calls += 1
+        if input in self.fail:
+            raise ConnectionError("tts caído")
+        return types.SimpleNamespace(content=b"\x00\x00" * 30 if response_format == "pcm" else b"ID3mp3")
+
+
+def client(fail=()):
+    return types.SimpleNamespace(audio=types.SimpleNamespace(speech=FakeSpeech(fail)))
+
+
+@pytest.fixture
+def bank(tmp_path):
+    return PhraseBank(str(tmp_path), phrases=dict(PHRASES))
+
+
+def test_missing_audio_falls_back(bank):
+    assert bank.mp3_path("hola") is None and bank.ulaw("hola") is None
+    assert bank.mp3_path("no_existe") is None
+    assert bank.stats()["ready"] == 0
+
+
+def test_failed_render_only_affects_that_phrase(bank):
+    results = asyncio.run(bank.warm(client(fail={PHRASES["adios"]})))
+    assert results["hola"] == "ok" and results["adios"] == "tts caído"
+    assert bank.mp3_path("hola").endswith("hola.mp3") and bank.ulaw("hola") == b"\xff" * 10
+    assert bank.mp3_path("adios") is None and bank.ulaw("adios") is None
+
+
+def test_changed_text_is_not_served_stale(bank, tmp_path):
+    asyncio.run(bank.warm(client()))
+    reworded = PhraseBank(str(tmp_path), phrases={**PHRASES, "hola": "Buenas, ¿qué necesita?"})
+    assert reworded.mp3_path("hola") is None and reworded.mp3_path("adios") is not None
+    tts = client()
+    assert asyncio.run(reworded.warm(tts)) == {"hola": "ok", "adios": "cached"}
+    assert tts.audio.speech.calls == 2 and reworded.is_ready("hola")
+
+
+def test_say_phrase_uses_polly_until_the_audio_is_ready(monkeypatch, bank):
+    voice_server = pytest.importorskip("voice_server")
+    monkeypatch.setattr(phrase_bank, "get_bank", lambda: bank)
+    monkeypatch.setattr(phrase_bank, "PHRASES", PHRASES)
+    response = VoiceResponse()
+    voice_server.say_phrase(response, "hola", "https://x.test", "es-MX", voice="Polly.Mia")
+    assert "<Say" in str(response) and PHRASES["hola"] in str(response)
+    asyncio.run(bank.warm(client()))
+    response = VoiceResponse()
+    voice_server.say_phrase(response, "hola", "https://x.test", "es-MX", voice="Polly.Mia")
+    assert "<Play>https://x.test/phrases/hola.mp3</Play>" in str(response)
+
+
+def test_pcm_to_ulaw_decimates_and_encodes():
+    assert pcm16_to_ulaw(b"\x00\x00" * 6) == b"\xff\xff"
+    loud = pcm16_to_ulaw((32767).to_bytes(2, "little") * 3 + (-32768).to_bytes(2, "little", signed=True) * 3)
+    assert loud == bytes([0x80, 0x00])
@@ -0,0 +1,117 @@
+import json
+import threading
+import time
+
+import pytest
+
+from policy_engine.audit import AuditLog
+from policy_engine.human_override import POLICY_RULES_PATH, PolicyEngine
+
+
+@pytest.fixture
+def audit():
+    return AuditLog(path=None, flush_interval_s=0)
+
+
+@pytest.fixture
+def engine(audit):
+    return PolicyEngine(audit=audit)
+
+
+def rules_file(tmp_path, actions: dict) -> str:
+    with open(POLICY_RULES_PATH, "r", encoding="utf-8") as f:
+        spec = json.load(f)
+    spec["actions"].update(actions)
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(spec), encoding="utf-8")
+    return str(path)
+
+
+def test_levels_from_rules_json(engine):
+    assert engine.decide("get_weather").outcome == "allow"
+    assert engine.decide("create_appointment").outcome == "allow"
+    assert engine.decide("refund_payment").outcome == "confirm"
+    assert engine.decide("refund_payment", {"human_confirmed": True}).rule == "l3_confirmed"
+    gas = engine.decide("gas_leak_emergency")
+    assert gas.outcome == "transfer" and gas.reason == "Policy Block: gas_leak_emergency is L4"
+    assert engine.decide("unknown_tool").outcome == "transfer"
+
+
+def test_every_decision_is_audited(engine, audit):
+    engine.decide("lookup_appointment")
+    engine.decide("gas_leak_emergency")
+    assert [(e["action"], e["outcome"], e["level"]) for e in audit.recent()] == [
+        ("lookup_appointment", "allow", 1), ("gas_leak_emergency", "transfer", 4)]
+
+
+def test_batch_reports_first_transfer(engine):
+    batch = engine.evaluate_batch(["lookup_appointment", ("refund_payment", {"human_confirmed": True}),
+                                   "flooding_emergency", "sewage_biohazard"], {"channel": "phone"})
+    assert not batch.allowed
+    assert batch.transfer.action == "flooding_emergency"
+    assert [d.action for d in batch.blocked] == ["flooding_emergency", "sewage_biohazard"]
+
+
+def test_predicates_and_no_match(tmp_path, audit):
+    path = rules_file(tmp_path, {"dispatch_quote": {"level": "L2_BUSINESS_IMPACT", "rules": [
+        {"id": "big", "when": {"amount": {"gt": 500}, "channel": ["phone", "whatsapp"]}, "outcome": "confirm"},
+        {"id": "no_city", "when": {"city": {"exists": False}}, "outcome": "deny"},
+    ]}})
+    engine = PolicyEngine(rules_path=path, audit=audit)
+    assert engine.decide("dispatch_quote", {"amount": 900, "channel": "phone"}).rule == "big"
+    assert engine.decide("dispatch_quote", {"amount": 900, "channel": "email"}).rule == "no_city"
+    # Las reglas de la acción van antes que l2_allow del nivel
+    assert engine.decide("dispatch_quote", {"amount": 100, "city": "gilroy"}).rule == "l2_allow"
+
+
+def dense_engine(tmp_path, audit, rows: int, memo_min_rows: int) -> PolicyEngine:
+    table = [{"id": f"zone_{i}", "when": {"zone": i, "amount": {"gt": 100}}, "outcome": "confirm"} for i in range(rows)]
+    path = rules_file(tmp_path, {"dispatch_quote": {"level": "L2_BUSINESS_IMPACT", "rules": table}})
+    return PolicyEngine(rules_path=path, audit=audit, memo_min_rows=memo_min_rows)
+
+
+def test_memo_only_for_dense_tables(tmp_path, audit):
+    engine = dense_engine(tmp_path, audit, rows=12, memo_min_rows=8)
+    for _ in range(3):
+        assert engine.decide("dispatch_quote", {"zone": 7, "amount": 300}).rule == "zone_7"
+    engine.decide("refund_payment", {"human_confirmed": True})
+    assert (engine.cache_hits, engine.cache_misses) == (2, 1)
+    assert engine.stats()["cache_entries"] == 1
+    # Valores no hasheables: se evalúa sin caché
+    assert engine.decide("dispatch_quote", {"zone": [7], "amount": 300}).rule == "l2_allow"
+
+
+def test_memo_counters_are_consistent_across_threads(tmp_path, audit):
+    engine = dense_engine(tmp_path, audit, rows=12, memo_min_rows=1)
+    per_thread = 2000
+
+    def worker():
+        for i in range(per_thread):
+            engine.decide("dispatch_quote", {"zone": i % 16, "amount": 300})
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert engine.cache_hits + engine.cache_misses == 4 * per_thread
+    assert engine.stats()["cache_entries"] == 16
+
+
+def test_audit_flushes_early_and_keeps_every_record(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    # Intervalo largo: solo la marca de llenado puede vaciar el ring a tiempo
+    audit = AuditLog(path=str(path), capacity=1000, flush_interval_s=30, high_water=0.25)
+    audit.start()
+    total = 5000
+    for i in range(total):
+        audit.record("lookup_appointment", "allow", 1, "l1_allow", "motivo \"con\" comillas ñ")
+        if i % 100 == 99:
+            time.sleep(0.002)
+    audit.close()
+    stats = audit.stats()
+    assert stats["dropped"] == 0 and stats["flushed"] == total
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == total
+    entry = json.loads(lines[-1])
+    assert entry["reason"] == "motivo \"con\" comillas ñ" and entry["level"] == 1 and isinstance(entry["ts"], float)
@@ -0,0 +1,62 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+voice_server = pytest.importorskip("voice_server")
+
+
+@pytest.fixture
+def ngrok(monkeypatch):
+    """API local de ngrok falsa: `tunnels` es lo que responde; None = no contesta."""
+    state = {"tunnels": [], "requests": 0}
+
+    def handler(request):
+        state["requests"] += 1
+        if state["tunnels"] is None:
+            raise httpx.ConnectError("ngrok apagado")
+        return httpx.Response(200, json={"tunnels": state["tunnels"]})
+
+    monkeypatch.setattr(voice_server, "_ngrok_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(voice_server, "public_base_url", None)
+    return state
+
+
+def tunnel(proto: str, url: str) -> dict:
+    return {"proto": proto, "public_url": url}
+
+
+def test_refresh_picks_the_https_tunnel_and_falls_back(ngrok):
+    ngrok["tunnels"] = [tunnel("http", "http://a.ngrok.app"), tunnel("https", "https://a.ngrok.app")]
+    asyncio.run(voice_server.refresh_public_url())
+    assert voice_server.get_base_url() == "https://a.ngrok.app"
+    ngrok["tunnels"] = [tunnel("https", "https://b.ngrok.app")]
+    asyncio.run(voice_server.refresh_public_url())
+    assert voice_server.get_base_url() == "https://b.ngrok.app"
+    ngrok["tunnels"] = None
+    asyncio.run(voice_server.refresh_public_url())
+    assert voice_server.get_base_url() == voice_server.DEFAULT_BASE_URL
+
+
+def test_background_loop_refreshes_on_interval(ngrok, monkeypatch):
+    monkeypatch.setattr(voice_server, "PUBLIC_URL_REFRESH_S", 0.01)
+    ngrok["tunnels"] = [tunnel("https", "https://c.ngrok.app")]
+
+    async def scenario():
+        task = asyncio.create_task(voice_server._refresh_public_url_forever())
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+    asyncio.run(scenario())
+    assert ngrok["requests"] >= 2 and voice_server.get_base_url() == "https://c.ngrok.app"
+
+
+def test_call_turns_use_the_cached_url(ngrok):
+    ngrok["tunnels"] = [tunnel("https", "https://d.ngrok.app")]
+    asyncio.run(voice_server.refresh_public_url())
+    client = TestClient(voice_server.app)
+    for _ in range(3):
+        twiml = client.post("/incoming-call-es", data={"CallSid": "CA1"}).text
+        assert 'action="https://d.ngrok.app/process-speech-es"' in twiml
+    assert ngrok["requests"] == 1
@@ -0,0 +1,121 @@
+import asyncio
+import time
+import types
+
+import pytest
+from websockets.protocol import State
+
+from core import realtime_pool
+from core.realtime_pool import RealtimePool, RealtimeSession
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeWS:
+    def __init__(self):
+        self.state = State.OPEN
+
+    async def close(self):
+        self.state = State.CLOSED
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(realtime_pool, "time", types.SimpleNamespace(monotonic=clock, perf_counter=time.perf_counter))
+    return clock
+
+
+@pytest.fixture
+def pool(monkeypatch, clock):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    pool = RealtimePool("gpt-realtime", lambda: {}, size=1, ttl_s=600)
+    pool.opened = []
+
+    async def connect():
+        session = RealtimeSession(FakeWS(), 5.0)
+        pool.opened.append(session)
+        return session
+
+    monkeypatch.setattr(pool, "connect", connect)
+    return pool
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_unconsumed_prewarms_expire_and_surplus_is_closed(pool, clock):
+    async def scenario():
+        await pool.maintain_once()
+        await settle()
+        for _ in range(3):
+            pool.prewarm()  # tres /incoming-call cuyos streams nunca llegan
+        await settle()
+        assert pool.stats()["ready"] == 4
+        clock.now += realtime_pool.REALTIME_PREWARM_TTL_S + 1
+        await pool.maintain_once()
+        await settle()
+        stats = pool.stats()
+        assert (stats["ready"], stats["prewarm_pending"], stats["prewarm_expired"]) == (1, 0, 3)
+        assert sum(1 for s in pool.opened if s.ws.state is State.CLOSED) == 3
+        # Tras otro TTL de sesión no se reabren las sesiones de más
+        clock.now += 601
+        await pool.maintain_once()
+        await settle()
+        assert pool.stats()["ready"] == 1 and len(pool.opened) == 5
+
+    asyncio.run(scenario())
+
+
+def test_acquire_consumes_the_prewarm(pool, clock):
+    async def scenario():
+        pool.prewarm()
+        ws, source = await pool.acquire()
+        assert source in ("prewarmed", "pooled")
+        assert pool.stats()["prewarm_pending"] == 0
+        await settle()
+        assert pool.stats()["ready"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_prewarm_demand_is_capped(pool, clock):
+    async def scenario():
+        for _ in range(realtime_pool.REALTIME_POOL_MAX_WARM + 5):
+            pool.prewarm()
+        assert pool.stats()["prewarm_pending"] == realtime_pool.REALTIME_POOL_MAX_WARM
+        await pool.close()
+
+    asyncio.run(scenario())
+
+
+def test_probe_records_to_degraded_mode_without_pool_demand(monkeypatch, clock):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    recorded = []
+    monkeypatch.setattr(realtime_pool.degraded_mode, "record",
+                        lambda dep, ms, ok=True: recorded.append((dep, ok)))
+    pool = RealtimePool("gpt-realtime", lambda: {}, size=0)
+    ws = FakeWS()
+
+    async def handshake(start):
+        return RealtimeSession(ws, 5.0)
+
+    monkeypatch.setattr(pool, "_handshake", handshake)
+
+    async def scenario():
+        pool.probe()
+        await settle()
+
+    asyncio.run(scenario())
+    assert recorded == [("realtime", True)]
+    assert ws.state is State.CLOSED
+    stats = pool.stats()
+    assert (stats["ready"], stats["prewarm_pending"]) == (0, 0)
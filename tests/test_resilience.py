@@ -0,0 +1,164 @@
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from core import resilience
+from core.resilience import AllProvidersFailed, CircuitBreaker, DeadlineExceeded, HedgedProviders, Provider
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience, "time", types.SimpleNamespace(monotonic=clock, perf_counter=time.perf_counter))
+    return clock
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=4)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+@pytest.fixture
+def gate():
+    """Los proveedores lentos quedan colgados aquí (más allá de su timeout) hasta que termina el test."""
+    gate = threading.Event()
+    yield gate
+    gate.set()
+
+
+def provider(name: str, reply=None, delay_s: float = 0.0, gate=None, error: Exception = None, **breaker) -> Provider:
+    calls = []
+
+    def call(prompt, timeout_s):
+        calls.append(timeout_s)
+        if gate is not None:
+            gate.wait(5)
+            raise TimeoutError(f"{name} lento")
+        time.sleep(delay_s)
+        if error is not None:
+            raise error
+        return reply or name
+
+    p = Provider(name, call, CircuitBreaker(name, **breaker) if breaker else None)
+    p.calls = calls
+    return p
+
+
+# ============ CIRCUIT BREAKER ============
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("x", failure_threshold=3, reset_timeout_s=30)
+    for _ in range(2):
+        breaker.record_failure()
+    breaker.record_success()  # un éxito reinicia la cuenta
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert (breaker.state, breaker.trips) == (CircuitBreaker.OPEN, 1)
+    assert not breaker.allow()
+
+
+def test_half_open_allows_one_trial_then_closes_or_reopens(clock):
+    breaker = CircuitBreaker("x", failure_threshold=1, reset_timeout_s=30)
+    breaker.record_failure()
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow() and breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()  # solo una prueba a la vez
+    breaker.record_failure()
+    assert (breaker.state, breaker.trips) == (CircuitBreaker.OPEN, 2)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+
+def test_release_frees_the_half_open_trial(clock):
+    breaker = CircuitBreaker("x", failure_threshold=1, reset_timeout_s=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow() and breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_hedge_delay_follows_observed_p95(monkeypatch):
+    monkeypatch.setattr(resilience, "HEDGE_MIN_SAMPLES", 10)
+    p = provider("a")
+    assert p.hedge_delay_s() == resilience.HEDGE_DEFAULT_MS / 1000
+    for ms in range(1, 21):
+        p.latency.observe(ms * 50)
+    assert p.hedge_delay_s() == pytest.approx(0.95)
+    fast = provider("b")
+    for _ in range(10):
+        fast.latency.observe(1)
+    assert fast.hedge_delay_s() == resilience.HEDGE_MIN_MS / 1000
+
+
+# ============ HEDGING ============
+def test_fast_primary_never_hedges(executor):
+    primary, backup = provider("openai"), provider("gemini")
+    hedged = HedgedProviders("t", [primary, backup], deadline_s=2, executor=executor)
+    assert hedged.call("hola") == "openai"
+    assert backup.calls == [] and primary.wins == 1
+
+
+def test_slow_primary_is_hedged_and_discarded(monkeypatch, executor, gate):
+    monkeypatch.setattr(resilience, "HEDGE_DEFAULT_MS", 50)
+    primary, backup = provider("openai", gate=gate), provider("gemini")
+    hedged = HedgedProviders("t", [primary, backup], deadline_s=2, executor=executor)
+    start = time.perf_counter()
+    assert hedged.call("hola") == "gemini"
+    assert time.perf_counter() - start < 0.5
+    assert (backup.hedges, backup.wins, primary.discarded) == (1, 1, 1)
+    # El perdedor recibió como timeout lo que quedaba del deadline
+    assert primary.calls[0] <= 2
+
+
+def test_failed_primary_falls_back_immediately(executor):
+    primary = provider("openai", error=ConnectionError("caído"))
+    backup = provider("gemini")
+    hedged = HedgedProviders("t", [primary, backup], deadline_s=2, executor=executor)
+    assert hedged.call("hola") == "gemini"
+    assert (backup.hedges, primary.failures, primary.breaker.consecutive_failures) == (0, 1, 1)
+
+
+def test_open_circuits_are_skipped(executor):
+    primary = provider("openai", failure_threshold=1, reset_timeout_s=60)
+    primary.breaker.record_failure()
+    backup = provider("gemini")
+    hedged = HedgedProviders("t", [primary, backup], deadline_s=2, executor=executor)
+    assert hedged.call("hola") == "gemini" and primary.calls == []
+    backup.breaker = CircuitBreaker("gemini", failure_threshold=1, reset_timeout_s=60)
+    backup.breaker.record_failure()
+    with pytest.raises(AllProvidersFailed):
+        hedged.call("hola")
+
+
+def test_all_failures_raise(executor):
+    hedged = HedgedProviders("t", [provider("a", error=ValueError("x")), provider("b", error=ValueError("y"))],
+                             deadline_s=2, executor=executor)
+    with pytest.raises(AllProvidersFailed, match="a: x; b: y"):
+        hedged.call("hola")
+
+
+def test_deadline_bounds_slow_providers(monkeypatch, executor, gate):
+    monkeypatch.setattr(resilience, "HEDGE_DEFAULT_MS", 50)
+    hedged = HedgedProviders("t", [provider("a", gate=gate), provider("b", gate=gate)], deadline_s=0.3,
+                             executor=executor)
+    start = time.perf_counter()
+    with pytest.raises(DeadlineExceeded):
+        hedged.call("hola")
+    assert time.perf_counter() - start < 0.6
@@ -0,0 +1,153 @@
+import asyncio
+import threading
+import types
+
+import pytest
+
+from core import session_store
+from core.session_store import SessionStore
+
+
+class Clock:
+    """Reloj manual para session_store (monotonic y time avanzan juntos)."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(session_store, "time", types.SimpleNamespace(monotonic=clock, time=clock))
+    return clock
+
+
+def recorder():
+    evicted = []
+    return evicted, lambda key, value, reason: evicted.append((key, reason))
+
+
+def test_memory_ttl_expires_idle_sessions(clock):
+    evicted, on_evict = recorder()
+    store = SessionStore("t", ttl_seconds=60, on_evict=on_evict)
+    store.set("a", [1])
+    store.set("b", [2])
+    clock.now += 30
+    assert store.get("a") == [1]  # el acceso renueva el TTL de "a"
+    clock.now += 45
+    assert store.get("b") is None
+    assert store.get("a") == [1]
+    assert evicted == [("b", "ttl")]
+    assert store.stats()["evictions"] == {"ttl": 1, "lru": 0}
+
+
+def test_memory_lru_evicts_least_recently_used(clock):
+    evicted, on_evict = recorder()
+    store = SessionStore("t", max_entries=2, on_evict=on_evict)
+    store.set("a", 1)
+    store.set("b", 2)
+    store.get("a")
+    store.set("c", 3)
+    assert "b" not in store
+    assert store.get("a") == 1 and store.get("c") == 3
+    assert evicted == [("b", "lru")]
+    assert len(store) == 2
+
+
+def test_memory_append_caps_messages_keeping_system_prompt(clock):
+    store = SessionStore("t", max_messages=3)
+    system = {"role": "system", "content": "prompt"}
+    for i in range(5):
+        history = store.append("a", {"role": "user", "content": str(i)}, initial=[system])
+    assert history[0] == system
+    assert [m["content"] for m in history[1:]] == ["3", "4"]
+    assert store.stats()["trimmed_messages"] == 3
+
+
+def test_backend_without_overrides_cannot_be_instantiated():
+    class Partial(session_store.SessionBackend):
+        def get(self, key, default=None):
+            return default
+
+    with pytest.raises(TypeError):
+        Partial("t")
+
+
+def test_sqlite_ttl_and_lru_sweep(clock, tmp_path):
+    evicted, on_evict = recorder()
+    store = session_store.SQLiteSessionBackend("t", path=str(tmp_path / "s.db"), ttl_seconds=60,
+                                               max_entries=2, on_evict=on_evict)
+    store.set("a", [1])
+    clock.now += 1
+    store.set("b", [2])
+    clock.now += 1
+    store.set("c", [3])
+    assert store.sweep() == 2
+    assert evicted == [("a", "lru")]
+    clock.now += 30
+    assert store.get("c") == [3]
+    clock.now += 45
+    assert store.get("b") is None  # vencida aunque el sweep todavía no la borró
+    assert store.sweep() == 1
+    assert evicted[1:] == [("b", "ttl")]
+    assert store.stats()["evictions"] == {"ttl": 1, "lru": 1}
+
+
+def test_sqlite_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "s.db")
+    first = session_store.SQLiteSessionBackend("t", path=path)
+    second = session_store.SQLiteSessionBackend("t", path=path)
+    first.append("a", {"role": "user", "content": "hola"})
+    assert second.append("a", {"role": "user", "content": "otra vez"})[0]["content"] == "hola"
+
+
+def threads_used(store) -> set:
+    """Ids de los hilos donde corren get/set/append/pop/sweep del store."""
+    used = set()
+    for name in ("get", "set", "append", "pop", "sweep"):
+        original = getattr(store, name)
+
+        def wrapped(*args, _original=original, **kwargs):
+            used.add(threading.get_ident())
+            return _original(*args, **kwargs)
+
+        setattr(store, name, wrapped)
+    return used
+
+
+async def roundtrip(store) -> list:
+    await store.aappend("a", {"role": "user", "content": "hola"}, initial=[{"role": "system", "content": "s"}])
+    await store.aset("slots", {"name": "Ana"})
+    assert (await store.aget("slots"))["name"] == "Ana"
+    assert await store.apop("slots") == {"name": "Ana"}
+    await store.asweep()
+    return await store.aget("a")
+
+
+def test_async_variants_run_sqlite_off_the_event_loop(tmp_path):
+    store = session_store.SQLiteSessionBackend("t", path=str(tmp_path / "s.db"))
+    used = threads_used(store)
+    history = asyncio.run(roundtrip(store))
+    assert [m["content"] for m in history] == ["s", "hola"]
+    assert used and threading.get_ident() not in used
+
+
+def test_async_variants_call_memory_store_inline():
+    store = SessionStore("t")
+    used = threads_used(store)
+    asyncio.run(roundtrip(store))
+    assert used == {threading.get_ident()}
+
+
+def test_redis_sliding_ttl():
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeRedis()
+    store = session_store.RedisSessionBackend("t", client=client, ttl_seconds=60)
+    store.append("a", {"role": "user", "content": "hola"})
+    client.pexpire("sofia:t:a", 1000)
+    assert store.get("a") == [{"role": "user", "content": "hola"}]
+    assert client.pttl("sofia:t:a") > 59000  # get renueva el TTL
+    assert store.pop("a") is not None and "a" not in store
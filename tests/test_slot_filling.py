@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from conftest import fake_completion
+from core import llm_gateway, slot_filling
+from core.llm_gateway import LLMResult
+
+SCHEMA = slot_filling.SlotSchema(
+    "test",
+    fields={"name": "nombre", "phone": "teléfono", "address": "dirección"},
+    required=("name", "phone", "address"),
+)
+HISTORY = [{"role": "system", "content": "prompt"}, {"role": "user", "content": "Soy Ana, 4085551234"}]
+
+
+class Recorder:
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.calls = 0
+
+    async def complete(self, purpose, messages, **kwargs):
+        self.calls += 1
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return LLMResult(purpose, fake_completion(reply), 1, 1.0)
+
+
+def run(recorder, monkeypatch, full_calls):
+    monkeypatch.setattr(llm_gateway, "complete", recorder.complete)
+
+    def full_prompt():
+        full_calls.append(1)
+        return "historial completo"
+
+    return asyncio.run(slot_filling.update_slots(SCHEMA, None, HISTORY, full_prompt=full_prompt))
+
+
+def test_incremental_turn_does_not_build_full_prompt(monkeypatch):
+    recorder, full_calls = Recorder('{"name": "Ana", "phone": "4085551234"}'), []
+    slots = run(recorder, monkeypatch, full_calls)
+    assert slots["name"] == "Ana" and slots["is_complete"] is False
+    assert recorder.calls == 1
+    assert full_calls == []
+
+
+def test_transport_error_propagates_without_second_call(monkeypatch):
+    recorder, full_calls = Recorder(TimeoutError("lento")), []
+    with pytest.raises(TimeoutError):
+        run(recorder, monkeypatch, full_calls)
+    assert recorder.calls == 1
+    assert full_calls == []
+
+
+@pytest.mark.parametrize("first", ['{"conflict": true}', "esto no es JSON"])
+def test_conflict_or_invalid_json_reextracts(monkeypatch, first):
+    recorder, full_calls = Recorder(first, '{"name": "Ana", "phone": "1", "address": "2 Main St"}'), []
+    slots = run(recorder, monkeypatch, full_calls)
+    assert recorder.calls == 2
+    assert full_calls == [1]
+    assert slots["is_complete"] is True
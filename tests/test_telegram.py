@@ -0,0 +1,60 @@
+import asyncio
+import time
+import types
+
+import httpx
+import pytest
+
+from core import telegram
+from core.telegram import TelegramSender
+
+
+@pytest.fixture
+def slept(monkeypatch):
+    slept = []
+    monkeypatch.setattr(telegram, "time", types.SimpleNamespace(perf_counter=time.perf_counter, sleep=slept.append))
+    return slept
+
+
+def sender_with(responses: list) -> tuple:
+    """TelegramSender cuyos dos clientes devuelven `responses` (retry_after o 200) en orden."""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        retry_after = responses[min(len(requests), len(responses)) - 1]
+        if retry_after:
+            return httpx.Response(429, json={"ok": False, "parameters": {"retry_after": retry_after}})
+        return httpx.Response(200, json={"ok": True})
+
+    sender = TelegramSender("token", base_url="https://tg.test")
+    sender._async_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    sender._sync_client = httpx.Client(transport=httpx.MockTransport(handler))
+    return sender, requests
+
+
+def test_long_retry_after_is_deferred_off_the_event_loop(slept):
+    sender, requests = sender_with([20, 0])
+
+    async def scenario():
+        start = time.perf_counter()
+        resp = await sender.send_message(1, "hola")
+        assert time.perf_counter() - start < 1
+        return resp
+
+    assert asyncio.run(scenario()).status_code == 429
+    asyncio.run(telegram.aclose())
+    assert slept == [20] and len(requests) == 2
+    assert requests[1].url.path == "/bottoken/sendMessage" and b"hola" in requests[1].content
+
+
+def test_short_retry_after_is_retried_inline(slept):
+    sender, requests = sender_with([0.01, 0])
+    assert asyncio.run(sender.send_message(1, "hola")).status_code == 200
+    assert len(requests) == 2 and slept == []
+
+
+def test_sync_sends_wait_the_full_retry_after(slept):
+    sender, requests = sender_with([20, 0])
+    assert sender.send_message_sync(1, "hola").status_code == 200
+    assert slept == [20] and len(requests) == 2
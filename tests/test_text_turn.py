@@ -0,0 +1,53 @@
+import asyncio
+import json
+
+import pytest
+
+from conftest import fake_completion
+
+main = pytest.importorskip("main")
+
+
+class FakeGateway:
+    def __init__(self, payload):
+        self.payload = payload
+
+    async def complete(self, purpose, messages, **kwargs):
+        from core.llm_gateway import LLMResult
+        return LLMResult(purpose, fake_completion(json.dumps(self.payload)), 1, 1.0)
+
+
+def test_single_turn_does_not_book_when_model_claims_complete(monkeypatch):
+    booked = []
+    monkeypatch.setattr(main, "llm_gateway", FakeGateway({
+        "reply": "¿Me da su dirección?",
+        "appointment": {"name": "Ana Ruiz", "phone": "4085551234", "diagnosis": "fuga", "is_complete": True},
+    }))
+    monkeypatch.setattr(main, "save_appointment", lambda **kw: booked.append(kw) or "MP-0001")
+    user = "tg_single_incomplete"
+    history = main.text_sessions.append(user, {"role": "user", "content": "hola"}, initial=[])
+
+    reply = asyncio.run(main._text_turn_single(user, history, "es"))
+
+    assert reply == "¿Me da su dirección?"
+    assert booked == []
+    slots = main.text_slots.get(user)
+    assert slots["is_complete"] is False
+    assert slots["name"] == "Ana Ruiz"
+
+
+def test_single_turn_books_when_required_fields_present(monkeypatch):
+    booked = []
+    monkeypatch.setattr(main, "llm_gateway", FakeGateway({
+        "reply": "",
+        "appointment": {"name": "Ana Ruiz", "phone": "4085551234", "address": "12 Main St, San Jose",
+                        "diagnosis": "fuga", "time_window": "8-10 AM", "is_complete": False},
+    }))
+    monkeypatch.setattr(main, "save_appointment", lambda **kw: booked.append(kw) or "MP-0002")
+    user = "tg_single_complete"
+    history = main.text_sessions.append(user, {"role": "user", "content": "hola"}, initial=[])
+
+    reply = asyncio.run(main._text_turn_single(user, history, "es"))
+
+    assert "MP-0002" in reply
+    assert booked[0]["address"] == "12 Main St, San Jose"
@@ -0,0 +1,66 @@
+import asyncio
+import os
+
+import pytest
+
+from core.tts_cache import TTSCache, cache_key
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return TTSCache(str(tmp_path), max_disk_bytes=300, max_memory_bytes=200)
+
+
+def test_key_depends_on_every_synthesis_parameter():
+    base = cache_key("Hola", "nova", "tts-1", 1.0, "mp3")
+    assert cache_key("Hola", "nova", "tts-1", 1, "mp3") == base
+    assert len({base, cache_key("Hola ", "nova", "tts-1"), cache_key("Hola", "alloy", "tts-1"),
+                cache_key("Hola", "nova", "tts-1-hd"), cache_key("Hola", "nova", "tts-1", 1.25),
+                cache_key("Hola", "nova", "tts-1", fmt="ulaw")}) == 6
+
+
+def test_memory_then_disk_hits(cache, tmp_path):
+    cache.put("a", b"x" * 50)
+    assert cache.get("a") == b"x" * 50
+    # Otro worker con el mismo directorio: el primer get sale del disco y sube a memoria
+    other = TTSCache(str(tmp_path), max_disk_bytes=300, max_memory_bytes=200)
+    assert other.get("a") == b"x" * 50 and other.get("a") == b"x" * 50
+    assert (other.hits_disk, other.hits_memory, other.misses) == (1, 1, 0)
+    assert other.get("nada") is None and other.stats()["misses"] == 1
+
+
+def test_lru_eviction_in_memory_and_on_disk(cache, tmp_path):
+    for key in ("a", "b", "c"):
+        cache.put(key, key.encode() * 100)
+    stats = cache.stats()
+    assert (stats["memory_entries"], stats["memory_bytes"]) == (2, 200)
+    assert (stats["disk_entries"], stats["disk_bytes"]) == (3, 300)
+    cache.get("a")  # "a" pasa a ser el más reciente en disco
+    cache.put("d", b"d" * 100)
+    assert not os.path.exists(tmp_path / "b.audio") and os.path.exists(tmp_path / "a.audio")
+    assert cache.stats()["disk_bytes"] == 300
+
+
+def test_concurrent_misses_share_one_synthesis(cache):
+    calls = []
+
+    async def synthesize():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return b"audio"
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_create("k", synthesize) for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1 and all(data == b"audio" for data, _ in results)
+    assert cache.shared_inflight == 4
+    assert asyncio.run(cache.get_or_create("k", synthesize)) == (b"audio", True)
+
+
+def test_empty_synthesis_is_not_cached(cache):
+    async def synthesize():
+        return b""
+
+    assert asyncio.run(cache.get_or_create("vacio", synthesize)) == (b"", False)
+    assert cache.stats()["disk_entries"] == 0
@@ -1,13 +1,17 @@
 import os
-import requests
+import asyncio
 import json
-import smtplib
+import time
+from contextlib import asynccontextmanager
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from fastapi import FastAPI, Form
-from fastapi.responses import HTMLResponse, Response
+from fastapi.responses import FileResponse, HTMLResponse, Response
 from twilio.twiml.voice_response import VoiceResponse, Gather
 from dotenv import load_dotenv
+import httpx
+from core import llm_client, llm_gateway, mailer, metrics, phrase_bank, telegram
+from core.session_store import open_session_store
 
 load_dotenv()
 
@@ -17,9 +21,15 @@ TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELEGRAM_OWNER_ID = os.getenv('TELEGRAM_OWNER_ID')
 EMAIL_USER = os.getenv('EMAIL_USER')
 EMAIL_PASS = os.getenv('EMAIL_PASS')
+DEFAULT_BASE_URL = os.getenv('BASE_URL', 'https://orion-cloud.onrender.com')
+NGROK_API_URL = os.getenv('NGROK_API_URL', 'http://localhost:4040/api/tunnels')
+PUBLIC_URL_REFRESH_S = float(os.getenv('PUBLIC_URL_REFRESH_S', '30'))
 
-# In-memory session state for phone calls
-call_sessions = {}
+# In-memory session state for phone calls (TTL + LRU + tope de mensajes)
+def _log_evicted_call(key, value, reason):
+    print(f"🧹 Sesión de llamada desalojada ({reason}): {key}")
+
+call_sessions = open_session_store("voice_call_sessions", ttl_seconds=900, on_evict=_log_evicted_call)
 
 # MULTILINGUAL SYSTEM PROMPTS - MORALES PLUMBING (MASTER BRAIN)
 SYSTEM_MESSAGE_ES = """Eres Nekon, el Master Dispatcher de IA por teléfono para Morales Plumbing (San Jose, CA).
@@ -88,29 +98,100 @@ SYSTEM_MESSAGE_EN = """You are Nekon, the Master AI Dispatcher for Morales Plumb
 - If asked about non-plumbing topics, redirect: "I'm a plumbing dispatcher, do you need help with your pipes?"
 - 🔴 SPAM/Telemarketers → "We are not interested, thank you" and END CALL."""
 
-app = FastAPI()
+# Cierre tras agendar: plantilla local en vez de una segunda llamada al LLM
+BOOKED_REPLY = {
+    "es": "Listo, {nombre}. Tu cita quedó registrada y un técnico certificado te llamará al {telefono} para confirmar el horario.",
+    "en": "All set, {nombre}. Your appointment is booked and a certified technician will call you at {telefono} to confirm the time.",
+}
+
+VOICE_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "agendar_cita",
+            "description": "Ejecuta esta función una vez que hayas recopilado nombre, teléfono, dirección y el problema de plomería del cliente para enviar la alerta al dueño.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "nombre": {"type": "string", "description": "Nombre del cliente"},
+                    "telefono": {"type": "string", "description": "Número de teléfono del cliente"},
+                    "direccion": {"type": "string", "description": "Dirección completa o ciudad de la visita"},
+                    "problema": {"type": "string", "description": "Descripción del problema de plomería y horario de preferencia"}
+                },
+                "required": ["nombre", "telefono", "direccion", "problema"]
+            }
+        }
+    }
+]
+
+# ============ URL PÚBLICA (ngrok) ============
+public_base_url = None
+_ngrok_client = None
 
-def get_ngrok_url():
-    """Get the public ngrok URL from its local API"""
+async def refresh_public_url():
+    """Consulta la API local de ngrok y guarda la URL https; si no hay túnel se usa DEFAULT_BASE_URL"""
+    global public_base_url, _ngrok_client
+    if _ngrok_client is None:
+        _ngrok_client = httpx.AsyncClient(timeout=2)
     try:
-        resp = requests.get("http://localhost:4040/api/tunnels", timeout=2)
+        resp = await _ngrok_client.get(NGROK_API_URL)
         tunnels = resp.json().get("tunnels", [])
-        for tunnel in tunnels:
-            if tunnel.get("proto") == "https":
-                return tunnel.get("public_url", "")
-        return None
-    except:
-        return None
-
-def enviar_alerta_telegram(datos):
+        public_base_url = next((t.get("public_url") for t in tunnels if t.get("proto") == "https"), None)
+    except Exception:
+        public_base_url = None
+
+async def _refresh_public_url_forever():
+    while True:
+        await asyncio.sleep(PUBLIC_URL_REFRESH_S)
+        await refresh_public_url()
+
+def get_base_url() -> str:
+    return public_base_url or DEFAULT_BASE_URL
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _ngrok_client
+    # Frases fijas (saludos, despedidas) pre-renderizadas para <Play> en vez de Polly en vivo
+    phrases = asyncio.create_task(phrase_bank.get_bank().warm()) if OPENAI_API_KEY else None
+    # URL pública resuelta una vez al arrancar y refrescada en segundo plano (no en cada turno)
+    await refresh_public_url()
+    url_refresher = asyncio.create_task(_refresh_public_url_forever())
+    yield
+    url_refresher.cancel()
+    if phrases:
+        phrases.cancel()
+    if _ngrok_client is not None:
+        await _ngrok_client.aclose()
+        _ngrok_client = None
+    await asyncio.to_thread(mailer.close)
+    await telegram.aclose()
+    await llm_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
+
+def say_phrase(response: VoiceResponse, phrase_id: str, base_url: str, language: str, voice: str = None):
+    """<Play> del audio pre-renderizado si está listo; si no, <Say> con Polly como antes"""
+    if phrase_bank.get_bank().mp3_path(phrase_id):
+        response.play(f"{base_url}/phrases/{phrase_id}.mp3")
+    elif voice:
+        response.say(phrase_bank.PHRASES[phrase_id], language=language, voice=voice)
+    else:
+        response.say(phrase_bank.PHRASES[phrase_id], language=language)
+
+@app.get("/phrases/{phrase_id}.mp3")
+async def get_phrase(phrase_id: str):
+    path = phrase_bank.get_bank().mp3_path(phrase_id)
+    if path is None:
+        return Response(status_code=404)
+    return FileResponse(path, media_type="audio/mpeg")
+
+async def enviar_alerta_telegram(datos):
     if not TELEGRAM_BOT_TOKEN or not TELEGRAM_OWNER_ID:
         print("⚠️ Telegram token missing. Alerta no enviada por TG.")
         return
     texto = f"🚨 *NUEVA CITA AGENDADA (Llamada Telefónica AI)* 🚨\n\n👤 *Nombre:* {datos.get('nombre')}\n📞 *Teléfono:* {datos.get('telefono')}\n📍 *Dirección:* {datos.get('direccion')}\n🛠️ *Problema/Horario:* {datos.get('problema')}"
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    payload = {"chat_id": TELEGRAM_OWNER_ID, "text": texto, "parse_mode": "Markdown"}
     try:
-        res = requests.post(url, json=payload, timeout=5)
+        res = await telegram.get_sender(TELEGRAM_BOT_TOKEN).send_message(TELEGRAM_OWNER_ID, texto, parse_mode="Markdown")
         if res.status_code == 200:
             print("✅ Alerta enviada por Telegram.")
         else:
@@ -131,102 +212,79 @@ def enviar_alerta_email(datos):
         cuerpo = f"NUEVA CITA AGENDADA POR EL BOT TELEFÓNICO NEKON\n\nNombre: {datos.get('nombre')}\nTeléfono: {datos.get('telefono')}\nDirección: {datos.get('direccion')}\nProblema/Horario: {datos.get('problema')}\n"
         msg.attach(MIMEText(cuerpo, 'plain'))
         
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(EMAIL_USER, EMAIL_PASS)
-        server.send_message(msg)
-        server.quit()
-        print("✅ Alerta enviada por Email a agem2013@gmail.com.")
+        # Encolado en el pool SMTP: el turno de voz no espera al envío
+        future = mailer.get_mailer().submit(msg)
+        future.add_done_callback(_log_email_result)
     except Exception as e:
         print(f"❌ Error enviando Email: {e}")
 
-def ask_openai(user_input: str, session_id: str, lang: str = "es") -> str:
+def _log_email_result(future):
+    error = future.exception()
+    if error:
+        print(f"❌ Error enviando Email: {error}")
+    else:
+        print("✅ Alerta enviada por Email a agem2013@gmail.com.")
+
+_background_tasks = set()
+
+async def ask_openai(user_input: str, session_id: str, lang: str = "es") -> str:
     """Send message to OpenAI GPT-4o-mini and get response, with history and function calling"""
+    start = time.perf_counter()
     try:
-        url = "https://api.openai.com/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {OPENAI_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
         system_msg = SYSTEM_MESSAGE_ES if lang == "es" else SYSTEM_MESSAGE_EN
         
-        if session_id not in call_sessions:
-            call_sessions[session_id] = [{"role": "system", "content": system_msg}]
-            
-        call_sessions[session_id].append({"role": "user", "content": user_input})
-        
-        tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "agendar_cita",
-                    "description": "Ejecuta esta función una vez que hayas recopilado nombre, teléfono, dirección y el problema de plomería del cliente para enviar la alerta al dueño.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "nombre": {"type": "string", "description": "Nombre del cliente"},
-                            "telefono": {"type": "string", "description": "Número de teléfono del cliente"},
-                            "direccion": {"type": "string", "description": "Dirección completa o ciudad de la visita"},
-                            "problema": {"type": "string", "description": "Descripción del problema de plomería y horario de preferencia"}
-                        },
-                        "required": ["nombre", "telefono", "direccion", "problema"]
-                    }
-                }
-            }
-        ]
+        history = await call_sessions.aappend(
+            session_id, {"role": "user", "content": user_input},
+            initial=[{"role": "system", "content": system_msg}]
+        )
         
-        payload = {
-            "model": "gpt-4o-mini",
-            "messages": call_sessions[session_id],
-            "max_tokens": 150,
-            "temperature": 0.7,
-            "tools": tools,
-            "tool_choice": "auto"
-        }
+        result = await llm_gateway.complete(
+            "voice_gather",
+            messages=history,
+            max_tokens=150,
+            temperature=0.7,
+            tools=VOICE_TOOLS,
+            tool_choice="auto"
+        )
+        message = result.message
+        assistant_msg = {"role": "assistant", "content": message.content}
+        if message.tool_calls:
+            assistant_msg["tool_calls"] = [tool_call.model_dump(exclude_none=True) for tool_call in message.tool_calls]
+        await call_sessions.aappend(session_id, assistant_msg)
         
-        response = requests.post(url, headers=headers, json=payload, timeout=15)
-        data = response.json()
+        # Check for function call
+        if message.tool_calls:
+            reply = None
+            for tool_call in message.tool_calls:
+                if tool_call.function.name == "agendar_cita":
+                    args = json.loads(tool_call.function.arguments)
+                    print(f"🔔 EJECUTANDO ALERTA DE CITA: {args}")
+                    # Alertas en segundo plano; la respuesta al cliente no las espera
+                    task = asyncio.create_task(enviar_alerta_telegram(args))
+                    _background_tasks.add(task)
+                    task.add_done_callback(_background_tasks.discard)
+                    enviar_alerta_email(args)
+                    reply = BOOKED_REPLY.get(lang, BOOKED_REPLY["en"]).format(
+                        nombre=args.get("nombre", ""), telefono=args.get("telefono", ""))
+                await call_sessions.aappend(session_id, {
+                    "role": "tool",
+                    "tool_call_id": tool_call.id,
+                    "name": tool_call.function.name,
+                    "content": '{"status": "success", "message": "Alerta enviada correctamente"}'
+                })
+            reply = reply or (message.content or "").strip()
+            await call_sessions.aappend(session_id, {"role": "assistant", "content": reply})
+            return reply
         
-        if response.status_code == 200 and "choices" in data:
-            message = data["choices"][0]["message"]
-            call_sessions[session_id].append(message)
-            
-            # Check for function call
-            if message.get("tool_calls"):
-                for tool_call in message["tool_calls"]:
-                    if tool_call["function"]["name"] == "agendar_cita":
-                        args = json.loads(tool_call["function"]["arguments"])
-                        print(f"🔔 EJECUTANDO ALERTA DE CITA: {args}")
-                        enviar_alerta_telegram(args)
-                        enviar_alerta_email(args)
-                        
-                        # Add tool response to history so AI can continue
-                        call_sessions[session_id].append({
-                            "role": "tool",
-                            "tool_call_id": tool_call["id"],
-                            "name": "agendar_cita",
-                            "content": '{"status": "success", "message": "Alerta enviada correctamente"}'
-                        })
-                        
-                        # Get final response from AI
-                        payload["messages"] = call_sessions[session_id]
-                        del payload["tools"]
-                        final_res = requests.post(url, headers=headers, json=payload, timeout=15)
-                        final_msg = final_res.json()["choices"][0]["message"]["content"]
-                        call_sessions[session_id].append({"role": "assistant", "content": final_msg})
-                        return final_msg.strip()
-            else:
-                ai_response = message["content"].strip()
-                print(f"🤖 OpenAI ({lang}): {ai_response}")
-                return ai_response
-        else:
-            print(f"❌ OpenAI Error: {data}")
-            return "Sorry, technical issue. Can you repeat?" if lang == "en" else "Perdona, problema técnico. ¿Puedes repetir?"
+        ai_response = (message.content or "").strip()
+        print(f"🤖 OpenAI ({lang}): {ai_response}")
+        return ai_response
         
     except Exception as e:
         print(f"❌ OpenAI Exception: {e}")
         return "Sorry, there was an issue." if lang == "en" else "Perdona, hubo un problemita."
+    finally:
+        metrics.observe("voice_gather.turn_ms", (time.perf_counter() - start) * 1000)
 
 @app.get("/", response_class=HTMLResponse)
 async def index_page():
@@ -238,13 +296,9 @@ async def index_page():
 async def handle_incoming_call_es(CallSid: str = Form(None)):
     """Handle incoming call - Spanish"""
     response = VoiceResponse()
-    base_url = get_ngrok_url() or "https://orion-cloud.onrender.com"
+    base_url = get_base_url()
     
-    response.say(
-        "Hola, soy Nekon, dispatcher de Morales Plumbing. ¿En qué te puedo ayudar?",
-        language="es-MX",
-        voice="Polly.Mia"
-    )
+    say_phrase(response, "greeting_es", base_url, "es-MX", "Polly.Mia")
     
     gather = Gather(
         input="speech",
@@ -255,14 +309,14 @@ async def handle_incoming_call_es(CallSid: str = Form(None)):
         speech_timeout="auto"
     )
     response.append(gather)
-    response.say("No escuché nada. Hasta luego.", language="es-MX")
+    say_phrase(response, "no_input_goodbye_es", base_url, "es-MX")
     return Response(content=str(response), media_type="application/xml")
 
 @app.api_route("/process-speech-es", methods=["GET", "POST"])
 async def process_speech(SpeechResult: str = Form(None), CallSid: str = Form(None)):
     """Process user speech, get AI response, and continue conversation"""
     response = VoiceResponse()
-    base_url = get_ngrok_url() or "https://orion-cloud.onrender.com"
+    base_url = get_base_url()
     session_id = CallSid or "test_session"
     
     if SpeechResult:
@@ -270,10 +324,10 @@ async def process_speech(SpeechResult: str = Form(None), CallSid: str = Form(Non
         
         goodbye_words = ["adiós", "adios", "bye", "chao", "hasta luego", "gracias", "ok gracias"]
         if any(word in SpeechResult.lower() for word in goodbye_words):
-            response.say("Fue un placer servirle. Morales Plumbing le desea excelente día. ¡Hasta luego!", language="es-MX", voice="Polly.Mia")
+            say_phrase(response, "farewell_es", base_url, "es-MX", "Polly.Mia")
             return Response(content=str(response), media_type="application/xml")
         
-        ai_response = ask_openai(SpeechResult, session_id, lang="es")
+        ai_response = await ask_openai(SpeechResult, session_id, lang="es")
         response.say(ai_response, language="es-MX", voice="Polly.Mia")
         
         gather = Gather(
@@ -285,7 +339,7 @@ async def process_speech(SpeechResult: str = Form(None), CallSid: str = Form(Non
             speech_timeout="auto"
         )
         response.append(gather)
-        response.say("¿Algo más?", language="es-MX", voice="Polly.Mia")
+        say_phrase(response, "anything_else_es", base_url, "es-MX", "Polly.Mia")
         gather2 = Gather(
             input="speech",
             language="es-MX",
@@ -295,9 +349,9 @@ async def process_speech(SpeechResult: str = Form(None), CallSid: str = Form(Non
             speech_timeout="auto"
         )
         response.append(gather2)
-        response.say("Bueno, hasta luego.", language="es-MX", voice="Polly.Mia")
+        say_phrase(response, "goodbye_es", base_url, "es-MX", "Polly.Mia")
     else:
-        response.say("No te escuché. ¿Puedes repetir?", language="es-MX", voice="Polly.Mia")
+        say_phrase(response, "repeat_es", base_url, "es-MX", "Polly.Mia")
         gather = Gather(
             input="speech",
             language="es-MX",
@@ -315,13 +369,9 @@ async def process_speech(SpeechResult: str = Form(None), CallSid: str = Form(Non
 async def handle_incoming_call_en(CallSid: str = Form(None)):
     """Handle incoming call - English"""
     response = VoiceResponse()
-    base_url = get_ngrok_url() or "https://orion-cloud.onrender.com"
+    base_url = get_base_url()
     
-    response.say(
-        "Hello, I'm Nekon, dispatcher for Morales Plumbing. How can I help you?",
-        language="en-US",
-        voice="Polly.Joanna"
-    )
+    say_phrase(response, "greeting_en", base_url, "en-US", "Polly.Joanna")
     
     gather = Gather(
         input="speech",
@@ -332,14 +382,14 @@ async def handle_incoming_call_en(CallSid: str = Form(None)):
         speech_timeout="auto"
     )
     response.append(gather)
-    response.say("I didn't hear anything. Goodbye.", language="en-US")
+    say_phrase(response, "no_input_goodbye_en", base_url, "en-US")
     return Response(content=str(response), media_type="application/xml")
 
 @app.api_route("/process-speech-en", methods=["GET", "POST"])
 async def process_speech_en(SpeechResult: str = Form(None), CallSid: str = Form(None)):
     """Process user speech in English"""
     response = VoiceResponse()
-    base_url = get_ngrok_url() or "https://orion-cloud.onrender.com"
+    base_url = get_base_url()
     session_id = CallSid or "test_session_en"
     
     if SpeechResult:
@@ -347,10 +397,10 @@ async def process_speech_en(SpeechResult: str = Form(None), CallSid: str = Form(
         
         goodbye_words = ["goodbye", "bye", "thanks", "thank you", "ok thanks", "that's all"]
         if any(word in SpeechResult.lower() for word in goodbye_words):
-            response.say("It was a pleasure serving you. Morales Plumbing wishes you a great day. Goodbye!", language="en-US", voice="Polly.Joanna")
+            say_phrase(response, "farewell_en", base_url, "en-US", "Polly.Joanna")
             return Response(content=str(response), media_type="application/xml")
         
-        ai_response = ask_openai(SpeechResult, session_id, lang="en")
+        ai_response = await ask_openai(SpeechResult, session_id, lang="en")
         response.say(ai_response, language="en-US", voice="Polly.Joanna")
         
         gather = Gather(
@@ -362,7 +412,7 @@ async def process_speech_en(SpeechResult: str = Form(None), CallSid: str = Form(
             speech_timeout="auto"
         )
         response.append(gather)
-        response.say("Anything else?", language="en-US", voice="Polly.Joanna")
+        say_phrase(response, "anything_else_en", base_url, "en-US", "Polly.Joanna")
         gather2 = Gather(
             input="speech",
             language="en-US",
@@ -372,9 +422,9 @@ async def process_speech_en(SpeechResult: str = Form(None), CallSid: str = Form(
             speech_timeout="auto"
         )
         response.append(gather2)
-        response.say("Alright, goodbye.", language="en-US", voice="Polly.Joanna")
+        say_phrase(response, "goodbye_en", base_url, "en-US", "Polly.Joanna")
     else:
-        response.say("I didn't hear you. Can you repeat?", language="en-US", voice="Polly.Joanna")
+        say_phrase(response, "repeat_en", base_url, "en-US", "Polly.Joanna")
         gather = Gather(
             input="speech",
             language="en-US",